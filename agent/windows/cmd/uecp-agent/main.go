@@ -30,6 +30,8 @@ type Config struct {
 	TimeoutSeconds            int    `json:"timeout_seconds"`
 	CollectionTimeoutSeconds  int    `json:"collection_timeout_seconds"`
 	SendTimeoutSeconds        int    `json:"send_timeout_seconds"`
+	IgnoreServerSchedule      bool   `json:"ignore_server_schedule"`
+	DisableConditionalUpload  bool   `json:"disable_conditional_upload"`
 }
 
 // defaultConfig возвращает конфигурацию по умолчанию
@@ -89,7 +91,7 @@ func main() {
 
 	if runOnce {
 		log.Println("Выполнение однократного сбора данных...")
-		err := performCollection(collector, recommender, sender, spoolStore, config, *output)
+		_, err := performCollection(collector, recommender, sender, spoolStore, config, *output)
 		if err != nil {
 			log.Printf("Ошибка при сборе данных: %v", err)
 			os.Exit(1)
@@ -134,8 +136,10 @@ func setupLogging(logFile string) error {
 	return nil
 }
 
+// performCollection собирает и отправляет снимок; возвращает задержку до следующего
+// сбора, назначенную сервером (0, если сервер ее не прислал или отправка не удалась)
 func performCollection(collector *collect.Collector, recommender *recommend.Engine, 
-	sender *transport.Sender, spoolStore *store.SpoolStore, config *Config, outputFile string) error {
+	sender *transport.Sender, spoolStore *store.SpoolStore, config *Config, outputFile string) (time.Duration, error) {
 	
 	// Отдельный таймаут для сбора данных
 	collectCtx, collectCancel := context.WithTimeout(context.Background(), time.Duration(config.CollectionTimeoutSeconds)*time.Second)
@@ -146,7 +150,7 @@ func performCollection(collector *collect.Collector, recommender *recommend.Engi
 	// Сбор данных о хосте
 	hostData, err := collector.CollectHostPosture(collectCtx)
 	if err != nil {
-		return fmt.Errorf("ошибка сбора данных о хосте: %w", err)
+		return 0, fmt.Errorf("ошибка сбора данных о хосте: %w", err)
 	}
 
 	log.Printf("Собрано данных: процессов=%d, автозапусков=%d", 
@@ -176,8 +180,15 @@ func performCollection(collector *collect.Collector, recommender *recommend.Engi
 	sendCtx, sendCancel := context.WithTimeout(context.Background(), time.Duration(config.SendTimeoutSeconds)*time.Second)
 	defer sendCancel()
 
-	// Попытка отправки через API
-	if err := sender.SendHostPosture(sendCtx, hostData); err != nil {
+	// Попытка отправки через API: по умолчанию только изменившиеся разделы
+	var nextReport time.Duration
+	var result *transport.IngestResponse
+	if config.DisableConditionalUpload {
+		result, err = sender.SendHostPosture(sendCtx, hostData)
+	} else {
+		result, err = sender.SendConditional(sendCtx, hostData, 1)
+	}
+	if err != nil {
 		log.Printf("Не удалось отправить данные через API: %v", err)
 		
 		// Сохранение в спул для повторной отправки
@@ -188,6 +199,7 @@ func performCollection(collector *collect.Collector, recommender *recommend.Engi
 		}
 	} else {
 		log.Println("Данные успешно отправлены в API")
+		nextReport = time.Duration(result.NextReportAfter) * time.Second
 	}
 
 	// Попытка отправки накопленных данных из спула
@@ -199,7 +211,7 @@ func performCollection(collector *collect.Collector, recommender *recommend.Engi
 		for _, event := range events {
 			// Отдельный таймаут для каждого события из спула
 			eventCtx, eventCancel := context.WithTimeout(context.Background(), time.Duration(config.SendTimeoutSeconds)*time.Second)
-			if err := sender.SendHostPosture(eventCtx, event.Data); err == nil {
+			if _, err := sender.SendHostPosture(eventCtx, event.Data); err == nil {
 				spoolStore.RemoveEvent(context.Background(), event.ID)
 				log.Printf("Событие %s успешно отправлено из спула", event.ID)
 			} else {
@@ -209,25 +221,33 @@ func performCollection(collector *collect.Collector, recommender *recommend.Engi
 		}
 	}
 
-	return nil
+	return nextReport, nil
 }
 
 func runDaemon(collector *collect.Collector, recommender *recommend.Engine,
 	sender *transport.Sender, spoolStore *store.SpoolStore, config *Config) {
 	
 	interval := time.Duration(config.IntervalSeconds) * time.Second
-	ticker := time.NewTicker(interval)
-	defer ticker.Stop()
+	timer := time.NewTimer(interval)
+	defer timer.Stop()
 
 	log.Printf("Демон запущен, первый сбор через %v", interval)
 
 	for {
-		select {
-		case <-ticker.C:
-			if err := performCollection(collector, recommender, sender, spoolStore, config, ""); err != nil {
-				log.Printf("Ошибка в цикле сбора данных: %v", err)
-			}
+		<-timer.C
+		nextReport, err := performCollection(collector, recommender, sender, spoolStore, config, "")
+		if err != nil {
+			log.Printf("Ошибка в цикле сбора данных: %v", err)
+		}
+
+		// Сервер распределяет отчеты парка по интервалу и растягивает его под нагрузкой;
+		// без его ответа используется интервал из конфигурации
+		wait := interval
+		if !config.IgnoreServerSchedule && nextReport > 0 {
+			wait = nextReport
 		}
+		log.Printf("Следующий сбор через %v", wait)
+		timer.Reset(wait)
 	}
 }
 
@@ -2,6 +2,9 @@ package collect
 
 import (
 	"context"
+	"crypto/sha256"
+	"encoding/hex"
+	"encoding/json"
 	"time"
 
 	"github.com/google/uuid"
@@ -31,6 +34,96 @@ type HostPostureData struct {
 	WindowsUpdate *WindowsUpdateInfo `json:"windows_update,omitempty"`
 	Findings      []Finding          `json:"findings"`
 	Metadata      *MetadataInfo      `json:"metadata"`
+	// SectionHashes - хеши разделов снимка для условной загрузки (см. ComputeSectionHashes)
+	SectionHashes map[string]string `json:"section_hashes,omitempty"`
+	// UnchangedSections - разделы, не включенные в снимок: сервер берет их из сохраненного
+	UnchangedSections []string `json:"unchanged_sections,omitempty"`
+}
+
+// ComputeSectionHashes вычисляет SHA256 JSON-представления каждого раздела снимка:
+// processes, части автозапусков (autoruns.registry, autoruns.startup_folders,
+// autoruns.services_auto, autoruns.scheduled_tasks), security, windows_update.
+// Автозапуски хешируются по частям: состояние служб меняется почти в каждом
+// отчете, остальные части - редко. Сервер хеши не пересчитывает, а только
+// сравнивает с присланными в прошлый раз
+func (d *HostPostureData) ComputeSectionHashes() (map[string]string, error) {
+	sections := map[string]interface{}{
+		"processes":                nil,
+		"autoruns.registry":        nil,
+		"autoruns.startup_folders": nil,
+		"autoruns.services_auto":   nil,
+		"autoruns.scheduled_tasks": nil,
+		"security":                 d.Security,
+		"windows_update":           d.WindowsUpdate,
+	}
+	if d.Inventory != nil {
+		sections["processes"] = d.Inventory.Processes
+		if autoruns := d.Inventory.Autoruns; autoruns != nil {
+			sections["autoruns.registry"] = autoruns.Registry
+			sections["autoruns.startup_folders"] = autoruns.StartupFolders
+			sections["autoruns.services_auto"] = autoruns.ServicesAuto
+			sections["autoruns.scheduled_tasks"] = autoruns.ScheduledTasks
+		}
+	}
+
+	hashes := make(map[string]string, len(sections))
+	for name, section := range sections {
+		data, err := json.Marshal(section)
+		if err != nil {
+			return nil, err
+		}
+		sum := sha256.Sum256(data)
+		hashes[name] = hex.EncodeToString(sum[:])
+	}
+	return hashes, nil
+}
+
+// WithoutSections возвращает копию снимка без перечисленных разделов
+// (исходный снимок не меняется)
+func (d *HostPostureData) WithoutSections(names []string) *HostPostureData {
+	partial := *d
+	if d.Inventory != nil {
+		inventory := *d.Inventory
+		if d.Inventory.Autoruns != nil {
+			autoruns := *d.Inventory.Autoruns
+			inventory.Autoruns = &autoruns
+		}
+		partial.Inventory = &inventory
+	}
+	for _, name := range names {
+		var autoruns *AutorunsInfo
+		if partial.Inventory != nil {
+			autoruns = partial.Inventory.Autoruns
+		}
+		switch name {
+		case "processes":
+			if partial.Inventory != nil {
+				partial.Inventory.Processes = nil
+			}
+		case "autoruns.registry":
+			if autoruns != nil {
+				autoruns.Registry = nil
+			}
+		case "autoruns.startup_folders":
+			if autoruns != nil {
+				autoruns.StartupFolders = nil
+			}
+		case "autoruns.services_auto":
+			if autoruns != nil {
+				autoruns.ServicesAuto = nil
+			}
+		case "autoruns.scheduled_tasks":
+			if autoruns != nil {
+				autoruns.ScheduledTasks = nil
+			}
+		case "security":
+			partial.Security = nil
+		case "windows_update":
+			partial.WindowsUpdate = nil
+		}
+	}
+	partial.UnchangedSections = names
+	return &partial
 }
 
 // InventoryInfo содержит инвентаризационные данные
@@ -4,6 +4,7 @@ import (
 	"bytes"
 	"context"
 	"encoding/json"
+	"errors"
 	"fmt"
 	"io"
 	"net/http"
@@ -18,6 +19,38 @@ type Sender struct {
 	httpClient *http.Client
 }
 
+// IngestResponse ответ API на отправку события
+type IngestResponse struct {
+	EventID string `json:"event_id"`
+	Status  string `json:"status"`
+	Message string `json:"message,omitempty"`
+	// NextReportAfter - через сколько секунд прислать следующий снимок (0 - сервер не задал)
+	NextReportAfter int `json:"next_report_after,omitempty"`
+}
+
+// StatusError ошибочный статус ответа API
+type StatusError struct {
+	StatusCode int
+	Body       string
+}
+
+func (e *StatusError) Error() string {
+	return fmt.Sprintf("получен ошибочный статус ответа %d: %s", e.StatusCode, e.Body)
+}
+
+// handshakeRequest хеши разделов снимка для POST <ingest_url>/handshake
+type handshakeRequest struct {
+	HostID        string            `json:"host_id"`
+	Hostname      string            `json:"hostname"`
+	SectionHashes map[string]string `json:"section_hashes"`
+}
+
+// handshakeResponse разделы, которые нужно прислать, и разделы, которые сервер возьмет из сохраненного снимка
+type handshakeResponse struct {
+	NeededSections    []string `json:"needed_sections"`
+	UnchangedSections []string `json:"unchanged_sections"`
+}
+
 // NewSender создает новый отправитель
 func NewSender(baseURL string, timeout time.Duration) *Sender {
 	return &Sender{
@@ -29,18 +62,18 @@ func NewSender(baseURL string, timeout time.Duration) *Sender {
 }
 
 // SendHostPosture отправляет данные о состоянии хоста в API
-func (s *Sender) SendHostPosture(ctx context.Context, data *collect.HostPostureData) error {
+func (s *Sender) SendHostPosture(ctx context.Context, data *collect.HostPostureData) (*IngestResponse, error) {
 	// Сериализация данных в JSON
 	jsonData, err := json.Marshal(data)
 	if err != nil {
-		return fmt.Errorf("ошибка сериализации данных в JSON: %w", err)
+		return nil, fmt.Errorf("ошибка сериализации данных в JSON: %w", err)
 	}
 
 	// Создание HTTP запроса
 	url := s.baseURL
 	req, err := http.NewRequestWithContext(ctx, "POST", url, bytes.NewBuffer(jsonData))
 	if err != nil {
-		return fmt.Errorf("ошибка создания HTTP запроса: %w", err)
+		return nil, fmt.Errorf("ошибка создания HTTP запроса: %w", err)
 	}
 
 	// Установка заголовков
@@ -50,26 +83,32 @@ func (s *Sender) SendHostPosture(ctx context.Context, data *collect.HostPostureD
 	// Выполнение запроса
 	resp, err := s.httpClient.Do(req)
 	if err != nil {
-		return fmt.Errorf("ошибка выполнения HTTP запроса: %w", err)
+		return nil, fmt.Errorf("ошибка выполнения HTTP запроса: %w", err)
 	}
 	defer resp.Body.Close()
 
 	// Чтение ответа
 	body, err := io.ReadAll(resp.Body)
 	if err != nil {
-		return fmt.Errorf("ошибка чтения ответа: %w", err)
+		return nil, fmt.Errorf("ошибка чтения ответа: %w", err)
 	}
 
 	// Проверка статуса ответа
 	if resp.StatusCode < 200 || resp.StatusCode >= 300 {
-		return fmt.Errorf("получен ошибочный статус ответа %d: %s", resp.StatusCode, string(body))
+		return nil, &StatusError{StatusCode: resp.StatusCode, Body: string(body)}
+	}
+
+	// Данные приняты; тело ответа без ожидаемых полей не считается ошибкой
+	result := &IngestResponse{}
+	if err := json.Unmarshal(body, result); err != nil {
+		return &IngestResponse{}, nil
 	}
 
-	return nil
+	return result, nil
 }
 
 // SendWithRetry отправляет данные с повторными попытками
-func (s *Sender) SendWithRetry(ctx context.Context, data *collect.HostPostureData, maxRetries int) error {
+func (s *Sender) SendWithRetry(ctx context.Context, data *collect.HostPostureData, maxRetries int) (*IngestResponse, error) {
 	var lastErr error
 
 	for attempt := 0; attempt < maxRetries; attempt++ {
@@ -78,18 +117,92 @@ func (s *Sender) SendWithRetry(ctx context.Context, data *collect.HostPostureDat
 			delay := time.Duration(attempt*attempt) * time.Second
 			select {
 			case <-ctx.Done():
-				return ctx.Err()
+				return nil, ctx.Err()
 			case <-time.After(delay):
 			}
 		}
 
-		err := s.SendHostPosture(ctx, data)
+		result, err := s.SendHostPosture(ctx, data)
 		if err == nil {
-			return nil
+			return result, nil
 		}
 
 		lastErr = err
+
+		// Конфликт (разделы нельзя взять из сохраненного снимка) повтором не исправить
+		var statusErr *StatusError
+		if errors.As(err, &statusErr) && statusErr.StatusCode == http.StatusConflict {
+			break
+		}
 	}
 
-	return fmt.Errorf("не удалось отправить данные после %d попыток: %w", maxRetries, lastErr)
+	return nil, fmt.Errorf("не удалось отправить данные после %d попыток: %w", maxRetries, lastErr)
+}
+
+// Handshake отправляет хеши разделов и возвращает разделы, которые сервер
+// возьмет из сохраненного снимка хоста
+func (s *Sender) Handshake(ctx context.Context, data *collect.HostPostureData) ([]string, error) {
+	if data.Host == nil {
+		return nil, fmt.Errorf("в снимке нет данных о хосте")
+	}
+	jsonData, err := json.Marshal(handshakeRequest{
+		HostID:        data.Host.HostID,
+		Hostname:      data.Host.Hostname,
+		SectionHashes: data.SectionHashes,
+	})
+	if err != nil {
+		return nil, fmt.Errorf("ошибка сериализации хешей разделов: %w", err)
+	}
+
+	req, err := http.NewRequestWithContext(ctx, "POST", s.baseURL+"/handshake", bytes.NewBuffer(jsonData))
+	if err != nil {
+		return nil, fmt.Errorf("ошибка создания HTTP запроса: %w", err)
+	}
+	req.Header.Set("Content-Type", "application/json")
+	req.Header.Set("User-Agent", "UECP-Agent-Windows/0.1.0")
+
+	resp, err := s.httpClient.Do(req)
+	if err != nil {
+		return nil, fmt.Errorf("ошибка выполнения HTTP запроса: %w", err)
+	}
+	defer resp.Body.Close()
+
+	body, err := io.ReadAll(resp.Body)
+	if err != nil {
+		return nil, fmt.Errorf("ошибка чтения ответа: %w", err)
+	}
+	if resp.StatusCode < 200 || resp.StatusCode >= 300 {
+		return nil, &StatusError{StatusCode: resp.StatusCode, Body: string(body)}
+	}
+
+	result := &handshakeResponse{}
+	if err := json.Unmarshal(body, result); err != nil {
+		return nil, fmt.Errorf("ошибка разбора ответа: %w", err)
+	}
+	return result.UnchangedSections, nil
+}
+
+// SendConditional отправляет снимок только с изменившимися разделами: хеши
+// разделов сверяются с сервером (Handshake), остальные разделы сервер берет
+// из сохраненного снимка. Если сверка не удалась или сервер отклонил снимок
+// (409 - сохраненный снимок недоступен), снимок отправляется целиком
+func (s *Sender) SendConditional(ctx context.Context, data *collect.HostPostureData, maxRetries int) (*IngestResponse, error) {
+	hashes, err := data.ComputeSectionHashes()
+	if err != nil {
+		return s.SendWithRetry(ctx, data, maxRetries)
+	}
+	full := *data
+	full.SectionHashes = hashes
+
+	unchanged, err := s.Handshake(ctx, &full)
+	if err != nil || len(unchanged) == 0 {
+		return s.SendWithRetry(ctx, &full, maxRetries)
+	}
+
+	result, err := s.SendWithRetry(ctx, full.WithoutSections(unchanged), maxRetries)
+	var statusErr *StatusError
+	if err != nil && errors.As(err, &statusErr) && statusErr.StatusCode == http.StatusConflict {
+		return s.SendWithRetry(ctx, &full, maxRetries)
+	}
+	return result, err
 }
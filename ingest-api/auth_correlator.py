@@ -0,0 +1,302 @@
+"""
+Корреляция событий аутентификации в скользящих окнах.
+
+Читает поток events:ingestion и передает события user_login и
+authentication в AuthCorrelator (shared/correlation.py): счетчики по
+ключам (пользователь, адрес источника, пара) живут в памяти и обновляются
+за постоянное время на событие. Алерты перебора паролей, password spray и
+успешного входа после серии неудач записываются в alerts-* тем же
+Alert-документом, что и у detection_worker.py.
+
+Ключи разбиты на --partitions разделов; воркер --shard из --shards
+считает разделы p, для которых p % shards == shard. Поток читается через
+XREAD без группы потребителей: каждый воркер видит все события и
+отбрасывает чужие ключи, поэтому счетчики одного ключа всегда в одном
+процессе.
+
+Состояние разделов раз в --checkpoint-interval секунд сохраняется в Redis
+(hash auth_corr:state:<partitions>, поле - номер раздела) вместе с
+позицией потока, до которой оно посчитано (hash auth_corr:position:<partitions>),
+одной транзакцией. Число разделов входит в имя ключа: при его изменении
+воркеры начинают с пустого состояния.
+После перезапуска или смены --shards воркер загружает свои разделы и
+продолжает чтение с наименьшей из их позиций; события, уже вошедшие в
+состояние раздела, для этого раздела пропускаются. ID алерта выводится из
+правила, ключа и события, поэтому повторное чтение не создает дубликатов.
+
+    python auth_correlator.py --rules auth_correlation_rules.json --shard 0 --shards 2
+
+Статистика раз в --stats-interval секунд пишется в лог и в Redis (hash
+auth_corr:stats, поле - shard/shards); ее показывает GET /admin/correlation.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+
+import redis.asyncio as aioredis
+from opensearchpy import AsyncOpenSearch
+from redis.exceptions import RedisError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.correlation import AuthCorrelator, build_correlation_alert, load_correlation_rules  # noqa: E402
+from detection_worker import _text, alerts_index_name, decode_stream_fields  # noqa: E402
+
+logger = logging.getLogger("ingest.correlation")
+
+DEFAULT_STREAM = "events:ingestion"
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "auth_correlation_rules.json")
+STATE_KEY = "auth_corr:state"
+POSITION_KEY = "auth_corr:position"
+STATS_KEY = "auth_corr:stats"
+
+AUTH_EVENT_TYPES = frozenset((b"authentication", b"user_login", "authentication", "user_login"))
+
+
+def parse_stream_id(entry_id: Any) -> Tuple[int, int]:
+    """ID записи потока "ms-seq" для сравнения"""
+    ms, _, seq = _text(entry_id).partition("-")
+    return int(ms), int(seq or 0)
+
+
+class AuthCorrelationWorker:
+    """Чтение потока, обновление счетчиков своих разделов, алерты и контрольные точки"""
+
+    def __init__(self, redis: aioredis.Redis, opensearch: AsyncOpenSearch, correlator: AuthCorrelator,
+                 stream: str = DEFAULT_STREAM, shard: int = 0, shards: int = 1, batch_size: int = 1000,
+                 block_ms: int = 1000, start_id: str = "$", checkpoint_interval: float = 10.0,
+                 stats_interval: float = 30.0, retry_delay: float = 5.0):
+        self.redis = redis
+        self.opensearch = opensearch
+        self.correlator = correlator
+        self.stream = stream
+        self.shard = shard
+        self.shards = shards
+        self.name = f"{shard}/{shards}"
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.start_id = start_id
+        self.checkpoint_interval = checkpoint_interval
+        self.stats_interval = stats_interval
+        self.retry_delay = retry_delay
+        self.state_key = f"{STATE_KEY}:{correlator.partitions}"
+        self.position_key = f"{POSITION_KEY}:{correlator.partitions}"
+        self.owned = sorted(correlator.owned if correlator.owned is not None else range(correlator.partitions))
+        # Последняя прочитанная запись и позиции разделов, еще не догнавших ее при восстановлении
+        self.last_id = start_id
+        self._lagging: Dict[int, Tuple[int, int]] = {}
+        self._pending_alerts: List[Dict[str, Any]] = []
+        self._stopping = asyncio.Event()
+        self.counters = {"entries": 0, "alerts": 0, "checkpoints": 0, "checkpoint_ms": 0.0,
+                         "restored_keys": 0, "alert_write_errors": 0}
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    async def restore(self) -> None:
+        """Загрузка состояния и позиций своих разделов"""
+        fields = [str(partition) for partition in self.owned]
+        states = await self.redis.hmget(self.state_key, fields)
+        positions = await self.redis.hmget(self.position_key, fields)
+        known: Dict[int, Tuple[int, int]] = {}
+        for partition, raw_state, raw_position in zip(self.owned, states, positions):
+            if raw_state:
+                self.counters["restored_keys"] += self.correlator.restore(partition, json.loads(raw_state))
+            if raw_position:
+                known[partition] = parse_stream_id(raw_position)
+        if known:
+            start = min(known.values())
+            self.last_id = f"{start[0]}-{start[1]}"
+            self._lagging = {partition: position for partition, position in known.items() if position > start}
+            logger.info(f"Восстановлено {self.counters['restored_keys']} ключей в {len(known)} разделах, "
+                        f"чтение с {self.last_id}")
+
+    def correlate(self, response: List[Any]) -> List[Dict[str, Any]]:
+        """Алерты по пачке записей; last_id сдвигается на последнюю запись"""
+        actions: List[Dict[str, Any]] = []
+        now = datetime.now(timezone.utc)
+        for _, entries in response or ():
+            for entry_id, fields in entries:
+                self.last_id = _text(entry_id)
+                self.counters["entries"] += 1
+                skip = None
+                if self._lagging:
+                    position = parse_stream_id(entry_id)
+                    self._lagging = {p: pos for p, pos in self._lagging.items() if pos >= position}
+                    skip = set(self._lagging)
+                event_type = fields.get(b"event_type", fields.get("event_type")) if fields else None
+                if event_type not in AUTH_EVENT_TYPES:
+                    continue
+                try:
+                    event = decode_stream_fields(fields)
+                except (UnicodeDecodeError, TypeError, ValueError):
+                    continue
+                for detection in self.correlator.process(event, skip):
+                    alert = build_correlation_alert(detection, event, self.stream, now)
+                    actions.append({"index": {"_index": alerts_index_name(event), "_id": alert["event_id"]}})
+                    actions.append(alert)
+        return actions
+
+    async def write_alerts(self) -> None:
+        """Запись накопленных алертов; при ошибке OpenSearch они остаются до следующей попытки"""
+        if not self._pending_alerts:
+            return
+        response = await self.opensearch.bulk(body=self._pending_alerts, refresh=False)
+        alerts = len(self._pending_alerts) // 2
+        if response.get("errors"):
+            failed = [item for item in response.get("items", []) if next(iter(item.values())).get("error")]
+            self.counters["alert_write_errors"] += len(failed)
+            if failed:
+                logger.error(f"Не записано {len(failed)} из {alerts} алертов: {next(iter(failed[0].values()))['error']}")
+            alerts -= len(failed)
+        self.counters["alerts"] += alerts
+        self._pending_alerts = []
+
+    async def checkpoint(self) -> None:
+        """Состояние измененных разделов и позиции всех своих разделов одной транзакцией"""
+        if self._pending_alerts or self.last_id in ("$", ">"):
+            return
+        started = time.perf_counter()
+        dirty = self.correlator.checkpoint_dirty()
+        pipe = self.redis.pipeline(transaction=True)
+        for partition, data in dirty.items():
+            if data:
+                pipe.hset(self.state_key, str(partition), json.dumps(data, separators=(",", ":")))
+            else:
+                pipe.hdel(self.state_key, str(partition))
+        # Разделы, еще не догнавшие last_id, сохраняют прежнюю позицию
+        positions = {str(partition): self.last_id for partition in self.owned if partition not in self._lagging}
+        if positions:
+            pipe.hset(self.position_key, mapping=positions)
+        try:
+            await pipe.execute()
+        except BaseException:
+            # Несохраненные разделы попадут в следующую контрольную точку
+            self.correlator.mark_dirty(dirty)
+            raise
+        self.counters["checkpoints"] += 1
+        self.counters["checkpoint_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    async def run(self) -> None:
+        await self.restore()
+        last_checkpoint = last_stats = time.monotonic()
+        while not self._stopping.is_set():
+            try:
+                await self.write_alerts()
+            except Exception as e:
+                logger.error(f"Ошибка записи алертов, повтор через {self.retry_delay}с: {e}")
+                await self._sleep(self.retry_delay)
+                continue
+            try:
+                response = await self.redis.xread({self.stream: self.last_id}, count=self.batch_size,
+                                                  block=self.block_ms)
+                if response:
+                    self._pending_alerts.extend(self.correlate(response))
+                if time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                    last_checkpoint = time.monotonic()
+                    await self.write_alerts()
+                    await self.checkpoint()
+            except RedisError as e:
+                logger.error(f"Ошибка Redis: {e}")
+                await self._sleep(self.retry_delay)
+            except Exception as e:
+                logger.error(f"Ошибка обработки пачки, повтор через {self.retry_delay}с: {e}")
+                await self._sleep(self.retry_delay)
+            if time.monotonic() - last_stats >= self.stats_interval:
+                last_stats = time.monotonic()
+                await self.publish_stats()
+        try:
+            await self.write_alerts()
+            await self.checkpoint()
+        except Exception as e:
+            logger.error(f"Не удалось сохранить состояние при остановке: {e}")
+        await self.publish_stats()
+
+    async def _sleep(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "shard": self.name,
+            "stream": self.stream,
+            "position": self.last_id,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            **self.counters,
+            "correlator": self.correlator.stats(),
+        }
+
+    async def publish_stats(self) -> None:
+        stats = self.stats()
+        logger.info(f"Корреляция {self.name}: {stats['correlator']['auth_events']} событий аутентификации, "
+                    f"{stats['correlator']['keys']} ключей, {stats['alerts']} алертов")
+        try:
+            await self.redis.hset(STATS_KEY, self.name, json.dumps(stats))
+        except RedisError as e:
+            logger.warning(f"Не удалось сохранить статистику корреляции: {e}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Корреляция событий аутентификации в скользящих окнах")
+    parser.add_argument("--rules", default=os.getenv("AUTH_CORRELATION_RULES_FILE", DEFAULT_RULES_FILE))
+    parser.add_argument("--stream", default=os.getenv("AUTH_CORRELATION_STREAM", DEFAULT_STREAM))
+    parser.add_argument("--shard", type=int, default=int(os.getenv("AUTH_CORRELATION_SHARD", "0")))
+    parser.add_argument("--shards", type=int, default=int(os.getenv("AUTH_CORRELATION_SHARDS", "1")))
+    parser.add_argument("--partitions", type=int, default=int(os.getenv("AUTH_CORRELATION_PARTITIONS", "64")),
+                        help="Число разделов ключей; не меняется без сброса состояния")
+    parser.add_argument("--max-keys", type=int, default=int(os.getenv("AUTH_CORRELATION_MAX_KEYS", "100000")),
+                        help="Ключей на правило в памяти воркера")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("AUTH_CORRELATION_BATCH_SIZE", "1000")))
+    parser.add_argument("--block-ms", type=int, default=int(os.getenv("AUTH_CORRELATION_BLOCK_MS", "1000")))
+    parser.add_argument("--start-id", default=os.getenv("AUTH_CORRELATION_START_ID", "$"),
+                        help="С какой записи читать поток без сохраненных позиций: $ - только новые, 0 - вся история")
+    parser.add_argument("--checkpoint-interval", type=float,
+                        default=float(os.getenv("AUTH_CORRELATION_CHECKPOINT_INTERVAL", "10")))
+    parser.add_argument("--stats-interval", type=float, default=float(os.getenv("AUTH_CORRELATION_STATS_INTERVAL", "30")))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"),
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if not 0 <= args.shard < args.shards:
+        raise SystemExit("--shard должен быть от 0 до --shards - 1")
+    owned = {partition for partition in range(args.partitions) if partition % args.shards == args.shard}
+    try:
+        correlator = AuthCorrelator(load_correlation_rules(args.rules), partitions=args.partitions,
+                                    owned=owned, max_keys=args.max_keys)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"Не удалось загрузить правила {args.rules}: {e}")
+    logger.info(f"Загружено правил: {len(correlator.rules)}; разделов: {len(owned)} из {args.partitions}")
+
+    async def run() -> None:
+        redis = aioredis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379"))
+        opensearch = AsyncOpenSearch([os.getenv("OPENSEARCH_URL", "http://localhost:9200")], http_compress=True)
+        worker = AuthCorrelationWorker(
+            redis, opensearch, correlator,
+            stream=args.stream, shard=args.shard, shards=args.shards,
+            batch_size=args.batch_size, block_ms=args.block_ms, start_id=args.start_id,
+            checkpoint_interval=args.checkpoint_interval, stats_interval=args.stats_interval,
+        )
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, worker.stop)
+        try:
+            await worker.run()
+        finally:
+            await opensearch.close()
+            await redis.aclose()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,737 @@
+"""
+Встроенные заменители OpenSearch и Redis для нагрузочных прогонов.
+
+Позволяют запускать Ingest API в одном процессе с генератором нагрузки
+без внешних сервисов и измерять стоимость самого API (валидация,
+сериализация, форматирование ответов). Поддерживается только то
+подмножество API клиентов, которое используют main.py и detection_worker.py
+(включая группы потребителей Redis Streams); запросы поиска
+интерпретируются приблизительно (term/terms/ids/wildcard/match_phrase,
+сортировка, from/size, search_after, агрегации terms, top_hits, sum).
+
+Параметр latency добавляет задержку на каждый вызов, чтобы имитировать
+сетевой обмен с реальными сервисами.
+"""
+
+import asyncio
+import bisect
+import fnmatch
+import re
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from opensearchpy import NotFoundError
+
+
+def _get_path(doc: Dict[str, Any], field: str) -> Any:
+    value: Any = doc
+    for part in field.split("."):
+        if isinstance(value, dict):
+            value = value.get(part)
+        elif isinstance(value, list):
+            value = [v.get(part) for v in value if isinstance(v, dict)]
+        else:
+            return None
+    return value
+
+
+def _field(name: str) -> str:
+    for suffix in (".keyword", ".trigram"):
+        if name.endswith(suffix):
+            return name[: -len(suffix)]
+    return name
+
+
+def _norm(value: Any) -> Any:
+    return value.lower() if isinstance(value, str) else value
+
+
+def _values(value: Any) -> List[Any]:
+    if isinstance(value, list):
+        return [_norm(v) for v in value]
+    return [_norm(value)]
+
+
+def _as_list(value: Any) -> List[Any]:
+    return value if isinstance(value, list) else [value]
+
+
+def _wildcard_regex(pattern: str) -> "re.Pattern":
+    """Шаблон wildcard OpenSearch: * и ? - метасимволы, \\ экранирует следующий символ"""
+    parts, i = [], 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\" and i + 1 < len(pattern):
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+            continue
+        parts.append(".*" if char == "*" else "." if char == "?" else re.escape(char))
+        i += 1
+    return re.compile("".join(parts), re.DOTALL)
+
+
+def _matches(doc_id: str, doc: Dict[str, Any], query: Optional[Dict[str, Any]]) -> bool:
+    if not query:
+        return True
+    kind, spec = next(iter(query.items()))
+    if kind == "match_all":
+        return True
+    if kind == "bool":
+        must = _as_list(spec.get("filter", [])) + _as_list(spec.get("must", []))
+        if not all(_matches(doc_id, doc, q) for q in must):
+            return False
+        if any(_matches(doc_id, doc, q) for q in _as_list(spec.get("must_not", []))):
+            return False
+        should = _as_list(spec.get("should", []))
+        if should and (not must or spec.get("minimum_should_match")):
+            return any(_matches(doc_id, doc, q) for q in should)
+        return True
+    if kind == "ids":
+        return doc_id in spec.get("values", [])
+    if kind in ("term", "terms", "wildcard", "match_phrase", "match", "range", "prefix"):
+        field, condition = next(iter(spec.items()))
+        field = _field(field)
+        actual = doc_id if field == "_id" else _get_path(doc, field)
+        if kind == "term":
+            expected = condition.get("value") if isinstance(condition, dict) else condition
+            return _norm(expected) in _values(actual)
+        if kind == "terms":
+            return any(_norm(v) in _values(actual) for v in condition)
+        if kind == "wildcard":
+            pattern = condition.get("value") if isinstance(condition, dict) else condition
+            regex = _wildcard_regex(pattern.lower())
+            return any(isinstance(v, str) and regex.fullmatch(v) for v in _values(actual))
+        if kind == "prefix":
+            prefix = condition.get("value") if isinstance(condition, dict) else condition
+            return any(isinstance(v, str) and v.startswith(prefix.lower()) for v in _values(actual))
+        if kind in ("match_phrase", "match"):
+            text = condition.get("query") if isinstance(condition, dict) else condition
+            return any(isinstance(v, str) and str(text).lower() in v for v in _values(actual))
+        if kind == "range":
+            for op, bound in condition.items():
+                if isinstance(bound, str) and bound.startswith("now"):
+                    continue
+                if actual is None:
+                    return False
+                if op == "gte" and not actual >= bound:
+                    return False
+                if op == "gt" and not actual > bound:
+                    return False
+                if op == "lte" and not actual <= bound:
+                    return False
+                if op == "lt" and not actual < bound:
+                    return False
+            return True
+    if kind == "exists":
+        return _get_path(doc, spec["field"]) is not None
+    return True
+
+
+def _project(doc: Dict[str, Any], source: Any) -> Optional[Dict[str, Any]]:
+    if source is False:
+        return None
+    if not source or source is True:
+        return doc
+    if isinstance(source, dict):
+        source = source.get("includes") or []
+    result: Dict[str, Any] = {}
+    for field in source:
+        value = _get_path(doc, field)
+        if value is None:
+            continue
+        target = result
+        parts = field.split(".")
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return result
+
+
+class _SortKey:
+    """Ключ сортировки с учетом направления и пустых значений"""
+    __slots__ = ("values", "orders")
+
+    def __init__(self, values: Tuple[Any, ...], orders: Tuple[str, ...]):
+        self.values = values
+        self.orders = orders
+
+    def __lt__(self, other: "_SortKey") -> bool:
+        for a, b, order in zip(self.values, other.values, self.orders):
+            if a == b:
+                continue
+            if a is None:
+                return False
+            if b is None:
+                return True
+            try:
+                less = a < b
+            except TypeError:
+                less = str(a) < str(b)
+            return less if order == "asc" else not less
+        return False
+
+
+class _Indices:
+    def __init__(self, owner: "InMemoryOpenSearch"):
+        self.owner = owner
+
+    async def exists(self, index: str, **kwargs) -> bool:
+        await self.owner._delay()
+        return bool(self.owner._resolve(index))
+
+    async def create(self, index: str, body: Any = None, **kwargs) -> Dict[str, Any]:
+        await self.owner._delay()
+        self.owner.docs.setdefault(index, {})
+        return {"acknowledged": True, "index": index}
+
+    async def delete(self, index: str, **kwargs) -> Dict[str, Any]:
+        await self.owner._delay()
+        for name in self.owner._resolve(index):
+            del self.owner.docs[name]
+        return {"acknowledged": True}
+
+    async def refresh(self, index: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        return {}
+
+    async def put_mapping(self, body: Any, index: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        return {"acknowledged": True}
+
+
+class InMemoryOpenSearch:
+    """Заменитель AsyncOpenSearch, хранящий документы в словарях"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.docs: Dict[str, Dict[str, Dict[str, Any]]] = defaultdict(dict)
+        self.indices = _Indices(self)
+        self.transport = SimpleNamespace(connection_pool=SimpleNamespace(connections=[]))
+        self.calls: Dict[str, int] = defaultdict(int)
+
+    async def _delay(self) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _resolve(self, index: Optional[str]) -> List[str]:
+        patterns = (index or "*").split(",")
+        return [name for name in list(self.docs) if any(fnmatch.fnmatchcase(name, p) for p in patterns)]
+
+    async def ping(self, **kwargs) -> bool:
+        return True
+
+    async def close(self) -> None:
+        pass
+
+    async def info(self, **kwargs) -> Dict[str, Any]:
+        return {"version": {"distribution": "in-memory", "number": "0"}}
+
+    async def exists(self, index: str, id: str, **kwargs) -> bool:
+        self.calls["exists"] += 1
+        await self._delay()
+        return id in self.docs.get(index, {})
+
+    async def index(self, index: str, body: Dict[str, Any], id: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        self.calls["index"] += 1
+        await self._delay()
+        doc_id = id or str(len(self.docs[index]) + 1)
+        result = "updated" if doc_id in self.docs[index] else "created"
+        self.docs[index][doc_id] = body
+        return {"_index": index, "_id": doc_id, "result": result}
+
+    async def get(self, index: str, id: str, **kwargs) -> Dict[str, Any]:
+        self.calls["get"] += 1
+        await self._delay()
+        doc = self.docs.get(index, {}).get(id)
+        if doc is None:
+            raise NotFoundError(404, "not_found", {"_index": index, "_id": id, "found": False})
+        return {"_index": index, "_id": id, "found": True, "_source": doc}
+
+    async def mget(self, body: Dict[str, Any], index: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        self.calls["mget"] += 1
+        await self._delay()
+        docs = []
+        for doc_id in body.get("ids", []):
+            doc = self.docs.get(index, {}).get(doc_id)
+            docs.append({"_index": index, "_id": doc_id, "found": doc is not None,
+                         **({"_source": doc} if doc is not None else {})})
+        return {"docs": docs}
+
+    async def delete(self, index: str, id: str, **kwargs) -> Dict[str, Any]:
+        self.calls["delete"] += 1
+        await self._delay()
+        if self.docs.get(index, {}).pop(id, None) is None:
+            raise NotFoundError(404, "not_found", {"_index": index, "_id": id, "result": "not_found"})
+        return {"_index": index, "_id": id, "result": "deleted"}
+
+    async def update(self, index: str, id: str, body: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        self.calls["update"] += 1
+        await self._delay()
+        return {"_index": index, "_id": id, "result": self._apply_update(index, id, body)}
+
+    def _apply_update(self, index: str, doc_id: str, body: Dict[str, Any]) -> str:
+        existing = self.docs[index].get(doc_id)
+        if existing is None:
+            upsert = body.get("upsert") or (body.get("doc") if body.get("doc_as_upsert") else None)
+            if upsert is None:
+                return "not_found"
+            self.docs[index][doc_id] = dict(upsert)
+            return "created"
+        if "doc" in body:
+            existing.update(body["doc"])
+        # Скрипты (painless) не исполняются - документ остается прежним
+        return "updated"
+
+    async def bulk(self, body: Any, **kwargs) -> Dict[str, Any]:
+        self.calls["bulk"] += 1
+        await self._delay()
+        items = []
+        lines = list(body)
+        i = 0
+        while i < len(lines):
+            action, meta = next(iter(lines[i].items()))
+            index, doc_id = meta.get("_index"), meta.get("_id")
+            if action in ("index", "create"):
+                doc = lines[i + 1]
+                result = "updated" if doc_id in self.docs[index] else "created"
+                self.docs[index][doc_id] = doc
+                i += 2
+            elif action == "update":
+                result = self._apply_update(index, doc_id, lines[i + 1])
+                i += 2
+            else:
+                result = "deleted" if self.docs.get(index, {}).pop(doc_id, None) is not None else "not_found"
+                i += 1
+            items.append({action: {"_index": index, "_id": doc_id, "result": result,
+                                   "status": 404 if result == "not_found" else 200}})
+        return {"took": 0, "errors": False, "items": items}
+
+    async def delete_by_query(self, index: str, body: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        self.calls["delete_by_query"] += 1
+        await self._delay()
+        deleted = 0
+        for name in self._resolve(index):
+            for doc_id, doc in list(self.docs[name].items()):
+                if _matches(doc_id, doc, body.get("query")):
+                    del self.docs[name][doc_id]
+                    deleted += 1
+        return {"deleted": deleted}
+
+    async def count(self, index: Optional[str] = None, body: Optional[Dict[str, Any]] = None, **kwargs) -> Dict[str, Any]:
+        await self._delay()
+        query = (body or {}).get("query")
+        return {"count": sum(1 for _ in self._iter_matching(index, query))}
+
+    def _iter_matching(self, index: Optional[str], query: Optional[Dict[str, Any]]) -> Iterable[Tuple[str, str, Dict[str, Any]]]:
+        for name in self._resolve(index):
+            for doc_id, doc in self.docs[name].items():
+                if _matches(doc_id, doc, query):
+                    yield name, doc_id, doc
+
+    def _sort(self, hits: List[Dict[str, Any]], sort: Any) -> None:
+        if not sort:
+            return
+        fields: List[Tuple[str, str]] = []
+        for item in sort if isinstance(sort, list) else [sort]:
+            if isinstance(item, str):
+                fields.append((item, "asc"))
+            else:
+                name, spec = next(iter(item.items()))
+                fields.append((name, spec.get("order", "asc") if isinstance(spec, dict) else spec))
+        orders = tuple(order for _, order in fields)
+        for hit in hits:
+            values = tuple(hit["_id"] if name == "_id" else _get_path(hit["_source"], name) for name, _ in fields)
+            hit["sort"] = list(values)
+            hit["_key"] = _SortKey(values, orders)
+        hits.sort(key=lambda h: h["_key"])
+        for hit in hits:
+            del hit["_key"]
+
+    def _aggregate(self, hits: List[Dict[str, Any]], aggs: Dict[str, Any]) -> Dict[str, Any]:
+        result: Dict[str, Any] = {}
+        for name, spec in aggs.items():
+            sub_aggs = spec.get("aggs") or spec.get("aggregations") or {}
+            if "terms" in spec:
+                field = _field(spec["terms"]["field"])
+                groups: Dict[Any, List[Dict[str, Any]]] = defaultdict(list)
+                for hit in hits:
+                    value = _get_path(hit["_source"], field)
+                    for v in value if isinstance(value, list) else [value]:
+                        if v is not None:
+                            groups[v].append(hit)
+                buckets = []
+                for key, group in groups.items():
+                    bucket = {"key": key, "doc_count": len(group)}
+                    bucket.update(self._aggregate(group, sub_aggs))
+                    buckets.append(bucket)
+                # Порядок по количеству документов или по значению метрики: {"order": {"bytes": "desc"}}
+                order_name, direction = next(iter((spec["terms"].get("order") or {"_count": "desc"}).items()))
+                buckets.sort(key=lambda b: b["doc_count"] if order_name == "_count" else b[order_name]["value"],
+                             reverse=direction == "desc")
+                result[name] = {"buckets": buckets[: spec["terms"].get("size", 10)]}
+            elif "top_hits" in spec:
+                top = [dict(h) for h in hits]
+                self._sort(top, spec["top_hits"].get("sort"))
+                top = top[: spec["top_hits"].get("size", 3)]
+                for hit in top:
+                    hit["_source"] = _project(hit["_source"], spec["top_hits"].get("_source"))
+                result[name] = {"hits": {"total": {"value": len(hits), "relation": "eq"}, "hits": top}}
+            elif "cardinality" in spec:
+                field = _field(spec["cardinality"]["field"])
+                result[name] = {"value": len({str(_get_path(h["_source"], field)) for h in hits})}
+            elif "sum" in spec:
+                field = _field(spec["sum"]["field"])
+                result[name] = {"value": float(sum(_get_path(h["_source"], field) or 0 for h in hits))}
+            elif "max" in spec:
+                field = _field(spec["max"]["field"])
+                values = [v for v in (_get_path(h["_source"], field) for h in hits) if v is not None]
+                result[name] = {"value": float(max(values)) if values else None}
+            elif "value_count" in spec:
+                result[name] = {"value": len(hits)}
+            else:
+                result[name] = {"buckets": []}
+        return result
+
+    async def search(self, index: Optional[str] = None, body: Optional[Dict[str, Any]] = None, **kwargs) -> Dict[str, Any]:
+        self.calls["search"] += 1
+        await self._delay()
+        started = time.perf_counter()
+        body = body or {}
+        hits = [
+            {"_index": name, "_id": doc_id, "_source": doc}
+            for name, doc_id, doc in self._iter_matching(index, body.get("query"))
+        ]
+        total = len(hits)
+        aggregations = self._aggregate(hits, body.get("aggs") or body.get("aggregations") or {})
+
+        self._sort(hits, body.get("sort"))
+        if "search_after" in body:
+            after = list(body["search_after"])
+            for position, hit in enumerate(hits):
+                if hit.get("sort") == after:
+                    hits = hits[position + 1:]
+                    break
+        start = body.get("from", 0)
+        hits = hits[start:start + body.get("size", 10)]
+        for hit in hits:
+            hit["_source"] = _project(hit["_source"], body.get("_source"))
+
+        response = {
+            "took": int((time.perf_counter() - started) * 1000),
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"total": {"value": total, "relation": "eq"}, "hits": hits},
+        }
+        if aggregations:
+            response["aggregations"] = aggregations
+        return response
+
+
+class _Pipeline:
+    def __init__(self, owner: "InMemoryRedis"):
+        self.owner = owner
+        self.commands: List[Tuple[str, tuple, dict]] = []
+
+    def __getattr__(self, name: str):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self) -> List[Any]:
+        results = []
+        for name, args, kwargs in self.commands:
+            results.append(await getattr(self.owner, name)(*args, **kwargs))
+        self.commands = []
+        return results
+
+    async def __aenter__(self) -> "_Pipeline":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        pass
+
+
+def _stream_id(value: Any) -> Tuple[int, int]:
+    ms, _, seq = _b(value).partition(b"-")
+    return int(ms), int(seq or 0)
+
+
+def _b(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+
+class InMemoryRedis:
+    """Заменитель redis.asyncio.Redis (ответы в bytes, как без decode_responses)"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.data: Dict[bytes, Any] = {}
+        self.expires: Dict[bytes, float] = {}
+        # (поток, группа) -> позиция следующей записи и pending: ID -> потребитель
+        self.groups: Dict[Tuple[bytes, bytes], Dict[str, Any]] = {}
+        self.connection_pool = SimpleNamespace(
+            _created_connections=1, _available_connections=[], _in_use_connections=[], max_connections=1
+        )
+
+    async def _delay(self) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _live(self, key: Any) -> Any:
+        key = _b(key)
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    def pipeline(self, transaction: bool = True) -> _Pipeline:
+        return _Pipeline(self)
+
+    async def ping(self) -> bool:
+        return True
+
+    async def close(self) -> None:
+        pass
+
+    async def aclose(self) -> None:
+        pass
+
+    async def get(self, key):
+        await self._delay()
+        return self._live(key)
+
+    async def set(self, key, value, ex=None, px=None, nx=False, **kwargs):
+        await self._delay()
+        key = _b(key)
+        if nx and self._live(key) is not None:
+            return None
+        self.data[key] = _b(value)
+        self.expires.pop(key, None)
+        if ex:
+            self.expires[key] = time.time() + ex
+        if px:
+            self.expires[key] = time.time() + px / 1000
+        return True
+
+    async def mget(self, keys, *args):
+        await self._delay()
+        keys = list(keys) if not isinstance(keys, (str, bytes)) else [keys, *args]
+        return [self._live(k) for k in keys]
+
+    async def delete(self, *keys):
+        await self._delay()
+        removed = 0
+        for key in keys:
+            if self.data.pop(_b(key), None) is not None:
+                removed += 1
+            self.expires.pop(_b(key), None)
+        return removed
+
+    async def exists(self, *keys):
+        return sum(1 for k in keys if self._live(k) is not None)
+
+    async def expire(self, key, seconds):
+        if self._live(key) is None:
+            return False
+        self.expires[_b(key)] = time.time() + seconds
+        return True
+
+    async def expireat(self, key, when):
+        if self._live(key) is None:
+            return False
+        self.expires[_b(key)] = float(when)
+        return True
+
+    async def incr(self, key, amount=1):
+        return await self.incrby(key, amount)
+
+    async def incrby(self, key, amount=1):
+        value = int(self._live(key) or 0) + amount
+        self.data[_b(key)] = _b(value)
+        return value
+
+    async def hget(self, key, field):
+        await self._delay()
+        return (self._live(key) or {}).get(_b(field))
+
+    async def hmget(self, key, fields, *args):
+        h = self._live(key) or {}
+        fields = list(fields) if not isinstance(fields, (str, bytes)) else [fields, *args]
+        return [h.get(_b(f)) for f in fields]
+
+    async def hset(self, key, field=None, value=None, mapping=None, **kwargs):
+        await self._delay()
+        h = self._live(key)
+        if h is None:
+            h = self.data[_b(key)] = {}
+        added = 0
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        for f, v in items.items():
+            if _b(f) not in h:
+                added += 1
+            h[_b(f)] = _b(v)
+        return added
+
+    async def hsetnx(self, key, field, value):
+        h = self._live(key) or {}
+        if _b(field) in h:
+            return 0
+        return await self.hset(key, field, value)
+
+    async def hgetall(self, key):
+        await self._delay()
+        return dict(self._live(key) or {})
+
+    async def hdel(self, key, *fields):
+        h = self._live(key) or {}
+        return sum(1 for f in fields if h.pop(_b(f), None) is not None)
+
+    async def hincrby(self, key, field, amount=1):
+        h = self._live(key)
+        if h is None:
+            h = self.data[_b(key)] = {}
+        value = int(h.get(_b(field), 0)) + amount
+        h[_b(field)] = _b(value)
+        return value
+
+    async def smembers(self, key):
+        await self._delay()
+        return set(self._live(key) or set())
+
+    async def sadd(self, key, *members):
+        s = self._live(key)
+        if s is None:
+            s = self.data[_b(key)] = set()
+        before = len(s)
+        s.update(_b(m) for m in members)
+        return len(s) - before
+
+    async def scard(self, key):
+        return len(self._live(key) or ())
+
+    async def srem(self, key, *members):
+        s = self._live(key) or set()
+        before = len(s)
+        s.difference_update(_b(m) for m in members)
+        return before - len(s)
+
+    async def zadd(self, key, mapping, **kwargs):
+        z = self._live(key)
+        if z is None:
+            z = self.data[_b(key)] = {}
+        added = sum(1 for member in mapping if _b(member) not in z)
+        z.update({_b(member): float(score) for member, score in mapping.items()})
+        return added
+
+    async def zcard(self, key):
+        return len(self._live(key) or {})
+
+    async def zcount(self, key, min, max):
+        low, high = float(min), float(max)
+        return sum(1 for score in (self._live(key) or {}).values() if low <= score <= high)
+
+    async def zrangebyscore(self, key, min, max):
+        low, high = float(min), float(max)
+        z = self._live(key) or {}
+        return [member for member, score in sorted(z.items(), key=lambda item: item[1]) if low <= score <= high]
+
+    async def zremrangebyscore(self, key, min, max):
+        z = self._live(key) or {}
+        low, high = float(min), float(max)
+        removed = [member for member, score in z.items() if low <= score <= high]
+        for member in removed:
+            del z[member]
+        return len(removed)
+
+    async def xinfo_groups(self, name):
+        stream = self._live(name)
+        if stream is None:
+            from redis.exceptions import ResponseError
+            raise ResponseError("ERR no such key")
+        return [
+            {"name": group, "consumers": len(state["consumers"]), "pending": len(state["pending"]),
+             "lag": len(stream) - state["position"]}
+            for (stream_name, group), state in self.groups.items() if stream_name == _b(name)
+        ]
+
+    async def xadd(self, name, fields, id="*", maxlen=None, approximate=True, **kwargs):
+        await self._delay()
+        stream = self._live(name)
+        if stream is None:
+            stream = self.data[_b(name)] = []
+        entry_id = f"{int(time.time() * 1000)}-{len(stream)}".encode()
+        stream.append((entry_id, {_b(k): _b(v) for k, v in fields.items()}))
+        if maxlen and len(stream) > maxlen:
+            del stream[: len(stream) - maxlen]
+        return entry_id
+
+    async def xlen(self, name):
+        return len(self._live(name) or [])
+
+    async def xgroup_create(self, name, groupname, id="$", mkstream=False, **kwargs):
+        from redis.exceptions import ResponseError
+        key = (_b(name), _b(groupname))
+        if key in self.groups:
+            raise ResponseError("BUSYGROUP Consumer Group name already exists")
+        stream = self._live(name)
+        if stream is None:
+            if not mkstream:
+                raise ResponseError("ERR The XGROUP subcommand requires the key to exist")
+            stream = self.data[_b(name)] = []
+        self.groups[key] = {"position": len(stream) if _b(id) == b"$" else 0, "pending": {},
+                            "consumers": set()}
+        return True
+
+    async def xreadgroup(self, groupname, consumername, streams, count=None, noack=False, block=None, **kwargs):
+        await self._delay()
+        consumer = _b(consumername)
+        result = []
+        for name, start in streams.items():
+            group = self.groups.get((_b(name), _b(groupname)))
+            stream = self._live(name) or []
+            if group is None:
+                continue
+            group["consumers"].add(consumer)
+            if _b(start) == b">":
+                entries = stream[group["position"]:group["position"] + count if count else None]
+                group["position"] += len(entries)
+                if not noack:
+                    for entry_id, _ in entries:
+                        group["pending"][entry_id] = consumer
+            else:
+                pending = [entry_id for entry_id, owner in group["pending"].items() if owner == consumer]
+                fields_by_id = dict(stream)
+                entries = [(entry_id, fields_by_id.get(entry_id)) for entry_id in pending[:count]]
+            if entries:
+                result.append([_b(name), entries])
+        if not result and block:
+            await asyncio.sleep(min(block / 1000, 0.01))
+        return result
+
+    async def xread(self, streams, count=None, block=None, **kwargs):
+        await self._delay()
+        result = []
+        for name, start in streams.items():
+            stream = self._live(name) or []
+            if _b(start) == b"$":
+                position = len(stream)
+            else:
+                position = bisect.bisect_right(stream, _stream_id(start), key=lambda entry: _stream_id(entry[0]))
+            entries = stream[position:position + count if count else None]
+            if entries:
+                result.append([_b(name), entries])
+        if not result and block:
+            await asyncio.sleep(min(block / 1000, 0.01))
+        return result
+
+    async def xack(self, name, groupname, *ids):
+        group = self.groups.get((_b(name), _b(groupname)))
+        if group is None:
+            return 0
+        return sum(1 for entry_id in ids if group["pending"].pop(_b(entry_id), None) is not None)
@@ -0,0 +1,192 @@
+"""
+Корреляция событий аутентификации: скорость, память и восстановление.
+
+Генерирует поток входов --users пользователей за --minutes минут (обычные
+входы с редкими ошибками пароля) и подмешивает атаки: перебор пароля
+одной учетной записи с одного адреса, password spray с одного адреса по
+многим учетным записям и успешный вход после серии неудач. Замеряет:
+- process  - AuthCorrelator.process: событий в секунду и стоимость
+  события в начале и в конце прогона (не должна расти с объемом);
+- detect   - срабатывания каждого правила против подмешанных атак;
+- ckpt     - размер и время контрольной точки всех разделов;
+- rebalance - AuthCorrelationWorker на встроенном Redis (backends.py):
+  половина потока обрабатывается двумя воркерами, затем три воркера
+  восстанавливают разделы из контрольных точек и дочитывают поток;
+  алерты должны совпасть с однопроходной обработкой.
+
+Запуск из каталога ingest-api:
+    python benchmarks/bench_auth_correlation.py --users 5000 --events 300000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backends import InMemoryOpenSearch, InMemoryRedis  # noqa: E402
+from auth_correlator import DEFAULT_RULES_FILE, DEFAULT_STREAM, AuthCorrelationWorker  # noqa: E402
+from shared.correlation import AuthCorrelator, build_correlation_alert, load_correlation_rules  # noqa: E402
+
+PARTITIONS = 64
+
+
+def synthetic_events(rng: random.Random, users: int, count: int, minutes: int, attacks: int):
+    start = datetime(2025, 9, 1, 8, 0, tzinfo=timezone.utc)
+    span = minutes * 60
+    events = []
+    for _ in range(count):
+        user = rng.randrange(users)
+        events.append((rng.random() * span, f"user{user}", f"10.1.{user // 250}.{user % 250 + 1}",
+                       rng.random() > 0.03))
+    injected = {"auth-brute-force": 0, "auth-password-spray": 0, "auth-success-after-failures": 0}
+    for attack in range(attacks):
+        at = rng.random() * (span - 600)
+        ip = f"203.0.113.{attack % 250 + 1}" if attack < 250 else f"198.51.100.{attack % 250 + 1}"
+        kind = attack % 3
+        if kind == 0:
+            for i in range(30):
+                events.append((at + i * 4, f"victim{attack}", ip, False))
+            injected["auth-brute-force"] += 1
+        elif kind == 1:
+            for i in range(40):
+                events.append((at + i * 5, f"user{rng.randrange(users)}", ip, False))
+            injected["auth-password-spray"] += 1
+        else:
+            for i in range(12):
+                events.append((at + i * 10, f"admin{attack}", ip, False))
+            events.append((at + 130, f"admin{attack}", ip, True))
+            injected["auth-success-after-failures"] += 1
+    events.sort(key=lambda item: item[0])
+    return [
+        {
+            "event_id": f"auth-{i}",
+            "event_type": "authentication",
+            "timestamp": (start + timedelta(seconds=offset)).isoformat(),
+            "source_host": "dc01",
+            "source_agent": "dc01-agent",
+            "user": user,
+            "source_ip": ip,
+            "success": success,
+            "auth_type": "kerberos",
+        }
+        for i, (offset, user, ip, success) in enumerate(events)
+    ], injected
+
+
+def alert_ids(detections_by_event):
+    return {build_correlation_alert(detection, event)["event_id"] for event, detection in detections_by_event}
+
+
+async def run_workers(rules, events, shards_before: int, shards_after: int, checkpoint_every: int):
+    """Половина потока - shards_before воркеров, остаток - shards_after воркеров после восстановления"""
+    redis, opensearch = InMemoryRedis(), InMemoryOpenSearch()
+    for event in events:
+        await redis.xadd(DEFAULT_STREAM, {key: str(value) for key, value in event.items()})
+
+    def workers(shards: int):
+        return [
+            AuthCorrelationWorker(
+                redis, opensearch,
+                AuthCorrelator(rules, partitions=PARTITIONS,
+                               owned={p for p in range(PARTITIONS) if p % shards == shard}),
+                shard=shard, shards=shards, batch_size=1000, block_ms=1, start_id="0",
+            )
+            for shard in range(shards)
+        ]
+
+    async def drain(worker, limit):
+        await worker.restore()
+        while worker.counters["entries"] < limit:
+            response = await redis.xread({DEFAULT_STREAM: worker.last_id},
+                                         count=min(1000, limit - worker.counters["entries"]))
+            if not response:
+                break
+            worker._pending_alerts.extend(worker.correlate(response))
+            if worker.counters["entries"] % checkpoint_every < 1000:
+                await worker.write_alerts()
+                await worker.checkpoint()
+        await worker.write_alerts()
+        await worker.checkpoint()
+
+    half = len(events) // 2
+    for worker in workers(shards_before):
+        # Воркеры останавливаются в разных местах потока
+        await drain(worker, half + worker.shard * 997)
+    started = time.perf_counter()
+    restored = 0
+    for worker in workers(shards_after):
+        await drain(worker, len(events))
+        restored += worker.counters["restored_keys"]
+    elapsed = time.perf_counter() - started
+    alerts = {doc_id for index, docs in opensearch.docs.items() if index.startswith("alerts-") for doc_id in docs}
+    return alerts, restored, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--events", type=int, default=300_000)
+    parser.add_argument("--minutes", type=int, default=240)
+    parser.add_argument("--attacks", type=int, default=60)
+    parser.add_argument("--worker-events", type=int, default=60_000,
+                        help="Событий для проверки восстановления через воркеры")
+    args = parser.parse_args()
+
+    rules = load_correlation_rules(DEFAULT_RULES_FILE)
+    events, injected = synthetic_events(random.Random(3), args.users, args.events, args.minutes, args.attacks)
+
+    correlator = AuthCorrelator(rules, partitions=PARTITIONS)
+    tenth = len(events) // 10
+    found = []
+    timings = []
+    started = time.perf_counter()
+    for part in range(10):
+        part_started = time.perf_counter()
+        for event in events[part * tenth:(part + 1) * tenth if part < 9 else len(events)]:
+            for detection in correlator.process(event):
+                found.append((event, detection))
+        timings.append((time.perf_counter() - part_started) / tenth)
+    elapsed = time.perf_counter() - started
+    stats = correlator.stats()
+    print(f"process  {len(events) / elapsed:9.0f} events/s; {timings[0] * 1e6:.1f} us/event first 10%, "
+          f"{timings[-1] * 1e6:.1f} us/event last 10%; {stats['keys']} keys in memory")
+
+    by_rule = {}
+    for _, detection in found:
+        by_rule[detection.rule.id] = by_rule.get(detection.rule.id, 0) + 1
+    for rule in correlator.rules:
+        expected = injected.get(rule.id)
+        print(f"detect   {rule.id:30s} {by_rule.get(rule.id, 0):5d} alerts"
+              + (f" ({expected} injected)" if expected is not None else ""))
+    for rule_id, expected in injected.items():
+        if by_rule.get(rule_id, 0) < expected:
+            raise SystemExit(f"{rule_id}: найдено {by_rule.get(rule_id, 0)} из {expected} атак")
+
+    correlator._dirty = set(range(PARTITIONS))
+    started = time.perf_counter()
+    checkpoint = correlator.checkpoint_dirty()
+    payload = sum(len(json.dumps(data, separators=(",", ":"))) for data in checkpoint.values())
+    print(f"ckpt     {(time.perf_counter() - started) * 1000:8.1f} ms  {len(checkpoint)} partitions, "
+          f"{payload / 1024:.0f} KiB")
+
+    subset = events[:args.worker_events]
+    single = AuthCorrelator(rules, partitions=PARTITIONS)
+    expected_alerts = alert_ids((event, d) for event in subset for d in single.process(event))
+    alerts, restored, elapsed = asyncio.run(run_workers(rules, subset, 2, 3, checkpoint_every=5000))
+    print(f"rebalance 2 -> 3 workers: {restored} keys restored, {len(alerts)} alerts "
+          f"({len(expected_alerts)} single pass), resume {elapsed:.2f} s")
+    if alerts != expected_alerts:
+        raise SystemExit(f"алерты расходятся: лишние {len(alerts - expected_alerts)}, "
+                         f"пропущены {len(expected_alerts - alerts)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Пропускная способность воркера обнаружения на одном ядре.
+
+Наполняет потоки встроенного Redis (backends.py) событиями синтетического
+парка в том виде, в каком их публикует Ingest API (обогащение IP и
+encode_stream_fields), и прогоняет DetectionWorker до опустошения потоков:
+чтение группой потребителей, разбор полей, проверка правил, bulk-запись
+алертов во встроенный OpenSearch и XACK.
+
+К правилам из detection_rules.json добавляются --extra-rules синтетических
+правил (по имени процесса, хешу, порту и подстроке командной строки), чтобы
+показать работу индекса: для каждого события проверяются только правила-
+кандидаты. Для сравнения отдельно замеряется проверка тех же событий всеми
+правилами подряд (без индекса).
+
+Запуск из каталога ingest-api:
+    python benchmarks/bench_detection.py --events 100000 --extra-rules 500
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+warnings.simplefilter("ignore", DeprecationWarning)
+
+import main  # noqa: E402
+from backends import InMemoryOpenSearch, InMemoryRedis  # noqa: E402
+from detection_worker import DEFAULT_RULES_FILE, DetectionWorker, decode_stream_fields  # noqa: E402
+from enrichment import annotate_ip_classes  # noqa: E402
+from fleet import PROCESS_CATALOG, SyntheticFleet  # noqa: E402
+from shared.detection import DetectionEngine, _Context, load_rules  # noqa: E402
+
+
+def synthetic_rules(count: int, rng: random.Random):
+    names = [name for name, _, _ in PROCESS_CATALOG if name != "System"]
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            condition = {"all": [
+                {"field": "process.name", "op": "eq", "value": rng.choice(names)},
+                {"field": "process.command_line", "op": "contains", "value": f"--marker-{i}"},
+            ]}
+        elif kind == 1:
+            condition = {"field": "file_hash", "op": "eq", "value": "%064x" % rng.getrandbits(256)}
+        elif kind == 2:
+            condition = {"all": [
+                {"field": "network.destination_port", "op": "eq", "value": rng.choice([80, 443, 445, 3389, 8080])},
+                {"field": "network.destination_ip", "op": "startswith", "value": f"10.{i % 256}."},
+            ]}
+        else:
+            condition = {"all": [
+                {"field": "event_type", "op": "eq", "value": rng.choice(["process_start", "file_create", "user_login"])},
+                {"field": "process.command_line", "op": "regex", "value": f"payload{i}\\.(exe|dll)"},
+            ]}
+        yield {"id": f"synthetic-{i}", "name": f"Synthetic rule {i}", "severity": "low", "condition": condition}
+
+
+async def fill_streams(redis: InMemoryRedis, fleet: SyntheticFleet, events: int, posture_every: int) -> None:
+    for i in range(events):
+        if posture_every and i % posture_every == 0:
+            stream, event = "events:host_posture", fleet.posture_event()
+        elif i % 10 == 0:
+            stream, event = "events:security", fleet.security_event()
+        else:
+            stream, event = "events:ingestion", fleet.telemetry_event()
+        annotate_ip_classes(event, main.ip_classifier)
+        await redis.xadd(stream, main.encode_stream_fields(event))
+
+
+async def run(args) -> None:
+    rng = random.Random(7)
+    rules = load_rules(DEFAULT_RULES_FILE) + list(synthetic_rules(args.extra_rules, rng))
+    engine = DetectionEngine(rules)
+    fleet = SyntheticFleet(hosts=200, processes=60, autoruns=20, churn=0.05, seed=42)
+    redis, opensearch = InMemoryRedis(), InMemoryOpenSearch()
+    worker = DetectionWorker(redis, opensearch, engine, consumer="bench", batch_size=args.batch_size,
+                             block_ms=1, start_id="0", stats_interval=3600)
+    await fill_streams(redis, fleet, args.events, args.posture_every)
+    await worker.ensure_groups()
+
+    streams = {stream: ">" for stream in worker.streams}
+    wall, cpu = time.perf_counter(), time.process_time()
+    while True:
+        response = await redis.xreadgroup(worker.group, worker.consumer, streams, count=args.batch_size)
+        if not response:
+            break
+        await worker.process(response)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+    stats = worker.stats()
+    events = stats["events"]
+    print(f"rules    {len(engine.rules)}  indexed fields: {', '.join(stats['engine']['indexed_fields'])}")
+    print(f"worker   {events} events in {wall:.2f}s: {events / wall:9.0f} events/s, "
+          f"{events / cpu:9.0f} events/CPU-s, {stats['alerts']} alerts")
+    print(f"index    {stats['engine']['candidates_per_event']} candidate rules per event")
+    for item in stats["engine"]["rule_stats"][:5]:
+        print(f"  {item['rule_id']:32s} {item['evaluations']:8d} evals {item['avg_us']:7.2f} us/eval "
+              f"{item['matches']:7d} matches")
+
+    # Те же события без индекса: каждое правило на каждом событии
+    sample = [decode_stream_fields(fields) for _, fields in
+              (redis.data[b"events:ingestion"][:min(20_000, args.events)])]
+    started = time.perf_counter()
+    for event in sample:
+        ctx = _Context(event, "events:ingestion")
+        for rule in engine.rules:
+            rule.predicate(ctx)
+    linear = time.perf_counter() - started
+    started = time.perf_counter()
+    for event in sample:
+        engine.evaluate(event, "events:ingestion")
+    indexed = time.perf_counter() - started
+    print(f"evaluate {len(sample) / indexed:9.0f} events/s indexed, {len(sample) / linear:9.0f} events/s all rules")
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--events", type=int, default=100_000)
+    parser.add_argument("--extra-rules", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--posture-every", type=int, default=1000,
+                        help="Каждое N-е событие - снимок host_posture (0 - без снимков)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
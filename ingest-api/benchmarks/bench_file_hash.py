@@ -0,0 +1,100 @@
+"""
+Хеширование файлов: прежняя реализация get_file_hash против FileHasher.
+
+Создает во временном каталоге набор файлов, похожий на исполняемые файлы
+процессов и автозапуска (много файлов 64 КБ - 4 МБ и несколько крупных),
+и сравнивает:
+- legacy - чтение блоками по 4 КБ в одном потоке, без кэша (прежний get_file_hash);
+- cold   - FileHasher.hash_many: большие буферы/mmap и пул потоков, пустой кэш;
+- warm   - повторный hash_many по неизмененным файлам (ответы из кэша);
+- restart - новый FileHasher с тем же файлом кэша SQLite (кэш после перезапуска).
+
+Запуск из каталога ingest-api:
+    python benchmarks/bench_file_hash.py --files 2000 --large 4
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from shared.file_hashing import FileHashCache, FileHasher  # noqa: E402
+
+SMALL_SIZES = (64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024)
+LARGE_SIZE = 64 * 1024 * 1024
+
+
+def legacy_get_file_hash(file_path: str):
+    """Прежняя реализация shared.utils.get_file_hash"""
+    sha256_hash = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            sha256_hash.update(chunk)
+    return sha256_hash.hexdigest()
+
+
+def make_files(directory: str, count: int, large: int, seed: int = 42):
+    rng = random.Random(seed)
+    block = os.urandom(1024 * 1024)
+    paths = []
+    for i in range(count + large):
+        size = LARGE_SIZE if i >= count else rng.choice(SMALL_SIZES)
+        path = os.path.join(directory, f"bin{i:05d}.exe")
+        with open(path, "wb") as f:
+            remaining = size
+            while remaining > 0:
+                chunk = block[:min(remaining, len(block))]
+                f.write(chunk)
+                remaining -= len(chunk)
+            # Уникальный хвост, чтобы у файлов были разные хеши
+            f.write(i.to_bytes(8, "little"))
+        paths.append(path)
+    return paths
+
+
+def measure(name: str, func, paths, total_bytes: int):
+    start = time.perf_counter()
+    result = func(paths)
+    elapsed = time.perf_counter() - start
+    print(f"{name:8s} {elapsed * 1000:9.1f} ms  {total_bytes / elapsed / 2**20:9.1f} MiB/s  "
+          f"{len(paths) / elapsed:10.0f} files/s")
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=1000, help="Число файлов 64 КБ - 4 МБ")
+    parser.add_argument("--large", type=int, default=2, help="Число файлов по 64 МБ (через mmap)")
+    parser.add_argument("--workers", type=int, default=None, help="Потоков пула (по умолчанию 2 x ядер)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_files(directory, args.files, args.large)
+        total_bytes = sum(os.path.getsize(path) for path in paths)
+        print(f"{len(paths)} файлов, {total_bytes / 2**20:.0f} MiB (данные в page cache)")
+
+        expected = measure("legacy", lambda items: {p: legacy_get_file_hash(p) for p in items}, paths, total_bytes)
+
+        cache_path = os.path.join(directory, "file_hashes.db")
+        hasher = FileHasher(cache=FileHashCache(cache_path), max_workers=args.workers)
+        cold = measure("cold", hasher.hash_many, paths, total_bytes)
+        warm = measure("warm", hasher.hash_many, paths, total_bytes)
+        hasher.close()
+
+        restarted = FileHasher(cache=FileHashCache(cache_path), max_workers=args.workers)
+        after_restart = measure("restart", restarted.hash_many, paths, total_bytes)
+        print(f"stats: {restarted.stats()}")
+        restarted.close()
+
+        if not (expected == cold == warm == after_restart):
+            print("ОШИБКА: хеши FileHasher не совпадают с прежней реализацией")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Сопоставление с индикаторами компрометации: построение индекса и проверка событий.
+
+Строит IocIndex из синтетического фида заданного размера (хэши, домены,
+IP-адреса и CIDR, подстроки командных строк) и замеряет:
+- build  - время построения индекса и прирост RSS процесса;
+- lookup - одиночные match_hash / match_ip / match_domain / match_text, нс на вызов;
+- event  - annotate_ioc_matches на событии host_posture (SyntheticFleet):
+  cold - с пустым кэшем текстовых совпадений, warm - повторная проверка
+  того же события (командные строки повторяются на всех хостах).
+
+В фид подмешиваются индикаторы, совпадающие с процессами события, чтобы
+замер включал запись совпадений; число совпадений проверяется.
+
+Запуск из каталога ingest-api:
+    python benchmarks/bench_ioc.py --hashes 1000000 --domains 1000000 --ips 200000 --substrings 10000
+"""
+
+import argparse
+import copy
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from enrichment import annotate_ioc_matches  # noqa: E402
+from fleet import SyntheticFleet  # noqa: E402
+from shared.ioc import Indicator, IocIndex  # noqa: E402
+
+TLDS = ("com", "net", "org", "ru", "io", "info", "xyz", "top")
+
+
+def synthetic_feed(rng: random.Random, hashes: int, domains: int, ips: int, substrings: int):
+    for _ in range(hashes):
+        yield Indicator("hash", "%064x" % rng.getrandbits(256), "malware", rng.randint(30, 100), "bench")
+    for i in range(domains):
+        yield Indicator("domain", f"d{i:x}{rng.getrandbits(24):x}.{rng.choice(TLDS)}", "c2", rng.randint(30, 100), "bench")
+    for i in range(ips):
+        address = rng.getrandbits(32)
+        value = f"{address >> 24}.{(address >> 16) & 255}.{(address >> 8) & 255}.{address & 255}"
+        # Каждый десятый - диапазон /24
+        if i % 10 == 0:
+            value = f"{address >> 24}.{(address >> 16) & 255}.{(address >> 8) & 255}.0/24"
+        yield Indicator("ip", value, "scanner", rng.randint(30, 100), "bench")
+    for i in range(substrings):
+        yield Indicator("substring", f"-{rng.getrandbits(40):010x}-{i}", "tool", rng.randint(30, 100), "bench")
+
+
+def rss_mib() -> float:
+    # ru_maxrss в КБ на Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def per_call_ns(func, values, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for value in values:
+            func(value)
+    return (time.perf_counter() - start) / (rounds * len(values)) * 1e9
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--hashes", type=int, default=1_000_000)
+    parser.add_argument("--domains", type=int, default=1_000_000)
+    parser.add_argument("--ips", type=int, default=200_000)
+    parser.add_argument("--substrings", type=int, default=10_000)
+    parser.add_argument("--processes", type=int, default=150)
+    parser.add_argument("--autoruns", type=int, default=40)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    event = SyntheticFleet(hosts=1, processes=args.processes, autoruns=args.autoruns, churn=0.0, seed=1234).posture_event()
+    processes = event["inventory"]["processes"]
+    planted = [
+        Indicator("hash", processes[0]["sha256"], "malware", 90, "planted"),
+        Indicator("substring", processes[1]["exe_path"].rsplit("\\", 1)[-1].lower(), "tool", 60, "planted"),
+    ]
+
+    rss_before = rss_mib()
+    start = time.perf_counter()
+    index = IocIndex.build(
+        [*synthetic_feed(rng, args.hashes, args.domains, args.ips, args.substrings), *planted]
+    )
+    build_seconds = time.perf_counter() - start
+    stats = index.stats()
+    print(f"build    {build_seconds:8.2f} s   {stats['indicators']} indicators, "
+          f"automaton {stats['automaton']}, RSS +{rss_mib() - rss_before:.0f} MiB")
+
+    hashes = list(index.hashes)[:1000] + ["%064x" % rng.getrandbits(256) for _ in range(1000)]
+    domains = [f"www.{domain}" for domain in list(index.domains)[:1000]] + [f"a.b.clean{i}.com" for i in range(1000)]
+    ips = [f"10.{i >> 8 & 255}.{i & 255}.7" for i in range(1000)] + [f"{rng.randint(1, 223)}.1.2.3" for _ in range(1000)]
+    texts = [process["cmdline"] for process in processes if process["cmdline"]]
+    lookup_rounds = max(1, args.rounds // 20)
+    print(f"hash     {per_call_ns(index.match_hash, hashes, lookup_rounds):8.0f} ns")
+    print(f"ip       {per_call_ns(index.match_ip, ips, lookup_rounds):8.0f} ns")
+    print(f"domain   {per_call_ns(index.match_domain, domains, lookup_rounds):8.0f} ns")
+    index._text_cache.clear()
+    print(f"text     {per_call_ns(index.match_text, texts, 1):8.0f} ns  (cold)")
+    print(f"text     {per_call_ns(index.match_text, texts, lookup_rounds):8.0f} ns  (warm)")
+
+    index._text_cache.clear()
+    data = copy.deepcopy(event)
+    start = time.perf_counter()
+    matched = annotate_ioc_matches(data, index)
+    cold = time.perf_counter() - start
+    if matched < len(planted):
+        raise SystemExit(f"ожидалось не меньше {len(planted)} совпадений, найдено {matched}")
+    events = [copy.deepcopy(event) for _ in range(args.rounds)]
+    start = time.perf_counter()
+    for data in events:
+        annotate_ioc_matches(data, index)
+    warm = (time.perf_counter() - start) / args.rounds
+    print(f"event    {cold * 1e6:8.0f} us  (cold, {len(processes)} processes, {matched} matches)")
+    print(f"event    {warm * 1e6:8.0f} us  (warm)")
+
+
+if __name__ == "__main__":
+    main()
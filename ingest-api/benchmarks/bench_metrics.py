@@ -0,0 +1,51 @@
+"""
+Замер накладных расходов метрик на одно событие.
+
+Повторяет набор операций, который выполняет обработчик /ingest/host-posture:
+одно наблюдение стадии приема, четыре таймера стадий и инкремент счетчика.
+
+Запуск из каталога ingest-api:
+    python benchmarks/bench_metrics.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Registry  # noqa: E402
+
+ITERATIONS = 200_000
+
+
+def main() -> None:
+    registry = Registry()
+    stages = registry.histogram("bench_stage_seconds", "bench", ("endpoint", "stage"))
+    events = registry.counter("bench_events_total", "bench", ("endpoint", "event_type", "status"))
+    endpoint = "/ingest/host-posture"
+
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        stages.observe(0.0003, endpoint, "receive_validate")
+        with stages.time(endpoint, "exists_check"):
+            pass
+        with stages.time(endpoint, "index"):
+            pass
+        with stages.time(endpoint, "record_location"):
+            pass
+        with stages.time(endpoint, "publish"):
+            pass
+        events.inc(endpoint, "host_posture", "accepted")
+    elapsed = time.perf_counter() - start
+
+    per_event_us = elapsed / ITERATIONS * 1e6
+    print(f"events: {ITERATIONS}, overhead per event: {per_event_us:.2f} us")
+
+    start = time.perf_counter()
+    text = registry.render()
+    print(f"render: {(time.perf_counter() - start) * 1000:.2f} ms, {len(text)} bytes")
+
+
+if __name__ == "__main__":
+    main()
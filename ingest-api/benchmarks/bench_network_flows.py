@@ -0,0 +1,146 @@
+"""
+Агрегация сетевых соединений в потоки против документа на каждое соединение.
+
+Генерирует --events событий network_connection от --hosts хостов за
+--minutes минут: каждый хост повторно обращается к небольшому набору
+сервисов (DNS, прокси, файловые серверы, контроллер домена) и изредка - к
+случайным внешним адресам; доля --flagged событий помечена совпадением IOC.
+Замеряет на встроенном OpenSearch (backends.py):
+- add     - пропускную способность FlowAggregator.add;
+- store   - число документов: сырые события против окон потоков и
+  сохраненных сырых событий помеченных и выбранных потоков;
+- write   - запись в индекс: bulk всех сырых событий против сброса окон;
+- top     - top talkers по байтам: агрегация сырых событий против
+  агрегации network-flows (результаты должны совпасть).
+
+Запуск из каталога ingest-api:
+    python benchmarks/bench_network_flows.py --hosts 100 --events 300000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backends import InMemoryOpenSearch  # noqa: E402
+from flow_aggregator import FLOW_INDEX, flush_flows, get_top_talkers  # noqa: E402
+from shared.flows import FlowAggregator  # noqa: E402
+
+RAW_INDEX = "agent-events-bench"
+
+SERVICES = [
+    ("10.0.0.53", 53, "udp"), ("10.0.0.10", 389, "tcp"), ("10.0.0.10", 88, "tcp"),
+    ("10.0.1.20", 445, "tcp"), ("10.0.1.21", 445, "tcp"), ("10.0.2.5", 8080, "tcp"),
+    ("52.1.2.3", 443, "tcp"), ("52.1.2.4", 443, "tcp"), ("140.82.1.1", 443, "tcp"),
+]
+PROCESSES = ("svchost.exe", "chrome.exe", "OUTLOOK.EXE", "Teams.exe", "explorer.exe")
+
+
+def synthetic_events(rng: random.Random, hosts: int, count: int, minutes: int, flagged: float):
+    start = datetime(2025, 9, 1, 10, 0, tzinfo=timezone.utc)
+    span = minutes * 60
+    for i in range(count):
+        host = rng.randrange(hosts)
+        if rng.random() < 0.05:
+            destination = (f"198.51.{rng.randrange(256)}.{rng.randrange(1, 255)}", rng.choice((443, 80)), "tcp")
+        else:
+            destination = SERVICES[min(int(rng.expovariate(0.5)), len(SERVICES) - 1)]
+        event = {
+            "event_id": f"net-{i}",
+            "event_type": "network_connection",
+            "timestamp": (start + timedelta(seconds=rng.random() * span)).isoformat(),
+            "severity": "info",
+            "host": {"host_id": f"host-{host:05d}", "hostname": f"WS-{host:05d}"},
+            "process": {"pid": 1000 + host, "name": rng.choice(PROCESSES)},
+            "network": {
+                "protocol": destination[2],
+                "source_ip": f"10.10.{host // 250}.{host % 250 + 1}",
+                "source_port": rng.randrange(49152, 65535),
+                "destination_ip": destination[0],
+                "destination_port": destination[1],
+                "bytes_sent": int(rng.lognormvariate(7, 1.5)),
+                "bytes_received": int(rng.lognormvariate(9, 1.5)),
+            },
+        }
+        if rng.random() < flagged:
+            event["ioc"] = {"matched": True, "count": 1}
+        yield event
+
+
+async def raw_top_talkers(opensearch: InMemoryOpenSearch, limit: int):
+    response = await opensearch.search(index=RAW_INDEX, body={
+        "size": 0,
+        "aggs": {"talkers": {
+            "terms": {"field": "network.destination_ip", "size": limit, "order": {"bytes": "desc"}},
+            "aggs": {"bytes": {"sum": {"field": "network.bytes_sent"}}}
+        }}
+    })
+    return [(b["key"], int(b["bytes"]["value"])) for b in response["aggregations"]["talkers"]["buckets"]]
+
+
+async def run(args) -> None:
+    rng = random.Random(5)
+    events = list(synthetic_events(rng, args.hosts, args.events, args.minutes, args.flagged))
+    aggregator = FlowAggregator(window_seconds=args.window, allowed_lateness=0,
+                                sample_rate=args.sample_rate, max_pending=len(events))
+
+    started = time.perf_counter()
+    retained = [event for event in events if aggregator.add(event)["retain"]]
+    elapsed = time.perf_counter() - started
+    print(f"add      {elapsed * 1000:8.1f} ms  {len(events) / elapsed:9.0f} events/s, {len(aggregator)} open flows")
+
+    raw, flows = InMemoryOpenSearch(), InMemoryOpenSearch()
+    started = time.perf_counter()
+    for start in range(0, len(events), 1000):
+        actions = []
+        for event in events[start:start + 1000]:
+            actions += [{"index": {"_index": RAW_INDEX, "_id": event["event_id"]}}, event]
+        await raw.bulk(body=actions)
+    raw_write = time.perf_counter() - started
+
+    started = time.perf_counter()
+    written = await flush_flows(aggregator, flows, force=True)
+    for event in retained:
+        await flows.index(index=RAW_INDEX, id=event["event_id"], body=event)
+    flow_write = time.perf_counter() - started
+
+    stored = written + len(retained)
+    print(f"store    raw {len(events)} docs, flows {written} windows + {len(retained)} raw events "
+          f"({len(events) / stored:.1f}x fewer documents)")
+    print(f"write    raw {raw_write * 1000:8.1f} ms ({raw.calls['bulk']} bulk), "
+          f"flows {flow_write * 1000:8.1f} ms ({flows.calls['bulk']} bulk + {flows.calls['index']} index)")
+
+    started = time.perf_counter()
+    expected = await raw_top_talkers(raw, args.top)
+    raw_top = time.perf_counter() - started
+    started = time.perf_counter()
+    result = await get_top_talkers(flows, "destination_ip", "bytes_sent", hours=24, limit=args.top)
+    flow_top = time.perf_counter() - started
+    actual = [(talker["key"], talker["bytes_sent"]) for talker in result["talkers"]]
+    if actual != expected:
+        raise SystemExit(f"top talkers расходятся:\n  raw   {expected}\n  flows {actual}")
+    print(f"top      raw {raw_top * 1000:8.1f} ms over {len(raw.docs[RAW_INDEX])} docs, "
+          f"flows {flow_top * 1000:8.1f} ms over {len(flows.docs[FLOW_INDEX])} docs (same top {args.top})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--hosts", type=int, default=100)
+    parser.add_argument("--events", type=int, default=300_000)
+    parser.add_argument("--minutes", type=int, default=30)
+    parser.add_argument("--window", type=int, default=60, help="Длина окна, секунды")
+    parser.add_argument("--sample-rate", type=float, default=0.01)
+    parser.add_argument("--flagged", type=float, default=0.001, help="Доля событий с совпадением IOC")
+    parser.add_argument("--top", type=int, default=10)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
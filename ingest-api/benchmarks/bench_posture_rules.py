@@ -0,0 +1,150 @@
+"""
+Серверные правила posture: оценка по всему парку и выкатка изменения правила.
+
+Строит таблицу последних снимков синтетического парка (SyntheticFleet) и
+замеряет:
+- load     - заполнение PostureTable снимками всех хостов;
+- evaluate - полную оценку правил posture_rules.json по всему парку;
+- change   - добавление и изменение одного правила: оценивается только оно,
+  результат - разница findings (сколько записать и удалить);
+- worker   - то же через PostureRuleWorker на встроенных Redis и OpenSearch
+  (backends.py): начальная сверка парка, затем изменение правила через hash
+  posture:rules, как это делает PUT /admin/posture-rules, до записи всех
+  изменившихся findings в индекс posture-findings;
+- stream   - обработку пачки новых снимков из потока events:host_posture.
+
+Запуск из каталога ingest-api:
+    python benchmarks/bench_posture_rules.py --hosts 10000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backends import InMemoryOpenSearch, InMemoryRedis  # noqa: E402
+from fleet import SyntheticFleet  # noqa: E402
+from posture_evaluator import (  # noqa: E402
+    DEFAULT_RULES_FILE, FINDINGS_INDEX, POSTURE_STREAM, RULES_KEY, RULES_VERSION_KEY, PostureRuleWorker,
+)
+from shared.posture_rules import PostureEvaluator, PostureRule, iter_rows, load_posture_rules  # noqa: E402
+
+NEW_RULE = {
+    "rule_id": "DEFENDER_SIGNATURES_STALE_3D",
+    "severity": "low",
+    "message_ru": "Сигнатуры антивируса старше 3 дней",
+    "condition": {"all": [
+        {"field": "defender.signature_age_days", "op": "gt", "value": 3},
+        {"field": "defender.antivirus_enabled", "op": "eq", "value": True},
+    ]},
+}
+
+
+def snapshot(event):
+    """Документ host_posture в том виде, в каком его сохраняет Ingest API"""
+    return dict(event, timestamp=event["@timestamp"], host_info=dict(event["host"]))
+
+
+def count(mask: int) -> int:
+    return bin(mask).count("1")
+
+
+async def run_worker(snapshots, args) -> None:
+    redis, opensearch = InMemoryRedis(), InMemoryOpenSearch()
+    for doc in snapshots:
+        opensearch.docs["agent-events-bench"][doc["event_id"]] = doc
+    worker = PostureRuleWorker(redis, opensearch, consumer="bench", block_ms=1, bulk_size=args.bulk_size)
+    await worker.ensure_group()
+
+    started = time.perf_counter()
+    await worker.initial_sync()
+    print(f"worker   initial sync {time.perf_counter() - started:6.2f} s: "
+          f"{len(worker.evaluator.table)} hosts, {len(opensearch.docs[FINDINGS_INDEX])} findings")
+
+    # Изменение правила - как в PUT /admin/posture-rules
+    definition = dict(NEW_RULE, condition={"field": "defender.signature_age_days", "op": "gt", "value": 10})
+    await redis.hset(RULES_KEY, NEW_RULE["rule_id"], json.dumps(NEW_RULE, ensure_ascii=False))
+    await redis.incr(RULES_VERSION_KEY)
+    await worker.sync_rules()
+    added = worker.last_rule_change
+    await redis.hset(RULES_KEY, NEW_RULE["rule_id"], json.dumps(definition, ensure_ascii=False))
+    await redis.incr(RULES_VERSION_KEY)
+    await worker.sync_rules()
+    changed = worker.last_rule_change
+    for label, change in (("add", added), ("change", changed)):
+        print(f"worker   rule {label:6s} {change['total_ms']:8.1f} ms total, {change['evaluate_ms']:6.2f} ms evaluate: "
+              f"{change['upserted']} upserted, {change['deleted']} deleted")
+    expected = sum(1 for doc in snapshots if doc["security"]["defender"]["signature_age_days"] > 10)
+    written = sum(1 for doc in opensearch.docs[FINDINGS_INDEX].values() if doc["rule_id"] == NEW_RULE["rule_id"])
+    if written != expected:
+        raise SystemExit(f"ожидалось {expected} findings нового правила, в индексе {written}")
+
+    fleet = SyntheticFleet(hosts=args.hosts, processes=1, autoruns=1, churn=1.0, seed=42)
+    for _ in range(args.updates):
+        event = snapshot(fleet.posture_event())
+        await redis.xadd(POSTURE_STREAM, {key: json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+                                          for key, value in event.items()})
+    response = await redis.xreadgroup(worker.group, worker.consumer, {POSTURE_STREAM: ">"}, count=args.updates)
+    started = time.perf_counter()
+    await worker.process(response)
+    elapsed = time.perf_counter() - started
+    print(f"stream   {args.updates} snapshots in {elapsed * 1000:8.1f} ms: {args.updates / elapsed:9.0f} snapshots/s "
+          f"({worker.counters['findings_upserted']} upserted, {worker.counters['findings_deleted']} deleted in total)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--hosts", type=int, default=10_000)
+    parser.add_argument("--updates", type=int, default=1000, help="Снимков в пачке из потока")
+    parser.add_argument("--rounds", type=int, default=100)
+    parser.add_argument("--bulk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    fleet = SyntheticFleet(hosts=args.hosts, processes=1, autoruns=1, churn=0.0, seed=7)
+    snapshots = [snapshot(host.posture_event()) for host in fleet.hosts]
+    rules = load_posture_rules(DEFAULT_RULES_FILE)
+
+    evaluator = PostureEvaluator(rules)
+    started = time.perf_counter()
+    evaluator.update_hosts(snapshots)
+    print(f"load     {time.perf_counter() - started:8.3f} s   {len(evaluator.table)} hosts, "
+          f"{len(evaluator.table.columns)} columns")
+
+    # Правила, общие с recommend/engine.go агента, должны дать те же findings
+    for rule_id in ("FIREWALL_DISABLED", "DEFENDER_REALTIME_OFF", "UAC_DISABLED", "SMB1_ENABLED", "BITLOCKER_OFF"):
+        agent = sum(1 for doc in snapshots for finding in doc["findings"] if finding["rule_id"] == rule_id)
+        if agent != count(evaluator.results[rule_id]):
+            raise SystemExit(f"{rule_id}: агент {agent}, сервер {count(evaluator.results[rule_id])}")
+
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        evaluator.evaluate_all()
+    full = (time.perf_counter() - started) / args.rounds
+    findings = sum(count(mask) for mask in evaluator.results.values())
+    print(f"evaluate {full * 1000:8.3f} ms  {len(rules)} rules over {len(evaluator.table)} hosts, {findings} findings")
+
+    started = time.perf_counter()
+    changes = evaluator.set_rules(rules + [PostureRule(NEW_RULE)])
+    added = time.perf_counter() - started
+    changed_rule = PostureRule(dict(NEW_RULE, severity="medium"))
+    started = time.perf_counter()
+    evaluator.set_rules(rules + [changed_rule])
+    changed = time.perf_counter() - started
+    print(f"change   {added * 1000:8.3f} ms  add rule ({len(changes)} rule evaluated, {count(changes[0].upsert)} hosts)")
+    print(f"change   {changed * 1000:8.3f} ms  change rule")
+
+    started = time.perf_counter()
+    docs = [evaluator.finding(changes[0].rule_id, row) for row in iter_rows(changes[0].upsert)]
+    print(f"findings {(time.perf_counter() - started) * 1000:8.3f} ms  {len(docs)} finding documents built")
+
+    asyncio.run(run_worker(snapshots, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Условная загрузка снимков host_posture против полной.
+
+Парк из --hosts хостов (fleet.py) отчитывается --cycles раз. Доля --steady
+хостов между отчетами не меняет состав процессов и автозапусков, у
+остальных меняется часть процессов и автозапусков (--churn) и число
+ожидающих обновлений. Как и у реальных хостов, у всех между отчетами
+доля --restarts процессов перезапускается с новым PID и столько же служб
+меняет состояние. С --replay вместо синтетического парка используются
+сохраненные снимки host_posture (ответ поиска OpenSearch или JSON-список):
+i-й цикл - i-й по времени снимок каждого хоста. Каждый цикл прогоняется
+через приложение на встроенных бэкендах (backends.py) двумя способами:
+- full        - полный снимок в /ingest/host-posture, как раньше;
+- conditional - хеши разделов в /ingest/host-posture/handshake, затем
+  снимок только с изменившимися разделами.
+Печатает байты запросов на хост за цикл, время приема на хост и долю
+разделов, взятых из сохраненного снимка, а для последнего цикла - время
+разбора и валидации тел снимков (json.loads + HostPostureEvent) обоих
+способов. Последние сохраненные снимки обоих способов сравниваются по
+разделам и должны совпасть.
+
+Запуск из каталога ingest-api:
+    python benchmarks/bench_posture_upload.py --hosts 200 --cycles 3 --steady 0.7
+    python benchmarks/bench_posture_upload.py --replay ../docs/debug/host_posture_updates_examples/latest_events_today.json
+"""
+
+import argparse
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import httpx  # noqa: E402
+
+from backends import InMemoryOpenSearch, InMemoryRedis  # noqa: E402
+from fleet import SyntheticFleet  # noqa: E402
+import main  # noqa: E402
+from posture_sections import POSTURE_SECTIONS  # noqa: E402
+
+
+def section_value(event, path):
+    for part in path:
+        event = (event or {}).get(part)
+    return event
+
+
+def section_hashes(event):
+    """Хеши разделов на стороне агента: sha256 канонического JSON раздела"""
+    return {
+        name: hashlib.sha256(json.dumps(section_value(event, path), sort_keys=True,
+                                        separators=(",", ":")).encode("utf-8")).hexdigest()
+        for name, path in POSTURE_SECTIONS.items()
+    }
+
+
+def restart(event, rate, rng) -> None:
+    """Перезапуск доли процессов с новым PID и смена состояния доли служб (на месте)"""
+    inventory = event.get("inventory") or {}
+    for proc in inventory.get("processes") or []:
+        if rng.random() < rate:
+            proc["pid"] += rng.randint(1000, 9000) * 4
+    for service in (inventory.get("autoruns") or {}).get("services_auto") or []:
+        if rng.random() < rate:
+            service["state"] = "Stopped" if service.get("state") == "Running" else "Running"
+
+
+def cycles(args):
+    """
+    Снимки каждого хоста по циклам; стабильные хосты повторяют прошлое
+    состояние, кроме перезапущенных процессов и служб
+    """
+    fleet = SyntheticFleet(args.hosts, processes=args.processes, autoruns=args.autoruns, churn=args.churn, seed=5)
+    steady = set(range(int(args.hosts * args.steady)))
+    rng = random.Random(7)
+    previous = {}
+    for cycle in range(args.cycles):
+        events = []
+        for i, host in enumerate(fleet.hosts):
+            if cycle and i in steady:
+                event = copy.deepcopy(previous[i])
+                event["event_id"] = str(uuid.uuid4())
+            else:
+                if cycle:
+                    host.apply_churn(args.churn)
+                event = copy.deepcopy(host.posture_event())
+            if cycle:
+                restart(event, args.restarts, rng)
+            event["@timestamp"] = f"2025-09-01T{10 + cycle:02d}:00:{i % 60:02d}Z"
+            previous[i] = event
+            events.append(event)
+        yield events
+
+
+def replay_cycles(path):
+    """Сохраненные снимки: i-й цикл - i-й по времени снимок каждого хоста"""
+    with open(path, encoding="utf-8-sig") as f:
+        data = json.load(f)
+    hits = data["hits"]["hits"] if isinstance(data, dict) else data
+    by_host = defaultdict(list)
+    for hit in hits:
+        event = copy.deepcopy(hit.get("_source", hit))
+        if "@timestamp" not in event:
+            event["@timestamp"] = event.pop("timestamp")
+        by_host[event["host"]["host_id"]].append(event)
+    snapshots = [sorted(events, key=lambda event: event["@timestamp"]) for events in by_host.values()]
+    for cycle in range(max(len(events) for events in snapshots)):
+        yield [events[cycle] for events in snapshots if cycle < len(events)]
+
+
+async def upload(client, event, conditional: bool, stats) -> None:
+    if not conditional:
+        body = json.dumps(event, ensure_ascii=False).encode("utf-8")
+        stats["bytes"] += len(body)
+        stats["bodies"].append(body)
+        response = await client.post("/ingest/host-posture", content=body,
+                                     headers={"Content-Type": "application/json"})
+        response.raise_for_status()
+        return
+    hashes = section_hashes(event)
+    handshake = json.dumps({"host_id": event["host"]["host_id"], "hostname": event["host"]["hostname"],
+                            "section_hashes": hashes}).encode("utf-8")
+    stats["bytes"] += len(handshake)
+    response = await client.post("/ingest/host-posture/handshake", content=handshake,
+                                 headers={"Content-Type": "application/json"})
+    response.raise_for_status()
+    unchanged = response.json()["unchanged_sections"]
+    partial = copy.deepcopy(event)
+    for name in unchanged:
+        path = POSTURE_SECTIONS[name]
+        parent = partial
+        for part in path[:-1]:
+            parent = parent[part]
+        del parent[path[-1]]
+    partial["section_hashes"] = hashes
+    partial["unchanged_sections"] = unchanged
+    body = json.dumps(partial, ensure_ascii=False).encode("utf-8")
+    stats["bytes"] += len(body)
+    stats["bodies"].append(body)
+    stats["reused"] += len(unchanged)
+    for name in unchanged:
+        stats["by_section"][name] += 1
+    stats["sections"] += len(POSTURE_SECTIONS)
+    response = await client.post("/ingest/host-posture", content=body, headers={"Content-Type": "application/json"})
+    if response.status_code == 409:
+        # Сохраненный снимок недоступен: полный снимок
+        stats["retries"] += 1
+        await upload(client, dict(event, section_hashes=hashes), False, stats)
+        return
+    response.raise_for_status()
+
+
+async def run_mode(args, conditional: bool):
+    opensearch, redis = InMemoryOpenSearch(), InMemoryRedis()
+    main.opensearch_client, main.redis_client = opensearch, redis
+    await main.ensure_inventory_index(opensearch)
+    await main.ensure_rollup_index(opensearch)
+    results = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as client:
+        for cycle, events in enumerate(replay_cycles(args.replay) if args.replay else cycles(args)):
+            stats = {"bytes": 0, "reused": 0, "sections": 0, "retries": 0, "bodies": [], "hosts": len(events),
+                     "by_section": defaultdict(int)}
+            started = time.perf_counter()
+            for event in events:
+                await upload(client, event, conditional, stats)
+            stats["seconds"] = time.perf_counter() - started
+            results.append(stats)
+    latest = {}
+    for index, docs in opensearch.docs.items():
+        for doc in docs.values():
+            if doc.get("format_type") == "host_posture":
+                host = doc["host_info"]["host_id"]
+                if host not in latest or doc["timestamp"] > latest[host]["timestamp"]:
+                    latest[host] = doc
+    return results, latest
+
+
+def validation_seconds(bodies) -> float:
+    """Разбор и валидация тел снимков, как при приеме в /ingest/host-posture"""
+    started = time.perf_counter()
+    for body in bodies:
+        main.HostPostureEvent(**json.loads(body))
+    return time.perf_counter() - started
+
+
+def main_() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--hosts", type=int, default=200)
+    parser.add_argument("--processes", type=int, default=150)
+    parser.add_argument("--autoruns", type=int, default=40)
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--steady", type=float, default=0.7, help="Доля хостов без изменений между отчетами")
+    parser.add_argument("--churn", type=float, default=0.05, help="Доля записей, меняющихся у остальных хостов")
+    parser.add_argument("--restarts", type=float, default=0.05,
+                        help="Доля процессов с новым PID и служб со сменой состояния у всех хостов между отчетами")
+    parser.add_argument("--replay", help="Файл сохраненных снимков host_posture вместо синтетического парка")
+    args = parser.parse_args()
+
+    full, full_latest = asyncio.run(run_mode(args, conditional=False))
+    conditional, conditional_latest = asyncio.run(run_mode(args, conditional=True))
+    for cycle, (f, c) in enumerate(zip(full, conditional)):
+        hosts = f["hosts"]
+        reused = c["reused"] / c["sections"] if c["sections"] else 0.0
+        print(f"cycle {cycle}  full {f['bytes'] / hosts / 1024:7.1f} KiB/host {f['seconds'] / hosts * 1000:6.2f} ms/host"
+              f"  conditional {c['bytes'] / hosts / 1024:7.1f} KiB/host {c['seconds'] / hosts * 1000:6.2f} ms/host"
+              f" (x{c['bytes'] / f['bytes']:.2f} bytes, {reused:4.0%} sections reused, {c['retries']} full retries)")
+        if cycle:
+            print("         reused per section: " + ", ".join(
+                f"{name} {c['by_section'][name] / hosts:.0%}" for name in POSTURE_SECTIONS))
+    hosts = full[-1]["hosts"]
+    full_validate = validation_seconds(full[-1]["bodies"])
+    conditional_validate = validation_seconds(conditional[-1]["bodies"])
+    print(f"validate full {full_validate / hosts * 1e6:8.0f} us/host, "
+          f"conditional {conditional_validate / hosts * 1e6:8.0f} us/host "
+          f"(x{full_validate / conditional_validate:.1f})")
+    for host, doc in full_latest.items():
+        other = conditional_latest.get(host)
+        for name, path in POSTURE_SECTIONS.items():
+            if other is None or section_value(doc, path) != section_value(other, path):
+                raise SystemExit(f"снимок хоста {host}: раздел {name} расходится")
+    print(f"latest snapshots of {len(full_latest)} hosts match section by section")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,156 @@
+"""
+Дерево процессов: синхронизация со снимками и запросы предков и потомков.
+
+Строит на одном хосте дерево из --processes процессов глубиной до --depth
+(цепочки services.exe -> svchost.exe -> ... и широкие ветви) и замеряет на
+встроенных Redis и OpenSearch (backends.py) с задержкой --latency-ms на
+каждый вызов бэкенда:
+- sync     - первый снимок host_posture и повторный с --churn долей
+  замененных процессов (в индекс уходят только изменения);
+- event    - process_start из телеметрии;
+- ancestry - цепочка предков самых глубоких процессов: get_ancestry (путь
+  в документе, один mget) против обхода по уровням с поиском родителя
+  по PID на каждом шаге;
+- subtree  - поддерево корня и ветви одним запросом по ancestors.
+
+Запуск из каталога ingest-api:
+    python benchmarks/bench_process_tree.py --processes 5000 --depth 30
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backends import InMemoryOpenSearch, InMemoryRedis  # noqa: E402
+from process_tree import (  # noqa: E402
+    PROCESS_TREE_INDEX, build_subtree, get_ancestry, get_descendants, get_process,
+    record_process_event, resolve_process_key, sync_host_processes,
+)
+
+HOST = {"host_id": "bench-host", "hostname": "WS-BENCH"}
+
+
+def synthetic_processes(rng: random.Random, count: int, depth: int):
+    """Дерево: корень System, одна цепочка глубины depth, остальные - случайные ветви"""
+    processes = [{"pid": 4, "ppid": 0, "name": "System", "exe_path": ""}]
+    level = {4: 0}
+    next_pid = 100
+    parent = 4
+    for _ in range(depth):
+        next_pid += 4
+        processes.append({"pid": next_pid, "ppid": parent, "name": f"chain{next_pid}.exe",
+                          "exe_path": f"C:\\Tools\\chain{next_pid}.exe"})
+        level[next_pid] = level[parent] + 1
+        parent = next_pid
+    pids = list(level)
+    while len(processes) < count:
+        next_pid += 4
+        parent = rng.choice(pids)
+        if level[parent] >= depth:
+            parent = 4
+        processes.append({"pid": next_pid, "ppid": parent, "name": f"proc{next_pid % 97}.exe",
+                          "exe_path": f"C:\\Program Files\\App{next_pid % 97}\\proc.exe",
+                          "cmdline": f"proc.exe --id {next_pid}"})
+        level[next_pid] = level[parent] + 1
+        pids.append(next_pid)
+    return processes, level
+
+
+def snapshot(event_id: str, timestamp: str, processes):
+    return {"event_id": event_id, "event_type": "host_posture", "timestamp": timestamp,
+            "host_info": dict(HOST), "inventory": {"processes": processes}}
+
+
+async def walk_by_search(opensearch, host_id: str, pid: int) -> int:
+    """Обход по уровням без пути: поиск родителя по PID на каждом шаге"""
+    steps = 0
+    while True:
+        response = await opensearch.search(index=PROCESS_TREE_INDEX, body={
+            "query": {"bool": {"filter": [{"term": {"host_id": host_id}}, {"term": {"pid": pid}},
+                                          {"term": {"status": "running"}}]}},
+            "size": 1
+        })
+        hits = response["hits"]["hits"]
+        if not hits or not hits[0]["_source"]["ppid"]:
+            return steps
+        pid = hits[0]["_source"]["ppid"]
+        steps += 1
+
+
+async def run(args) -> None:
+    rng = random.Random(11)
+    processes, level = synthetic_processes(rng, args.processes, args.depth)
+    redis, opensearch = InMemoryRedis(), InMemoryOpenSearch()
+
+    started = time.perf_counter()
+    await sync_host_processes(opensearch, redis, snapshot("s1", "2025-09-01T10:00:00Z", processes))
+    first = time.perf_counter() - started
+    docs = len(opensearch.docs[PROCESS_TREE_INDEX])
+
+    changed = list(processes)
+    for i in rng.sample(range(args.depth + 1, len(changed)), int(len(changed) * args.churn)):
+        proc = changed[i]
+        changed[i] = dict(proc, name=f"replaced{proc['pid']}.exe", exe_path=f"C:\\Temp\\r{proc['pid']}.exe")
+    bulk_before = opensearch.calls["bulk"]
+    started = time.perf_counter()
+    added, exited = await sync_host_processes(opensearch, redis, snapshot("s2", "2025-09-01T11:00:00Z", changed))
+    second = time.perf_counter() - started
+    print(f"sync     {first * 1000:8.1f} ms  first snapshot, {docs} processes")
+    print(f"sync     {second * 1000:8.1f} ms  next snapshot: +{added} / -{exited} "
+          f"({opensearch.calls['bulk'] - bulk_before} bulk)")
+
+    opensearch.latency = redis.latency = args.latency_ms / 1000
+    deepest = max(level, key=level.get)
+    started = time.perf_counter()
+    for i in range(args.rounds):
+        await record_process_event(opensearch, redis, {
+            "event_id": f"e{i}", "event_type": "process_start", "timestamp": "2025-09-01T11:30:00Z",
+            "host": dict(HOST), "process": {"pid": 900_000 + i, "ppid": deepest, "name": "child.exe"}})
+    print(f"event    {(time.perf_counter() - started) / args.rounds * 1000:8.2f} ms  process_start "
+          f"(latency {args.latency_ms} ms per backend call)")
+
+    chain = sorted(level, key=level.get)[-args.rounds:]
+    calls_before = sum(opensearch.calls.values()) + 0
+    started = time.perf_counter()
+    for pid in chain:
+        key = await resolve_process_key(redis, HOST["host_id"], str(pid))
+        result = await get_ancestry(opensearch, HOST["host_id"], key)
+    path = (time.perf_counter() - started) / len(chain)
+    path_calls = (sum(opensearch.calls.values()) - calls_before) / len(chain)
+    calls_before = sum(opensearch.calls.values())
+    started = time.perf_counter()
+    for pid in chain:
+        steps = await walk_by_search(opensearch, HOST["host_id"], pid)
+    walk = (time.perf_counter() - started) / len(chain)
+    walk_calls = (sum(opensearch.calls.values()) - calls_before) / len(chain)
+    print(f"ancestry {path * 1000:8.2f} ms  path + mget: depth {result['depth']}, {path_calls:.0f} OpenSearch calls")
+    print(f"ancestry {walk * 1000:8.2f} ms  search per level: depth {steps}, {walk_calls:.0f} OpenSearch calls")
+
+    root_key = await resolve_process_key(redis, HOST["host_id"], "4")
+    root = await get_process(opensearch, HOST["host_id"], root_key)
+    started = time.perf_counter()
+    descendants = await get_descendants(opensearch, HOST["host_id"], root)
+    tree = build_subtree(root, descendants)
+    print(f"subtree  {(time.perf_counter() - started) * 1000:8.2f} ms  root: {len(descendants)} descendants, "
+          f"{len(tree['children'])} children")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--processes", type=int, default=5000)
+    parser.add_argument("--depth", type=int, default=30)
+    parser.add_argument("--churn", type=float, default=0.02)
+    parser.add_argument("--latency-ms", type=float, default=1.0)
+    parser.add_argument("--rounds", type=int, default=20)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
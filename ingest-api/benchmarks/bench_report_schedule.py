@@ -0,0 +1,113 @@
+"""
+Расписание отчетов агентов: фиксированный интервал против next_report_after.
+
+Моделирует парк из --hosts хостов, загружающихся одновременно (в пределах
+--boot-spread секунд), на виртуальных часах в течение --cycles базовых
+интервалов. Сравнивает:
+- fixed     - каждый агент отчитывается со своим фиксированным интервалом
+  от момента загрузки (текущее поведение агента);
+- scheduled - агент ждет next_report_after из ответа (ReportScheduler);
+  доля --active хостов с недавними изменениями инвентаря отчитывается чаще;
+- limited   - то же с REPORT_TARGET_RATE ниже, чем парк дает при базовом
+  интервале: интервал растягивается по емкости.
+Для установившегося режима (после первых двух интервалов) печатает
+среднюю и пиковую частоту отчетов по секундам и коэффициент вариации
+частоты по --bucket-секундным корзинам; ровный прием - пик близок к
+среднему, коэффициент вариации мал. Снизу оба ограничены случайным
+разбросом: при средней частоте r коэффициент вариации не меньше
+1/sqrt(r * bucket).
+
+Запуск из каталога ingest-api:
+    python benchmarks/bench_report_schedule.py --hosts 20000 --interval 900
+"""
+
+import argparse
+import heapq
+import os
+import random
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from report_scheduler import RATE_WINDOW_SECONDS, ReportScheduler  # noqa: E402
+
+# Начало модели на виртуальных часах, секунды эпохи
+EPOCH = 1_750_000_000.0
+
+
+def simulate(args, hosts, scheduler=None):
+    """Время всех отчетов; без scheduler - фиксированный интервал агента"""
+    horizon = EPOCH + args.cycles * args.interval
+    queue = [(boot, host) for host, boot in hosts.items()]
+    heapq.heapify(queue)
+    arrivals = []
+    recent = []
+    next_refresh = EPOCH
+    while queue:
+        now, host = heapq.heappop(queue)
+        if now >= horizon:
+            break
+        arrivals.append(now)
+        if scheduler is None:
+            heapq.heappush(queue, (now + args.interval, host))
+            continue
+        # refresh() на виртуальных часах: частота отчетов парка за последнюю минуту
+        recent.append(now)
+        if now >= next_refresh:
+            cutoff = now - RATE_WINDOW_SECONDS
+            recent = [t for t in recent if t >= cutoff]
+            scheduler.fleet_size = len(hosts)
+            scheduler.report_rate = len(recent) / RATE_WINDOW_SECONDS
+            next_refresh = now + scheduler.refresh_interval
+        changed_at = now - 60 if host < args.active * len(hosts) else None
+        heapq.heappush(queue, (now + scheduler.next_report_after(str(host), changed_at, now), host))
+    return arrivals
+
+
+def report(name: str, args, arrivals) -> None:
+    start = EPOCH + 2 * args.interval
+    end = EPOCH + args.cycles * args.interval
+    per_second = [0] * int(end - start)
+    for t in arrivals:
+        if start <= t < end:
+            per_second[int(t - start)] += 1
+    buckets = [sum(per_second[i:i + args.bucket]) / args.bucket for i in range(0, len(per_second), args.bucket)]
+    mean = statistics.fmean(per_second)
+    cv = statistics.pstdev(buckets) / mean if mean else 0.0
+    print(f"{name:10s} mean {mean:7.1f} reports/s, peak {max(per_second):6d} reports/s "
+          f"(x{max(per_second) / mean:5.1f}), cv over {args.bucket}s buckets {cv:5.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--hosts", type=int, default=20000)
+    parser.add_argument("--interval", type=float, default=900, help="Базовый интервал отчетов, секунды")
+    parser.add_argument("--boot-spread", type=float, default=60, help="Разброс загрузки хостов, секунды")
+    parser.add_argument("--cycles", type=int, default=12, help="Длительность модели в базовых интервалах")
+    parser.add_argument("--active", type=float, default=0.1, help="Доля хостов с недавними изменениями")
+    parser.add_argument("--bucket", type=int, default=10, help="Корзина для коэффициента вариации, секунды")
+    parser.add_argument("--limit-factor", type=float, default=0.5,
+                        help="REPORT_TARGET_RATE для limited как доля частоты парка при базовом интервале")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    hosts = {host: EPOCH + rng.uniform(0, args.boot_spread) for host in range(args.hosts)}
+
+    def scheduler(target_rate: float = 0.0) -> ReportScheduler:
+        return ReportScheduler(base_interval=args.interval, min_interval=args.interval / 4,
+                               max_interval=args.interval * 4, target_rate=target_rate,
+                               backlog_limit=0, rng=random.Random(1))
+
+    report("fixed", args, simulate(args, hosts))
+    report("scheduled", args, simulate(args, hosts, scheduler()))
+    target = args.limit_factor * args.hosts / args.interval
+    limited = scheduler(target)
+    report("limited", args, simulate(args, hosts, limited))
+    print(f"limited    target {target:.1f} reports/s, fleet interval {limited.fleet_interval():.0f} s")
+
+
+if __name__ == "__main__":
+    main()
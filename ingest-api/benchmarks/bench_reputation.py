@@ -0,0 +1,171 @@
+"""
+Репутация хешей файлов: кэш в памяти и Redis против запроса на каждый хеш.
+
+Генерирует парк из --hosts хостов: у каждого --processes процессов,
+хеши которых выбираются из --binaries общих бинарных файлов (частота по
+закону Ципфа), плюс --unique собственных хешей хоста. Провайдер
+(StaticReputationProvider) отвечает с задержкой --provider-ms на вызов,
+как удаленный сервис. На встроенном Redis (backends.py) замеряет:
+- naive  - запрос к провайдеру на каждый хеш снимка (на первых
+  --naive-hosts хостах, в пересчете на хост);
+- cold   - цикл снимков всего парка через ReputationCache (по --concurrency
+  событий одновременно, как в /ingest/host-posture): число вызовов и
+  хешей провайдера должно равняться числу различных хешей, а не
+  хостов x процессов;
+- warm   - повторный цикл тем же воркером (память процесса);
+- worker - цикл вторым воркером с пустой памятью и общим Redis;
+- outage - недоступный провайдер: вердикты из Redis, ошибки не кэшируются.
+Вердикты аннотаций сверяются с эталоном провайдера.
+
+Запуск из каталога ingest-api:
+    python benchmarks/bench_reputation.py --hosts 2000 --processes 150
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backends import InMemoryRedis  # noqa: E402
+from enrichment import annotate_reputation, event_file_hashes  # noqa: E402
+from shared.reputation import ReputationCache, StaticReputationProvider  # noqa: E402
+
+
+def synthetic_fleet(rng: random.Random, hosts: int, processes: int, binaries: int, unique: int):
+    """Снимки host_posture и эталонные вердикты провайдера"""
+    shared = [f"{rng.getrandbits(256):064x}" for _ in range(binaries)]
+    weights = [1 / (rank + 1) for rank in range(binaries)]
+    verdicts = {}
+    for file_hash in shared:
+        roll = rng.random()
+        if roll < 0.002:
+            verdicts[file_hash] = "malicious"
+        elif roll < 0.01:
+            verdicts[file_hash] = "suspicious"
+        elif roll < 0.9:
+            verdicts[file_hash] = "clean"
+    events = []
+    for host in range(hosts):
+        hashes = rng.choices(shared, weights, k=processes - unique)
+        hashes += [f"{rng.getrandbits(256):064x}" for _ in range(unique)]
+        events.append({
+            "event_id": f"posture-{host}",
+            "host_id": f"host-{host:05d}",
+            "inventory": {"processes": [{"pid": 100 + i, "name": f"proc{i}.exe", "sha256": h}
+                                        for i, h in enumerate(hashes)]},
+        })
+    return events, verdicts
+
+
+async def ingest_cycle(cache: ReputationCache, redis, events, concurrency: int) -> float:
+    """Аннотация всех снимков по concurrency событий одновременно; секунды на событие"""
+    async def one(event):
+        annotate_reputation(event, await cache.lookup_many(event_file_hashes(event), redis))
+
+    started = time.perf_counter()
+    for start in range(0, len(events), concurrency):
+        await asyncio.gather(*(one(event) for event in events[start:start + concurrency]))
+    return (time.perf_counter() - started) / len(events)
+
+
+def check(events, verdicts) -> None:
+    for event in events:
+        for process in event["inventory"]["processes"]:
+            expected = verdicts.get(process["sha256"], "unknown")
+            if process.get("sha256_reputation") != expected:
+                raise SystemExit(f"{event['host_id']}: вердикт {process.get('sha256_reputation')} "
+                                 f"вместо {expected} для {process['sha256']}")
+
+
+def fresh(events):
+    return [{**event, "inventory": {"processes": [
+        {key: value for key, value in process.items() if key != "sha256_reputation"}
+        for process in event["inventory"]["processes"]
+    ]}} for event in events]
+
+
+def report(name: str, per_event: float, provider: StaticReputationProvider, calls: int, asked: int,
+           cache: ReputationCache) -> None:
+    stats = cache.stats()
+    print(f"{name:8s} {per_event * 1000:8.2f} ms/event; provider {provider.calls - calls:6d} calls, "
+          f"{provider.asked - asked:8d} hashes; local hits {stats['local_hits']}, "
+          f"redis hits {stats['redis_hits']}, coalesced {stats['coalesced']}")
+
+
+async def run(args) -> None:
+    rng = random.Random(5)
+    events, verdicts = synthetic_fleet(rng, args.hosts, args.processes, args.binaries, args.unique)
+    distinct = {p["sha256"] for event in events for p in event["inventory"]["processes"]}
+    entries = sum(len(event["inventory"]["processes"]) for event in events)
+    print(f"fleet    {args.hosts} hosts, {entries} process entries, {len(distinct)} distinct hashes")
+    delay = args.provider_ms / 1000
+
+    provider = StaticReputationProvider(verdicts, delay=delay)
+    sample = events[:args.naive_hosts]
+    started = time.perf_counter()
+    for event in sample:
+        for process in event["inventory"]["processes"]:
+            answer = await provider.lookup([process["sha256"]])
+            process["sha256_reputation"] = answer.get(process["sha256"], {"verdict": "unknown"})["verdict"]
+    naive = (time.perf_counter() - started) / len(sample)
+    check(sample, verdicts)
+    print(f"naive    {naive * 1000:8.2f} ms/event; provider {provider.calls / len(sample):6.0f} calls/event "
+          f"({provider.calls * args.hosts // len(sample)} per fleet cycle)")
+
+    redis = InMemoryRedis(latency=args.redis_ms / 1000)
+    provider = StaticReputationProvider(verdicts, delay=delay)
+    cache = ReputationCache(provider, local_size=args.local_size)
+    cycle = fresh(events)
+    report("cold", await ingest_cycle(cache, redis, cycle, args.concurrency), provider, 0, 0, cache)
+    check(cycle, verdicts)
+    if provider.asked != len(distinct):
+        raise SystemExit(f"провайдер спрошен о {provider.asked} хешах, различных {len(distinct)}")
+
+    calls, asked = provider.calls, provider.asked
+    cycle = fresh(events)
+    report("warm", await ingest_cycle(cache, redis, cycle, args.concurrency), provider, calls, asked, cache)
+    check(cycle, verdicts)
+
+    second = ReputationCache(provider, local_size=args.local_size)
+    cycle = fresh(events)
+    report("worker", await ingest_cycle(second, redis, cycle, args.concurrency), provider, calls, asked, second)
+    check(cycle, verdicts)
+    if provider.asked != asked:
+        raise SystemExit("второй воркер обратился к провайдеру, хотя вердикты есть в Redis")
+
+    # Провайдер недоступен: известные хеши из Redis, новые остаются без вердикта и не кэшируются
+    provider.fail = True
+    third = ReputationCache(provider, local_size=args.local_size)
+    new_hashes = [f"{rng.getrandbits(256):064x}" for _ in range(100)]
+    known = list(distinct)[:1000]
+    answer = await third.lookup_many(known + new_hashes, redis)
+    provider.fail = False
+    retried = await third.lookup_many(new_hashes, redis)
+    print(f"outage   {len(answer)} of {len(known) + len(new_hashes)} hashes answered from Redis, "
+          f"{third.counters['provider_errors']} provider errors; {len(retried)} retried after recovery")
+    if len(answer) != len(known) or len(retried) != len(new_hashes):
+        raise SystemExit("неожиданный ответ при недоступном провайдере")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--hosts", type=int, default=2000)
+    parser.add_argument("--processes", type=int, default=150)
+    parser.add_argument("--binaries", type=int, default=3000, help="Общих бинарных файлов в парке")
+    parser.add_argument("--unique", type=int, default=2, help="Собственных хешей каждого хоста")
+    parser.add_argument("--provider-ms", type=float, default=5.0, help="Задержка вызова провайдера, мс")
+    parser.add_argument("--redis-ms", type=float, default=0.2, help="Задержка команды Redis, мс")
+    parser.add_argument("--naive-hosts", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--local-size", type=int, default=100_000)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Индекс уязвимостей против агрегации сырых результатов сканирования.
+
+Генерирует парк из --hosts хостов и --cves CVE (распространенность CVE
+убывает по закону Ципфа) и --scans повторных сканирований всего парка:
+каждое сканирование заново сообщает все уязвимости хоста по его IP, часть
+уязвимостей между сканированиями устраняется. На встроенных бэкендах
+(backends.py) замеряет:
+- ingest - учет результатов в индексе (sync_vulnerabilities на каждое
+  событие, как в /ingest/vuln-scan) против записи только сырых событий;
+- fleet  - сводка парка: хосты по максимальному уровню и top CVE по числу
+  хостов из агрегации сырых событий против индекса;
+- cve    - хосты, затронутые самой распространенной CVE;
+- host   - уязвимости одного хоста.
+Ответы по сырым событиям и по индексу должны совпасть.
+
+Запуск из каталога ingest-api:
+    python benchmarks/bench_vuln_index.py --hosts 2000 --cves 1000 --scans 3
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backends import InMemoryOpenSearch, InMemoryRedis  # noqa: E402
+from vuln_index import (  # noqa: E402
+    VULN_INDEX, cvss_severity, get_cve_exposure, get_fleet_exposure,
+    get_host_vulnerabilities, register_host, sync_vulnerabilities,
+)
+
+RAW_INDEX = "vuln-scans-bench"
+
+# Сырые события последнего сканирования без сообщений об устранении
+NOT_FIXED = {"term": {"metadata.status": "fixed"}}
+
+
+def synthetic_fleet(rng: random.Random, hosts: int, cves: int, per_host: int):
+    """Уязвимости хостов: {ip: {cve: cvss}}; ip и host_id связаны один к одному"""
+    scores = {f"CVE-2024-{i:05d}": round(rng.uniform(1.0, 10.0), 1) for i in range(cves)}
+    names = list(scores)
+    weights = [1 / (rank + 1) for rank in range(cves)]
+    fleet = {}
+    for host in range(hosts):
+        count = max(1, int(rng.expovariate(1 / per_host)))
+        fleet[f"10.20.{host // 250}.{host % 250 + 1}"] = {
+            cve: scores[cve] for cve in rng.choices(names, weights, k=count)
+        }
+    return fleet
+
+
+def scan_events(fleet, scan: int):
+    for ip, vulns in fleet.items():
+        for cve, score in vulns.items():
+            yield {
+                "event_id": f"scan{scan}-{ip}-{cve}",
+                "timestamp": f"2025-09-0{scan + 1}T02:00:00Z",
+                "source_host": "scanner",
+                "source_agent": "scanner-01",
+                "target": ip,
+                "vulnerability_id": cve,
+                "vulnerability_name": f"Vulnerability {cve}",
+                "cvss_score": score,
+                "metadata": {},
+            }
+
+
+async def raw_fleet(raw: InMemoryOpenSearch, since: str, hosts: int, limit: int):
+    """Сводка парка по сырым событиям последнего сканирования"""
+    response = await raw.search(index=RAW_INDEX, body={
+        "query": {"bool": {"filter": [{"range": {"timestamp": {"gte": since}}}], "must_not": [NOT_FIXED]}},
+        "size": 0,
+        "aggs": {
+            "hosts": {"terms": {"field": "target", "size": hosts},
+                      "aggs": {"max_cvss": {"max": {"field": "cvss_score"}}}},
+            "cves": {"terms": {"field": "vulnerability_id", "size": limit}},
+        }
+    })
+    by_severity = {}
+    for bucket in response["aggregations"]["hosts"]["buckets"]:
+        severity = cvss_severity(bucket["max_cvss"]["value"])
+        by_severity[severity] = by_severity.get(severity, 0) + 1
+    top = {(b["key"], b["doc_count"]) for b in response["aggregations"]["cves"]["buckets"]}
+    return by_severity, top
+
+
+async def run(args) -> None:
+    rng = random.Random(11)
+    opensearch, redis, raw = InMemoryOpenSearch(), InMemoryRedis(), InMemoryOpenSearch()
+    fleets = [synthetic_fleet(rng, args.hosts, args.cves, args.per_host)]
+    for _ in range(args.scans - 1):
+        # Между сканированиями часть уязвимостей устраняется
+        fleets.append({ip: {cve: s for cve, s in vulns.items() if rng.random() > args.fixed}
+                       for ip, vulns in fleets[-1].items()})
+    host_of = {ip: f"host-{i:05d}" for i, ip in enumerate(fleets[0])}
+    for ip, host_id in host_of.items():
+        await register_host(opensearch, redis, host_id, host_id.upper(), [ip])
+
+    events = 0
+    index_time = raw_time = 0.0
+    for scan, fleet in enumerate(fleets):
+        batch = list(scan_events(fleet, scan))
+        if scan:
+            # Устраненные с прошлого сканирования уязвимости сообщаются со статусом fixed
+            for ip, vulns in fleets[scan - 1].items():
+                for cve in vulns.keys() - fleet[ip].keys():
+                    batch.append({"event_id": f"scan{scan}-{ip}-{cve}-fixed", "target": ip,
+                                  "vulnerability_id": cve, "timestamp": f"2025-09-0{scan + 1}T02:00:00Z",
+                                  "metadata": {"status": "fixed"}})
+        events += len(batch)
+        started = time.perf_counter()
+        for event in batch:
+            await sync_vulnerabilities(opensearch, redis, event)
+        index_time += time.perf_counter() - started
+        started = time.perf_counter()
+        for start in range(0, len(batch), 1000):
+            actions = []
+            for event in batch[start:start + 1000]:
+                actions += [{"index": {"_index": RAW_INDEX, "_id": event["event_id"]}}, event]
+            await raw.bulk(body=actions)
+        raw_time += time.perf_counter() - started
+    print(f"ingest   {events} results: index {events / index_time:8.0f} results/s, "
+          f"raw bulk only {events / raw_time:8.0f} results/s; "
+          f"{len(raw.docs[RAW_INDEX])} raw docs, {len(opensearch.docs[VULN_INDEX])} index docs")
+
+    latest, since = fleets[-1], f"2025-09-0{len(fleets)}T00:00:00Z"
+    started = time.perf_counter()
+    raw_severity, raw_top = await raw_fleet(raw, since, args.hosts, args.top)
+    raw_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    fleet = await get_fleet_exposure(opensearch, limit=args.top)
+    index_ms = (time.perf_counter() - started) * 1000
+    index_severity = {k: v for k, v in fleet["hosts_by_max_severity"].items() if v}
+    index_top = {(c["cve_id"], c["host_count"]) for c in fleet["top_cves"]}
+    if raw_severity != index_severity or raw_top != index_top:
+        raise SystemExit(f"сводка парка расходится:\n  raw   {raw_severity} {sorted(raw_top)}\n"
+                         f"  index {index_severity} {sorted(index_top)}")
+    print(f"fleet    raw {raw_ms:8.1f} ms, index {index_ms:8.1f} ms "
+          f"({fleet['hosts_affected']} hosts, {fleet['exposures']} exposures)")
+
+    top_cve = max(index_top, key=lambda item: item[1])[0]
+    started = time.perf_counter()
+    response = await raw.search(index=RAW_INDEX, body={
+        "query": {"bool": {"filter": [{"term": {"vulnerability_id": top_cve}},
+                                      {"range": {"timestamp": {"gte": since}}}],
+                           "must_not": [NOT_FIXED]}},
+        "size": 0, "aggs": {"hosts": {"terms": {"field": "target", "size": args.hosts}}}
+    })
+    raw_ms = (time.perf_counter() - started) * 1000
+    raw_hosts = {host_of[b["key"]] for b in response["aggregations"]["hosts"]["buckets"]}
+    started = time.perf_counter()
+    exposure = await get_cve_exposure(opensearch, top_cve, limit=args.hosts)
+    index_ms = (time.perf_counter() - started) * 1000
+    if raw_hosts != {h["host_id"] for h in exposure["hosts"]}:
+        raise SystemExit(f"хосты {top_cve} расходятся")
+    print(f"cve      raw {raw_ms:8.1f} ms, index {index_ms:8.1f} ms ({top_cve}: {len(raw_hosts)} hosts)")
+
+    ip = next(iter(latest))
+    started = time.perf_counter()
+    response = await raw.search(index=RAW_INDEX, body={
+        "query": {"bool": {"filter": [{"term": {"target": ip}}, {"range": {"timestamp": {"gte": since}}}],
+                           "must_not": [NOT_FIXED]}},
+        "size": 0, "aggs": {"cves": {"terms": {"field": "vulnerability_id", "size": args.cves}}}
+    })
+    raw_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    host = await get_host_vulnerabilities(opensearch, host_of[ip], limit=args.cves)
+    index_ms = (time.perf_counter() - started) * 1000
+    if {b["key"] for b in response["aggregations"]["cves"]["buckets"]} != {v["cve_id"] for v in host["vulnerabilities"]}:
+        raise SystemExit(f"уязвимости хоста {host_of[ip]} расходятся")
+    print(f"host     raw {raw_ms:8.1f} ms, index {index_ms:8.1f} ms "
+          f"({host['total']} CVE, max CVSS {host['summary']['max_cvss']})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--hosts", type=int, default=2000)
+    parser.add_argument("--cves", type=int, default=1000)
+    parser.add_argument("--per-host", type=int, default=20, help="Среднее число уязвимостей хоста")
+    parser.add_argument("--scans", type=int, default=3)
+    parser.add_argument("--fixed", type=float, default=0.1, help="Доля уязвимостей, устраняемых между сканированиями")
+    parser.add_argument("--top", type=int, default=10)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
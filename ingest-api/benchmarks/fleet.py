@@ -0,0 +1,306 @@
+"""
+Синтетический парк Windows-хостов для нагрузочного тестирования.
+
+Генерирует события в форматах, которые принимает Ingest API:
+- host_posture (формат Go-агента, /ingest/host-posture);
+- AgentTelemetryEvent (/ingest);
+- SecurityEvent (/ingest/security).
+
+Каждый хост имеет устойчивый набор процессов и автозапусков; между
+отчетами часть записей меняется с вероятностью churn, как у реальных
+рабочих станций. Генерация детерминирована при заданном seed.
+"""
+
+import hashlib
+import random
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+# Типичные процессы рабочей станции Windows: (имя, путь, аргументы)
+PROCESS_CATALOG = [
+    ("System", "", ""),
+    ("smss.exe", "C:\\Windows\\System32\\smss.exe", ""),
+    ("csrss.exe", "C:\\Windows\\System32\\csrss.exe", "ObjectDirectory=\\Windows SharedSection=1024,20480,768"),
+    ("wininit.exe", "C:\\Windows\\System32\\wininit.exe", ""),
+    ("services.exe", "C:\\Windows\\System32\\services.exe", ""),
+    ("lsass.exe", "C:\\Windows\\System32\\lsass.exe", ""),
+    ("svchost.exe", "C:\\Windows\\System32\\svchost.exe", "-k netsvcs -p"),
+    ("svchost.exe", "C:\\Windows\\System32\\svchost.exe", "-k LocalServiceNetworkRestricted -p"),
+    ("svchost.exe", "C:\\Windows\\System32\\svchost.exe", "-k DcomLaunch -p"),
+    ("svchost.exe", "C:\\Windows\\System32\\svchost.exe", "-k RPCSS -p"),
+    ("explorer.exe", "C:\\Windows\\explorer.exe", ""),
+    ("MsMpEng.exe", "C:\\ProgramData\\Microsoft\\Windows Defender\\Platform\\4.18.24070.5-0\\MsMpEng.exe", ""),
+    ("SearchIndexer.exe", "C:\\Windows\\System32\\SearchIndexer.exe", "/Embedding"),
+    ("RuntimeBroker.exe", "C:\\Windows\\System32\\RuntimeBroker.exe", "-Embedding"),
+    ("dwm.exe", "C:\\Windows\\System32\\dwm.exe", ""),
+    ("spoolsv.exe", "C:\\Windows\\System32\\spoolsv.exe", ""),
+    ("chrome.exe", "C:\\Program Files\\Google\\Chrome\\Application\\chrome.exe", "--type=renderer --lang=ru"),
+    ("msedge.exe", "C:\\Program Files (x86)\\Microsoft\\Edge\\Application\\msedge.exe", "--type=utility"),
+    ("OUTLOOK.EXE", "C:\\Program Files\\Microsoft Office\\root\\Office16\\OUTLOOK.EXE", ""),
+    ("Teams.exe", "C:\\Users\\{user}\\AppData\\Local\\Microsoft\\Teams\\current\\Teams.exe", "--system-initiated"),
+    ("Code.exe", "C:\\Users\\{user}\\AppData\\Local\\Programs\\Microsoft VS Code\\Code.exe", "--type=utility"),
+    ("powershell.exe", "C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe", "-NoProfile -ExecutionPolicy Bypass"),
+    ("cmd.exe", "C:\\Windows\\System32\\cmd.exe", "/c whoami"),
+    ("OneDrive.exe", "C:\\Users\\{user}\\AppData\\Local\\Microsoft\\OneDrive\\OneDrive.exe", "/background"),
+    ("updater.exe", "C:\\Users\\{user}\\AppData\\Local\\Temp\\updater.exe", "--silent"),
+]
+
+RUN_KEY_CATALOG = [
+    ("SecurityHealth", "%windir%\\system32\\SecurityHealthSystray.exe"),
+    ("OneDrive", "\"C:\\Users\\{user}\\AppData\\Local\\Microsoft\\OneDrive\\OneDrive.exe\" /background"),
+    ("Teams", "\"C:\\Users\\{user}\\AppData\\Local\\Microsoft\\Teams\\Update.exe\" --processStart \"Teams.exe\""),
+    ("RtkAudUService", "\"C:\\Windows\\System32\\DriverStore\\FileRepository\\RtkAudUService64.exe\" -background"),
+    ("Discord", "\"C:\\Users\\{user}\\AppData\\Local\\Discord\\Update.exe\" --processStart Discord.exe"),
+    ("Updater", "\"C:\\Users\\{user}\\AppData\\Roaming\\upd\\svc.exe\" -k"),
+]
+
+SERVICE_CATALOG = [
+    ("WinDefend", "Microsoft Defender Antivirus Service", "\"C:\\ProgramData\\Microsoft\\Windows Defender\\Platform\\MsMpEng.exe\""),
+    ("wuauserv", "Windows Update", "C:\\Windows\\system32\\svchost.exe -k netsvcs -p"),
+    ("Spooler", "Print Spooler", "C:\\Windows\\System32\\spoolsv.exe"),
+    ("BITS", "Background Intelligent Transfer Service", "C:\\Windows\\System32\\svchost.exe -k netsvcs -p"),
+    ("EventLog", "Windows Event Log", "C:\\Windows\\System32\\svchost.exe -k LocalServiceNetworkRestricted -p"),
+    ("gupdate", "Google Update Service", "\"C:\\Program Files (x86)\\Google\\Update\\GoogleUpdate.exe\" /svc"),
+]
+
+TASK_CATALOG = [
+    ("\\Microsoft\\Windows\\Defrag\\ScheduledDefrag", "SYSTEM", "%windir%\\system32\\defrag.exe -c -h -o"),
+    ("\\GoogleUpdateTaskMachineUA", "SYSTEM", "C:\\Program Files (x86)\\Google\\Update\\GoogleUpdate.exe /ua /installsource scheduler"),
+    ("\\OneDrive Standalone Update Task", "{user}", "%localappdata%\\Microsoft\\OneDrive\\OneDriveStandaloneUpdater.exe"),
+    ("\\Microsoft\\Windows\\WindowsUpdate\\Scheduled Start", "SYSTEM", "C:\\Windows\\system32\\sc.exe start wuauserv"),
+]
+
+TELEMETRY_TYPES = [
+    "process_start", "process_end", "file_create", "file_modify", "file_delete",
+    "network_connection", "user_login", "user_logout", "service_start", "registry_modify",
+]
+
+THREAT_TYPES = [
+    "exploit", "malware", "phishing", "vulnerability", "intrusion",
+    "ransomware", "trojan", "backdoor", "rootkit", "botnet",
+]
+
+SEVERITIES = ["info", "low", "medium", "high", "critical"]
+
+
+def _sha256(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class SyntheticHost:
+    """Один хост парка с устойчивым состоянием между отчетами"""
+
+    def __init__(self, index: int, rng: random.Random, processes: int, autoruns: int):
+        self.rng = rng
+        self.host_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        self.hostname = f"WS-{index:05d}"
+        self.user = f"user{index:05d}"
+        self.ip = f"10.{(index >> 16) & 255}.{(index >> 8) & 255}.{index & 255}"
+        self.agent_id = f"win-agent-{index:05d}"
+        self.processes_count = processes
+        self.autoruns_count = autoruns
+        self.next_pid = 100
+
+        self.security = self._random_security()
+        self.processes = [self._random_process() for _ in range(processes)]
+        self.registry = [self._random_run_key() for _ in range(max(1, autoruns // 2))]
+        self.services = [self._random_service() for _ in range(max(1, autoruns // 3))]
+        self.tasks = [self._random_task() for _ in range(max(1, autoruns - autoruns // 2 - autoruns // 3))]
+
+    def _user_path(self, template: str) -> str:
+        return template.replace("{user}", self.user)
+
+    def _random_process(self) -> Dict[str, Any]:
+        name, path, args = self.rng.choice(PROCESS_CATALOG)
+        path = self._user_path(path)
+        self.next_pid += self.rng.randint(4, 64)
+        return {
+            "pid": self.next_pid,
+            "ppid": self.rng.choice([4, 640, 788, 1024, self.next_pid - 4]),
+            "name": name,
+            "exe_path": path,
+            "cmdline": f"\"{path}\" {args}".strip() if path else "",
+            "username": self.rng.choice(["NT AUTHORITY\\SYSTEM", f"CORP\\{self.user}"]),
+            "sha256": _sha256(path) if path else None,
+        }
+
+    def _random_run_key(self) -> Dict[str, Any]:
+        name, value = self.rng.choice(RUN_KEY_CATALOG)
+        return {
+            "root": self.rng.choice(["HKLM", "HKCU"]),
+            "path": "Software\\Microsoft\\Windows\\CurrentVersion\\Run",
+            "name": name,
+            "value": self._user_path(value),
+        }
+
+    def _random_service(self) -> Dict[str, Any]:
+        name, display, path = self.rng.choice(SERVICE_CATALOG)
+        return {"name": name, "display_name": display, "path": path,
+                "start_mode": "Auto", "state": self.rng.choice(["Running", "Stopped"])}
+
+    def _random_task(self) -> Dict[str, Any]:
+        name, run_as, action = self.rng.choice(TASK_CATALOG)
+        return {"task_name": name, "run_as": self._user_path(run_as), "trigger": "Daily",
+                "action": self._user_path(action), "status": "Ready"}
+
+    def _random_security(self) -> Dict[str, Any]:
+        rng = self.rng
+        return {
+            "defender": {"realtime_enabled": rng.random() > 0.05, "antivirus_enabled": True,
+                         "engine_version": "1.1.24070.3", "signature_age_days": rng.randint(0, 14),
+                         "permission": "granted"},
+            "firewall": {
+                profile: {"enabled": rng.random() > 0.08, "default_inbound": "Block"}
+                for profile in ("domain", "private", "public")
+            },
+            "uac": {"enabled": rng.random() > 0.03, "permission": "granted"},
+            "rdp": {"enabled": rng.random() < 0.2, "permission": "granted"},
+            "bitlocker": {"system_drive_protected": rng.random() > 0.3, "permission": "granted"},
+            "smb1": {"enabled": rng.random() < 0.05, "permission": "granted"},
+        }
+
+    def _churn_list(self, items: List[Dict[str, Any]], factory, churn: float) -> None:
+        for i in range(len(items)):
+            if self.rng.random() < churn:
+                items[i] = factory()
+
+    def apply_churn(self, churn: float) -> None:
+        """Изменение части состояния хоста между отчетами"""
+        self._churn_list(self.processes, self._random_process, churn)
+        self._churn_list(self.registry, self._random_run_key, churn / 4)
+        self._churn_list(self.services, self._random_service, churn / 4)
+        self._churn_list(self.tasks, self._random_task, churn / 4)
+        if self.rng.random() < churn / 2:
+            self.security = self._random_security()
+
+    def findings(self) -> List[Dict[str, Any]]:
+        """Находки по тем же правилам, что и recommend/engine.go агента"""
+        sec = self.security
+        result = []
+        if any(not p["enabled"] for p in sec["firewall"].values()):
+            result.append({"rule_id": "FIREWALL_DISABLED", "severity": "high",
+                           "message_ru": "Брандмауэр отключен для одного или нескольких профилей"})
+        if not sec["defender"]["realtime_enabled"]:
+            result.append({"rule_id": "DEFENDER_REALTIME_OFF", "severity": "high",
+                           "message_ru": "Защита в реальном времени отключена"})
+        if not sec["uac"]["enabled"]:
+            result.append({"rule_id": "UAC_DISABLED", "severity": "high", "message_ru": "UAC отключен"})
+        if sec["rdp"]["enabled"]:
+            result.append({"rule_id": "RDP_ENABLED_NO_NLA", "severity": "high",
+                           "message_ru": "RDP включен без NLA"})
+        if sec["smb1"]["enabled"]:
+            result.append({"rule_id": "SMB1_ENABLED", "severity": "high", "message_ru": "SMB1 включен"})
+        if not sec["bitlocker"]["system_drive_protected"]:
+            result.append({"rule_id": "BITLOCKER_OFF", "severity": "medium",
+                           "message_ru": "Системный диск не защищен BitLocker"})
+        for proc in self.processes:
+            if "\\Temp\\" in (proc["exe_path"] or ""):
+                result.append({"rule_id": "PROCESS_TEMP_EXEC", "severity": "medium",
+                               "message_ru": "Процесс запущен из временной папки",
+                               "evidence": proc["exe_path"]})
+        return result
+
+    def posture_event(self) -> Dict[str, Any]:
+        return {
+            "event_id": str(uuid.UUID(int=self.rng.getrandbits(128))),
+            "event_type": "host_posture",
+            "@timestamp": _now_iso(),
+            "host": {
+                "host_id": self.host_id,
+                "hostname": self.hostname,
+                "os": {"name": "Windows 10 Pro", "version": "10.0.19045", "build": "19045"},
+                "uptime_seconds": self.rng.randint(600, 1_000_000),
+            },
+            "agent": {"agent_id": self.agent_id, "agent_version": "0.1.0"},
+            "inventory": {
+                "processes": list(self.processes),
+                "autoruns": {
+                    "registry": list(self.registry),
+                    "startup_folders": [],
+                    "services_auto": list(self.services),
+                    "scheduled_tasks": list(self.tasks),
+                },
+            },
+            "security": self.security,
+            "windows_update": {
+                "last_update_date": "2025-08-20T10:00:00Z",
+                "update_service_status": "Running",
+                "pending_updates": self.rng.randint(0, 5),
+                "permission": "granted",
+            },
+            "findings": self.findings(),
+            "metadata": {"collector": "uecp-agent-windows", "schema_version": "1.0"},
+        }
+
+    def telemetry_event(self) -> Dict[str, Any]:
+        event_type = self.rng.choice(TELEMETRY_TYPES)
+        proc = self.rng.choice(self.processes)
+        event = {
+            "event_id": str(uuid.UUID(int=self.rng.getrandbits(128))),
+            "event_type": event_type,
+            "timestamp": _now_iso(),
+            "severity": self.rng.choices(SEVERITIES, weights=[60, 20, 12, 6, 2])[0],
+            "host": {"host_id": self.host_id, "hostname": self.hostname,
+                     "os_version": "Windows 10 Pro", "ip_addresses": [self.ip]},
+            "agent": {"agent_version": "1.0.0", "collect_level": "standard"},
+            "process": {"pid": proc["pid"], "ppid": proc["ppid"], "name": proc["name"],
+                        "path": proc["exe_path"], "command_line": proc["cmdline"],
+                        "user": proc["username"]},
+            "tags": ["synthetic"],
+        }
+        if event_type == "network_connection":
+            event["network"] = {
+                "protocol": "tcp", "source_ip": self.ip, "source_port": self.rng.randint(49152, 65535),
+                "destination_ip": f"93.184.{self.rng.randint(0, 255)}.{self.rng.randint(1, 254)}",
+                "destination_port": self.rng.choice([80, 443, 445, 3389, 8080]),
+                "bytes_sent": self.rng.randint(100, 100_000), "bytes_received": self.rng.randint(100, 1_000_000),
+            }
+        elif event_type.startswith("file_"):
+            event["file"] = {"path": f"C:\\Users\\{self.user}\\Documents\\report_{self.rng.randint(1, 999)}.docx",
+                             "name": "report.docx", "size": self.rng.randint(1_000, 5_000_000)}
+        return event
+
+    def security_event(self) -> Dict[str, Any]:
+        threat_type = self.rng.choice(THREAT_TYPES)
+        return {
+            "event_id": str(uuid.UUID(int=self.rng.getrandbits(128))),
+            "timestamp": _now_iso(),
+            "source": self.hostname,
+            "threat_type": threat_type,
+            "description": f"Synthetic {threat_type} detection on {self.hostname}",
+            "severity": self.rng.choice(SEVERITIES[1:]),
+            "cve_id": f"CVE-2024-{self.rng.randint(1000, 49999)}" if threat_type == "vulnerability" else None,
+            "cvss_score": round(self.rng.uniform(3.0, 9.8), 1) if threat_type == "vulnerability" else None,
+            "file_hash": self.rng.choice(self.processes)["sha256"],
+            "source_ip": f"185.{self.rng.randint(0, 255)}.{self.rng.randint(0, 255)}.{self.rng.randint(1, 254)}",
+            "target_port": self.rng.choice([22, 80, 443, 445, 3389]),
+        }
+
+
+class SyntheticFleet:
+    """Парк из N хостов с настраиваемым размером инвентаря и изменчивостью"""
+
+    def __init__(self, hosts: int, processes: int = 120, autoruns: int = 30,
+                 churn: float = 0.05, seed: Optional[int] = 42):
+        self.rng = random.Random(seed)
+        self.churn = churn
+        self.hosts = [SyntheticHost(i, self.rng, processes, autoruns) for i in range(hosts)]
+
+    def random_host(self) -> SyntheticHost:
+        return self.rng.choice(self.hosts)
+
+    def posture_event(self) -> Dict[str, Any]:
+        host = self.random_host()
+        host.apply_churn(self.churn)
+        return host.posture_event()
+
+    def telemetry_event(self) -> Dict[str, Any]:
+        return self.random_host().telemetry_event()
+
+    def security_event(self) -> Dict[str, Any]:
+        return self.random_host().security_event()
@@ -0,0 +1,321 @@
+"""
+Нагрузочный прогон Ingest API на синтетическом парке Windows-хостов.
+
+Генератор отправляет запросы с заданной частотой (открытая модель: запрос i
+планируется на момент start + i / rate, независимо от ответов на предыдущие)
+в смеси ingest- и read-эндпоинтов. Латентность считается от запланированного
+момента отправки, поэтому отставание генератора от графика не скрывает
+очередь на стороне сервера.
+
+Режимы:
+- inprocess - приложение main:app в этом же процессе со встроенными
+  заменителями OpenSearch/Redis (benchmarks/backends.py);
+- http - реальный сервер по --base-url с настоящими бэкендами.
+
+Результат - JSON с конфигурацией, пропускной способностью, p50/p95/p99 по
+каждой операции и потреблением ресурсов; файлы разных версий можно
+сравнивать между собой.
+
+Примеры (из каталога ingest-api):
+    python benchmarks/load_test.py --hosts 500 --rate 300 --duration 30 --output load.json
+    python benchmarks/load_test.py --mode http --base-url http://localhost:8000 --rate 100
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fleet import SyntheticFleet  # noqa: E402
+
+DEFAULT_MIX = "posture=1,telemetry=6,security=1,read=2"
+EVENT_ID_PLACEHOLDER = "00000000-0000-0000-0000-00000000beef"
+
+# Доля чтений по эндпоинтам
+READ_ENDPOINTS = [
+    "/events?limit=50",
+    "/api/hosts",
+    "/api/host/{host_id}/posture/latest",
+    "/stats",
+    "/api/inventory/search?name=chrome.exe",
+]
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, weight = part.split("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - {"posture", "telemetry", "security", "read"}
+    if unknown:
+        raise argparse.ArgumentTypeError(f"неизвестные операции в --mix: {sorted(unknown)}")
+    return mix
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+class PayloadPool:
+    """
+    Заранее сериализованные тела запросов.
+
+    Генерация и json.dumps больших снимков не должны попадать в измерение,
+    поэтому тела готовятся до прогона, а при отправке в них только
+    подставляется уникальный event_id.
+    """
+
+    def __init__(self, fleet: SyntheticFleet, size: int):
+        self.bodies: Dict[str, List[bytes]] = {}
+        self.cursors: Dict[str, itertools.cycle] = {}
+        for kind, factory in (("posture", fleet.posture_event),
+                              ("telemetry", fleet.telemetry_event),
+                              ("security", fleet.security_event)):
+            bodies = []
+            for _ in range(size):
+                event = factory()
+                event["event_id"] = EVENT_ID_PLACEHOLDER
+                bodies.append(json.dumps(event, ensure_ascii=False).encode("utf-8"))
+            self.bodies[kind] = bodies
+            self.cursors[kind] = itertools.cycle(bodies)
+
+    def next(self, kind: str) -> bytes:
+        return next(self.cursors[kind]).replace(EVENT_ID_PLACEHOLDER.encode(), str(uuid.uuid4()).encode(), 1)
+
+    def average_size(self, kind: str) -> int:
+        bodies = self.bodies[kind]
+        return sum(len(b) for b in bodies) // max(1, len(bodies))
+
+
+async def build_client(args: argparse.Namespace) -> Tuple[httpx.AsyncClient, Optional[Any]]:
+    """HTTP-клиент к реальному серверу или к приложению в этом процессе"""
+    if args.mode == "http":
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        return httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits), None
+
+    os.environ.setdefault("LOG_LEVEL", args.server_log_level)
+    from backends import InMemoryOpenSearch, InMemoryRedis
+    import main
+
+    main.opensearch_client = InMemoryOpenSearch(latency=args.backend_latency_ms / 1000)
+    main.redis_client = InMemoryRedis(latency=args.backend_latency_ms / 1000)
+    await main.ensure_inventory_index(main.opensearch_client)
+    await main.ensure_rollup_index(main.opensearch_client)
+
+    transport = httpx.ASGITransport(app=main.app)
+    return httpx.AsyncClient(transport=transport, base_url="http://inprocess", timeout=args.timeout), main
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    fleet = SyntheticFleet(args.hosts, processes=args.processes, autoruns=args.autoruns,
+                           churn=args.churn, seed=args.seed)
+    pool = PayloadPool(fleet, args.payload_pool)
+    host_ids = [host.host_id for host in fleet.hosts]
+    client, app_module = await build_client(args)
+
+    mix = parse_mix(args.mix)
+    operations = list(mix)
+    weights = [mix[op] for op in operations]
+    rng = fleet.rng
+    read_cycle = itertools.cycle(READ_ENDPOINTS)
+
+    # Предварительная загрузка: по одному снимку на хост, чтобы чтения видели данные
+    if args.warmup:
+        for host in fleet.hosts:
+            event = host.posture_event()
+            await client.post("/ingest/host-posture", json=event)
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    status_codes: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+    semaphore = asyncio.Semaphore(args.concurrency)
+    headers = {"Content-Type": "application/json", "User-Agent": "uecp-load-test"}
+
+    def request_for(op: str) -> Tuple[str, Callable[[], Any]]:
+        if op == "posture":
+            body = pool.next("posture")
+            return "POST /ingest/host-posture", lambda: client.post("/ingest/host-posture", content=body, headers=headers)
+        if op == "telemetry":
+            body = pool.next("telemetry")
+            return "POST /ingest", lambda: client.post("/ingest", content=body, headers=headers)
+        if op == "security":
+            body = pool.next("security")
+            return "POST /ingest/security", lambda: client.post("/ingest/security", content=body, headers=headers)
+        template = next(read_cycle)
+        path = template.format(host_id=rng.choice(host_ids))
+        return f"GET {template.split('?')[0]}", lambda: client.get(path)
+
+    async def fire(name: str, send: Callable[[], Any], scheduled: float) -> None:
+        async with semaphore:
+            try:
+                response = await send()
+                status_codes[name][response.status_code] += 1
+                if response.status_code >= 400:
+                    errors[name] += 1
+            except Exception:
+                errors[name] += 1
+                status_codes[name][0] += 1
+        latencies[name].append(time.perf_counter() - scheduled)
+
+    total_requests = int(args.rate * args.duration)
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    tasks = []
+    behind_schedule = 0
+
+    for i in range(total_requests):
+        scheduled = started + i / args.rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif delay < -0.01:
+            behind_schedule += 1
+        op = rng.choices(operations, weights)[0]
+        name, send = request_for(op)
+        tasks.append(asyncio.create_task(fire(name, send, scheduled)))
+
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    await client.aclose()
+
+    result_ops = {}
+    all_latencies: List[float] = []
+    for name, values in sorted(latencies.items()):
+        values.sort()
+        all_latencies.extend(values)
+        result_ops[name] = {
+            "count": len(values),
+            "errors": errors.get(name, 0),
+            "status_codes": dict(status_codes[name]),
+            "throughput_rps": round(len(values) / elapsed, 2),
+            "latency_ms": {
+                "mean": round(sum(values) / len(values) * 1000, 3),
+                "p50": round(percentile(values, 50) * 1000, 3),
+                "p95": round(percentile(values, 95) * 1000, 3),
+                "p99": round(percentile(values, 99) * 1000, 3),
+                "max": round(values[-1] * 1000, 3),
+            },
+        }
+    all_latencies.sort()
+
+    cpu_seconds = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    completed = len(all_latencies)
+    result = {
+        "benchmark": "ingest-load",
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpu_count": os.cpu_count()},
+        "config": {
+            "mode": args.mode, "base_url": args.base_url if args.mode == "http" else None,
+            "hosts": args.hosts, "processes": args.processes, "autoruns": args.autoruns,
+            "churn": args.churn, "rate": args.rate, "duration": args.duration,
+            "concurrency": args.concurrency, "mix": mix, "seed": args.seed,
+            "backend_latency_ms": args.backend_latency_ms if args.mode == "inprocess" else None,
+            "payload_bytes": {kind: pool.average_size(kind) for kind in pool.bodies},
+        },
+        "summary": {
+            "requests": completed,
+            "errors": sum(errors.values()),
+            "duration_s": round(elapsed, 3),
+            "throughput_rps": round(completed / elapsed, 2),
+            "target_rps": args.rate,
+            "behind_schedule": behind_schedule,
+            "latency_ms": {
+                "p50": round(percentile(all_latencies, 50) * 1000, 3),
+                "p95": round(percentile(all_latencies, 95) * 1000, 3),
+                "p99": round(percentile(all_latencies, 99) * 1000, 3),
+            },
+        },
+        "operations": result_ops,
+        "resources": {
+            # В режиме inprocess включает работу сервера, в режиме http - только генератора
+            "scope": "client+server" if args.mode == "inprocess" else "client",
+            "cpu_seconds": round(cpu_seconds, 3),
+            "cpu_ms_per_request": round(cpu_seconds * 1000 / max(1, completed), 3),
+            "cpu_utilization": round(cpu_seconds / elapsed, 3),
+            "max_rss_mb": round(usage_after.ru_maxrss / 1024, 1),
+        },
+    }
+    if app_module is not None:
+        result["resources"]["backend_calls"] = dict(app_module.opensearch_client.calls)
+    return result
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def print_summary(result: Dict[str, Any]) -> None:
+    summary = result["summary"]
+    print(f"requests={summary['requests']} errors={summary['errors']} "
+          f"throughput={summary['throughput_rps']} rps (target {summary['target_rps']}) "
+          f"p50={summary['latency_ms']['p50']}ms p95={summary['latency_ms']['p95']}ms "
+          f"p99={summary['latency_ms']['p99']}ms")
+    for name, op in result["operations"].items():
+        lat = op["latency_ms"]
+        print(f"  {name:<45} n={op['count']:<7} err={op['errors']:<5} "
+              f"p50={lat['p50']:<9} p95={lat['p95']:<9} p99={lat['p99']}")
+    res = result["resources"]
+    print(f"cpu={res['cpu_seconds']}s ({res['cpu_ms_per_request']} ms/req, scope {res['scope']}) "
+          f"max_rss={res['max_rss_mb']}MB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон Ingest API на синтетическом парке")
+    parser.add_argument("--mode", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--hosts", type=int, default=200, help="Количество хостов парка")
+    parser.add_argument("--processes", type=int, default=120, help="Процессов на хост")
+    parser.add_argument("--autoruns", type=int, default=30, help="Автозапусков на хост")
+    parser.add_argument("--churn", type=float, default=0.05, help="Доля записей, меняющихся между отчетами")
+    parser.add_argument("--rate", type=float, default=200, help="Целевая частота запросов в секунду")
+    parser.add_argument("--duration", type=float, default=20, help="Длительность прогона в секундах")
+    parser.add_argument("--concurrency", type=int, default=64, help="Максимум одновременных запросов")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Веса операций (по умолчанию {DEFAULT_MIX})")
+    parser.add_argument("--payload-pool", type=int, default=200, help="Заранее сгенерированных тел каждого типа")
+    parser.add_argument("--backend-latency-ms", type=float, default=0.0,
+                        help="Задержка заменителей OpenSearch/Redis на вызов (режим inprocess)")
+    parser.add_argument("--server-log-level", default="WARNING", help="LOG_LEVEL приложения в режиме inprocess")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false",
+                        help="Не загружать снимок каждого хоста перед прогоном")
+    parser.add_argument("--output", help="Файл для результата в JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_summary(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Результат сохранен в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
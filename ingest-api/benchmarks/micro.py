@@ -0,0 +1,314 @@
+"""
+Микробенчмарки горячих функций Ingest API и проверка регрессий.
+
+Замеряются функции, которые выполняются на каждое событие или на каждый
+hit выдачи:
+- get_index_name - имя индекса по timestamp;
+- encode_stream_fields - подготовка полей для Redis Stream;
+- HostPostureEvent - валидация события host_posture и event.dict();
+- mask_event - маскирование секретов в event_data: clean - документ без
+  секретов (возвращается без копирования), secrets - с секретами в
+  командных строках процессов и действиях задач, cold - с пустым кэшем
+  строк;
+- format_event_hit / format_agent_event_hit - форматирование выдачи
+  /events и /api/events (100 hits на операцию).
+
+Полезная нагрузка строится детерминированно (SyntheticFleet с фиксированным
+seed) в трех размерах: small, medium и huge.
+
+Повторы замера чередуются с повторами калибровочного цикла на чистом
+Python, и для каждой пары считается отношение времени бенчмарка к времени
+калибровки: замедление всей машины (соседние нагрузки, частота CPU) на
+время в несколько повторов сокращается в отношении. Результат - медианы
+абсолютного времени (нс на операцию) и отношения (relative) по повторам и
+шум relative - относительная стандартная ошибка медианы, оцененная по
+межквартильному размаху. compare по умолчанию сравнивает relative,
+--absolute - абсолютное время.
+
+Baseline для проверки регрессий снимается на той же машине, где
+выполняется compare: по умолчанию benchmarks/baselines/local.json (в git не
+хранится). benchmarks/baselines/reference.json - справочный снимок
+результатов для сравнения порядков величин между машинами; как порог
+регрессий он не используется, обновляется командой baseline --reference
+вместе с изменениями, которые осознанно меняют производительность.
+
+Запуск из каталога ingest-api:
+    python benchmarks/micro.py run
+    python benchmarks/micro.py baseline
+    python benchmarks/micro.py compare --threshold 0.15
+
+compare завершается с кодом 1, если хотя бы один бенчмарк медленнее
+baseline больше чем на threshold (доля, 0.15 = 15%) плюс NOISE_FACTOR
+шумов разницы замеров. Бенчмарки за порогом перемеряются, и регрессией
+считаются, только если превышение повторилось.
+"""
+
+import argparse
+import copy
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+import warnings
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main  # noqa: E402
+from fleet import SyntheticFleet  # noqa: E402
+from shared.masking import DataMasker  # noqa: E402
+
+# main.py вызывает event.dict(), замер повторяет это без предупреждений pydantic v2
+warnings.simplefilter("ignore", DeprecationWarning)
+
+FIXTURE_SEED = 1234
+REFERENCE_BASELINE = "benchmarks/baselines/reference.json"
+LOCAL_BASELINE = "benchmarks/baselines/local.json"
+
+# Размер полезной нагрузки: (процессов, автозапусков)
+PAYLOAD_SIZES = {
+    "small": (20, 5),
+    "medium": (150, 40),
+    "huge": (1500, 300),
+}
+
+HITS_PER_PAGE = 100
+DEFAULT_REPEAT = 15
+DEFAULT_MIN_TIME = 0.05
+DEFAULT_THRESHOLD = 0.15
+# Порог регрессии расширяется на столько шумов разницы baseline и текущего замера
+NOISE_FACTOR = 3.0
+
+
+def build_posture_payloads() -> Dict[str, Dict[str, Any]]:
+    payloads = {}
+    for size, (processes, autoruns) in PAYLOAD_SIZES.items():
+        fleet = SyntheticFleet(hosts=1, processes=processes, autoruns=autoruns, churn=0.0, seed=FIXTURE_SEED)
+        payloads[size] = fleet.posture_event()
+    return payloads
+
+
+def build_stream_payloads(postures: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """event_data в том виде, в каком он уходит в publish_to_stream"""
+    payloads = {}
+    for size, raw in postures.items():
+        event_data = main.HostPostureEvent(**raw).dict()
+        event_data['received_at'] = "2025-09-01T10:00:00+00:00"
+        event_data['agent_id'] = raw["agent"]["agent_id"]
+        event_data['user_agent'] = "uecp-agent/0.1.0"
+        event_data['format_type'] = 'host_posture'
+        payloads[size] = event_data
+    return payloads
+
+
+def add_secrets(event_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Копия event_data, где у каждого десятого процесса и задачи в командной строке пароль"""
+    data = copy.deepcopy(event_data)
+    inventory = data.get("inventory") or {}
+    for i, process in enumerate(inventory.get("processes") or []):
+        if i % 10 == 0:
+            process["cmdline"] = f"{process.get('cmdline') or ''} --password=S3cret{i} /token:abc{i}def"
+    for i, task in enumerate(inventory.get("scheduled_tasks") or []):
+        if i % 10 == 0:
+            task["action"] = f"{task.get('action') or ''} -Password P@ss{i}"
+    return data
+
+
+def build_hits(count: int = HITS_PER_PAGE) -> List[Dict[str, Any]]:
+    """Страница выдачи OpenSearch из событий AgentTelemetryEvent"""
+    fleet = SyntheticFleet(hosts=10, processes=30, autoruns=5, seed=FIXTURE_SEED)
+    hits = []
+    for i in range(count):
+        source = fleet.telemetry_event()
+        source["agent"]["agent_id"] = f"win-agent-{i % 10:05d}"
+        hits.append({"_id": source["event_id"], "_index": "agent-events-2025.09.01", "_source": source})
+    return hits
+
+
+def calibration_workload():
+    """Эталонная нагрузка на чистом Python (словари, строки)"""
+    data = {}
+    for i in range(100):
+        data[str(i)] = i * 2
+    return sum(v for v in data.values() if v % 3)
+
+
+def _timer(func: Callable[[], Any], min_time: float) -> Tuple[timeit.Timer, int]:
+    """Таймер и число вызовов, при котором один повтор занимает около min_time"""
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        if timer.timeit(number) >= min_time / 10:
+            break
+        number *= 2
+    elapsed = timer.timeit(number)
+    return timer, max(1, int(number * min_time / max(elapsed, 1e-9)))
+
+
+def _median_noise(samples: List[float]) -> Tuple[float, float]:
+    """Медиана и ее относительная стандартная ошибка: ~1.25 * sigma / sqrt(n), sigma ~ IQR / 1.35"""
+    median = statistics.median(samples)
+    q1, _, q3 = statistics.quantiles(samples, n=4)
+    return median, 0.93 * (q3 - q1) / median / len(samples) ** 0.5
+
+
+def measure(func: Callable[[], Any], repeat: int, min_time: float) -> Dict[str, float]:
+    """
+    Замер func повторами, чередующимися с повторами калибровки: медианное
+    время вызова в наносекундах, медиана отношения к калибровке в паре
+    повторов и шум этого отношения
+    """
+    timer, number = _timer(func, min_time)
+    calibration, calibration_number = _timer(calibration_workload, min_time)
+    times, ratios = [], []
+    for _ in range(max(repeat, 4)):
+        elapsed = timer.timeit(number) / number
+        baseline = calibration.timeit(calibration_number) / calibration_number
+        times.append(elapsed * 1e9)
+        ratios.append(elapsed / baseline)
+    relative, noise = _median_noise(ratios)
+    return {"ns_per_op": statistics.median(times), "relative": relative, "noise": noise}
+
+
+def build_benchmarks() -> List[Tuple[str, Callable[[], Any]]]:
+    postures = build_posture_payloads()
+    stream_payloads = build_stream_payloads(postures)
+    hits = build_hits()
+    timestamp = "2025-09-01T10:15:30.123456Z"
+
+    benchmarks: List[Tuple[str, Callable[[], Any]]] = [
+        ("get_index_name", lambda: main.get_index_name(timestamp)),
+        ("get_index_name.fallback", lambda: main.get_index_name("not-a-timestamp")),
+    ]
+    for size in PAYLOAD_SIZES:
+        raw = postures[size]
+        benchmarks.append((f"host_posture_validate.{size}", lambda raw=raw: main.HostPostureEvent(**raw).dict()))
+    for size in PAYLOAD_SIZES:
+        event_data = stream_payloads[size]
+        benchmarks.append((f"mask_event.clean.{size}", lambda data=event_data: main.masker.mask(data)))
+        with_secrets = add_secrets(event_data)
+        benchmarks.append((f"mask_event.secrets.{size}", lambda data=with_secrets: main.masker.mask(data)))
+        # Пустой кэш строк: первое событие с незнакомыми командными строками
+        benchmarks.append((f"mask_event.cold.{size}", lambda data=with_secrets: DataMasker().mask(data)))
+    for size in PAYLOAD_SIZES:
+        event_data = stream_payloads[size]
+        benchmarks.append((f"encode_stream_fields.{size}", lambda data=event_data: main.encode_stream_fields(data)))
+    benchmarks.append(("format_event_hit.page", lambda: [main.format_event_hit(hit) for hit in hits]))
+    benchmarks.append(("format_agent_event_hit.page", lambda: [main.format_agent_event_hit(hit) for hit in hits]))
+    return benchmarks
+
+
+def run_benchmarks(name_filter: Optional[str], repeat: int, min_time: float,
+                   names: Optional[List[str]] = None) -> Dict[str, Any]:
+    results = {}
+    for name, func in build_benchmarks():
+        if name_filter and name_filter not in name:
+            continue
+        if names is not None and name not in names:
+            continue
+        result = measure(func, repeat, min_time)
+        results[name] = {"ns_per_op": round(result["ns_per_op"], 1), "relative": round(result["relative"], 4),
+                         "noise": round(result["noise"], 4)}
+        print(f"{name:<40} {result['ns_per_op'] / 1000:>12.2f} us/op  {result['relative']:>10.3f} x calib"
+              f"  ±{result['noise']:.1%}")
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float,
+                    metric: str) -> List[str]:
+    """
+    Список бенчмарков, замедлившихся больше чем на threshold плюс NOISE_FACTOR
+    шумов разницы замеров (baseline без шума - только шум текущего замера)
+    """
+    regressions = []
+    print(f"\n{'benchmark':<40} {'baseline':>12} {'current':>12} {'change':>9} {'limit':>8}")
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<40} {'-':>12} {result[metric]:>12} {'new':>9}")
+            continue
+        change = result[metric] / base[metric] - 1.0
+        noise = (base.get("noise", 0.0) ** 2 + result.get("noise", 0.0) ** 2) ** 0.5
+        limit = threshold + NOISE_FACTOR * noise
+        flag = "  REGRESSION?" if change > limit else ""
+        print(f"{name:<40} {base[metric]:>12} {result[metric]:>12} {change:>+8.1%} {limit:>+7.1%}{flag}")
+        if change > limit:
+            regressions.append(name)
+    return regressions
+
+
+def main_cli() -> int:
+    parser = argparse.ArgumentParser(description="Микробенчмарки горячих функций Ingest API")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(sub):
+        sub.add_argument("--filter", default=None, help="Запускать только бенчмарки, содержащие подстроку")
+        sub.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+        sub.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME,
+                         help="Длительность одного повтора, секунды")
+
+    run_parser = subparsers.add_parser("run", help="Выполнить замеры")
+    add_common(run_parser)
+    run_parser.add_argument("--output", default=None, help="Сохранить результаты в JSON")
+
+    baseline_parser = subparsers.add_parser("baseline", help="Снять baseline этой машины")
+    add_common(baseline_parser)
+    baseline_parser.add_argument("--output", default=LOCAL_BASELINE)
+    baseline_parser.add_argument("--reference", action="store_true",
+                                 help=f"Обновить справочный {REFERENCE_BASELINE} вместо baseline машины")
+
+    compare_parser = subparsers.add_parser("compare", help="Сравнить с baseline этой машины")
+    add_common(compare_parser)
+    compare_parser.add_argument("--baseline", default=LOCAL_BASELINE)
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                help="Допустимое замедление (доля, 0.15 = 15%%)")
+    compare_parser.add_argument("--absolute", action="store_true",
+                                help="Сравнивать абсолютное время, а не относительно калибровки")
+
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        if not os.path.exists(args.baseline):
+            print(f"Нет baseline {args.baseline}: снимите его на этой машине командой "
+                  f"'python benchmarks/micro.py baseline' до изменений ({REFERENCE_BASELINE} - только справочный)")
+            return 2
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        current = run_benchmarks(args.filter, args.repeat, args.min_time)
+        metric = "ns_per_op" if args.absolute else "relative"
+        regressions = compare_results(baseline, current, args.threshold, metric)
+        if regressions:
+            # Единичный выброс (фоновая нагрузка, частота CPU) не считается регрессией: перемер
+            print(f"\nПеремер бенчмарков за порогом: {', '.join(regressions)}")
+            retry = run_benchmarks(None, args.repeat, args.min_time, names=regressions)
+            regressions = compare_results(baseline, retry, args.threshold, metric)
+        if regressions:
+            print(f"\nРегрессия производительности (> {args.threshold:.0%}): {', '.join(regressions)}")
+            return 1
+        print("\nРегрессий не обнаружено")
+        return 0
+
+    results = run_benchmarks(args.filter, args.repeat, args.min_time)
+    if args.command == "baseline" and args.reference:
+        args.output = REFERENCE_BASELINE
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\nРезультаты сохранены в {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
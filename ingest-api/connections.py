@@ -0,0 +1,247 @@
+"""
+Супервизор соединений с OpenSearch и Redis.
+
+Супервизор владеет клиентами бэкендов:
+- создает их с настроенными пулами (размер пула, таймауты, keep-alive);
+- в фоне проверяет каждый бэкенд: здоровый - раз в check_interval
+  секунд, недоступный - с экспоненциальной задержкой с полным джиттером
+  (от 0 до min(max_backoff, base * 2^попытка)), чтобы воркеры и реплики
+  не переподключались синхронно;
+- хранит кэшированное состояние здоровья, которое читают /health и
+  функции зависимостей - сами проверки на запрос не выполняются.
+
+При смене состояния вызывается on_change(backend, client_or_None): main.py
+держит в глобальных opensearch_client/redis_client клиент здорового
+бэкенда или None. Первый переход OpenSearch в здоровое состояние вызывает
+on_ready (создание индексов).
+"""
+
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import redis.asyncio as aioredis
+from opensearchpy import AsyncOpenSearch
+
+logger = logging.getLogger(__name__)
+
+
+def build_opensearch_client(url: str, pool_size: int, timeout: float, connection_class=None,
+                            max_retries: int = 1) -> AsyncOpenSearch:
+    """
+    Клиент OpenSearch с пулом на pool_size соединений на узел.
+
+    Соединения aiohttp переиспользуются (keep-alive) в пределах пула;
+    сжатие запросов уменьшает трафик bulk-запросов. Таймаут транспорт не
+    повторяет: запрос мог быть выполнен, а повторы идемпотентных вызовов
+    решает политика устойчивости (ResilientClient).
+    """
+    kwargs: Dict[str, Any] = {
+        "maxsize": pool_size,
+        "timeout": timeout,
+        "max_retries": max_retries,
+        "retry_on_timeout": False,
+        "http_compress": True,
+    }
+    if connection_class is not None:
+        kwargs["connection_class"] = connection_class
+    return AsyncOpenSearch([url], **kwargs)
+
+
+def build_redis_client(url: str, pool_size: int, pool_timeout: float, socket_timeout: float,
+                       connect_timeout: float, health_check_interval: int = 30) -> aioredis.Redis:
+    """
+    Клиент Redis на блокирующем пуле: при исчерпании лимита запрос ждет
+    соединение до pool_timeout секунд, а не падает. TCP keep-alive и
+    периодическая проверка простаивающих соединений отсекают соединения,
+    оборванные на стороне сети. Таймаут команды клиент не повторяет (см.
+    build_opensearch_client).
+    """
+    pool = aioredis.BlockingConnectionPool.from_url(
+        url,
+        max_connections=pool_size,
+        timeout=pool_timeout,
+        socket_timeout=socket_timeout,
+        socket_connect_timeout=connect_timeout,
+        socket_keepalive=True,
+        health_check_interval=health_check_interval,
+        retry_on_timeout=False,
+    )
+    return aioredis.Redis(connection_pool=pool)
+
+
+class BackendState:
+    """Кэшированное состояние одного бэкенда"""
+
+    __slots__ = ("name", "client", "healthy", "status", "last_check", "last_change",
+                 "last_error", "latency_ms", "failures", "ready")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.client: Any = None
+        self.healthy = False
+        self.status = "connecting"
+        self.last_check: Optional[float] = None
+        self.last_change = time.time()
+        self.last_error: Optional[str] = None
+        self.latency_ms: Optional[float] = None
+        self.failures = 0
+        self.ready = False
+
+    def as_dict(self) -> Dict[str, Any]:
+        def iso(ts: Optional[float]) -> Optional[str]:
+            return datetime.fromtimestamp(ts, timezone.utc).isoformat() if ts else None
+        return {
+            "status": self.status,
+            "latency_ms": self.latency_ms,
+            "last_check": iso(self.last_check),
+            "since": iso(self.last_change),
+            "consecutive_failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class ConnectionSupervisor:
+    """Владелец клиентов OpenSearch/Redis с фоновым переподключением"""
+
+    def __init__(self,
+                 factories: Dict[str, Callable[[], Any]],
+                 on_change: Optional[Callable[[str, Any], None]] = None,
+                 on_ready: Optional[Dict[str, Callable[[Any], Awaitable[None]]]] = None,
+                 check_interval: float = 5.0,
+                 ping_timeout: float = 2.0,
+                 base_backoff: float = 0.5,
+                 max_backoff: float = 30.0):
+        self.factories = factories
+        self.on_change = on_change
+        self.on_ready = on_ready or {}
+        self.check_interval = check_interval
+        self.ping_timeout = ping_timeout
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.states = {name: BackendState(name) for name in factories}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._first_check = {name: asyncio.Event() for name in factories}
+        # Внеочередная проверка бэкенда (после report_failure)
+        self._wakeups = {name: asyncio.Event() for name in factories}
+
+    # === Жизненный цикл ===
+
+    async def start(self, wait: float = 5.0) -> None:
+        """
+        Запуск фоновых проверок. Ждет первой проверки всех бэкендов не
+        дольше wait секунд; недоступные бэкенды подключаются уже в фоне.
+        """
+        for name in self.factories:
+            self._tasks[name] = asyncio.create_task(self._supervise(name), name=f"supervise-{name}")
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(event.wait() for event in self._first_check.values())), wait
+            )
+        except asyncio.TimeoutError:
+            pass
+
+    async def stop(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        for task in self._tasks.values():
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._tasks.clear()
+        for state in self.states.values():
+            if state.client is not None:
+                try:
+                    await state.client.close()
+                except Exception as e:
+                    logger.warning(f"Ошибка закрытия клиента {state.name}: {e}")
+            self._set(state, None, "stopped", None)
+
+    # === Состояние ===
+
+    def client(self, name: str) -> Any:
+        """Клиент здорового бэкенда или None"""
+        state = self.states.get(name)
+        return state.client if state is not None and state.healthy else None
+
+    def is_healthy(self, name: str) -> bool:
+        state = self.states.get(name)
+        return bool(state and state.healthy)
+
+    def health(self) -> Dict[str, Dict[str, Any]]:
+        return {name: state.as_dict() for name, state in self.states.items()}
+
+    def report_failure(self, name: str, error: Exception) -> None:
+        """
+        Внешний сигнал о сбое бэкенда (например, от circuit breaker):
+        бэкенд помечается недоступным до следующей успешной проверки.
+        """
+        state = self.states.get(name)
+        if state is not None and state.healthy:
+            state.failures += 1
+            self._set(state, None, "unhealthy", f"{type(error).__name__}: {error}")
+            self._wakeups[name].set()
+
+    # === Фоновая проверка ===
+
+    def _backoff(self, attempt: int) -> float:
+        """Полный джиттер: равномерно от 0 до экспоненциальной границы"""
+        cap = min(self.max_backoff, self.base_backoff * (2 ** min(attempt, 16)))
+        return max(0.05, random.uniform(0, cap))
+
+    async def _ping(self, name: str, client: Any) -> None:
+        result = await asyncio.wait_for(client.ping(), self.ping_timeout)
+        # AsyncOpenSearch.ping возвращает False вместо исключения
+        if result is False:
+            raise ConnectionError("ping вернул False")
+
+    def _set(self, state: BackendState, client: Any, status: str, error: Optional[str]) -> None:
+        healthy = status == "healthy"
+        changed = healthy != state.healthy or status != state.status
+        state.healthy = healthy
+        state.status = status
+        state.last_error = error
+        if changed:
+            state.last_change = time.time()
+            if healthy:
+                logger.info(f"{state.name}: соединение установлено")
+            elif status == "unhealthy":
+                logger.warning(f"{state.name}: бэкенд недоступен ({error})")
+            if self.on_change is not None:
+                self.on_change(state.name, client if healthy else None)
+
+    async def _supervise(self, name: str) -> None:
+        state = self.states[name]
+        wakeup = self._wakeups[name]
+        while True:
+            start = time.perf_counter()
+            try:
+                if state.client is None:
+                    state.client = self.factories[name]()
+                await self._ping(name, state.client)
+                state.latency_ms = round((time.perf_counter() - start) * 1000, 2)
+                if not state.ready and name in self.on_ready:
+                    await self.on_ready[name](state.client)
+                state.ready = True
+                state.failures = 0
+                self._set(state, state.client, "healthy", None)
+                delay = self.check_interval
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                state.latency_ms = None
+                state.failures += 1
+                self._set(state, state.client, "unhealthy", f"{type(e).__name__}: {e}")
+                delay = self._backoff(state.failures)
+            state.last_check = time.time()
+            self._first_check[name].set()
+
+            wakeup.clear()
+            try:
+                await asyncio.wait_for(wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
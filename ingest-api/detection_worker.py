@@ -0,0 +1,314 @@
+"""
+Воркер обнаружения: правила детектирования над Redis Streams событий.
+
+Читает потоки events:* через группу потребителей, проверяет каждое событие
+правилами DetectionEngine (shared/detection.py) и записывает Alert-документы
+в OpenSearch одним bulk-запросом на пачку. Записи подтверждаются (XACK)
+только после успешной записи алертов: при сбое OpenSearch или перезапуске
+воркера необработанные записи остаются в pending и читаются повторно.
+ID алерта выводится из правила и исходного события, поэтому повторная
+обработка не создает дубликатов.
+
+    python detection_worker.py --rules detection_rules.json
+
+Несколько воркеров с разными --consumer делят потоки между собой.
+Имя потребителя должно быть постоянным (по умолчанию - имя хоста): после
+перезапуска воркер сначала дочитывает свои неподтвержденные записи.
+
+Статистика (события, алерты, события в секунду, стоимость каждого правила)
+раз в --stats-interval секунд пишется в лог и в Redis (hash detection:stats,
+поле - имя потребителя); ее показывает GET /admin/detection в Ingest API.
+Файл правил перечитывается при изменении.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from datetime import datetime, timezone
+from typing import AbstractSet, Any, Dict, List, Optional, Sequence, Tuple
+
+import redis.asyncio as aioredis
+from opensearchpy import AsyncOpenSearch
+from redis.exceptions import RedisError, ResponseError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.detection import DetectionEngine, build_alert, load_rules  # noqa: E402
+
+logger = logging.getLogger("ingest.detection")
+
+DEFAULT_STREAMS = ("events:ingestion", "events:host_posture", "events:security")
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "detection_rules.json")
+STATS_KEY = "detection:stats"
+ALERTS_INDEX_PREFIX = "alerts-"
+
+
+def _text(value: Any) -> str:
+    return value.decode("utf-8", "replace") if isinstance(value, bytes) else str(value)
+
+
+def decode_stream_fields(fields: Dict[Any, Any], only: Optional[AbstractSet[str]] = None) -> Dict[str, Any]:
+    """
+    Событие из полей записи потока (обратное к encode_stream_fields в main.py).
+    С only разбираются только эти поля верхнего уровня.
+    """
+    event: Dict[str, Any] = {}
+    for key, value in fields.items():
+        if only is not None and _text(key) not in only:
+            continue
+        text = _text(value)
+        if text[:1] in ("{", "["):
+            try:
+                event[_text(key)] = json.loads(text)
+                continue
+            except ValueError:
+                pass
+        event[_text(key)] = text
+    return event
+
+
+def alerts_index_name(event: Dict[str, Any]) -> str:
+    """Индекс алертов по дате исходного события: повторная обработка попадает в тот же индекс"""
+    try:
+        dt = datetime.fromisoformat(str(event.get("timestamp")).replace("Z", "+00:00"))
+    except ValueError:
+        dt = datetime.now(timezone.utc)
+    return f"{ALERTS_INDEX_PREFIX}{dt.strftime('%Y.%m.%d')}"
+
+
+class DetectionWorker:
+    """Чтение потоков группой потребителей, проверка правилами и bulk-запись алертов"""
+
+    def __init__(self, redis: aioredis.Redis, opensearch: AsyncOpenSearch, engine: DetectionEngine,
+                 group: str = "detection", consumer: Optional[str] = None,
+                 streams: Sequence[str] = DEFAULT_STREAMS, batch_size: int = 1000,
+                 block_ms: int = 1000, start_id: str = "$", retry_delay: float = 5.0,
+                 stats_interval: float = 30.0, rules_file: Optional[str] = None):
+        self.redis = redis
+        self.opensearch = opensearch
+        self.engine = engine
+        self.group = group
+        self.consumer = consumer or socket.gethostname()
+        self.streams = list(streams)
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.start_id = start_id
+        self.retry_delay = retry_delay
+        self.stats_interval = stats_interval
+        self.rules_file = rules_file
+        self._rules_mtime = self._mtime()
+        self._stopping = asyncio.Event()
+        self.counters = {"events": 0, "alerts": 0, "batches": 0, "decode_errors": 0,
+                         "alert_write_errors": 0, "bulk_failures": 0}
+        self._busy_seconds = 0.0
+        self._window_start = time.monotonic()
+        self._window_events = 0
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def _mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.rules_file) if self.rules_file else None
+        except OSError:
+            return None
+
+    async def ensure_groups(self) -> None:
+        for stream in self.streams:
+            try:
+                await self.redis.xgroup_create(stream, self.group, id=self.start_id, mkstream=True)
+                logger.info(f"Создана группа {self.group} для {stream} (с {self.start_id})")
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    def detect(self, response: List[Any]) -> Tuple[List[Dict[str, Any]], Dict[str, List[Any]]]:
+        """Алерты по пачке записей и ID записей для подтверждения по потокам"""
+        engine = self.engine
+        # Для проверки правил разбираются только поля, которые читают правила
+        wanted = engine.fields | {"event_id", "timestamp"}
+        actions: List[Dict[str, Any]] = []
+        acks: Dict[str, List[Any]] = {}
+        now = datetime.now(timezone.utc)
+        for stream_name, entries in response:
+            stream = _text(stream_name)
+            ids = acks.setdefault(stream, [])
+            for entry_id, fields in entries:
+                ids.append(entry_id)
+                if not fields:
+                    # Запись удалена из потока, пока числилась в pending
+                    continue
+                try:
+                    event = decode_stream_fields(fields, wanted)
+                except (UnicodeDecodeError, TypeError, ValueError):
+                    self.counters["decode_errors"] += 1
+                    continue
+                self.counters["events"] += 1
+                matched = engine.evaluate(event, stream)
+                if matched:
+                    # Поля алерта (host, agent) - из полностью разобранного события
+                    event = decode_stream_fields(fields)
+                for rule in matched:
+                    alert = build_alert(rule, event, stream, now)
+                    actions.append({"index": {"_index": alerts_index_name(event), "_id": alert["event_id"]}})
+                    actions.append(alert)
+        return actions, acks
+
+    async def write_alerts(self, actions: List[Dict[str, Any]]) -> None:
+        """Bulk-запись алертов; исключение - пачка не подтверждается и будет прочитана повторно"""
+        if not actions:
+            return
+        response = await self.opensearch.bulk(body=actions, refresh=False)
+        alerts = len(actions) // 2
+        if response.get("errors"):
+            failed = [item for item in response.get("items", []) if next(iter(item.values())).get("error")]
+            # Ошибки отдельных документов (маппинг) не исправятся повтором - они учитываются и пропускаются
+            self.counters["alert_write_errors"] += len(failed)
+            if failed:
+                logger.error(f"Не записано {len(failed)} из {alerts} алертов: {next(iter(failed[0].values()))['error']}")
+            alerts -= len(failed)
+        self.counters["alerts"] += alerts
+
+    async def process(self, response: List[Any]) -> int:
+        started = time.perf_counter()
+        actions, acks = self.detect(response)
+        await self.write_alerts(actions)
+        entries = 0
+        for stream, ids in acks.items():
+            if ids:
+                await self.redis.xack(stream, self.group, *ids)
+                entries += len(ids)
+        self.counters["batches"] += 1
+        self._busy_seconds += time.perf_counter() - started
+        self._window_events += entries
+        return entries
+
+    async def run(self) -> None:
+        await self.ensure_groups()
+        # Сначала - записи, выданные этому потребителю ранее и не подтвержденные
+        backlog = True
+        last_stats = time.monotonic()
+        while not self._stopping.is_set():
+            try:
+                response = await self.redis.xreadgroup(
+                    self.group, self.consumer,
+                    {stream: "0" if backlog else ">" for stream in self.streams},
+                    count=self.batch_size,
+                    block=None if backlog else self.block_ms,
+                )
+            except RedisError as e:
+                logger.error(f"Ошибка чтения потоков: {e}")
+                await self._sleep(self.retry_delay)
+                continue
+            if backlog and not any(entries for _, entries in response or ()):
+                backlog = False
+            elif response:
+                try:
+                    await self.process(response)
+                except Exception as e:
+                    # Записи остаются в pending этого потребителя и будут прочитаны повторно
+                    self.counters["bulk_failures"] += 1
+                    logger.error(f"Ошибка обработки пачки, повтор через {self.retry_delay}с: {e}")
+                    backlog = True
+                    await self._sleep(self.retry_delay)
+            if time.monotonic() - last_stats >= self.stats_interval:
+                last_stats = time.monotonic()
+                self.reload_rules_if_changed()
+                await self.publish_stats()
+        await self.publish_stats()
+
+    async def _sleep(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    def reload_rules_if_changed(self) -> None:
+        mtime = self._mtime()
+        if mtime is None or mtime == self._rules_mtime:
+            return
+        self._rules_mtime = mtime
+        try:
+            self.engine = DetectionEngine(load_rules(self.rules_file))
+            logger.info(f"Правила перечитаны из {self.rules_file}: {len(self.engine.rules)}")
+        except (OSError, ValueError) as e:
+            logger.error(f"Ошибка в файле правил {self.rules_file}, используются прежние правила: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        rate = self._window_events / elapsed if elapsed > 0 else 0.0
+        self._window_start, self._window_events = now, 0
+        return {
+            "consumer": self.consumer,
+            "group": self.group,
+            "streams": self.streams,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "events_per_second": round(rate, 1),
+            "busy_seconds": round(self._busy_seconds, 3),
+            **self.counters,
+            "engine": self.engine.stats(),
+        }
+
+    async def publish_stats(self) -> None:
+        stats = self.stats()
+        top = ", ".join(f"{item['rule_id']} {item['time_ms']}ms" for item in stats["engine"]["rule_stats"][:3])
+        logger.info(f"Обнаружение: {stats['events']} событий, {stats['alerts']} алертов, "
+                    f"{stats['events_per_second']} событий/с; самые дорогие правила: {top or '-'}")
+        try:
+            await self.redis.hset(STATS_KEY, self.consumer, json.dumps(stats))
+        except RedisError as e:
+            logger.warning(f"Не удалось сохранить статистику обнаружения: {e}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Воркер обнаружения: правила над Redis Streams")
+    parser.add_argument("--rules", default=os.getenv("DETECTION_RULES_FILE", DEFAULT_RULES_FILE))
+    parser.add_argument("--group", default=os.getenv("DETECTION_GROUP", "detection"))
+    parser.add_argument("--consumer", default=os.getenv("DETECTION_CONSUMER") or socket.gethostname())
+    parser.add_argument("--streams", default=os.getenv("DETECTION_STREAMS", ",".join(DEFAULT_STREAMS)))
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("DETECTION_BATCH_SIZE", "1000")))
+    parser.add_argument("--block-ms", type=int, default=int(os.getenv("DETECTION_BLOCK_MS", "1000")))
+    parser.add_argument("--start-id", default=os.getenv("DETECTION_START_ID", "$"),
+                        help="С какой записи читать поток при создании группы: $ - только новые, 0 - вся история")
+    parser.add_argument("--stats-interval", type=float, default=float(os.getenv("DETECTION_STATS_INTERVAL", "30")))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"),
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    try:
+        engine = DetectionEngine(load_rules(args.rules))
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"Не удалось загрузить правила {args.rules}: {e}")
+    logger.info(f"Загружено правил: {len(engine.rules)}; индексированные поля: {engine.stats()['indexed_fields']}")
+
+    async def run() -> None:
+        redis = aioredis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379"))
+        opensearch = AsyncOpenSearch([os.getenv("OPENSEARCH_URL", "http://localhost:9200")], http_compress=True)
+        worker = DetectionWorker(
+            redis, opensearch, engine,
+            group=args.group, consumer=args.consumer,
+            streams=[stream for stream in args.streams.split(",") if stream],
+            batch_size=args.batch_size, block_ms=args.block_ms, start_id=args.start_id,
+            stats_interval=args.stats_interval, rules_file=args.rules,
+        )
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, worker.stop)
+        try:
+            await worker.run()
+        finally:
+            await opensearch.close()
+            await redis.aclose()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""
+Обогащение событий при приеме: классификация IP-адресов и совпадения с IOC.
+
+Адреса события классифицируются одним пакетным вызовом IpClassifier
+(shared/ip_enrichment.py), результаты записываются рядом с адресами
+плоскими полями-списками. Фильтры UI по типу адреса становятся term-
+запросами вместо скриптов и разбора на клиенте:
+
+    network.destination_ip_classes: public      исходящие во внешнюю сеть
+    network.direction: outbound
+    host.ip_sites: hq
+    source_ip_classes: known_bad                события безопасности
+
+Поля:
+- host.ip_classes / host.ip_sites / host.ip_threat_lists - объединение по
+  всем host.ip_addresses (AgentTelemetryEvent);
+- network.{source,destination}_ip_classes, _site, _threat_lists и
+  network.direction (internal, outbound, inbound, external);
+- source_ip_classes / source_site / source_threat_lists (SecurityEvent).
+
+Хеши файлов (процессы и автозапуски снимка host_posture, file_hash событий
+безопасности) получают вердикт репутации (ReputationCache,
+shared/reputation.py) рядом с хешем, а событие - сводку:
+
+    inventory.processes.sha256_reputation: malicious
+    reputation.verdicts: malicious              события с вредоносными файлами
+
+Совпадения с индикаторами компрометации (IocIndex, shared/ioc.py)
+записываются в поле ioc: хэши, пути и командные строки процессов и
+автозапусков, IP-адреса и домены сетевых событий, file_hash и source_ip
+событий безопасности. Поиск по индексу в памяти, без обращений к бэкендам:
+
+    ioc.matched: true                           события с совпадениями
+    ioc.threat_types: c2
+    ioc.matches.field: inventory.processes.sha256
+"""
+
+import logging
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from shared.ioc import Indicator, IocIndex, indicators_from_threat_intel, load_indicator_feed
+from shared.ip_enrichment import IpClassifier, load_ip_ranges
+from shared.reputation import VERDICTS, ListFileProvider, ReputationCache, normalize_hash
+
+logger = logging.getLogger(__name__)
+
+# Адреса внутри организации для определения направления соединения
+INTERNAL_CLASSES = frozenset(("private", "internal_site", "loopback", "link_local", "cgnat"))
+
+
+def build_ip_classifier(ranges_file: Optional[str], cache_size: int) -> IpClassifier:
+    """Классификатор со встроенными диапазонами и диапазонами из файла (внутренние площадки, known-bad)"""
+    ranges: Dict[str, Dict[str, List[str]]] = {}
+    if ranges_file:
+        try:
+            ranges = load_ip_ranges(ranges_file)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось загрузить диапазоны IP из {ranges_file}: {e}")
+    try:
+        return IpClassifier(cache_size=cache_size, **ranges)
+    except ValueError as e:
+        logger.error(f"Некорректный диапазон в {ranges_file}: {e}; используются только встроенные диапазоны")
+        return IpClassifier(cache_size=cache_size)
+
+
+def _is_internal(info: Optional[Dict[str, Any]]) -> Optional[bool]:
+    if info is None or info["version"] is None:
+        return None
+    return not INTERNAL_CLASSES.isdisjoint(info["classes"])
+
+
+def _annotate_address(target: Dict[str, Any], prefix: str, info: Optional[Dict[str, Any]]) -> None:
+    if info is None:
+        return
+    target[f"{prefix}_ip_classes"] = list(info["classes"])
+    if info["site"]:
+        target[f"{prefix}_site"] = info["site"]
+    if info["threat_lists"]:
+        target[f"{prefix}_threat_lists"] = list(info["threat_lists"])
+
+
+def connection_direction(source: Optional[Dict[str, Any]], destination: Optional[Dict[str, Any]]) -> Optional[str]:
+    source_internal = _is_internal(source)
+    destination_internal = _is_internal(destination)
+    if source_internal is None or destination_internal is None:
+        return None
+    if source_internal:
+        return "internal" if destination_internal else "outbound"
+    return "inbound" if destination_internal else "external"
+
+
+def _event_addresses(event_data: Dict[str, Any]) -> Iterable[str]:
+    host = event_data.get("host")
+    if isinstance(host, dict):
+        yield from host.get("ip_addresses") or ()
+    network = event_data.get("network")
+    if isinstance(network, dict):
+        yield network.get("source_ip")
+        yield network.get("destination_ip")
+    source_ip = event_data.get("source_ip")
+    if isinstance(source_ip, str):
+        yield source_ip
+
+
+def annotate_ip_classes(event_data: Dict[str, Any], classifier: IpClassifier) -> None:
+    """Запись классов IP-адресов события в event_data (на месте)"""
+    infos = classifier.classify_many(ip for ip in _event_addresses(event_data) if isinstance(ip, str))
+    if not infos:
+        return
+
+    host = event_data.get("host")
+    if isinstance(host, dict) and host.get("ip_addresses"):
+        classes, sites, threat_lists = set(), set(), set()
+        for ip in host["ip_addresses"]:
+            info = infos.get(ip)
+            if info is None:
+                continue
+            classes.update(info["classes"])
+            if info["site"]:
+                sites.add(info["site"])
+            threat_lists.update(info["threat_lists"])
+        host["ip_classes"] = sorted(classes)
+        host["ip_sites"] = sorted(sites)
+        if threat_lists:
+            host["ip_threat_lists"] = sorted(threat_lists)
+
+    network = event_data.get("network")
+    if isinstance(network, dict):
+        source = infos.get(network.get("source_ip"))
+        destination = infos.get(network.get("destination_ip"))
+        _annotate_address(network, "source", source)
+        _annotate_address(network, "destination", destination)
+        direction = connection_direction(source, destination)
+        if direction:
+            network["direction"] = direction
+
+    source_ip = event_data.get("source_ip")
+    if isinstance(source_ip, str):
+        _annotate_address(event_data, "source", infos.get(source_ip))
+
+
+# === Индикаторы компрометации ===
+
+# Совпадений в одном событии сохраняется не больше (счетчик - по всем)
+MAX_IOC_MATCHES = 50
+
+# (поле, способ проверки, значение); способы: hash, ip, text (подстроки и домены)
+Observation = Tuple[str, str, Optional[str]]
+
+
+def _as_dicts(value: Any) -> Iterable[Dict[str, Any]]:
+    if isinstance(value, list):
+        return (item for item in value if isinstance(item, dict))
+    return ()
+
+
+def _inventory_observations(inventory: Dict[str, Any]) -> Iterator[Observation]:
+    for process in _as_dicts(inventory.get("processes")):
+        yield "inventory.processes.sha256", "hash", process.get("sha256")
+        yield "inventory.processes.exe_path", "text", process.get("exe_path")
+        yield "inventory.processes.cmdline", "text", process.get("cmdline")
+    autoruns = inventory.get("autoruns")
+    if not isinstance(autoruns, dict):
+        return
+    for entry in _as_dicts(autoruns.get("registry")):
+        yield "inventory.autoruns.registry.value", "text", entry.get("value")
+    for entry in _as_dicts(autoruns.get("startup_folders")):
+        yield "inventory.autoruns.startup_folders.target", "text", entry.get("target")
+        yield "inventory.autoruns.startup_folders.file", "text", entry.get("file")
+    for entry in _as_dicts(autoruns.get("services_auto")):
+        yield "inventory.autoruns.services_auto.path", "text", entry.get("path")
+    for entry in _as_dicts(autoruns.get("scheduled_tasks")):
+        yield "inventory.autoruns.scheduled_tasks.action", "text", entry.get("action")
+
+
+def _event_observations(event_data: Dict[str, Any]) -> Iterator[Observation]:
+    process = event_data.get("process")
+    if isinstance(process, dict):
+        yield "process.path", "text", process.get("path")
+        yield "process.command_line", "text", process.get("command_line")
+    file_info = event_data.get("file")
+    if isinstance(file_info, dict):
+        yield "file.path", "text", file_info.get("path")
+    network = event_data.get("network")
+    if isinstance(network, dict):
+        yield "network.source_ip", "ip", network.get("source_ip")
+        yield "network.destination_ip", "ip", network.get("destination_ip")
+    inventory = event_data.get("inventory")
+    if isinstance(inventory, dict):
+        yield from _inventory_observations(inventory)
+    # SecurityEvent
+    yield "file_hash", "hash", event_data.get("file_hash")
+    yield "source_ip", "ip", event_data.get("source_ip")
+
+
+def annotate_ioc_matches(event_data: Dict[str, Any], index: IocIndex) -> int:
+    """
+    Проверка полей события по индексу IOC; при совпадениях в event_data
+    записывается поле ioc (на месте). Возвращает число совпадений.
+    """
+    if not len(index):
+        return 0
+    matches: List[Dict[str, Any]] = []
+    seen = set()
+    for field, kind, value in _event_observations(event_data):
+        if not value or not isinstance(value, str):
+            continue
+        if kind == "text":
+            found = index.match_text(value)
+        else:
+            match = index.match_hash(value) if kind == "hash" else index.match_ip(value)
+            found = (match,) if match is not None else ()
+        for match in found:
+            indicator = match.indicator
+            # Один и тот же индикатор в одном поле (сотни процессов svchost) - одна запись
+            key = (field, indicator.type, indicator.value)
+            if key in seen:
+                continue
+            seen.add(key)
+            matches.append({"field": field, "observed": match.observed, **indicator.as_dict()})
+    if not matches:
+        return 0
+    event_data["ioc"] = {
+        "matched": True,
+        "count": len(matches),
+        "indicators": sorted({match["indicator"] for match in matches}),
+        "threat_types": sorted({match["threat_type"] for match in matches}),
+        "sources": sorted({match["source"] for match in matches}),
+        "max_confidence": max(match["confidence"] for match in matches),
+        "matches": matches[:MAX_IOC_MATCHES],
+    }
+    return len(matches)
+
+
+# === Репутация файлов ===
+
+# Хешей с вредоносным или подозрительным вердиктом в сводке события не больше
+MAX_REPUTATION_HASHES = 50
+
+
+def _hash_entries(event_data: Dict[str, Any]) -> Iterator[Tuple[Dict[str, Any], str]]:
+    """(объект, поле хеша): процессы и автозапуски снимка, процесс и file_hash события"""
+    inventory = event_data.get("inventory")
+    if isinstance(inventory, dict):
+        for process in _as_dicts(inventory.get("processes")):
+            yield process, "sha256"
+        autoruns = inventory.get("autoruns")
+        if isinstance(autoruns, dict):
+            for entries in autoruns.values():
+                for entry in _as_dicts(entries):
+                    yield entry, "file_hash"
+    process = event_data.get("process")
+    if isinstance(process, dict):
+        yield process, "file_hash"
+    yield event_data, "file_hash"
+
+
+def event_file_hashes(event_data: Dict[str, Any]) -> set:
+    """Различные нормализованные хеши файлов события"""
+    hashes = set()
+    for entry, field in _hash_entries(event_data):
+        file_hash = normalize_hash(entry.get(field))
+        if file_hash:
+            hashes.add(file_hash)
+    return hashes
+
+
+def annotate_reputation(event_data: Dict[str, Any], verdicts: Dict[str, Dict[str, Any]]) -> int:
+    """
+    Запись вердиктов рядом с хешами (<поле>_reputation) и сводки reputation
+    в event_data (на месте). Возвращает число записей с вердиктом.
+    """
+    counts = dict.fromkeys(VERDICTS, 0)
+    flagged = set()
+    annotated = 0
+    for entry, field in _hash_entries(event_data):
+        file_hash = normalize_hash(entry.get(field))
+        verdict = verdicts.get(file_hash) if file_hash else None
+        if verdict is None:
+            continue
+        entry[f"{field}_reputation"] = verdict["verdict"]
+        counts[verdict["verdict"]] += 1
+        annotated += 1
+        if verdict["verdict"] in ("malicious", "suspicious"):
+            flagged.add(file_hash)
+    if annotated:
+        event_data["reputation"] = {
+            "verdicts": sorted(v for v, count in counts.items() if count),
+            "counts": counts,
+            "flagged_hashes": sorted(flagged)[:MAX_REPUTATION_HASHES],
+        }
+    return annotated
+
+
+def build_reputation_cache(list_file: Optional[str], **options) -> Optional[ReputationCache]:
+    """Кэш репутации над локальным списком разрешенных и запрещенных хешей; без файла - None"""
+    if not list_file:
+        return None
+    try:
+        provider = ListFileProvider(list_file)
+    except (OSError, ValueError) as e:
+        logger.error(f"Не удалось загрузить список репутации файлов {list_file}: {e}")
+        return None
+    logger.info(f"Список репутации файлов {list_file}: {len(provider)} хешей, пропущено {provider.skipped}")
+    return ReputationCache(provider, **options)
+
+
+def collect_indicators(feed_file: Optional[str], records: Iterable[Dict[str, Any]] = (),
+                       min_confidence: int = 0) -> Iterator[Optional[Indicator]]:
+    """
+    Индикаторы из локального фида и записей ThreatIntelEvent с порогом
+    достоверности; непригодные записи передаются как None и учитываются
+    индексом как пропущенные.
+    """
+    sources: List[Iterable[Optional[Indicator]]] = [indicators_from_threat_intel(records)]
+    if feed_file:
+        sources.append(load_indicator_feed(feed_file))
+    for source in sources:
+        for indicator in source:
+            if indicator is None or indicator.confidence >= min_confidence:
+                yield indicator
+
+
+async def fetch_threat_intel(opensearch, index: str, page_size: int = 5000,
+                             max_records: int = 5_000_000) -> List[Dict[str, Any]]:
+    """
+    Записи ThreatIntelEvent из OpenSearch, постранично через search_after,
+    только поля индикатора.
+    """
+    search_body: Dict[str, Any] = {
+        "query": {"match_all": {}},
+        "sort": [{"_id": {"order": "asc"}}],
+        "_source": ["indicator_type", "indicator_value", "threat_type", "confidence", "source"],
+        "size": page_size,
+    }
+    records: List[Dict[str, Any]] = []
+    while len(records) < max_records:
+        response = await opensearch.search(index=index, body=search_body, ignore_unavailable=True)
+        hits = response["hits"]["hits"]
+        if not hits:
+            break
+        records.extend(hit["_source"] for hit in hits)
+        search_body["search_after"] = hits[-1]["sort"]
+    return records
@@ -0,0 +1,90 @@
+"""
+Таблица расположения событий: event_id -> индекс OpenSearch.
+
+Индекс события известен в момент записи, поэтому он сохраняется в Redis
+отдельным ключом с TTL, равным сроку хранения событий. Получение и удаление
+события по ID идут сразу в нужный индекс через get/delete вместо поиска по
+всем суточным индексам agent-events-* и security-events-*.
+
+Если записи в таблице нет (событие сохранено до её появления или ключ
+истек), вызывающий код использует прежний поиск и дописывает найденное
+расположение.
+"""
+
+import logging
+import os
+from typing import Dict, Iterable, List, Optional
+
+import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+LOCATOR_PREFIX = "events:loc:"
+
+# Срок хранения событий - ключи расположения живут столько же
+EVENT_RETENTION_DAYS = int(os.getenv("EVENT_RETENTION_DAYS", "30"))
+LOCATOR_TTL_SECONDS = EVENT_RETENTION_DAYS * 24 * 3600
+
+# Паттерны индексов, в которых могут лежать события
+EVENT_INDEX_PATTERNS = "agent-events-*,security-events-*,vuln-scans-*"
+
+
+def _key(event_id: str) -> str:
+    return f"{LOCATOR_PREFIX}{event_id}"
+
+
+async def record_event_location(redis: aioredis.Redis, event_id: str, index: str) -> None:
+    """Запись индекса сохраненного события"""
+    try:
+        await redis.set(_key(event_id), index, ex=LOCATOR_TTL_SECONDS)
+    except Exception as e:
+        logger.warning(f"Не удалось записать расположение события {event_id}: {e}")
+
+
+async def record_event_locations(redis: aioredis.Redis, locations: Dict[str, str]) -> None:
+    """Запись расположения нескольких событий одним pipeline"""
+    if not locations:
+        return
+    try:
+        pipe = redis.pipeline(transaction=False)
+        for event_id, index in locations.items():
+            pipe.set(_key(event_id), index, ex=LOCATOR_TTL_SECONDS)
+        await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Не удалось записать расположение {len(locations)} событий: {e}")
+
+
+async def locate_event(redis: aioredis.Redis, event_id: str) -> Optional[str]:
+    """Индекс события или None, если расположение неизвестно"""
+    try:
+        index = await redis.get(_key(event_id))
+        return index.decode() if index is not None else None
+    except Exception as e:
+        logger.warning(f"Ошибка чтения расположения события {event_id}: {e}")
+        return None
+
+
+async def locate_events(redis: aioredis.Redis, event_ids: List[str]) -> Dict[str, Optional[str]]:
+    """Индексы нескольких событий одним MGET"""
+    if not event_ids:
+        return {}
+    try:
+        values = await redis.mget([_key(event_id) for event_id in event_ids])
+    except Exception as e:
+        logger.warning(f"Ошибка чтения расположения {len(event_ids)} событий: {e}")
+        values = [None] * len(event_ids)
+    return {
+        event_id: value.decode() if value is not None else None
+        for event_id, value in zip(event_ids, values)
+    }
+
+
+async def forget_events(redis: aioredis.Redis, event_ids: Iterable[str]) -> None:
+    """Удаление записей о расположении удаленных событий"""
+    keys = [_key(event_id) for event_id in event_ids]
+    if not keys:
+        return
+    try:
+        await redis.delete(*keys)
+    except Exception as e:
+        logger.warning(f"Не удалось удалить расположение {len(keys)} событий: {e}")
@@ -0,0 +1,479 @@
+"""
+Почасовые и посуточные сводки findings для исторических графиков.
+
+При каждом приеме host_posture пересчитываются сводные документы индекса
+findings-rollup:
+- по хосту: количество findings по severity и rule_id в последнем снимке
+  хоста внутри часа / суток;
+- по всему парку: сумма последних значений всех хостов в том же интервале.
+
+Сводка хоста перезаписывается целиком, сводка парка обновляется скриптом на
+разницу между новым и предыдущим значением хоста в этом интервале.
+Предыдущие значения хранятся в Redis с TTL, пока интервал может обновляться,
+и записываются только после того, как обе сводки приняты OpenSearch. В
+сводке парка хранится время учтенного снимка каждого хоста (applied):
+повтор того же снимка (повторная отправка bulk) или более старый снимок
+скрипт пропускает, поэтому запись сводок можно повторять.
+
+График за несколько недель читает сотни сводных документов вместо
+агрегации всех сырых снимков host_posture.
+
+Запуск пересчета по уже сохраненным данным:
+    python findings_rollup.py --days 90
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import redis.asyncio as aioredis
+from opensearchpy import AsyncOpenSearch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.resilience import retry_safe  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_INDEX = "findings-rollup"
+
+SEVERITIES = ("critical", "high", "medium", "low", "info")
+
+# Длительность интервалов сводок
+INTERVALS = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+# Сколько после окончания интервала принимаются опоздавшие снимки
+LATE_EVENTS_WINDOW = timedelta(hours=6)
+
+LAST_VALUE_PREFIX = "rollup:last:"
+
+ROLLUP_INDEX_BODY = {
+    "mappings": {
+        "properties": {
+            "scope": {"type": "keyword"},
+            "host_id": {"type": "keyword"},
+            "hostname": {"type": "keyword"},
+            "interval": {"type": "keyword"},
+            "bucket": {"type": "date"},
+            "total": {"type": "integer"},
+            "hosts": {"type": "integer"},
+            "severity": {
+                "properties": {s: {"type": "integer"} for s in SEVERITIES}
+            },
+            # Карта rule_id -> количество; не индексируется, чтобы не раздувать маппинг
+            "rules": {"type": "object", "enabled": False},
+            # Сводка парка: host_id -> время учтенного снимка хоста (мс эпохи)
+            "applied": {"type": "object", "enabled": False},
+            "snapshot_timestamp": {"type": "date"},
+            "updated_at": {"type": "date"}
+        }
+    }
+}
+
+# Painless-скрипт: прибавляет к сводке парка разницу значений одного хоста.
+# Снимок не новее уже учтенного (повтор bulk) не меняет документ
+FLEET_DELTA_SCRIPT = """
+if (ctx._source.applied == null) { ctx._source.applied = new HashMap(); }
+def seen = ctx._source.applied.get(params.host_id);
+if (seen != null && ((Number) seen).longValue() >= params.snapshot_ms) { ctx.op = 'none'; return; }
+if (ctx._source.severity == null) { ctx._source.severity = new HashMap(); }
+if (ctx._source.rules == null) { ctx._source.rules = new HashMap(); }
+for (entry in params.severity.entrySet()) {
+    def current = ctx._source.severity.getOrDefault(entry.getKey(), 0);
+    ctx._source.severity[entry.getKey()] = current + entry.getValue();
+}
+for (entry in params.rules.entrySet()) {
+    def current = ctx._source.rules.getOrDefault(entry.getKey(), 0) + entry.getValue();
+    if (current <= 0) { ctx._source.rules.remove(entry.getKey()); }
+    else { ctx._source.rules[entry.getKey()] = current; }
+}
+ctx._source.total = (ctx._source.total == null ? 0 : ctx._source.total) + params.total;
+ctx._source.hosts = (ctx._source.hosts == null ? 0 : ctx._source.hosts) + (seen == null ? 1 : 0);
+ctx._source.applied[params.host_id] = params.snapshot_ms;
+ctx._source.updated_at = params.updated_at;
+"""
+
+
+async def ensure_rollup_index(opensearch: AsyncOpenSearch) -> None:
+    """Создание индекса сводок, если его ещё нет"""
+    try:
+        if not await opensearch.indices.exists(index=ROLLUP_INDEX):
+            await opensearch.indices.create(index=ROLLUP_INDEX, body=ROLLUP_INDEX_BODY)
+            logger.info(f"Создан индекс {ROLLUP_INDEX}")
+        else:
+            # Индекс, созданный до появления applied: без маппинга карта хостов стала бы полями
+            await opensearch.indices.put_mapping(
+                index=ROLLUP_INDEX,
+                body={"properties": {"applied": ROLLUP_INDEX_BODY["mappings"]["properties"]["applied"]}}
+            )
+    except Exception as e:
+        logger.warning(f"Не удалось создать индекс {ROLLUP_INDEX}: {e}")
+
+
+def _parse_timestamp(timestamp: Optional[str]) -> datetime:
+    try:
+        dt = datetime.fromisoformat((timestamp or "").replace('Z', '+00:00'))
+        return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+    except Exception:
+        return datetime.now(timezone.utc)
+
+
+def bucket_start(dt: datetime, interval: str) -> datetime:
+    """Начало часового или суточного интервала (UTC)"""
+    dt = dt.astimezone(timezone.utc)
+    if interval == "hour":
+        return dt.replace(minute=0, second=0, microsecond=0)
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def count_findings(findings: Optional[Iterable[Dict[str, Any]]]) -> Dict[str, Any]:
+    """Подсчет findings снимка по severity и rule_id"""
+    severity = {s: 0 for s in SEVERITIES}
+    rules: Dict[str, int] = defaultdict(int)
+    total = 0
+    for finding in findings or []:
+        level = (finding.get("severity") or "").lower()
+        if level in severity:
+            severity[level] += 1
+        rule_id = finding.get("rule_id")
+        if rule_id:
+            rules[rule_id] += 1
+        total += 1
+    return {"severity": severity, "rules": dict(rules), "total": total}
+
+
+def _diff_counts(new: Dict[str, Any], old: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Разница двух значений хоста для обновления сводки парка"""
+    old = old or {"severity": {}, "rules": {}, "total": 0}
+    severity = {s: new["severity"].get(s, 0) - old["severity"].get(s, 0) for s in SEVERITIES}
+    rules = {}
+    for rule_id in set(new["rules"]) | set(old["rules"]):
+        delta = new["rules"].get(rule_id, 0) - old["rules"].get(rule_id, 0)
+        if delta:
+            rules[rule_id] = delta
+    return {"severity": severity, "rules": rules, "total": new["total"] - old["total"]}
+
+
+def _epoch_ms(dt: datetime) -> int:
+    return int(dt.timestamp() * 1000)
+
+
+def _bulk_item_ok(item: Dict[str, Any]) -> bool:
+    result = next(iter(item.values()))
+    return not result.get("error") and result.get("status", 200) < 300
+
+
+def _host_doc_id(host_id: str, interval: str, bucket: datetime) -> str:
+    return f"host:{host_id}:{interval}:{bucket.strftime('%Y%m%dT%H')}"
+
+
+def _fleet_doc_id(interval: str, bucket: datetime) -> str:
+    return f"fleet:{interval}:{bucket.strftime('%Y%m%dT%H')}"
+
+
+def _host_doc(host_id: str, hostname: Optional[str], interval: str, bucket: datetime,
+              counts: Dict[str, Any], snapshot_timestamp: str, updated_at: str) -> Dict[str, Any]:
+    return {
+        "scope": "host",
+        "host_id": host_id,
+        "hostname": hostname,
+        "interval": interval,
+        "bucket": bucket.isoformat(),
+        "severity": counts["severity"],
+        "rules": counts["rules"],
+        "total": counts["total"],
+        "snapshot_timestamp": snapshot_timestamp,
+        "updated_at": updated_at
+    }
+
+
+def _fleet_doc(interval: str, bucket: datetime, updated_at: str) -> Dict[str, Any]:
+    return {
+        "scope": "fleet",
+        "interval": interval,
+        "bucket": bucket.isoformat(),
+        "severity": {s: 0 for s in SEVERITIES},
+        "rules": {},
+        "total": 0,
+        "hosts": 0,
+        "applied": {},
+        "updated_at": updated_at
+    }
+
+
+async def update_findings_rollups(
+    opensearch: AsyncOpenSearch,
+    redis: aioredis.Redis,
+    event_data: Dict[str, Any]
+) -> None:
+    """Обновление почасовых и посуточных сводок по новому снимку host_posture"""
+    host_info = event_data.get("host_info") or {}
+    host_id = host_info.get("host_id")
+    if not host_id:
+        return
+
+    snapshot_ts = _parse_timestamp(event_data.get("timestamp"))
+    snapshot_iso = snapshot_ts.isoformat()
+    now = datetime.now(timezone.utc)
+    updated_at = now.isoformat()
+    counts = count_findings(event_data.get("findings"))
+
+    try:
+        actions: List[Dict[str, Any]] = []
+        # Состояние интервалов для Redis: записывается после успешной записи обеих сводок
+        pending: List[Tuple[str, datetime]] = []
+        for interval, length in INTERVALS.items():
+            bucket = bucket_start(snapshot_ts, interval)
+            expires_at = bucket + length + LATE_EVENTS_WINDOW
+            if expires_at <= now:
+                # Интервал закрыт - им занимается только пересчет (backfill)
+                continue
+
+            state_key = f"{LAST_VALUE_PREFIX}{interval}:{bucket.strftime('%Y%m%dT%H')}"
+            raw_previous = await redis.hget(state_key, host_id)
+            previous = json.loads(raw_previous) if raw_previous else None
+
+            # В сводку попадает последний по времени снимок хоста в интервале
+            if previous and previous.get("snapshot_timestamp", "") > snapshot_iso:
+                continue
+
+            pending.append((state_key, expires_at))
+            actions.append({"index": {"_index": ROLLUP_INDEX, "_id": _host_doc_id(host_id, interval, bucket)}})
+            actions.append(_host_doc(host_id, host_info.get("hostname"), interval, bucket,
+                                     counts, snapshot_iso, updated_at))
+
+            delta = _diff_counts(counts, previous)
+            actions.append({"update": {"_index": ROLLUP_INDEX, "_id": _fleet_doc_id(interval, bucket),
+                                       "retry_on_conflict": 5}})
+            actions.append({
+                "script": {
+                    "source": FLEET_DELTA_SCRIPT,
+                    "lang": "painless",
+                    "params": dict(delta, host_id=host_id, snapshot_ms=_epoch_ms(snapshot_ts),
+                                   updated_at=updated_at)
+                },
+                "upsert": _fleet_doc(interval, bucket, updated_at),
+                "scripted_upsert": True
+            })
+
+        if not actions:
+            return
+        # Сводка хоста перезаписывается, сводка парка пропускает учтенный снимок: повтор безопасен
+        with retry_safe():
+            response = await opensearch.bulk(body=actions)
+
+        # Два элемента bulk на интервал: сводка хоста и сводка парка. Если хоть один не
+        # записан, предыдущее значение в Redis остается, и следующий снимок считает разницу
+        # от того, что сводка парка действительно получила
+        items = response.get("items", [])
+        state = json.dumps(dict(counts, snapshot_timestamp=snapshot_iso))
+        pipe = redis.pipeline()
+        written = 0
+        for i, (state_key, expires_at) in enumerate(pending):
+            if not all(_bulk_item_ok(item) for item in items[2 * i:2 * i + 2]):
+                continue
+            pipe.hset(state_key, host_id, state)
+            pipe.expireat(state_key, int(expires_at.timestamp()))
+            written += 1
+        if written:
+            await pipe.execute()
+        if written < len(pending):
+            failed = [next(iter(item.values())) for item in items if not _bulk_item_ok(item)]
+            logger.warning(f"Сводки findings хоста {host_id}: не записано {len(pending) - written} "
+                           f"из {len(pending)} интервалов: {failed[0].get('error') if failed else 'нет ответа'}")
+    except Exception as e:
+        logger.error(f"Ошибка обновления сводок findings хоста {host_id}: {e}")
+
+
+def collect_latest_snapshots(
+    latest: Dict[Tuple[str, str, datetime], Dict[str, Any]],
+    snapshots: Iterable[Dict[str, Any]]
+) -> None:
+    """Отбор последнего снимка каждого хоста в каждом интервале"""
+    for snapshot in snapshots:
+        host_info = snapshot.get("host_info") or {}
+        host_id = host_info.get("host_id")
+        if not host_id:
+            continue
+        snapshot_ts = _parse_timestamp(snapshot.get("timestamp"))
+        for interval in INTERVALS:
+            key = (host_id, interval, bucket_start(snapshot_ts, interval))
+            current = latest.get(key)
+            if current is None or current["ts"] <= snapshot_ts:
+                latest[key] = {
+                    "ts": snapshot_ts,
+                    "hostname": host_info.get("hostname"),
+                    "counts": count_findings(snapshot.get("findings"))
+                }
+
+
+def build_rollup_docs(
+    latest: Dict[Tuple[str, str, datetime], Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, str]]]:
+    """
+    Расчет сводок по отобранным снимкам (для пересчета истории).
+
+    Возвращает bulk-действия для индекса сводок и состояние последних значений
+    хостов по интервалам для Redis.
+    """
+    updated_at = datetime.now(timezone.utc).isoformat()
+    fleet: Dict[Tuple[str, datetime], Dict[str, Any]] = {}
+    state: Dict[str, Dict[str, str]] = defaultdict(dict)
+    actions: List[Dict[str, Any]] = []
+
+    for (host_id, interval, bucket), value in latest.items():
+        counts = value["counts"]
+        snapshot_iso = value["ts"].isoformat()
+        actions.append({"index": {"_index": ROLLUP_INDEX, "_id": _host_doc_id(host_id, interval, bucket)}})
+        actions.append(_host_doc(host_id, value["hostname"], interval, bucket, counts, snapshot_iso, updated_at))
+
+        fleet_doc = fleet.setdefault((interval, bucket), _fleet_doc(interval, bucket, updated_at))
+        for level, count in counts["severity"].items():
+            fleet_doc["severity"][level] += count
+        for rule_id, count in counts["rules"].items():
+            fleet_doc["rules"][rule_id] = fleet_doc["rules"].get(rule_id, 0) + count
+        fleet_doc["total"] += counts["total"]
+        fleet_doc["hosts"] += 1
+        fleet_doc["applied"][host_id] = _epoch_ms(value["ts"])
+
+        state_key = f"{LAST_VALUE_PREFIX}{interval}:{bucket.strftime('%Y%m%dT%H')}"
+        state[state_key][host_id] = json.dumps(dict(counts, snapshot_timestamp=snapshot_iso))
+
+    for (interval, bucket), fleet_doc in fleet.items():
+        actions.append({"index": {"_index": ROLLUP_INDEX, "_id": _fleet_doc_id(interval, bucket)}})
+        actions.append(fleet_doc)
+
+    return actions, state
+
+
+async def backfill_findings_rollups(
+    opensearch: AsyncOpenSearch,
+    redis: Optional[aioredis.Redis],
+    days: int = 30,
+    page_size: int = 500,
+    bulk_size: int = 1000
+) -> Dict[str, int]:
+    """
+    Пересчет сводок по уже сохраненным снимкам host_posture за последние days суток.
+
+    Снимки читаются постранично через search_after, только нужные поля;
+    в памяти остается по одному значению на хост и интервал.
+    """
+    await ensure_rollup_index(opensearch)
+
+    search_body: Dict[str, Any] = {
+        "query": {"bool": {"filter": [
+            {"term": {"event_type": "host_posture"}},
+            {"range": {"timestamp": {"gte": f"now-{days}d/d"}}}
+        ]}},
+        "sort": [{"timestamp": {"order": "asc"}}, {"_id": {"order": "asc"}}],
+        "_source": ["host_info.host_id", "host_info.hostname", "timestamp",
+                    "findings.rule_id", "findings.severity"],
+        "size": page_size
+    }
+
+    latest: Dict[Tuple[str, str, datetime], Dict[str, Any]] = {}
+    snapshots_count = 0
+    while True:
+        response = await opensearch.search(index="agent-events-*", body=search_body, ignore_unavailable=True)
+        hits = response["hits"]["hits"]
+        if not hits:
+            break
+        collect_latest_snapshots(latest, (hit["_source"] for hit in hits))
+        snapshots_count += len(hits)
+        search_body["search_after"] = hits[-1]["sort"]
+
+    actions, state = build_rollup_docs(latest)
+    for start in range(0, len(actions), bulk_size * 2):
+        await opensearch.bulk(body=actions[start:start + bulk_size * 2])
+
+    # Последние значения нужны только для интервалов, которые ещё обновляются
+    if redis is not None:
+        now = datetime.now(timezone.utc)
+        for state_key, values in state.items():
+            interval, bucket_id = state_key[len(LAST_VALUE_PREFIX):].split(":", 1)
+            bucket = datetime.strptime(bucket_id, "%Y%m%dT%H").replace(tzinfo=timezone.utc)
+            expires_at = bucket + INTERVALS[interval] + LATE_EVENTS_WINDOW
+            if expires_at > now:
+                pipe = redis.pipeline()
+                pipe.delete(state_key)
+                pipe.hset(state_key, mapping=values)
+                pipe.expireat(state_key, int(expires_at.timestamp()))
+                await pipe.execute()
+
+    result = {"snapshots": snapshots_count, "rollup_docs": len(actions) // 2}
+    logger.info(f"Пересчет сводок findings завершен: {result}")
+    return result
+
+
+async def get_findings_trend(
+    opensearch: AsyncOpenSearch,
+    host_id: Optional[str],
+    interval: str,
+    days: int,
+    include_rules: bool = False
+) -> Dict[str, Any]:
+    """Чтение ряда сводок хоста или всего парка"""
+    filters: List[Dict[str, Any]] = [
+        {"term": {"interval": interval}},
+        {"range": {"bucket": {"gte": f"now-{days}d/d"}}}
+    ]
+    if host_id:
+        filters += [{"term": {"scope": "host"}}, {"term": {"host_id": host_id}}]
+    else:
+        filters.append({"term": {"scope": "fleet"}})
+
+    # Окно now-Nd/d начинается с полуночи и захватывает N+1 календарных суток
+    buckets = (days + 1) * int(timedelta(days=1) / INTERVALS[interval])
+
+    source = ["bucket", "severity", "total", "hosts"]
+    if include_rules:
+        source.append("rules")
+
+    response = await opensearch.search(
+        index=ROLLUP_INDEX,
+        body={
+            "query": {"bool": {"filter": filters}},
+            # При упоре в лимит отбрасываются самые старые точки, а не свежие
+            "sort": [{"bucket": {"order": "desc"}}],
+            "_source": source,
+            "size": min(buckets, 10000)
+        },
+        ignore_unavailable=True
+    )
+    points = [hit["_source"] for hit in reversed(response["hits"]["hits"])]
+
+    return {
+        "scope": "host" if host_id else "fleet",
+        "host_id": host_id,
+        "interval": interval,
+        "points": points
+    }
+
+
+async def _main() -> None:
+    parser = argparse.ArgumentParser(description="Пересчет сводок findings по сохраненным снимкам host_posture")
+    parser.add_argument("--days", type=int, default=30, help="Глубина пересчета в сутках")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    opensearch = AsyncOpenSearch([os.getenv("OPENSEARCH_URL", "http://localhost:9200")])
+    redis = aioredis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379"))
+    try:
+        await backfill_findings_rollups(opensearch, redis, days=args.days)
+    finally:
+        await opensearch.close()
+        await redis.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
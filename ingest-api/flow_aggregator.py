@@ -0,0 +1,322 @@
+"""
+Агрегированные сетевые потоки (индекс network-flows).
+
+События network_connection не сохраняются по одному документу на
+соединение: /ingest складывает их в FlowAggregator (shared/flows.py) -
+окна фиксированной длины FLOW_WINDOW_SECONDS по ключу (хост, источник,
+назначение, порт назначения, протокол) с суммами соединений и байт. Закрытые
+окна периодически сбрасываются в индекс network-flows одним bulk-запросом.
+
+Документ потока обновляется скриптом, который прибавляет счетчики к уже
+сохраненным: одно окно могут сбрасывать несколько воркеров, а опоздавшие
+события - прийти после сброса окна. Количество различных портов источника
+при сложении частей берется по максимуму (нижняя оценка). Каждая часть
+имеет part_id (FlowRecord.part_id), который скрипт запоминает в поле parts:
+повтор той же части (ответ bulk потерян, запись вернулась в агрегатор) не
+прибавляется второй раз, поэтому bulk повторяется безопасно.
+
+Сырое событие сохраняется в agent-events-* только для помеченных потоков
+(совпадение IOC, адрес из списка угроз, severity high/critical) и для доли
+FLOW_RAW_SAMPLE_RATE потоков; в нем поле flow.flow_id ссылается на документ
+потока. Запросы top talkers и поиск потоков читают network-flows.
+
+Открытые окна находятся в памяти воркера: до сброса (конец окна +
+FLOW_ALLOWED_LATENESS_SECONDS + период сброса) поток в индексе не виден.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import redis.asyncio as aioredis
+from opensearchpy import AsyncOpenSearch
+
+from shared.flows import FlowAggregator, FlowRecord
+from shared.resilience import retry_safe
+
+logger = logging.getLogger(__name__)
+
+FLOW_INDEX = "network-flows"
+
+# Ключи принятых в агрегат событий: повтор того же event_id не считается дважды
+SEEN_PREFIX = "flows:seen:"
+SEEN_TTL_SECONDS = 24 * 3600
+
+FLUSH_BULK_SIZE = 1000
+
+# Поля группировки и метрики top talkers
+TOP_TALKER_FIELDS = ("source_ip", "destination_ip", "host_id", "destination_port", "protocol")
+TOP_TALKER_METRICS = ("bytes_total", "bytes_sent", "bytes_received", "connections")
+
+FLOW_INDEX_BODY = {
+    "mappings": {
+        "properties": {
+            "flow_id": {"type": "keyword"},
+            "window_start": {"type": "date"},
+            "window_end": {"type": "date"},
+            "window_seconds": {"type": "integer"},
+            "host_id": {"type": "keyword"},
+            "hostname": {"type": "keyword"},
+            "source_ip": {"type": "ip"},
+            "destination_ip": {"type": "ip"},
+            "destination_port": {"type": "integer"},
+            "protocol": {"type": "keyword"},
+            "connections": {"type": "long"},
+            "bytes_sent": {"type": "long"},
+            "bytes_received": {"type": "long"},
+            "bytes_total": {"type": "long"},
+            "source_ports": {"type": "integer"},
+            "processes": {"type": "keyword"},
+            "first_seen": {"type": "date"},
+            "last_seen": {"type": "date"},
+            "flagged": {"type": "boolean"},
+            "flags": {"type": "keyword"},
+            "sampled": {"type": "boolean"},
+            "raw_events": {"type": "integer"},
+            "direction": {"type": "keyword"},
+            "source_ip_classes": {"type": "keyword"},
+            "destination_ip_classes": {"type": "keyword"},
+            "parts": {"type": "keyword", "index": False, "doc_values": False}
+        }
+    }
+}
+
+# Painless-скрипт: прибавляет часть окна к сохраненному документу потока,
+# если эта часть (params.parts[0]) еще не прибавлена
+FLOW_MERGE_SCRIPT = """
+def s = ctx._source;
+if (s.parts == null) { s.parts = []; }
+if (s.parts.contains(params.parts[0])) {
+  ctx.op = 'none';
+} else {
+  s.parts.add(params.parts[0]);
+  s.connections += params.connections;
+  s.bytes_sent += params.bytes_sent;
+  s.bytes_received += params.bytes_received;
+  s.bytes_total += params.bytes_total;
+  s.raw_events += params.raw_events;
+  s.source_ports = Math.max(s.source_ports, params.source_ports);
+  if (params.first_seen.compareTo(s.first_seen) < 0) { s.first_seen = params.first_seen; }
+  if (params.last_seen.compareTo(s.last_seen) > 0) { s.last_seen = params.last_seen; }
+  for (p in params.processes) { if (s.processes.size() < 16 && !s.processes.contains(p)) { s.processes.add(p); } }
+  for (f in params.flags) { if (!s.flags.contains(f)) { s.flags.add(f); } }
+  s.flagged = s.flagged || params.flagged;
+  s.sampled = s.sampled || params.sampled;
+}
+"""
+
+
+async def ensure_flow_index(opensearch: AsyncOpenSearch) -> None:
+    """Создание индекса потоков, если его ещё нет; в существующий добавляется поле parts"""
+    try:
+        if not await opensearch.indices.exists(index=FLOW_INDEX):
+            await opensearch.indices.create(index=FLOW_INDEX, body=FLOW_INDEX_BODY)
+            logger.info(f"Создан индекс {FLOW_INDEX}")
+        else:
+            parts = FLOW_INDEX_BODY["mappings"]["properties"]["parts"]
+            await opensearch.indices.put_mapping(index=FLOW_INDEX, body={"properties": {"parts": parts}})
+    except Exception as e:
+        logger.warning(f"Не удалось создать индекс {FLOW_INDEX}: {e}")
+
+
+async def claim_flow_event(redis: aioredis.Redis, event_id: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """
+    Отметка события, учтенного в потоке. Возвращает (новое, отметка потока):
+    (True, None) - событие еще не учтено; (False, None) - учтено и обработано
+    (повторная отправка агентом); (False, отметка) - учтено, но сырое событие
+    не сохранено (release_flow_event): повтор сохраняет его с той же отметкой,
+    не прибавляя соединение к потоку второй раз.
+    """
+    key = f"{SEEN_PREFIX}{event_id}"
+    if await redis.set(key, 1, ex=SEEN_TTL_SECONDS, nx=True):
+        return True, None
+    raw = await redis.get(key)
+    if raw is None or raw in (b"1", "1"):
+        return False, None
+    return False, json.loads(raw)
+
+
+async def release_flow_event(redis: aioredis.Redis, event_id: str, flow: Optional[Dict[str, Any]]) -> None:
+    """
+    Отметка учтенного события, сырое событие которого не сохранено: повтор
+    агента не считается дубликатом и сохраняет событие. Без отметки потока
+    (событие не попало в поток) отметка снимается.
+    """
+    try:
+        if flow is None:
+            await redis.delete(f"{SEEN_PREFIX}{event_id}")
+        else:
+            await redis.set(f"{SEEN_PREFIX}{event_id}", json.dumps(flow), ex=SEEN_TTL_SECONDS)
+    except Exception as e:
+        logger.error(f"Не удалось отметить несохраненное событие {event_id}, повтор будет отброшен: {e}")
+
+
+async def complete_flow_event(redis: aioredis.Redis, event_id: str) -> None:
+    """Сырое событие, сохраненное повтором, больше не нужно сохранять"""
+    await redis.set(f"{SEEN_PREFIX}{event_id}", 1, ex=SEEN_TTL_SECONDS)
+
+
+def flow_actions(records: List[FlowRecord]) -> List[Dict[str, Any]]:
+    """Действия bulk: скриптовый upsert документа каждого окна"""
+    actions: List[Dict[str, Any]] = []
+    for record in records:
+        doc = record.to_doc()
+        doc["parts"] = [record.part_id]
+        actions.append({"update": {"_index": FLOW_INDEX, "_id": doc["flow_id"], "retry_on_conflict": 5}})
+        actions.append({
+            "script": {"source": FLOW_MERGE_SCRIPT, "lang": "painless", "params": doc},
+            "upsert": doc,
+        })
+    return actions
+
+
+def failed_records(records: List[FlowRecord], response: Dict[str, Any]) -> List[FlowRecord]:
+    """Записи пачки, чьи элементы bulk завершились ошибкой"""
+    if not response.get("errors"):
+        return []
+    return [record for record, item in zip(records, response["items"])
+            if item["update"].get("error") or item["update"].get("status", 200) >= 300]
+
+
+async def flush_flows(aggregator: FlowAggregator, opensearch: Optional[AsyncOpenSearch], force: bool = False) -> int:
+    """
+    Сброс закрытых окон (всех при force); возвращает число записанных. Не
+    записанные окна (OpenSearch недоступен, ошибка bulk или элемента)
+    возвращаются в агрегатор и уходят при следующем сбросе.
+    """
+    records = aggregator.drain(force=force)
+    if not records:
+        return 0
+    if opensearch is None:
+        dropped = aggregator.restore(records)
+        if dropped:
+            logger.error(f"OpenSearch недоступен, потерян {dropped} потоков сверх FLOW_MAX_PENDING")
+        return 0
+    failed: List[FlowRecord] = []
+    for start in range(0, len(records), FLUSH_BULK_SIZE):
+        chunk = records[start:start + FLUSH_BULK_SIZE]
+        try:
+            # Повтор части не прибавляется дважды (FLOW_MERGE_SCRIPT)
+            with retry_safe():
+                response = await opensearch.bulk(body=flow_actions(chunk))
+        except asyncio.CancelledError:
+            aggregator.restore(failed + records[start:])
+            raise
+        except Exception as e:
+            # Прежние пачки записаны; эта могла быть записана - ее part_id не даст прибавить ее дважды
+            unwritten = failed + records[start:]
+            dropped = aggregator.restore(unwritten)
+            logger.error(f"Ошибка записи потоков ({len(unwritten)} из {len(records)}, потеряно {dropped}): {e}")
+            return len(records) - len(unwritten)
+        failed += failed_records(chunk, response)
+    if failed:
+        dropped = aggregator.restore(failed)
+        logger.error(f"Не записано {len(failed)} из {len(records)} потоков в {FLOW_INDEX}, "
+                     f"повтор при следующем сбросе (потеряно {dropped})")
+    return len(records) - len(failed)
+
+
+async def run_flow_flush_loop(
+    aggregator: FlowAggregator,
+    get_client: Callable[[], Optional[AsyncOpenSearch]],
+    interval: float
+) -> None:
+    """Периодический сброс закрытых окон; переполненный агрегатор сбрасывается целиком"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush_flows(aggregator, get_client(), force=aggregator.overflowing)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка сброса сетевых потоков: {e}")
+
+
+def _flow_filters(
+    hours: int,
+    host_id: Optional[str] = None,
+    ip: Optional[str] = None,
+    port: Optional[int] = None,
+    flagged_only: bool = False
+) -> List[Dict[str, Any]]:
+    filters: List[Dict[str, Any]] = [{"range": {"window_start": {"gte": f"now-{hours}h"}}}]
+    if host_id:
+        filters.append({"term": {"host_id": host_id}})
+    if ip:
+        filters.append({"bool": {"should": [{"term": {"source_ip": ip}}, {"term": {"destination_ip": ip}}],
+                                 "minimum_should_match": 1}})
+    if port is not None:
+        filters.append({"term": {"destination_port": port}})
+    if flagged_only:
+        filters.append({"term": {"flagged": True}})
+    return filters
+
+
+async def get_top_talkers(
+    opensearch: AsyncOpenSearch,
+    by: str,
+    metric: str,
+    hours: int,
+    host_id: Optional[str] = None,
+    flagged_only: bool = False,
+    limit: int = 10
+) -> Dict[str, Any]:
+    """Наибольшие значения метрики по полю группировки за последние hours часов"""
+    sums = {name: {"sum": {"field": name}} for name in dict.fromkeys((metric, "bytes_total", "connections"))}
+    response = await opensearch.search(
+        index=FLOW_INDEX,
+        body={
+            "query": {"bool": {"filter": _flow_filters(hours, host_id, flagged_only=flagged_only)}},
+            "size": 0,
+            "aggs": {
+                "talkers": {
+                    "terms": {"field": by, "size": limit, "order": {metric: "desc"}},
+                    "aggs": sums
+                }
+            }
+        },
+        ignore_unavailable=True
+    )
+    buckets = response.get("aggregations", {}).get("talkers", {}).get("buckets", [])
+    return {
+        "by": by,
+        "metric": metric,
+        "hours": hours,
+        "host_id": host_id,
+        "talkers": [
+            {
+                "key": bucket["key"],
+                metric: int(bucket[metric]["value"]),
+                "bytes_total": int(bucket["bytes_total"]["value"]),
+                "connections": int(bucket["connections"]["value"]),
+                "flows": bucket["doc_count"],
+            }
+            for bucket in buckets
+        ]
+    }
+
+
+async def search_flows(
+    opensearch: AsyncOpenSearch,
+    hours: int,
+    host_id: Optional[str] = None,
+    ip: Optional[str] = None,
+    port: Optional[int] = None,
+    flagged_only: bool = False,
+    size: int = 100
+) -> Dict[str, Any]:
+    """Окна потоков по хосту, адресу и порту, новые первыми"""
+    response = await opensearch.search(
+        index=FLOW_INDEX,
+        body={
+            "query": {"bool": {"filter": _flow_filters(hours, host_id, ip, port, flagged_only)}},
+            "sort": [{"window_start": {"order": "desc"}}, {"bytes_total": {"order": "desc"}}],
+            "size": size
+        },
+        ignore_unavailable=True
+    )
+    return {
+        "total": response["hits"]["total"]["value"],
+        "flows": [hit["_source"] for hit in response["hits"]["hits"]]
+    }
@@ -0,0 +1,401 @@
+"""
+Плоский индекс инвентаря хостов.
+
+Каждая запись инвентаря последнего снимка host_posture (процесс, автозапуск
+из реестра, папка автозагрузки, служба, запланированная задача) хранится
+отдельным документом в индексе host-inventory. Это позволяет отвечать на
+вопросы вида «на каких хостах запущен evil.exe» одним term-запросом вместо
+просмотра вложенных списков в каждом снимке.
+
+Индекс поддерживается инкрементально: в Redis для каждого хоста хранится
+хеш ID записи -> дайджест ее содержимого (счетчик, хеш файла, пользователь и
+т.д.), и при новом снимке в OpenSearch отправляются только новые и
+изменившиеся записи и удаление исчезнувших. snapshot_event_id и
+snapshot_timestamp записи - снимок, в котором запись появилась в нынешнем
+виде. Состояние в Redis обновляется только по успешно записанным элементам
+bulk, поэтому незаписанные повторяются со следующим снимком.
+"""
+
+import hashlib
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis.asyncio as aioredis
+from opensearchpy import AsyncOpenSearch
+
+from shared.resilience import retry_safe
+
+logger = logging.getLogger(__name__)
+
+INVENTORY_INDEX = "host-inventory"
+
+# Типы записей инвентаря
+INVENTORY_KINDS = ("process", "registry", "startup", "service", "task")
+
+# Ключи Redis
+ENTRIES_PREFIX = "inventory:entries:"
+SNAPSHOT_KEY = "inventory:snapshot"
+
+# Поля записи, от которых зависит дайджест
+DIGEST_FIELDS = ("kind", "name", "path", "cmdline", "hash", "user", "location", "count", "hostname")
+
+# Предел длины cmdline в keyword-поле (ignore_above): длиннее - только trigram
+CMDLINE_KEYWORD_LIMIT = 8191
+
+INVENTORY_INDEX_BODY = {
+    "settings": {
+        "analysis": {
+            "normalizer": {
+                "lowercase": {"type": "custom", "filter": ["lowercase"]}
+            },
+            "tokenizer": {
+                "trigram": {"type": "ngram", "min_gram": 3, "max_gram": 3}
+            },
+            "analyzer": {
+                "trigram": {
+                    "type": "custom",
+                    "tokenizer": "trigram",
+                    "filter": ["lowercase"]
+                }
+            }
+        }
+    },
+    "mappings": {
+        "properties": {
+            "host_id": {"type": "keyword"},
+            "hostname": {"type": "keyword"},
+            "kind": {"type": "keyword"},
+            "name": {"type": "keyword", "normalizer": "lowercase"},
+            "path": {"type": "keyword", "normalizer": "lowercase"},
+            "cmdline": {
+                "type": "keyword",
+                "normalizer": "lowercase",
+                "ignore_above": CMDLINE_KEYWORD_LIMIT,
+                "fields": {"trigram": {"type": "text", "analyzer": "trigram"}}
+            },
+            "hash": {"type": "keyword", "normalizer": "lowercase"},
+            "user": {"type": "keyword", "normalizer": "lowercase"},
+            "location": {"type": "keyword"},
+            "count": {"type": "integer"},
+            "snapshot_event_id": {"type": "keyword"},
+            "snapshot_timestamp": {"type": "date"},
+            "indexed_at": {"type": "date"}
+        }
+    }
+}
+
+
+async def ensure_inventory_index(opensearch: AsyncOpenSearch) -> None:
+    """Создание индекса инвентаря с маппингом, если его ещё нет"""
+    try:
+        if not await opensearch.indices.exists(index=INVENTORY_INDEX):
+            await opensearch.indices.create(index=INVENTORY_INDEX, body=INVENTORY_INDEX_BODY)
+            logger.info(f"Создан индекс {INVENTORY_INDEX}")
+    except Exception as e:
+        logger.warning(f"Не удалось создать индекс {INVENTORY_INDEX}: {e}")
+
+
+def _entry_id(host_id: str, kind: str, *identity: Optional[str]) -> str:
+    """Стабильный ID записи: одна и та же запись на хосте всегда получает один ID"""
+    raw = "\x1f".join([host_id, kind] + [(part or "").lower() for part in identity])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _make_entry(kind: str, name=None, path=None, cmdline=None, file_hash=None,
+                user=None, location=None) -> Dict[str, Any]:
+    return {
+        "kind": kind,
+        "name": name or None,
+        "path": path or None,
+        "cmdline": cmdline or None,
+        "hash": file_hash or None,
+        "user": user or None,
+        "location": location or None,
+    }
+
+
+def flatten_inventory(host_id: str, inventory: Optional[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Разворачивание вложенного инвентаря снимка в плоские записи.
+
+    Возвращает словарь {entry_id: запись}. Одинаковые процессы (например,
+    несколько svchost.exe с одной командной строкой) схлопываются в одну
+    запись со счётчиком count.
+    """
+    entries: Dict[str, Dict[str, Any]] = {}
+    if not inventory:
+        return entries
+
+    def add(entry_id: str, entry: Dict[str, Any]) -> None:
+        existing = entries.get(entry_id)
+        if existing:
+            existing["count"] += 1
+        else:
+            entry["count"] = 1
+            entries[entry_id] = entry
+
+    for proc in inventory.get("processes") or []:
+        if not (proc.get("name") or proc.get("exe_path")):
+            continue
+        add(
+            _entry_id(host_id, "process", proc.get("name"), proc.get("exe_path"), proc.get("cmdline")),
+            _make_entry("process", name=proc.get("name"), path=proc.get("exe_path"),
+                        cmdline=proc.get("cmdline"), file_hash=proc.get("sha256"),
+                        user=proc.get("username"))
+        )
+
+    autoruns = inventory.get("autoruns") or {}
+
+    for item in autoruns.get("registry") or []:
+        location = "\\".join(p for p in (item.get("root"), item.get("path")) if p)
+        add(
+            _entry_id(host_id, "registry", location, item.get("name"), item.get("value")),
+            _make_entry("registry", name=item.get("name"), cmdline=item.get("value"),
+                        location=location)
+        )
+
+    for item in autoruns.get("startup_folders") or []:
+        add(
+            _entry_id(host_id, "startup", item.get("location"), item.get("file"), item.get("target")),
+            _make_entry("startup", name=item.get("file"), path=item.get("target"),
+                        location=item.get("location"))
+        )
+
+    for item in autoruns.get("services_auto") or []:
+        add(
+            _entry_id(host_id, "service", item.get("name"), item.get("path")),
+            _make_entry("service", name=item.get("name"), cmdline=item.get("path"),
+                        location=item.get("start_mode"))
+        )
+
+    for item in autoruns.get("scheduled_tasks") or []:
+        add(
+            _entry_id(host_id, "task", item.get("task_name"), item.get("action")),
+            _make_entry("task", name=item.get("task_name"), cmdline=item.get("action"),
+                        user=item.get("run_as"))
+        )
+
+    return entries
+
+
+def entry_digest(entry: Dict[str, Any]) -> str:
+    """Дайджест содержимого записи: изменение любого поля DIGEST_FIELDS переписывает документ"""
+    raw = "\x1f".join(str(entry.get(field) or "") for field in DIGEST_FIELDS)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _bulk_failures(response: Dict[str, Any]) -> set:
+    """ID элементов bulk, которые не записаны (удаление отсутствующего документа - не ошибка)"""
+    if not response.get("errors"):
+        return set()
+    failed = set()
+    for item in response.get("items", []):
+        kind, result = next(iter(item.items()))
+        if result.get("error") or (result.get("status", 200) >= 300 and not (kind == "delete" and result.get("status") == 404)):
+            failed.add(result.get("_id"))
+    return failed
+
+
+def _snapshot_time(timestamp: str) -> Optional[datetime]:
+    """Время снимка для сравнения порядка (смещения в строках бывают разными)"""
+    try:
+        dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+async def _is_latest_snapshot(redis: aioredis.Redis, host_id: str, timestamp: str) -> bool:
+    """Проверка, что снимок не старше уже учтённого (события могут приходить не по порядку)"""
+    previous = await redis.hget(SNAPSHOT_KEY, host_id)
+    previous_time = _snapshot_time(previous.decode()) if previous is not None else None
+    if previous_time is None:
+        return True
+    current = _snapshot_time(timestamp)
+    return current is not None and current >= previous_time
+
+
+async def _mark_snapshot(redis: aioredis.Redis, host_id: str, timestamp: str) -> None:
+    """
+    Отметка учтённого снимка. Ставится после записи: снимок, запись
+    которого не удалась, при повторе не считается устаревшим.
+    """
+    if await _is_latest_snapshot(redis, host_id, timestamp):
+        await redis.hset(SNAPSHOT_KEY, host_id, timestamp)
+
+
+async def sync_host_inventory(
+    opensearch: AsyncOpenSearch,
+    redis: aioredis.Redis,
+    event_data: Dict[str, Any]
+) -> Tuple[int, int]:
+    """
+    Синхронизация плоского индекса с новым снимком host_posture.
+
+    Отправляет в OpenSearch только новые и изменившиеся записи и удаление
+    исчезнувших. Возвращает (записано, удалено).
+    """
+    host_info = event_data.get("host_info") or {}
+    host_id = host_info.get("host_id")
+    timestamp = event_data.get("timestamp") or ""
+    snapshot_event_id = event_data.get("event_id")
+    if not host_id:
+        return 0, 0
+
+    try:
+        if not await _is_latest_snapshot(redis, host_id, timestamp):
+            logger.debug("Снимок %s хоста %s устарел, индекс инвентаря не обновляется", snapshot_event_id, host_id)
+            return 0, 0
+
+        entries = flatten_inventory(host_id, event_data.get("inventory"))
+        entries_key = f"{ENTRIES_PREFIX}{host_id}"
+        known = {k.decode(): v.decode() for k, v in (await redis.hgetall(entries_key)).items()}
+        digests = {}
+        for entry_id, entry in entries.items():
+            entry["hostname"] = host_info.get("hostname")
+            digests[entry_id] = entry_digest(entry)
+
+        written = {entry_id: digest for entry_id, digest in digests.items() if known.get(entry_id) != digest}
+        removed = [entry_id for entry_id in known if entry_id not in entries]
+        if not written and not removed:
+            await _mark_snapshot(redis, host_id, timestamp)
+            return 0, 0
+
+        indexed_at = datetime.now(timezone.utc).isoformat()
+        actions: List[Dict[str, Any]] = []
+        for entry_id in written:
+            doc = entries[entry_id]
+            doc.update({
+                "host_id": host_id,
+                "snapshot_event_id": snapshot_event_id,
+                "snapshot_timestamp": timestamp,
+                "indexed_at": indexed_at,
+            })
+            actions.append({"index": {"_index": INVENTORY_INDEX, "_id": entry_id}})
+            actions.append(doc)
+        for entry_id in removed:
+            actions.append({"delete": {"_index": INVENTORY_INDEX, "_id": entry_id}})
+
+        # Только index/delete с явными ID: повтор безопасен
+        with retry_safe():
+            response = await opensearch.bulk(body=actions, refresh=False)
+        failed = _bulk_failures(response)
+        if failed:
+            logger.warning(f"Индекс инвентаря хоста {host_id}: не записано {len(failed)} записей, "
+                           f"они будут отправлены со следующим снимком")
+
+        # Первый снимок после потери состояния в Redis: удаляем записи,
+        # которые могли остаться от предыдущих снимков
+        if not known:
+            await opensearch.delete_by_query(
+                index=INVENTORY_INDEX,
+                body={"query": {"bool": {
+                    "filter": [{"term": {"host_id": host_id}}],
+                    "must_not": [{"ids": {"values": list(entries)}}]
+                }}},
+                conflicts="proceed",
+                ignore_unavailable=True
+            )
+
+        # Незаписанная запись остается в Redis с прежним дайджестом (или без него) и
+        # отправляется повторно; неудаленная - остается в хеше и удаляется повторно
+        written = {entry_id: digest for entry_id, digest in written.items() if entry_id not in failed}
+        removed = [entry_id for entry_id in removed if entry_id not in failed]
+        pipe = redis.pipeline()
+        if removed:
+            pipe.hdel(entries_key, *removed)
+        if written:
+            pipe.hset(entries_key, mapping=written)
+        await pipe.execute()
+        await _mark_snapshot(redis, host_id, timestamp)
+
+        logger.debug("Индекс инвентаря хоста %s: +%s / -%s", host_id, len(written), len(removed))
+        return len(written), len(removed)
+    except Exception as e:
+        logger.error(f"Ошибка обновления индекса инвентаря хоста {host_id}: {e}")
+        return 0, 0
+
+
+def escape_wildcard(value: str) -> str:
+    """Экранирование метасимволов wildcard: * и ? из запроса ищутся буквально"""
+    return value.replace("\\", "\\\\").replace("*", "\\*").replace("?", "\\?")
+
+
+def build_inventory_query(
+    kind: Optional[str] = None,
+    name: Optional[str] = None,
+    path: Optional[str] = None,
+    cmdline: Optional[str] = None,
+    hash: Optional[str] = None
+) -> Dict[str, Any]:
+    """Построение запроса к плоскому индексу по имени, пути, подстроке командной строки или хешу"""
+    filters: List[Dict[str, Any]] = []
+    if kind:
+        filters.append({"term": {"kind": kind}})
+    if name:
+        filters.append({"term": {"name": name}})
+    if path:
+        filters.append({"term": {"path": path}})
+    if hash:
+        filters.append({"term": {"hash": hash}})
+    if cmdline:
+        wildcard = {"wildcard": {"cmdline": {"value": f"*{escape_wildcard(cmdline)}*", "case_insensitive": True}}}
+        if len(cmdline) >= 3:
+            # Триграммы сужают кандидатов, wildcard по keyword подтверждает подстроку.
+            # Командные строки длиннее CMDLINE_KEYWORD_LIMIT в keyword не попадают
+            # (поле в _ignored): для них подстроку подтверждает фраза из триграмм
+            filters.append({"match_phrase": {"cmdline.trigram": cmdline}})
+            filters.append({"bool": {"should": [wildcard, {"term": {"_ignored": "cmdline"}}],
+                                     "minimum_should_match": 1}})
+        else:
+            filters.append(wildcard)
+    return {"bool": {"filter": filters}} if filters else {"match_all": {}}
+
+
+async def search_inventory_hosts(
+    opensearch: AsyncOpenSearch,
+    query: Dict[str, Any],
+    limit: int = 100,
+    matches_per_host: int = 5
+) -> Dict[str, Any]:
+    """Поиск хостов, у которых есть подходящие записи инвентаря"""
+    body = {
+        "query": query,
+        "size": 0,
+        "track_total_hits": True,
+        "aggs": {
+            "hosts": {
+                "terms": {"field": "host_id", "size": limit},
+                "aggs": {
+                    "matches": {
+                        "top_hits": {
+                            "size": matches_per_host,
+                            "_source": ["hostname", "kind", "name", "path", "cmdline",
+                                        "hash", "user", "location", "count",
+                                        "snapshot_timestamp"]
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+    response = await opensearch.search(index=INVENTORY_INDEX, body=body, ignore_unavailable=True)
+
+    hosts = []
+    for bucket in response.get("aggregations", {}).get("hosts", {}).get("buckets", []):
+        matches = [hit["_source"] for hit in bucket["matches"]["hits"]["hits"]]
+        hosts.append({
+            "host_id": bucket["key"],
+            "hostname": matches[0].get("hostname") if matches else bucket["key"],
+            "match_count": bucket["doc_count"],
+            "matches": matches
+        })
+
+    return {
+        "hosts": hosts,
+        "total_hosts": len(hosts),
+        "total_entries": response["hits"]["total"]["value"],
+        "took_ms": response.get("took")
+    }
@@ -10,25 +10,175 @@ import json
 import logging
 import os
 import random
+import sys
 import time
 import uuid
 from datetime import datetime, timezone
 from typing import List, Optional, Dict, Any
 
 import redis.asyncio as aioredis
-from fastapi import FastAPI, HTTPException, Depends, Request, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, BackgroundTasks
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from opensearchpy import AsyncOpenSearch, RequestError
+from fastapi.responses import JSONResponse, PlainTextResponse
+from opensearchpy import AsyncOpenSearch, NotFoundError, RequestError
+from opensearchpy.exceptions import ConnectionError as OpenSearchConnectionError, TransportError
+from redis import exceptions as redis_exceptions
 from pydantic import BaseModel, Field, validator
 import uvicorn
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Общий пакет shared лежит рядом с ingest-api (в контейнере - внутри /app)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.resilience import (
+    ResilienceError,
+    CircuitOpenError,
+    ResiliencePolicy,
+    ResilientClient,
+    retry_safe,
+    start_deadline,
 )
+from shared.masking import get_default_masker
+from shared.ioc import IocIndex, IocMatcherHolder
+from shared.reputation import ListFileProvider
+from shared.posture_rules import PostureRule, PostureRuleError
+from shared.flows import FlowAggregator
+from shared.schemas import VulnScanResult
+from shared.log_manager import (
+    configure_logging,
+    shutdown_logging,
+    get_hot_logger,
+    get_logging_stats,
+    LazyJSON,
+)
+
+from inventory_index import (
+    ensure_inventory_index,
+    sync_host_inventory,
+    build_inventory_query,
+    search_inventory_hosts,
+    INVENTORY_KINDS,
+)
+from process_tree import (
+    MAX_DESCENDANTS,
+    ensure_process_tree_index,
+    record_process_event,
+    sync_host_processes,
+    resolve_process_key,
+    get_process,
+    get_ancestry,
+    get_descendants,
+    build_subtree,
+)
+from report_scheduler import ReportScheduler
+from posture_sections import (
+    POSTURE_SECTIONS,
+    fill_unchanged_sections,
+    invalid_sections,
+    record_section_hashes,
+    sections_needed,
+)
+from flow_aggregator import (
+    TOP_TALKER_FIELDS,
+    TOP_TALKER_METRICS,
+    ensure_flow_index,
+    claim_flow_event,
+    complete_flow_event,
+    release_flow_event,
+    flush_flows,
+    run_flow_flush_loop,
+    get_top_talkers,
+    search_flows,
+)
+from vuln_index import (
+    ensure_vuln_index,
+    sync_vulnerabilities,
+    host_needs_registration,
+    register_host,
+    get_host_vulnerabilities,
+    get_cve_exposure,
+    get_fleet_exposure,
+)
+from findings_rollup import (
+    ensure_rollup_index,
+    update_findings_rollups,
+    backfill_findings_rollups,
+    get_findings_trend,
+    INTERVALS as ROLLUP_INTERVALS,
+)
+from event_locator import (
+    record_event_location,
+    record_event_locations,
+    locate_event,
+    locate_events,
+    forget_events,
+    EVENT_INDEX_PATTERNS,
+)
+from metrics import (
+    REGISTRY,
+    PROMETHEUS_CONTENT_TYPE,
+    INGEST_STAGE_SECONDS,
+    INGEST_EVENTS_TOTAL,
+    HTTP_REQUESTS_IN_FLIGHT,
+    HTTP_REQUEST_SECONDS,
+    BACKEND_POOL_CONNECTIONS,
+    STREAM_LENGTH,
+    LOG_RECORDS,
+    BACKEND_RESILIENCE_EVENTS,
+    BACKEND_CIRCUIT_STATE,
+    BACKEND_CALLS_IN_FLIGHT,
+    IOC_MATCHES,
+    REPUTATION_VERDICTS,
+    REPORT_SCHEDULE_INTERVAL,
+    REPORT_SCHEDULE_LOAD,
+    POSTURE_SECTIONS_TOTAL,
+    IOC_INDICATORS,
+)
+from profiling import RequestProfiler, instrument_opensearch
+from opensearch_tracing import (
+    QueryCostTracker,
+    TracedOpenSearch,
+    TracedAIOHttpConnection,
+    bind_request_scope,
+)
+from enrichment import (
+    build_ip_classifier,
+    annotate_ip_classes,
+    annotate_ioc_matches,
+    annotate_reputation,
+    build_reputation_cache,
+    event_file_hashes,
+    collect_indicators,
+    fetch_threat_intel,
+)
+from posture_evaluator import (
+    FINDINGS_INDEX as POSTURE_FINDINGS_INDEX,
+    RULES_KEY as POSTURE_RULES_KEY,
+    RULES_VERSION_KEY as POSTURE_RULES_VERSION_KEY,
+    STATS_KEY as POSTURE_STATS_KEY,
+)
+from connections import ConnectionSupervisor, build_opensearch_client, build_redis_client
+from workers import (
+    WORKERS,
+    WORKER_ID,
+    BOOTSTRAPPED,
+    OPENSEARCH_POOL_PER_WORKER,
+    REDIS_POOL_PER_WORKER,
+    worker_info,
+    collect_worker_snapshots,
+    run_worker_heartbeat,
+    unregister_worker,
+)
+
+# Настройка логирования: записи уходят в очередь, форматирование и вывод - в фоновом потоке
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Сообщения на каждое событие: доля выводимых и предел в секунду
+LOG_HOT_SAMPLE_RATE = float(os.getenv("LOG_HOT_SAMPLE_RATE", "1.0"))
+LOG_HOT_MAX_PER_SECOND = float(os.getenv("LOG_HOT_MAX_PER_SECOND", "50"))
+
+configure_logging(level=LOG_LEVEL, json_format=LOG_FORMAT == "json")
 logger = logging.getLogger(__name__)
+hot_logger = get_hot_logger(__name__, sample_rate=LOG_HOT_SAMPLE_RATE, max_per_second=LOG_HOT_MAX_PER_SECOND)
 
 # Конфигурация
 OPENSEARCH_URL = os.getenv("OPENSEARCH_URL", "http://localhost:9200")
@@ -36,6 +186,108 @@ REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 API_HOST = os.getenv("API_HOST", "0.0.0.0")
 API_PORT = int(os.getenv("API_PORT", "8000"))
 DEBUG = os.getenv("DEBUG", "true").lower() == "true"
+# Ожидание свободного соединения из пула Redis, секунды
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "2"))
+OPENSEARCH_TIMEOUT = float(os.getenv("OPENSEARCH_TIMEOUT", "10"))
+
+# Супервизор соединений (см. connections.py)
+BACKEND_CHECK_INTERVAL = float(os.getenv("BACKEND_CHECK_INTERVAL", "5"))
+BACKEND_PING_TIMEOUT = float(os.getenv("BACKEND_PING_TIMEOUT", "2"))
+BACKEND_MAX_BACKOFF = float(os.getenv("BACKEND_MAX_BACKOFF", "10"))
+# Сколько ждать бэкенды при запуске, прежде чем продолжить в фоне
+BACKEND_STARTUP_WAIT = float(os.getenv("BACKEND_STARTUP_WAIT", "5"))
+
+# Маскирование секретов в событиях перед сохранением (см. shared/masking.py)
+MASKING_ENABLED = os.getenv("MASKING_ENABLED", "true").lower() == "true"
+
+# Классификация IP-адресов при приеме (см. enrichment.py)
+IP_ENRICHMENT_ENABLED = os.getenv("IP_ENRICHMENT_ENABLED", "true").lower() == "true"
+# JSON с внутренними площадками и known-bad диапазонами: {"internal_sites": {...}, "known_bad": {...}}
+IP_RANGES_FILE = os.getenv("IP_RANGES_FILE", "")
+IP_CACHE_SIZE = int(os.getenv("IP_CACHE_SIZE", "65536"))
+
+# Сопоставление с индикаторами компрометации при приеме (см. shared/ioc.py)
+IOC_MATCHING_ENABLED = os.getenv("IOC_MATCHING_ENABLED", "true").lower() == "true"
+# Локальный фид: JSON lines записей ThreatIntelEvent или CSV
+IOC_FEED_FILE = os.getenv("IOC_FEED_FILE", "")
+# Индекс OpenSearch с записями ThreatIntelEvent; пусто - не читать
+IOC_THREAT_INTEL_INDEX = os.getenv("IOC_THREAT_INTEL_INDEX", "")
+IOC_MIN_CONFIDENCE = int(os.getenv("IOC_MIN_CONFIDENCE", "0"))
+# Период перестроения индекса, секунды; 0 - только при запуске и через /admin/ioc/reload
+# (при нескольких воркерах перестроение по запросу доходит до всех через Redis)
+IOC_RELOAD_INTERVAL = float(os.getenv("IOC_RELOAD_INTERVAL", "0"))
+
+# Репутация хешей файлов (см. shared/reputation.py); без списка аннотация выключена
+REPUTATION_ENABLED = os.getenv("REPUTATION_ENABLED", "true").lower() == "true"
+# Локальный список разрешенных и запрещенных хешей (CSV hash,verdict,reason или JSON lines)
+REPUTATION_LIST_FILE = os.getenv("REPUTATION_LIST_FILE", "")
+REPUTATION_CACHE_SIZE = int(os.getenv("REPUTATION_CACHE_SIZE", "100000"))
+# Время хранения известных вердиктов и вердикта unknown (негативный кэш) в Redis, секунды
+REPUTATION_TTL = float(os.getenv("REPUTATION_TTL", "86400"))
+REPUTATION_NEGATIVE_TTL = float(os.getenv("REPUTATION_NEGATIVE_TTL", "3600"))
+# Сколько вердикт живет в памяти воркера до повторного чтения из Redis, секунды
+REPUTATION_LOCAL_TTL = float(os.getenv("REPUTATION_LOCAL_TTL", "300"))
+REPUTATION_TIMEOUT = float(os.getenv("REPUTATION_TIMEOUT", "2"))
+
+# Агрегация сетевых соединений в потоки (см. flow_aggregator.py)
+FLOW_AGGREGATION_ENABLED = os.getenv("FLOW_AGGREGATION_ENABLED", "true").lower() == "true"
+FLOW_WINDOW_SECONDS = int(os.getenv("FLOW_WINDOW_SECONDS", "60"))
+# Сколько после конца окна ждать опоздавшие события до сброса, секунды
+FLOW_ALLOWED_LATENESS_SECONDS = float(os.getenv("FLOW_ALLOWED_LATENESS_SECONDS", "30"))
+FLOW_FLUSH_INTERVAL = float(os.getenv("FLOW_FLUSH_INTERVAL", "10"))
+# Доля потоков, сырые события которых сохраняются полностью (0 - только помеченные)
+FLOW_RAW_SAMPLE_RATE = float(os.getenv("FLOW_RAW_SAMPLE_RATE", "0.01"))
+# Сохранять сырые события потоков с IOC, адресами из списков угроз и severity high/critical
+FLOW_KEEP_FLAGGED_RAW = os.getenv("FLOW_KEEP_FLAGGED_RAW", "true").lower() == "true"
+# Открытых потоков в памяти воркера; при превышении сбрасываются все окна
+FLOW_MAX_PENDING = int(os.getenv("FLOW_MAX_PENDING", "50000"))
+
+# Индекс корреляции уязвимостей с хостами (см. vuln_index.py)
+VULN_INDEX_ENABLED = os.getenv("VULN_INDEX_ENABLED", "true").lower() == "true"
+
+# Адаптивное расписание отчетов агентов: next_report_after в ответе /ingest/host-posture (см. report_scheduler.py)
+REPORT_SCHEDULING_ENABLED = os.getenv("REPORT_SCHEDULING_ENABLED", "true").lower() == "true"
+REPORT_BASE_INTERVAL = float(os.getenv("REPORT_BASE_INTERVAL", "900"))
+REPORT_MIN_INTERVAL = float(os.getenv("REPORT_MIN_INTERVAL", "300"))
+REPORT_MAX_INTERVAL = float(os.getenv("REPORT_MAX_INTERVAL", "3600"))
+# Целевая частота отчетов всего парка, в секунду; 0 - без ограничения
+REPORT_TARGET_RATE = float(os.getenv("REPORT_TARGET_RATE", "0"))
+# Отставание обработки events:host_posture, при котором интервал начинает растягиваться
+REPORT_BACKLOG_LIMIT = int(os.getenv("REPORT_BACKLOG_LIMIT", "10000"))
+# Группы потребителей, чье отставание учитывается (через запятую); пусто - все группы с потребителями
+REPORT_BACKLOG_GROUPS = [name.strip() for name in os.getenv("REPORT_BACKLOG_GROUPS", "").split(",") if name.strip()]
+# Хосты с изменениями инвентаря за REPORT_ACTIVE_WINDOW секунд отчитываются в REPORT_ACTIVE_FACTOR интервала,
+# без изменений дольше REPORT_STABLE_AFTER секунд - в REPORT_STABLE_FACTOR интервала
+REPORT_ACTIVE_WINDOW = float(os.getenv("REPORT_ACTIVE_WINDOW", "3600"))
+REPORT_ACTIVE_FACTOR = float(os.getenv("REPORT_ACTIVE_FACTOR", "0.5"))
+REPORT_STABLE_AFTER = float(os.getenv("REPORT_STABLE_AFTER", "86400"))
+REPORT_STABLE_FACTOR = float(os.getenv("REPORT_STABLE_FACTOR", "2"))
+# Случайный сдвиг отчета, доля интервала
+REPORT_JITTER = float(os.getenv("REPORT_JITTER", "0.02"))
+
+# Устойчивость вызовов бэкендов (см. shared/resilience.py)
+# Бюджет времени на все вызовы бэкендов в одном запросе, секунды
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "15"))
+RESILIENCE_MAX_ATTEMPTS = int(os.getenv("RESILIENCE_MAX_ATTEMPTS", "3"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "5"))
+# Одновременные вызовы одного бэкенда и ожидание свободного слота
+OPENSEARCH_MAX_CONCURRENT = int(os.getenv("OPENSEARCH_MAX_CONCURRENT", "64"))
+REDIS_MAX_CONCURRENT = int(os.getenv("REDIS_MAX_CONCURRENT", "256"))
+BULKHEAD_MAX_WAIT = float(os.getenv("BULKHEAD_MAX_WAIT", "1"))
+
+# Профилирование запросов по требованию (см. profiling.py)
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_SLOW_MS = float(os.getenv("PROFILING_SLOW_MS", "1000"))
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "10"))
+PROFILING_RING_SIZE = int(os.getenv("PROFILING_RING_SIZE", "50"))
+
+# Учет стоимости запросов к OpenSearch (см. opensearch_tracing.py)
+OPENSEARCH_SLOW_QUERY_MS = float(os.getenv("OPENSEARCH_SLOW_QUERY_MS", "500"))
+OPENSEARCH_STATS_WINDOW_MINUTES = int(os.getenv("OPENSEARCH_STATS_WINDOW_MINUTES", "15"))
 
 # Pydantic схемы
 
@@ -65,6 +317,7 @@ class ProcessInfo(BaseModel):
     path: Optional[str] = Field(None, description="Путь к исполняемому файлу")
     command_line: Optional[str] = Field(None, description="Командная строка")
     user: Optional[str] = Field(None, description="Пользователь")
+    create_time: Optional[str] = Field(None, description="Время запуска процесса ISO 8601 (различает экземпляры с одним PID)")
 
 class FileInfo(BaseModel):
     path: Optional[str] = Field(None, description="Путь к файлу")
@@ -120,6 +373,7 @@ class IngestResponse(BaseModel):
     status: str = Field(..., description="Статус обработки")
     message: Optional[str] = Field(None, description="Дополнительное сообщение")
     processing_time_ms: Optional[int] = Field(None, description="Время обработки в мс")
+    next_report_after: Optional[int] = Field(None, description="Через сколько секунд агенту прислать следующий снимок")
 
 # === Схемы для агента host_posture (формат Go-агента) ===
 
@@ -140,6 +394,8 @@ class GoProcessInfo(BaseModel):
     exe_path: Optional[str] = Field(None, description="Путь к exe")
     cmdline: Optional[str] = Field(None, description="Командная строка")
     username: Optional[str] = Field(None, description="Пользователь")
+    sha256: Optional[str] = Field(None, description="SHA256 хеш исполняемого файла")
+    create_time: Optional[str] = Field(None, description="Время запуска процесса ISO 8601 (различает экземпляры с одним PID)")
 
 class GoRegistryAutorun(BaseModel):
     root: Optional[str] = Field(None, description="Корень реестра")
@@ -252,6 +508,20 @@ class HostPostureEvent(BaseModel):
     windows_update: Optional[GoWindowsUpdateInfo] = Field(None, description="Информация об обновлениях Windows")
     findings: Optional[List[GoFinding]] = Field(None, description="Находки")
     metadata: Optional[GoMetadataInfo] = Field(None, description="Метаданные")
+    # Условная загрузка (см. posture_sections.py): хеши всех разделов и пропущенные разделы
+    section_hashes: Optional[Dict[str, str]] = Field(None, description="Хеши разделов снимка, посчитанные агентом")
+    unchanged_sections: Optional[List[str]] = Field(None, description="Разделы, не изменившиеся с прошлого снимка и не присланные")
+
+class PostureHandshake(BaseModel):
+    """Первый шаг условной загрузки host_posture: хеши разделов снимка"""
+    host_id: Optional[str] = Field(None, description="ID хоста")
+    hostname: str = Field(..., description="Имя хоста")
+    section_hashes: Dict[str, str] = Field(..., description="Хеши разделов (см. POSTURE_SECTIONS)")
+
+class PostureHandshakeResponse(BaseModel):
+    host_id: str = Field(..., description="ID хоста")
+    needed_sections: List[str] = Field(..., description="Разделы, которые нужно прислать")
+    unchanged_sections: List[str] = Field(..., description="Разделы, которые сервер возьмет из последнего снимка")
 
 # === Схемы для событий безопасности (новый формат) ===
 
@@ -296,8 +566,190 @@ class EventsResponse(BaseModel):
     size: int = Field(..., description="Размер страницы")
 
 # Глобальные подключения
+profiler = RequestProfiler(
+    enabled=PROFILING_ENABLED,
+    sample_rate=PROFILING_SAMPLE_RATE,
+    slow_ms=PROFILING_SLOW_MS,
+    interval_ms=PROFILING_INTERVAL_MS,
+    ring_size=PROFILING_RING_SIZE
+)
+masker = get_default_masker()
+ip_classifier = build_ip_classifier(IP_RANGES_FILE, IP_CACHE_SIZE)
+# Текущий индекс IOC; перестраивается в потоке и подменяется целиком
+ioc_holder = IocMatcherHolder()
+ioc_reload_lock = asyncio.Lock()
+# Вердикты хешей файлов: память воркера -> Redis -> провайдер пакетами
+reputation_cache = build_reputation_cache(
+    REPUTATION_LIST_FILE if REPUTATION_ENABLED else "",
+    local_size=REPUTATION_CACHE_SIZE,
+    ttl=REPUTATION_TTL,
+    negative_ttl=REPUTATION_NEGATIVE_TTL,
+    local_ttl=REPUTATION_LOCAL_TTL,
+    timeout=REPUTATION_TIMEOUT
+)
+# Расписание отчетов агентов; заполнение пула OpenSearch воркера - один из сигналов нагрузки
+report_scheduler = ReportScheduler(
+    base_interval=REPORT_BASE_INTERVAL,
+    min_interval=REPORT_MIN_INTERVAL,
+    max_interval=REPORT_MAX_INTERVAL,
+    target_rate=REPORT_TARGET_RATE,
+    backlog_limit=REPORT_BACKLOG_LIMIT,
+    backlog_groups=REPORT_BACKLOG_GROUPS,
+    active_window=REPORT_ACTIVE_WINDOW,
+    active_factor=REPORT_ACTIVE_FACTOR,
+    stable_after=REPORT_STABLE_AFTER,
+    stable_factor=REPORT_STABLE_FACTOR,
+    jitter=REPORT_JITTER,
+    load_sources=lambda: {"opensearch_in_flight": opensearch_policy.bulkhead.in_flight / OPENSEARCH_MAX_CONCURRENT}
+)
+# Открытые окна сетевых потоков этого воркера
+flow_aggregator = FlowAggregator(
+    window_seconds=FLOW_WINDOW_SECONDS,
+    allowed_lateness=FLOW_ALLOWED_LATENESS_SECONDS,
+    sample_rate=FLOW_RAW_SAMPLE_RATE,
+    keep_flagged=FLOW_KEEP_FLAGGED_RAW,
+    max_pending=FLOW_MAX_PENDING
+)
+query_tracker = QueryCostTracker(
+    slow_ms=OPENSEARCH_SLOW_QUERY_MS,
+    window_minutes=OPENSEARCH_STATS_WINDOW_MINUTES
+)
+# Клиент здорового бэкенда или None; значения выставляет супервизор соединений
 opensearch_client: Optional[AsyncOpenSearch] = None
 redis_client: Optional[aioredis.Redis] = None
+worker_heartbeat_task: Optional[asyncio.Task] = None
+ioc_reload_task: Optional[asyncio.Task] = None
+flow_flush_task: Optional[asyncio.Task] = None
+
+# === Политики устойчивости бэкендов ===
+
+# Сбои, при которых вызов повторяется и засчитывается circuit breaker;
+# ошибки приложения (404, 400, конфликт версий) бэкенд здоров вернуть
+OPENSEARCH_RETRY_STATUSES = (429, 502, 503, 504)
+
+def is_opensearch_failure(error: BaseException) -> bool:
+    if isinstance(error, OpenSearchConnectionError):
+        return True
+    if isinstance(error, TransportError):
+        return error.status_code in OPENSEARCH_RETRY_STATUSES
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError))
+
+def is_redis_failure(error: BaseException) -> bool:
+    return isinstance(error, (
+        redis_exceptions.ConnectionError,
+        redis_exceptions.TimeoutError,
+        redis_exceptions.BusyLoadingError,
+        asyncio.TimeoutError,
+        ConnectionError,
+    ))
+
+def on_resilience_event(backend: str, event: str):
+    BACKEND_RESILIENCE_EVENTS.inc(backend, event)
+
+def on_circuit_change(backend: str):
+    def handler(previous: str, state: str):
+        # Открытый breaker - сигнал супервизору: бэкенд недоступен до успешной проверки
+        if state == "open":
+            supervisor.report_failure(backend, CircuitOpenError(backend, "серия сбоев вызовов"))
+    return handler
+
+def build_policy(backend: str, max_concurrent: int, call_timeout: float) -> ResiliencePolicy:
+    return ResiliencePolicy(
+        backend,
+        is_failure=is_opensearch_failure if backend == "opensearch" else is_redis_failure,
+        max_attempts=RESILIENCE_MAX_ATTEMPTS,
+        call_timeout=call_timeout,
+        failure_threshold=BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=BREAKER_RESET_TIMEOUT,
+        max_concurrent=max_concurrent,
+        max_wait=BULKHEAD_MAX_WAIT,
+        on_event=on_resilience_event,
+        on_state_change=on_circuit_change(backend)
+    )
+
+opensearch_policy = build_policy("opensearch", OPENSEARCH_MAX_CONCURRENT, OPENSEARCH_TIMEOUT)
+redis_policy = build_policy("redis", REDIS_MAX_CONCURRENT, REDIS_SOCKET_TIMEOUT)
+
+# Защищенные методы клиентов: True - идемпотентный вызов, повторяется при сбое.
+# Запись с явным ID (index, delete) повторять безопасно; update со скриптом,
+# xadd и pipeline.execute (инкременты, sadd без ID) - нет. bulk по умолчанию
+# не повторяется (в нем бывают update со скриптом): вызовы только из index и
+# delete с явными ID помечаются повторяемыми через retry_safe().
+# ping и close не защищаются: ими супервизор проверяет бэкенд в обход breaker.
+OPENSEARCH_GUARDED = {
+    "search": True, "count": True, "msearch": True, "get": True, "mget": True,
+    "exists": True, "scroll": True, "index": True, "bulk": False, "delete": True,
+    "delete_by_query": True, "update": False, "update_by_query": False,
+}
+OPENSEARCH_INDICES_GUARDED = {"exists": True, "create": True, "delete": True, "refresh": True}
+REDIS_GUARDED = {
+    "get": True, "mget": True, "set": True, "delete": True, "exists": True,
+    "hget": True, "hmget": True, "hset": True, "hgetall": True, "hdel": True,
+    "smembers": True, "sadd": True, "srem": True, "expire": True, "expireat": True,
+    "xlen": True, "xinfo_groups": True,
+    "xadd": False, "incr": False, "hincrby": False,
+}
+REDIS_PIPELINE_GUARDED = {"execute": False}
+
+def create_opensearch_client() -> AsyncOpenSearch:
+    """Клиент OpenSearch с учетом стоимости запросов, профилированием и политикой устойчивости"""
+    client = TracedOpenSearch(
+        build_opensearch_client(
+            OPENSEARCH_URL,
+            pool_size=OPENSEARCH_POOL_PER_WORKER,
+            timeout=OPENSEARCH_TIMEOUT,
+            connection_class=TracedAIOHttpConnection
+        ),
+        query_tracker
+    )
+    instrument_opensearch(client)
+    return ResilientClient(
+        client, opensearch_policy, OPENSEARCH_GUARDED,
+        namespaces={"indices": OPENSEARCH_INDICES_GUARDED}
+    )
+
+def create_redis_client() -> aioredis.Redis:
+    client = build_redis_client(
+        REDIS_URL,
+        pool_size=REDIS_POOL_PER_WORKER,
+        pool_timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        connect_timeout=REDIS_CONNECT_TIMEOUT
+    )
+    return ResilientClient(
+        client, redis_policy, REDIS_GUARDED,
+        factories={"pipeline": REDIS_PIPELINE_GUARDED}
+    )
+
+def on_backend_change(backend: str, client: Any):
+    """Публикация клиента в глобальные переменные при смене состояния бэкенда"""
+    global opensearch_client, redis_client
+    if backend == "opensearch":
+        opensearch_client = client
+    elif backend == "redis":
+        redis_client = client
+
+async def prepare_opensearch(client: AsyncOpenSearch):
+    """Создание индексов при первом подключении (в многопроцессном режиме их создает server.py)"""
+    logger.info(f"OpenSearch подключен: {OPENSEARCH_URL}")
+    if not BOOTSTRAPPED:
+        await ensure_inventory_index(client)
+        await ensure_rollup_index(client)
+        await ensure_process_tree_index(client)
+        await ensure_flow_index(client)
+        await ensure_vuln_index(client)
+
+async def prepare_redis(client: aioredis.Redis):
+    logger.info(f"Redis подключен: {REDIS_URL}")
+
+supervisor = ConnectionSupervisor(
+    factories={"opensearch": create_opensearch_client, "redis": create_redis_client},
+    on_change=on_backend_change,
+    on_ready={"opensearch": prepare_opensearch, "redis": prepare_redis},
+    check_interval=BACKEND_CHECK_INTERVAL,
+    ping_timeout=BACKEND_PING_TIMEOUT,
+    max_backoff=BACKEND_MAX_BACKOFF
+)
 
 # Инициализация FastAPI
 app = FastAPI(
@@ -317,62 +769,252 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """Учет запросов в обработке и полного времени ответа"""
+    request.state.received_at = time.perf_counter()
+    bind_request_scope(request.scope)
+    # Общий бюджет времени на вызовы бэкендов; фоновые задачи после ответа им не ограничены
+    deadline = start_deadline(REQUEST_DEADLINE_SECONDS)
+    HTTP_REQUESTS_IN_FLIGHT.inc()
+    status_code = "500"
+    try:
+        response = await call_next(request)
+        status_code = str(response.status_code)
+        return response
+    finally:
+        deadline.close()
+        HTTP_REQUESTS_IN_FLIGHT.dec()
+        # Шаблон пути маршрута, а не фактический путь - иначе ID событий раздувают число серий
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - request.state.received_at,
+            request.method,
+            route.path if route else "unmatched",
+            status_code
+        )
+
+@app.middleware("http")
+async def profiling_middleware(request: Request, call_next):
+    """Захват профиля для запросов с X-Profile, случайной выборки и медленных запросов"""
+    state = profiler.begin_request(request.headers)
+    if state is None:
+        return await call_next(request)
+    status_code = "500"
+    response = None
+    try:
+        response = await call_next(request)
+        status_code = str(response.status_code)
+        return response
+    finally:
+        profile_id = profiler.end_request(state, request.method, request.url.path, status_code)
+        if profile_id:
+            logger.info("Сохранен профиль %s (%s %s)", profile_id, request.method, request.url.path)
+            if response is not None:
+                response.headers["X-Profile-Id"] = profile_id
+
+@app.exception_handler(ResilienceError)
+async def resilience_error_handler(request: Request, exc: ResilienceError):
+    """Отказ политики устойчивости (breaker открыт, нет слота, истек бюджет) - 503"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Бэкенд {exc.backend} перегружен или недоступен"},
+        headers={"Retry-After": str(max(1, int(BREAKER_RESET_TIMEOUT)))}
+    )
+
+def collect_pool_metrics() -> Dict[tuple, float]:
+    """Состояние пулов соединений на момент чтения /metrics"""
+    values = {}
+    if redis_client:
+        pool = redis_client.connection_pool
+        values[("redis", "created")] = getattr(pool, "_created_connections", 0)
+        values[("redis", "available")] = len(getattr(pool, "_available_connections", []))
+        values[("redis", "in_use")] = len(getattr(pool, "_in_use_connections", []))
+        values[("redis", "max")] = getattr(pool, "max_connections", 0)
+    if opensearch_client:
+        in_use = 0
+        limit = 0
+        for connection in opensearch_client.transport.connection_pool.connections:
+            session = getattr(connection, "session", None)
+            connector = getattr(session, "connector", None) if session else None
+            if connector is not None:
+                in_use += len(getattr(connector, "_acquired", ()))
+                limit += getattr(connector, "limit", 0) or 0
+        values[("opensearch", "in_use")] = in_use
+        values[("opensearch", "max")] = limit
+    return values
+
+BACKEND_POOL_CONNECTIONS.set_function(collect_pool_metrics)
+BACKEND_CIRCUIT_STATE.set_function(lambda: {
+    (policy.name, state): 1 if policy.breaker.state == state else 0
+    for policy in (opensearch_policy, redis_policy)
+    for state in ("closed", "open", "half_open")
+})
+BACKEND_CALLS_IN_FLIGHT.set_function(lambda: {
+    (policy.name,): policy.bulkhead.in_flight for policy in (opensearch_policy, redis_policy)
+})
+REPORT_SCHEDULE_INTERVAL.set_function(lambda: {(): report_scheduler.fleet_interval()})
+REPORT_SCHEDULE_LOAD.set_function(lambda: {(signal,): value for signal, value in report_scheduler.load().items()})
+LOG_RECORDS.set_function(lambda: {(state,): value for state, value in get_logging_stats().items()})
+IOC_INDICATORS.set_function(lambda: {
+    (kind,): ioc_holder.index.stats()[key]
+    for kind, key in (("hash", "hashes"), ("ip", "ips"), ("cidr", "cidrs"), ("domain", "domains"), ("substring", "substrings"))
+})
+
+EVENT_STREAMS = ("events:ingestion", "events:host_posture", "events:security")
+
 # Lifecycle events
 @app.on_event("startup")
 async def startup_event():
     """Инициализация соединений при запуске"""
-    global opensearch_client, redis_client
+    global worker_heartbeat_task, ioc_reload_task, flow_flush_task
     
-    logger.info("Запуск Ingest API...")
+    logger.info(f"Запуск Ingest API (воркер {WORKER_ID}, пулы: OpenSearch {OPENSEARCH_POOL_PER_WORKER}, Redis {REDIS_POOL_PER_WORKER})...")
     
-    # Инициализация OpenSearch
-    try:
-        opensearch_client = AsyncOpenSearch([OPENSEARCH_URL])
-        # Проверка соединения
-        await opensearch_client.ping()
-        logger.info(f"OpenSearch подключен: {OPENSEARCH_URL}")
-    except Exception as e:
-        logger.error(f"Ошибка подключения к OpenSearch: {e}")
-        opensearch_client = None
+    # Клиенты создает и проверяет супервизор; недоступные бэкенды подключаются в фоне
+    await supervisor.start(wait=BACKEND_STARTUP_WAIT)
+    for backend, state in supervisor.health().items():
+        if state["status"] != "healthy":
+            logger.error(f"{backend} недоступен при запуске, переподключение в фоне: {state['last_error']}")
     
-    # Инициализация Redis
-    try:
-        redis_client = aioredis.from_url(REDIS_URL)
-        # Проверка соединения
-        await redis_client.ping()
-        logger.info(f"Redis подключен: {REDIS_URL}")
-    except Exception as e:
-        logger.error(f"Ошибка подключения к Redis: {e}")
-        redis_client = None
+    if WORKERS > 1:
+        worker_heartbeat_task = asyncio.create_task(
+            run_worker_heartbeat(lambda: redis_client, REGISTRY, apply_shared_settings)
+        )
+        await seed_reload_versions()
+    
+    # Индекс IOC строится в фоне: до готовности события принимаются без сопоставления
+    if IOC_MATCHING_ENABLED and (IOC_FEED_FILE or IOC_THREAT_INTEL_INDEX):
+        ioc_reload_task = asyncio.create_task(run_ioc_reload_loop())
+    
+    if FLOW_AGGREGATION_ENABLED:
+        flow_flush_task = asyncio.create_task(
+            run_flow_flush_loop(flow_aggregator, lambda: opensearch_client, FLOW_FLUSH_INTERVAL)
+        )
+    
+    profiler.start()
+    if profiler.enabled:
+        logger.info(f"Профилирование запросов включено: {profiler.settings()}")
     
     logger.info("Ingest API готов к работе")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Закрытие соединений при остановке"""
-    global opensearch_client, redis_client
+    logger.info(f"Остановка Ingest API (воркер {WORKER_ID})...")
     
-    logger.info("Остановка Ingest API...")
+    profiler.stop()
     
-    if opensearch_client:
-        await opensearch_client.close()
+    if ioc_reload_task:
+        ioc_reload_task.cancel()
     
-    if redis_client:
-        await redis_client.close()
+    # Открытые окна потоков сбрасываются до закрытия соединений
+    if flow_flush_task:
+        flow_flush_task.cancel()
+        await flush_flows(flow_aggregator, opensearch_client, force=True)
+    
+    if worker_heartbeat_task:
+        worker_heartbeat_task.cancel()
+        if redis_client:
+            await unregister_worker(redis_client)
+    
+    await supervisor.stop()
     
     logger.info("Ingest API остановлен")
+    shutdown_logging()
+
+async def reload_ioc_index() -> Dict[str, Any]:
+    """
+    Перестроение индекса IOC из IOC_FEED_FILE и IOC_THREAT_INTEL_INDEX.
+
+    Индекс строится в отдельном потоке и подменяется одной операцией:
+    прием событий не ждет перестроения и до подмены использует прежний индекс.
+    """
+    async with ioc_reload_lock:
+        records: List[Dict[str, Any]] = []
+        if IOC_THREAT_INTEL_INDEX:
+            if opensearch_client is None:
+                logger.warning(f"OpenSearch недоступен, индикаторы из {IOC_THREAT_INTEL_INDEX} не загружены")
+            else:
+                records = await fetch_threat_intel(opensearch_client, IOC_THREAT_INTEL_INDEX)
+        index = await asyncio.to_thread(
+            lambda: IocIndex.build(collect_indicators(IOC_FEED_FILE, records, IOC_MIN_CONFIDENCE))
+        )
+        ioc_holder.swap(index)
+        stats = index.stats()
+        logger.info(f"Индекс IOC перестроен за {stats['build_seconds']}с: {stats['indicators']} индикаторов")
+        return {"version": ioc_holder.version, **stats}
+
+async def reload_reputation_list() -> Dict[str, Any]:
+    """Перечитывание REPUTATION_LIST_FILE и подмена провайдера кэша репутации"""
+    if reputation_cache is None:
+        return {"hashes": 0}
+    provider = await asyncio.to_thread(ListFileProvider, REPUTATION_LIST_FILE)
+    reputation_cache.set_provider(provider)
+    logger.info(f"Список репутации файлов перечитан: {len(provider)} хешей, версия {provider.version}")
+    return {"hashes": len(provider), "skipped": provider.skipped, "version": provider.version}
+
+async def run_ioc_reload_loop():
+    """Загрузка индекса IOC при запуске и, если задан IOC_RELOAD_INTERVAL, периодически"""
+    while True:
+        try:
+            await reload_ioc_index()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка загрузки индикаторов компрометации: {e}")
+        if IOC_RELOAD_INTERVAL <= 0:
+            return
+        await asyncio.sleep(IOC_RELOAD_INTERVAL)
+
+def match_iocs(endpoint: str, event_data: Dict[str, Any]) -> None:
+    """Сопоставление события с текущим индексом IOC и учет совпадений в метриках"""
+    if annotate_ioc_matches(event_data, ioc_holder.index):
+        for match in event_data["ioc"]["matches"]:
+            IOC_MATCHES.inc(endpoint, match["indicator_type"])
+
+async def annotate_file_reputation(endpoint: str, event_data: Dict[str, Any], redis: aioredis.Redis) -> None:
+    """
+    Вердикты репутации всех хешей события одним пакетным запросом к кэшу.
+    Сбой Redis или провайдера не мешает приему: событие сохраняется без вердиктов.
+    """
+    hashes = event_file_hashes(event_data)
+    if not hashes:
+        return
+    try:
+        verdicts = await reputation_cache.lookup_many(hashes, redis)
+    except Exception as e:
+        logger.warning(f"Репутация файлов недоступна для события {event_data.get('event_id')}: {e}")
+        return
+    if annotate_reputation(event_data, verdicts):
+        for verdict, count in event_data["reputation"]["counts"].items():
+            if count:
+                REPUTATION_VERDICTS.inc(endpoint, verdict, amount=count)
+
+async def schedule_next_report(endpoint: str, redis: aioredis.Redis, host_id: str) -> Optional[int]:
+    """next_report_after для ответа агенту; None, если расписание выключено"""
+    if not REPORT_SCHEDULING_ENABLED:
+        return None
+    with INGEST_STAGE_SECONDS.time(endpoint, "schedule"):
+        return await report_scheduler.schedule(redis, host_id)
+
+async def sync_inventory_and_mark_changes(opensearch: AsyncOpenSearch, redis: aioredis.Redis, event_data: Dict[str, Any]) -> None:
+    """Синхронизация индекса инвентаря; изменившийся инвентарь учащает отчеты хоста"""
+    added, removed = await sync_host_inventory(opensearch, redis, event_data)
+    if REPORT_SCHEDULING_ENABLED and (added or removed):
+        await report_scheduler.mark_changed(redis, event_data["host_info"]["host_id"])
 
 # Dependency functions
 async def get_opensearch() -> AsyncOpenSearch:
-    """Получение OpenSearch клиента"""
+    """Получение OpenSearch клиента (по кэшированному состоянию супервизора)"""
     if not opensearch_client:
-        raise HTTPException(status_code=503, detail="OpenSearch недоступен")
+        raise HTTPException(status_code=503, detail="OpenSearch недоступен", headers={"Retry-After": "5"})
     return opensearch_client
 
 async def get_redis() -> aioredis.Redis:
-    """Получение Redis клиента"""
+    """Получение Redis клиента (по кэшированному состоянию супервизора)"""
     if not redis_client:
-        raise HTTPException(status_code=503, detail="Redis недоступен")
+        raise HTTPException(status_code=503, detail="Redis недоступен", headers={"Retry-After": "5"})
     return redis_client
 
 # Helper functions
@@ -385,6 +1027,140 @@ def get_index_name(timestamp: str) -> str:
         # Fallback на текущую дату
         return f"agent-events-{datetime.now().strftime('%Y.%m.%d')}"
 
+def encode_stream_fields(event_data: dict) -> Dict[str, str]:
+    """Подготовка полей события для Redis Stream (пустые поля пропускаются)"""
+    cleaned_data = {}
+    for k, v in event_data.items():
+        if v is not None:
+            # Для сложных объектов сериализуем в JSON
+            if isinstance(v, (dict, list)):
+                cleaned_data[k] = json.dumps(v, ensure_ascii=False, default=str)
+            else:
+                cleaned_data[k] = str(v)
+    return cleaned_data
+
+# Справочники для форматирования событий (строятся один раз, а не на каждый hit)
+EVENT_TYPE_DISPLAY_EN = {
+    'system_info': 'System Information',
+    'process_start': 'Process Start',
+    'process_end': 'Process End',
+    'file_create': 'File Created',
+    'file_modify': 'File Modified',
+    'file_delete': 'File Deleted',
+    'network_connection': 'Network Connection',
+    'user_login': 'User Login',
+    'user_logout': 'User Logout',
+    'security_alert': 'Security Alert'
+}
+
+EVENT_TYPE_DISPLAY_RU = {
+    'system_info': 'Системная информация',
+    'process_start': 'Запуск процесса',
+    'process_end': 'Завершение процесса',
+    'file_create': 'Создание файла',
+    'file_modify': 'Изменение файла',
+    'file_delete': 'Удаление файла',
+    'network_connection': 'Сетевое соединение',
+    'user_login': 'Вход пользователя',
+    'user_logout': 'Выход пользователя',
+    'security_alert': 'Алерт безопасности'
+}
+
+SEVERITY_DISPLAY_RU = {
+    "info": "Информация",
+    "low": "Низкий",
+    "medium": "Средний",
+    "high": "Высокий",
+    "critical": "Критический"
+}
+
+SECURITY_SEVERITY_TRANSLATIONS = {
+    'critical': 'критический',
+    'high': 'высокий',
+    'medium': 'средний',
+    'low': 'низкий',
+    'info': 'информационный'
+}
+
+THREAT_TYPE_TRANSLATIONS = {
+    'exploit': 'эксплойт',
+    'malware': 'вредоносное ПО',
+    'phishing': 'фишинг',
+    'vulnerability': 'уязвимость',
+    'intrusion': 'вторжение',
+    'ransomware': 'вымогатель',
+    'trojan': 'троян',
+    'backdoor': 'бэкдор',
+    'rootkit': 'руткит',
+    'botnet': 'ботнет'
+}
+
+def format_event_hit(hit: dict) -> dict:
+    """Форматирование события агента для /events"""
+    event_data = hit['_source']
+    event_type = event_data.get('event_type')
+    agent_id = event_data.get('agent', {}).get('agent_id', 'unknown')
+    
+    return {
+        "_id": hit['_id'],
+        "_index": hit['_index'],
+        "event_id": event_data.get('event_id'),
+        "event_type": EVENT_TYPE_DISPLAY_EN.get(event_type, event_data.get('event_type', 'Unknown')),
+        "timestamp": event_data.get('timestamp'),
+        "severity": event_data.get('severity', 'info'),
+        "host": event_data.get('host', {}).get('hostname', 'unknown'),
+        "agent": agent_id,
+        "description": f"Event from agent {agent_id}",
+        "data": event_data.get('data', {}),
+        "raw_data": event_data
+    }
+
+def format_agent_event_hit(hit: dict) -> dict:
+    """Форматирование события агента в удобный для UI вид"""
+    event_data = hit['_source']
+    host = event_data.get('host', {})
+    agent = event_data.get('agent', {})
+    
+    formatted_event = {
+        "_id": hit['_id'],
+        "_index": hit['_index'],
+        "event_id": event_data.get('event_id'),
+        "event_type": EVENT_TYPE_DISPLAY_RU.get(event_data.get('event_type'), event_data.get('event_type', 'Неизвестно')),
+        "timestamp": event_data.get('timestamp'),
+        "severity": event_data.get('severity', 'info'),
+        "severity_ru": SEVERITY_DISPLAY_RU.get(event_data.get('severity', 'info'), 'Информация'),
+        "source": "Агент " + agent.get('agent_version', '1.0.0'),
+        "description": event_data.get('description', f"Событие от агента {agent.get('agent_id', 'unknown')}"),
+        "details": {
+            "Хост": host.get('hostname', 'неизвестно'),
+            "ОС": host.get('os', 'неизвестно'),
+            "Агент ID": agent.get('agent_id', 'неизвестно'),
+            "Версия агента": agent.get('agent_version', 'неизвестно')
+        },
+        "raw_data": event_data.get('data', {}),
+        "tags": event_data.get('tags', [])
+    }
+    details = formatted_event["details"]
+    
+    # Добавляем специфичные для типа события поля
+    process = event_data.get('process')
+    if process:
+        details["PID"] = process.get('pid', 'неизвестно')
+        details["Процесс"] = process.get('name', 'неизвестно')
+    
+    file_info = event_data.get('file')
+    if file_info:
+        details["Файл"] = file_info.get('path', 'неизвестно')
+        details["Размер"] = file_info.get('size', 'неизвестно')
+    
+    network = event_data.get('network')
+    if network:
+        details["Протокол"] = network.get('protocol', 'неизвестно')
+        details["Источник"] = f"{network.get('source_ip', '')}:{network.get('source_port', '')}"
+        details["Назначение"] = f"{network.get('destination_ip', '')}:{network.get('destination_port', '')}"
+    
+    return formatted_event
+
 async def check_event_exists(opensearch: AsyncOpenSearch, index: str, event_id: str) -> bool:
     """Проверка существования события (для идемпотентности)"""
     try:
@@ -408,6 +1184,8 @@ async def index_event(opensearch: AsyncOpenSearch, index: str, event_id: str, ev
             refresh=True  # Для немедленной доступности в поиске
         )
         return True
+    except ResilienceError:
+        raise
     except RequestError as e:
         logger.error(f"OpenSearch ошибка индексации события {event_id}: {e}")
         return False
@@ -418,17 +1196,7 @@ async def index_event(opensearch: AsyncOpenSearch, index: str, event_id: str, ev
 async def publish_to_stream(redis: aioredis.Redis, stream: str, event_data: dict) -> bool:
     """Публикация события в Redis Stream"""
     try:
-        # Подготавливаем данные для Redis Stream
-        cleaned_data = {}
-        for k, v in event_data.items():
-            if v is not None:
-                # Для сложных объектов сериализуем в JSON
-                if isinstance(v, (dict, list)):
-                    cleaned_data[k] = json.dumps(v, ensure_ascii=False, default=str)
-                else:
-                    cleaned_data[k] = str(v)
-        
-        await redis.xadd(stream, cleaned_data)
+        await redis.xadd(stream, encode_stream_fields(event_data))
         return True
     except Exception as e:
         logger.error(f"Ошибка публикации в Redis Stream {stream}: {e}")
@@ -442,34 +1210,41 @@ async def health_check():
     status = {
         "status": "healthy",
         "timestamp": datetime.now(timezone.utc).isoformat(),
+        "worker": worker_info(),
         "services": {}
     }
     
-    # Проверка OpenSearch
-    if opensearch_client:
-        try:
-            await opensearch_client.ping()
-            status["services"]["opensearch"] = "healthy"
-        except:
-            status["services"]["opensearch"] = "unhealthy"
+    # Состояние из кэша супервизора: сама проверка бэкендов на запрос не выполняется
+    for backend, state in supervisor.health().items():
+        status["services"][backend] = state["status"]
+        if state["status"] != "healthy":
             status["status"] = "degraded"
-    else:
-        status["services"]["opensearch"] = "unavailable"
-        status["status"] = "degraded"
+    status["details"] = supervisor.health()
     
-    # Проверка Redis
+    return status
+
+@app.get("/metrics")
+async def get_metrics():
+    """Метрики в формате Prometheus"""
     if redis_client:
         try:
-            await redis_client.ping()
-            status["services"]["redis"] = "healthy"
-        except:
-            status["services"]["redis"] = "unhealthy"
-            status["status"] = "degraded"
-    else:
-        status["services"]["redis"] = "unavailable"
-        status["status"] = "degraded"
+            pipe = redis_client.pipeline(transaction=False)
+            for stream in EVENT_STREAMS:
+                pipe.xlen(stream)
+            for stream, length in zip(EVENT_STREAMS, await pipe.execute()):
+                STREAM_LENGTH.set(length, stream)
+        except Exception as e:
+            logger.warning(f"Не удалось получить длину Redis Streams: {e}")
     
-    return status
+    # Несколько воркеров: складываем метрики всех процессов, опубликованные в Redis
+    snapshots = None
+    if WORKERS > 1 and redis_client:
+        try:
+            snapshots = await collect_worker_snapshots(redis_client)
+        except Exception as e:
+            logger.warning(f"Не удалось получить метрики других воркеров: {e}")
+    
+    return PlainTextResponse(REGISTRY.render(snapshots), media_type=PROMETHEUS_CONTENT_TYPE)
 
 @app.post("/ingest", response_model=IngestResponse)
 async def ingest_event(
@@ -489,21 +1264,25 @@ async def ingest_event(
     - Публикацию в Redis Stream
     """
     start_time = datetime.now()
+    endpoint = "/ingest"
+    INGEST_STAGE_SECONDS.observe(time.perf_counter() - request.state.received_at, endpoint, "receive_validate")
     
     try:
         # Получение дополнительных заголовков
         agent_id = request.headers.get("X-Agent-ID", "unknown")
         user_agent = request.headers.get("User-Agent", "")
         
-        logger.info(f"Получено событие {event.event_id} от агента {agent_id}")
+        hot_logger.info("Получено событие %s от агента %s", event.event_id, agent_id)
         
         # Определение индекса
         index_name = get_index_name(event.timestamp)
         
         # Проверка идемпотентности
-        exists = await check_event_exists(opensearch, index_name, event.event_id)
+        with INGEST_STAGE_SECONDS.time(endpoint, "exists_check"):
+            exists = await check_event_exists(opensearch, index_name, event.event_id)
         if exists:
-            logger.info(f"Событие {event.event_id} уже существует")
+            INGEST_EVENTS_TOTAL.inc(endpoint, event.event_type, "duplicate")
+            hot_logger.info("Событие %s уже существует", event.event_id)
             processing_time = int((datetime.now() - start_time).total_seconds() * 1000)
             return IngestResponse(
                 event_id=event.event_id,
@@ -518,30 +1297,93 @@ async def ingest_event(
         event_data['agent_id'] = agent_id
         event_data['user_agent'] = user_agent
         
+        # Секреты в командных строках, действиях задач и metadata не попадают в индекс
+        if MASKING_ENABLED:
+            with INGEST_STAGE_SECONDS.time(endpoint, "mask"):
+                event_data = masker.mask(event_data)
+        
+        # Классы IP-адресов для term-фильтров (private, public, internal_site, known_bad)
+        if IP_ENRICHMENT_ENABLED:
+            with INGEST_STAGE_SECONDS.time(endpoint, "enrich"):
+                annotate_ip_classes(event_data, ip_classifier)
+        
+        # Совпадения с индикаторами компрометации (хэши, IP, домены, подстроки)
+        if IOC_MATCHING_ENABLED:
+            with INGEST_STAGE_SECONDS.time(endpoint, "ioc"):
+                match_iocs(endpoint, event_data)
+        
+        # Соединение учитывается в окне потока; сырое событие сохраняется
+        # только для помеченных потоков и выборки FLOW_RAW_SAMPLE_RATE
+        flow = None
+        claimed = unstored = False
+        if FLOW_AGGREGATION_ENABLED and event.event_type == "network_connection" and event.network:
+            with INGEST_STAGE_SECONDS.time(endpoint, "flow"):
+                claimed, flow = await claim_flow_event(redis, event.event_id)
+                # Повтор события, учтенного в потоке, но не сохраненного: только сохранение
+                unstored = flow is not None
+                if not claimed and not unstored:
+                    INGEST_EVENTS_TOTAL.inc(endpoint, event.event_type, "duplicate")
+                    processing_time = int((datetime.now() - start_time).total_seconds() * 1000)
+                    return IngestResponse(
+                        event_id=event.event_id,
+                        status="duplicate",
+                        message="Событие уже было обработано",
+                        processing_time_ms=processing_time
+                    )
+                if claimed:
+                    flow = flow_aggregator.add(event_data)
+            if flow:
+                event_data['flow'] = flow
+        
         # Сохранение в OpenSearch
-        indexed = await index_event(opensearch, index_name, event.event_id, event_data)
-        if not indexed:
-            raise HTTPException(status_code=500, detail="Ошибка сохранения события")
+        if flow is None or flow["retain"]:
+            try:
+                with INGEST_STAGE_SECONDS.time(endpoint, "index"):
+                    indexed = await index_event(opensearch, index_name, event.event_id, event_data)
+                if not indexed:
+                    raise HTTPException(status_code=500, detail="Ошибка сохранения события")
+            except BaseException:
+                # Соединение уже учтено в потоке: повтор агента должен сохранить событие
+                if claimed or unstored:
+                    await release_flow_event(redis, event.event_id, flow)
+                raise
+            if unstored:
+                await complete_flow_event(redis, event.event_id)
+            with INGEST_STAGE_SECONDS.time(endpoint, "record_location"):
+                await record_event_location(redis, event.event_id, index_name)
         
         # Публикация в Redis Stream для дальнейшей обработки
-        published = await publish_to_stream(redis, "events:ingestion", event_data)
+        with INGEST_STAGE_SECONDS.time(endpoint, "publish"):
+            published = await publish_to_stream(redis, "events:ingestion", event_data)
         if not published:
-            logger.warning(f"Событие {event.event_id} сохранено в OpenSearch, но не опубликовано в Redis")
+            logger.warning(f"Событие {event.event_id} принято, но не опубликовано в Redis")
+        
+        # Запуск и завершение процессов обновляют дерево процессов хоста после ответа агенту
+        if event.event_type in ("process_start", "process_end") and event.process:
+            background_tasks.add_task(record_process_event, opensearch, redis, event_data)
+        
+        # Адреса хоста сопоставляют цели сканеров уязвимостей с хостом (только при изменении)
+        if VULN_INDEX_ENABLED and host_needs_registration(event.host.host_id, event.host.hostname, event.host.ip_addresses):
+            background_tasks.add_task(register_host, opensearch, redis, event.host.host_id,
+                                      event.host.hostname, event.host.ip_addresses)
         
         processing_time = int((datetime.now() - start_time).total_seconds() * 1000)
+        INGEST_EVENTS_TOTAL.inc(endpoint, event.event_type, "accepted")
         
-        logger.info(f"Событие {event.event_id} успешно обработано за {processing_time}ms")
+        hot_logger.info("Событие %s успешно обработано за %sms", event.event_id, processing_time)
         
         return IngestResponse(
             event_id=event.event_id,
             status="accepted",
-            message="Событие успешно обработано",
+            message="Соединение учтено в сетевом потоке" if flow and not flow["retain"] else "Событие успешно обработано",
             processing_time_ms=processing_time
         )
         
-    except HTTPException:
+    except (HTTPException, ResilienceError):
+        INGEST_EVENTS_TOTAL.inc(endpoint, event.event_type, "failed")
         raise
     except Exception as e:
+        INGEST_EVENTS_TOTAL.inc(endpoint, event.event_type, "failed")
         processing_time = int((datetime.now() - start_time).total_seconds() * 1000)
         logger.error(f"Ошибка обработки события {event.event_id}: {e}")
         raise HTTPException(
@@ -549,6 +1391,26 @@ async def ingest_event(
             detail=f"Внутренняя ошибка обработки события"
         )
 
+@app.post("/ingest/host-posture/handshake", response_model=PostureHandshakeResponse)
+async def posture_handshake(
+    handshake: PostureHandshake,
+    redis: aioredis.Redis = Depends(get_redis)
+) -> PostureHandshakeResponse:
+    """
+    Первый шаг условной загрузки host_posture: агент присылает хеши разделов,
+    сервер отвечает, какие разделы изменились с последнего сохраненного снимка.
+    """
+    invalid = invalid_sections(handshake.section_hashes)
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Неизвестные разделы или недопустимые хеши: {', '.join(invalid)}")
+    host_id = handshake.host_id or handshake.hostname
+    needed = await sections_needed(redis, host_id, handshake.section_hashes)
+    return PostureHandshakeResponse(
+        host_id=host_id,
+        needed_sections=needed,
+        unchanged_sections=[name for name in POSTURE_SECTIONS if name not in needed]
+    )
+
 @app.post("/ingest/host-posture", response_model=IngestResponse)
 async def ingest_host_posture_event(
     event: HostPostureEvent,
@@ -567,31 +1429,63 @@ async def ingest_host_posture_event(
     - Публикацию в Redis Stream
     """
     start_time = datetime.now()
+    endpoint = "/ingest/host-posture"
+    INGEST_STAGE_SECONDS.observe(time.perf_counter() - request.state.received_at, endpoint, "receive_validate")
     
     try:
         # Получение дополнительных заголовков
         agent_id = request.headers.get("X-Agent-ID", event.agent.agent_id or "unknown")
         user_agent = request.headers.get("User-Agent", "")
         
-        logger.info(f"Получено событие host_posture {event.event_id} от агента {agent_id}")
+        hot_logger.info("Получено событие host_posture %s от агента %s", event.event_id, agent_id)
         
         # Определение индекса
         index_name = get_index_name(event.timestamp)
         
         # Проверка идемпотентности
-        exists = await check_event_exists(opensearch, index_name, event.event_id)
+        with INGEST_STAGE_SECONDS.time(endpoint, "exists_check"):
+            exists = await check_event_exists(opensearch, index_name, event.event_id)
         if exists:
-            logger.info(f"Событие host_posture {event.event_id} уже существует")
+            INGEST_EVENTS_TOTAL.inc(endpoint, "host_posture", "duplicate")
+            hot_logger.info("Событие host_posture %s уже существует", event.event_id)
+            next_report_after = await schedule_next_report(endpoint, redis, event.host.host_id or event.host.hostname)
             processing_time = int((datetime.now() - start_time).total_seconds() * 1000)
             return IngestResponse(
                 event_id=event.event_id,
                 status="duplicate",
                 message="Событие уже было обработано",
-                processing_time_ms=processing_time
+                processing_time_ms=processing_time,
+                next_report_after=next_report_after
             )
         
         # Подготовка данных для сохранения
+        host_id = event.host.host_id or event.host.hostname
         event_data = event.dict()
+        section_hashes = event_data.pop('section_hashes', None) or {}
+        unchanged_sections = event_data.pop('unchanged_sections', None) or []
+        invalid = invalid_sections(section_hashes, unchanged_sections)
+        if invalid:
+            raise HTTPException(status_code=400, detail=f"Неизвестные разделы или недопустимые хеши: {', '.join(invalid)}")
+        
+        # Разделы, не изменившиеся с прошлого снимка, берутся из сохраненного снимка
+        if unchanged_sections:
+            with INGEST_STAGE_SECONDS.time(endpoint, "fill_sections"):
+                needed = await fill_unchanged_sections(
+                    opensearch, redis, host_id, event_data, unchanged_sections, section_hashes
+                )
+            if needed:
+                INGEST_EVENTS_TOTAL.inc(endpoint, "host_posture", "sections_required")
+                hot_logger.info("Снимок %s: разделы %s нужно прислать заново", event.event_id, needed)
+                return JSONResponse(status_code=409, content={
+                    "event_id": event.event_id,
+                    "status": "sections_required",
+                    "message": "Разделы нельзя взять из сохраненного снимка, пришлите их целиком",
+                    "needed_sections": needed,
+                })
+            event_data['reused_sections'] = unchanged_sections
+        for section in section_hashes:
+            POSTURE_SECTIONS_TOTAL.inc(section, "reused" if section in unchanged_sections else "uploaded")
+        
         event_data['received_at'] = datetime.now(timezone.utc).isoformat()
         event_data['agent_id'] = agent_id
         event_data['user_agent'] = user_agent
@@ -606,30 +1500,67 @@ async def ingest_host_posture_event(
             'uptime_seconds': event.host.uptime_seconds
         }
         
+        # Секреты в командных строках, действиях задач и metadata не попадают в индекс
+        if MASKING_ENABLED:
+            with INGEST_STAGE_SECONDS.time(endpoint, "mask"):
+                event_data = masker.mask(event_data)
+        
+        # Совпадения процессов и автозапусков с индикаторами компрометации
+        if IOC_MATCHING_ENABLED:
+            with INGEST_STAGE_SECONDS.time(endpoint, "ioc"):
+                match_iocs(endpoint, event_data)
+        
+        # Вердикты репутации хешей процессов: повторяющиеся по парку хеши берутся из кэша
+        if reputation_cache is not None:
+            with INGEST_STAGE_SECONDS.time(endpoint, "reputation"):
+                await annotate_file_reputation(endpoint, event_data, redis)
+        
         # Сохранение в OpenSearch
-        indexed = await index_event(opensearch, index_name, event.event_id, event_data)
+        with INGEST_STAGE_SECONDS.time(endpoint, "index"):
+            indexed = await index_event(opensearch, index_name, event.event_id, event_data)
         if not indexed:
             raise HTTPException(status_code=500, detail="Ошибка сохранения события host_posture")
+        with INGEST_STAGE_SECONDS.time(endpoint, "record_location"):
+            await record_event_location(redis, event.event_id, index_name)
         
         # Публикация в Redis Stream для дальнейшей обработки
-        published = await publish_to_stream(redis, "events:host_posture", event_data)
+        with INGEST_STAGE_SECONDS.time(endpoint, "publish"):
+            published = await publish_to_stream(redis, "events:host_posture", event_data)
         if not published:
             logger.warning(f"Событие host_posture {event.event_id} сохранено в OpenSearch, но не опубликовано в Redis")
         
+        # Обновление плоского индекса инвентаря после ответа агенту
+        background_tasks.add_task(sync_inventory_and_mark_changes, opensearch, redis, event_data)
+        background_tasks.add_task(update_findings_rollups, opensearch, redis, event_data)
+        background_tasks.add_task(sync_host_processes, opensearch, redis, event_data)
+        if section_hashes:
+            background_tasks.add_task(
+                record_section_hashes, redis, host_id, section_hashes, event.event_id, index_name, event.timestamp
+            )
+        if VULN_INDEX_ENABLED and host_needs_registration(host_id, event.host.hostname):
+            background_tasks.add_task(register_host, opensearch, redis, host_id, event.host.hostname)
+        
+        # Время следующего отчета агента: слот хоста, нагрузка и давность изменений
+        next_report_after = await schedule_next_report(endpoint, redis, host_id)
+        
         processing_time = int((datetime.now() - start_time).total_seconds() * 1000)
+        INGEST_EVENTS_TOTAL.inc(endpoint, "host_posture", "accepted")
         
-        logger.info(f"Событие host_posture {event.event_id} успешно обработано за {processing_time}ms")
+        hot_logger.info("Событие host_posture %s успешно обработано за %sms", event.event_id, processing_time)
         
         return IngestResponse(
             event_id=event.event_id,
             status="accepted",
             message="Событие host_posture успешно обработано",
-            processing_time_ms=processing_time
+            processing_time_ms=processing_time,
+            next_report_after=next_report_after
         )
         
-    except HTTPException:
+    except (HTTPException, ResilienceError):
+        INGEST_EVENTS_TOTAL.inc(endpoint, "host_posture", "failed")
         raise
     except Exception as e:
+        INGEST_EVENTS_TOTAL.inc(endpoint, "host_posture", "failed")
         processing_time = int((datetime.now() - start_time).total_seconds() * 1000)
         logger.error(f"Ошибка обработки события host_posture {event.event_id}: {e}")
         raise HTTPException(
@@ -655,6 +1586,8 @@ async def ingest_security_event(
     - Публикация в Redis Stream для обработки
     """
     start_time = datetime.now()
+    endpoint = "/ingest/security"
+    INGEST_STAGE_SECONDS.observe(time.perf_counter() - request.state.received_at, endpoint, "receive_validate")
     
     try:
         # Генерация event_id если не указан
@@ -665,7 +1598,7 @@ async def ingest_security_event(
         source_system = request.headers.get("X-Source-System", "unknown")
         user_agent = request.headers.get("User-Agent", "")
         
-        logger.info(f"Получено событие безопасности {event.event_id} от источника {source_system}")
+        hot_logger.info("Получено событие безопасности %s от источника %s", event.event_id, source_system)
         
         # Определение индекса для событий безопасности
         try:
@@ -676,9 +1609,11 @@ async def ingest_security_event(
             index_name = f"security-events-{datetime.now().strftime('%Y.%m.%d')}"
         
         # Проверка идемпотентности
-        exists = await check_event_exists(opensearch, index_name, event.event_id)
+        with INGEST_STAGE_SECONDS.time(endpoint, "exists_check"):
+            exists = await check_event_exists(opensearch, index_name, event.event_id)
         if exists:
-            logger.info(f"Событие безопасности {event.event_id} уже существует")
+            INGEST_EVENTS_TOTAL.inc(endpoint, event.threat_type, "duplicate")
+            hot_logger.info("Событие безопасности %s уже существует", event.event_id)
             processing_time = int((datetime.now() - start_time).total_seconds() * 1000)
             return IngestResponse(
                 event_id=event.event_id,
@@ -695,42 +1630,51 @@ async def ingest_security_event(
         event_data['event_format'] = 'security_v1'
         
         # Добавление русских названий для Dashboard
-        severity_translations = {
-            'critical': 'критический',
-            'high': 'высокий', 
-            'medium': 'средний',
-            'low': 'низкий',
-            'info': 'информационный'
-        }
-        event_data['severity_ru'] = severity_translations.get(event.severity, event.severity)
-        
-        threat_type_translations = {
-            'exploit': 'эксплойт',
-            'malware': 'вредоносное ПО',
-            'phishing': 'фишинг',
-            'vulnerability': 'уязвимость',
-            'intrusion': 'вторжение',
-            'ransomware': 'вымогатель',
-            'trojan': 'троян',
-            'backdoor': 'бэкдор',
-            'rootkit': 'руткит',
-            'botnet': 'ботнет'
-        }
-        event_data['threat_type_ru'] = threat_type_translations.get(event.threat_type, event.threat_type)
+        event_data['severity_ru'] = SECURITY_SEVERITY_TRANSLATIONS.get(event.severity, event.severity)
+        event_data['threat_type_ru'] = THREAT_TYPE_TRANSLATIONS.get(event.threat_type, event.threat_type)
+        
+        # Секреты в командных строках, действиях задач и metadata не попадают в индекс
+        if MASKING_ENABLED:
+            with INGEST_STAGE_SECONDS.time(endpoint, "mask"):
+                event_data = masker.mask(event_data)
+        
+        # Классы IP-адресов для term-фильтров (private, public, internal_site, known_bad)
+        if IP_ENRICHMENT_ENABLED:
+            with INGEST_STAGE_SECONDS.time(endpoint, "enrich"):
+                annotate_ip_classes(event_data, ip_classifier)
+        
+        # Совпадения с индикаторами компрометации (хэши, IP, домены, подстроки)
+        if IOC_MATCHING_ENABLED:
+            with INGEST_STAGE_SECONDS.time(endpoint, "ioc"):
+                match_iocs(endpoint, event_data)
+        
+        # Вердикт репутации file_hash
+        if reputation_cache is not None:
+            with INGEST_STAGE_SECONDS.time(endpoint, "reputation"):
+                await annotate_file_reputation(endpoint, event_data, redis)
         
         # Сохранение в OpenSearch
-        indexed = await index_event(opensearch, index_name, event.event_id, event_data)
+        with INGEST_STAGE_SECONDS.time(endpoint, "index"):
+            indexed = await index_event(opensearch, index_name, event.event_id, event_data)
         if not indexed:
             raise HTTPException(status_code=500, detail="Ошибка сохранения события безопасности")
+        with INGEST_STAGE_SECONDS.time(endpoint, "record_location"):
+            await record_event_location(redis, event.event_id, index_name)
         
         # Публикация в Redis Stream для дальнейшей обработки
-        published = await publish_to_stream(redis, "events:security", event_data)
+        with INGEST_STAGE_SECONDS.time(endpoint, "publish"):
+            published = await publish_to_stream(redis, "events:security", event_data)
         if not published:
             logger.warning(f"Событие безопасности {event.event_id} сохранено в OpenSearch, но не опубликовано в Redis")
         
+        # CVE события связывается с хостом из metadata в индексе уязвимостей
+        if VULN_INDEX_ENABLED and event.cve_id:
+            background_tasks.add_task(sync_vulnerabilities, opensearch, redis, event_data)
+        
         processing_time = int((datetime.now() - start_time).total_seconds() * 1000)
+        INGEST_EVENTS_TOTAL.inc(endpoint, event.threat_type, "accepted")
         
-        logger.info(f"Событие безопасности {event.event_id} успешно обработано за {processing_time}ms")
+        hot_logger.info("Событие безопасности %s успешно обработано за %sms", event.event_id, processing_time)
         
         return IngestResponse(
             event_id=event.event_id,
@@ -739,9 +1683,11 @@ async def ingest_security_event(
             processing_time_ms=processing_time
         )
         
-    except HTTPException:
+    except (HTTPException, ResilienceError):
+        INGEST_EVENTS_TOTAL.inc(endpoint, event.threat_type, "failed")
         raise
     except Exception as e:
+        INGEST_EVENTS_TOTAL.inc(endpoint, event.threat_type, "failed")
         processing_time = int((datetime.now() - start_time).total_seconds() * 1000)
         logger.error(f"Ошибка обработки события безопасности {event.event_id if hasattr(event, 'event_id') else 'unknown'}: {e}")
         raise HTTPException(
@@ -749,6 +1695,94 @@ async def ingest_security_event(
             detail=f"Внутренняя ошибка обработки события безопасности: {str(e)}"
         )
 
+@app.post("/ingest/vuln-scan", response_model=IngestResponse)
+async def ingest_vuln_scan_result(
+    event: VulnScanResult,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    opensearch: AsyncOpenSearch = Depends(get_opensearch),
+    redis: aioredis.Redis = Depends(get_redis)
+) -> IngestResponse:
+    """
+    Прием результата сканера уязвимостей (схема VulnScanResult).
+    
+    Обеспечивает:
+    - Идемпотентность через event_id
+    - Сохранение в индекс vuln-scans
+    - Публикацию в Redis Stream
+    - Учет пары цель + CVE в индексе уязвимостей (metadata.status fixed/resolved снимает пару)
+    """
+    start_time = datetime.now()
+    endpoint = "/ingest/vuln-scan"
+    INGEST_STAGE_SECONDS.observe(time.perf_counter() - request.state.received_at, endpoint, "receive_validate")
+    
+    try:
+        source_system = request.headers.get("X-Source-System", "unknown")
+        hot_logger.info("Получен результат сканирования %s от источника %s", event.event_id, source_system)
+        
+        index_name = f"vuln-scans-{event.timestamp.strftime('%Y.%m.%d')}"
+        
+        # Проверка идемпотентности
+        with INGEST_STAGE_SECONDS.time(endpoint, "exists_check"):
+            exists = await check_event_exists(opensearch, index_name, event.event_id)
+        if exists:
+            INGEST_EVENTS_TOTAL.inc(endpoint, "vuln_scan_result", "duplicate")
+            processing_time = int((datetime.now() - start_time).total_seconds() * 1000)
+            return IngestResponse(
+                event_id=event.event_id,
+                status="duplicate",
+                message="Событие уже было обработано",
+                processing_time_ms=processing_time
+            )
+        
+        # Подготовка данных для сохранения (datetime и enum схемы - в JSON-значения)
+        event_data = jsonable_encoder(event)
+        event_data['received_at'] = datetime.now(timezone.utc).isoformat()
+        event_data['source_system'] = source_system
+        
+        if MASKING_ENABLED:
+            with INGEST_STAGE_SECONDS.time(endpoint, "mask"):
+                event_data = masker.mask(event_data)
+        
+        # Сохранение в OpenSearch
+        with INGEST_STAGE_SECONDS.time(endpoint, "index"):
+            indexed = await index_event(opensearch, index_name, event.event_id, event_data)
+        if not indexed:
+            raise HTTPException(status_code=500, detail="Ошибка сохранения результата сканирования")
+        with INGEST_STAGE_SECONDS.time(endpoint, "record_location"):
+            await record_event_location(redis, event.event_id, index_name)
+        
+        # Публикация в Redis Stream для дальнейшей обработки
+        with INGEST_STAGE_SECONDS.time(endpoint, "publish"):
+            published = await publish_to_stream(redis, "events:security", event_data)
+        if not published:
+            logger.warning(f"Результат сканирования {event.event_id} сохранен в OpenSearch, но не опубликован в Redis")
+        
+        # Пара цель + CVE учитывается в индексе уязвимостей после ответа сканеру
+        if VULN_INDEX_ENABLED:
+            background_tasks.add_task(sync_vulnerabilities, opensearch, redis, event_data)
+        
+        processing_time = int((datetime.now() - start_time).total_seconds() * 1000)
+        INGEST_EVENTS_TOTAL.inc(endpoint, "vuln_scan_result", "accepted")
+        
+        return IngestResponse(
+            event_id=event.event_id,
+            status="accepted",
+            message="Результат сканирования успешно обработан",
+            processing_time_ms=processing_time
+        )
+        
+    except (HTTPException, ResilienceError):
+        INGEST_EVENTS_TOTAL.inc(endpoint, "vuln_scan_result", "failed")
+        raise
+    except Exception as e:
+        INGEST_EVENTS_TOTAL.inc(endpoint, "vuln_scan_result", "failed")
+        logger.error(f"Ошибка обработки результата сканирования {event.event_id}: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail="Внутренняя ошибка обработки результата сканирования"
+        )
+
 @app.get("/events", response_model=EventsResponse)
 async def get_events(
     limit: int = 100,
@@ -762,7 +1796,7 @@ async def get_events(
     Получение списка событий с фильтрацией и пагинацией.
     Объединяет события агентов и события безопасности.
     """
-    logger.info(f"DEBUG: get_events called with limit={limit}, page={page}")
+    logger.debug("get_events called with limit=%s, page=%s", limit, page)
     try:
         # Валидация параметров
         if limit > 1000:
@@ -794,52 +1828,22 @@ async def get_events(
             "size": limit
         }
         
-        logger.info(f"Search query: {search_body}")
-        logger.info(f"Searching index: agent-events-*")
+        logger.debug("Search query: %s", LazyJSON(search_body))
         
         response = await opensearch.search(
             index="agent-events-*",
             body=search_body
         )
         
-        logger.info(f"OpenSearch response: hits total = {response['hits']['total']}, got {len(response['hits']['hits'])} hits")
+        logger.debug("OpenSearch response: hits total = %s, got %s hits", response['hits']['total'], len(response['hits']['hits']))
         
         total = response['hits']['total']['value']
         events = []
         
         for hit in response['hits']['hits']:
-            event_data = hit['_source']
-            
-            # Определяем тип события для отображения
-            event_type_display = {
-                'system_info': 'System Information',
-                'process_start': 'Process Start',
-                'process_end': 'Process End',
-                'file_create': 'File Created',
-                'file_modify': 'File Modified',
-                'file_delete': 'File Deleted',
-                'network_connection': 'Network Connection',
-                'user_login': 'User Login',
-                'user_logout': 'User Logout',
-                'security_alert': 'Security Alert'
-            }.get(event_data.get('event_type'), event_data.get('event_type', 'Unknown'))
-            
-            formatted_event = {
-                "_id": hit['_id'],
-                "_index": hit['_index'],
-                "event_id": event_data.get('event_id'),
-                "event_type": event_type_display,
-                "timestamp": event_data.get('timestamp'),
-                "severity": event_data.get('severity', 'info'),
-                "host": event_data.get('host', {}).get('hostname', 'unknown'),
-                "agent": event_data.get('agent', {}).get('agent_id', 'unknown'),
-                "description": f"Event from agent {event_data.get('agent', {}).get('agent_id', 'unknown')}",
-                "data": event_data.get('data', {}),
-                "raw_data": event_data
-            }
-            events.append(formatted_event)
+            events.append(format_event_hit(hit))
         
-        logger.info(f"Returned {len(events)} events from total {total} (page {page})")
+        logger.debug("Returned %s events from total %s (page %s)", len(events), total, page)
         
         return EventsResponse(
             events=events,
@@ -848,6 +1852,8 @@ async def get_events(
             size=len(events)
         )
         
+    except ResilienceError:
+        raise
     except Exception as e:
         logger.error(f"Error getting events: {e}")
         raise HTTPException(status_code=500, detail=f"Error getting events: {str(e)}")
@@ -883,58 +1889,7 @@ async def get_agent_events(opensearch: AsyncOpenSearch, limit: int, offset: int,
         
         events = []
         for hit in response['hits']['hits']:
-            event_data = hit['_source']
-            
-            # Определяем тип события для отображения
-            event_type_display = {
-                'system_info': 'Системная информация',
-                'process_start': 'Запуск процесса',
-                'process_end': 'Завершение процесса',
-                'file_create': 'Создание файла',
-                'file_modify': 'Изменение файла',
-                'file_delete': 'Удаление файла',
-                'network_connection': 'Сетевое соединение',
-                'user_login': 'Вход пользователя',
-                'user_logout': 'Выход пользователя',
-                'security_alert': 'Алерт безопасности'
-            }.get(event_data.get('event_type'), event_data.get('event_type', 'Неизвестно'))
-            
-            # Преобразуем в удобный формат для UI
-            formatted_event = {
-                "_id": hit['_id'],
-                "_index": hit['_index'],
-                "event_id": event_data.get('event_id'),
-                "event_type": event_type_display,
-                "timestamp": event_data.get('timestamp'),
-                "severity": event_data.get('severity', 'info'),
-                "severity_ru": {"info": "Информация", "low": "Низкий", "medium": "Средний", "high": "Высокий", "critical": "Критический"}.get(event_data.get('severity', 'info'), 'Информация'),
-                "source": "Агент " + event_data.get('agent', {}).get('agent_version', '1.0.0'),
-                "description": event_data.get('description', f"Событие от агента {event_data.get('agent', {}).get('agent_id', 'unknown')}"),
-                "details": {
-                    "Хост": event_data.get('host', {}).get('hostname', 'неизвестно'),
-                    "ОС": event_data.get('host', {}).get('os', 'неизвестно'),
-                    "Агент ID": event_data.get('agent', {}).get('agent_id', 'неизвестно'),
-                    "Версия агента": event_data.get('agent', {}).get('agent_version', 'неизвестно')
-                },
-                "raw_data": event_data.get('data', {}),
-                "tags": event_data.get('tags', [])
-            }
-            
-            # Добавляем специфичные для типа события поля
-            if event_data.get('process'):
-                formatted_event["details"]["PID"] = event_data['process'].get('pid', 'неизвестно')
-                formatted_event["details"]["Процесс"] = event_data['process'].get('name', 'неизвестно')
-            
-            if event_data.get('file'):
-                formatted_event["details"]["Файл"] = event_data['file'].get('path', 'неизвестно')
-                formatted_event["details"]["Размер"] = event_data['file'].get('size', 'неизвестно')
-            
-            if event_data.get('network'):
-                formatted_event["details"]["Протокол"] = event_data['network'].get('protocol', 'неизвестно')
-                formatted_event["details"]["Источник"] = f"{event_data['network'].get('source_ip', '')}:{event_data['network'].get('source_port', '')}"
-                formatted_event["details"]["Назначение"] = f"{event_data['network'].get('destination_ip', '')}:{event_data['network'].get('destination_port', '')}"
-            
-            events.append(formatted_event)
+            events.append(format_agent_event_hit(hit))
         
         return events
     except Exception as e:
@@ -1009,6 +1964,18 @@ async def delete_event(
 ):
     """Удаление события по ID"""
     try:
+        # Индекс события известен из таблицы расположения - удаляем напрямую
+        index = await locate_event(redis_client, event_id) if redis_client else None
+        if index:
+            try:
+                await opensearch.delete(index=index, id=event_id)
+                await forget_events(redis_client, [event_id])
+                logger.info(f"Удалено событие {event_id} из {index}")
+                return {"success": True, "message": "Событие удалено"}
+            except NotFoundError:
+                # Устаревшая запись (индекс удален) - ищем событие как раньше
+                await forget_events(redis_client, [event_id])
+        
         # Ищем событие во всех индексах
         search_body = {
             "query": {"term": {"_id": event_id}},
@@ -1045,12 +2012,66 @@ async def delete_event(
         
         raise HTTPException(status_code=404, detail="Событие не найдено")
         
-    except HTTPException:
+    except (HTTPException, ResilienceError):
         raise
     except Exception as e:
         logger.error(f"Ошибка удаления события {event_id}: {e}")
         raise HTTPException(status_code=500, detail="Ошибка удаления события")
 
+class BulkDeleteRequest(BaseModel):
+    event_ids: List[str] = Field(..., min_length=1, max_length=10000, description="ID удаляемых событий")
+
+@app.post("/events/bulk-delete")
+async def bulk_delete_events(
+    request: BulkDeleteRequest,
+    opensearch: AsyncOpenSearch = Depends(get_opensearch)
+):
+    """
+    Удаление нескольких событий одним запросом _bulk.
+    
+    Индексы берутся из таблицы расположения; для неизвестных событий
+    выполняется один поиск по ids во всех индексах событий.
+    """
+    try:
+        event_ids = list(dict.fromkeys(request.event_ids))
+        locations = await locate_events(redis_client, event_ids) if redis_client else {}
+        
+        missing = [event_id for event_id in event_ids if not locations.get(event_id)]
+        if missing:
+            response = await opensearch.search(
+                index=EVENT_INDEX_PATTERNS,
+                body={"query": {"ids": {"values": missing}}, "_source": False, "size": len(missing)},
+                ignore_unavailable=True
+            )
+            for hit in response['hits']['hits']:
+                locations[hit['_id']] = hit['_index']
+        
+        actions = [
+            {"delete": {"_index": index, "_id": event_id}}
+            for event_id, index in locations.items() if index
+        ]
+        deleted = 0
+        if actions:
+            with retry_safe():
+                response = await opensearch.bulk(body=actions)
+            deleted = sum(1 for item in response['items'] if item['delete'].get('result') == 'deleted')
+        
+        if redis_client:
+            await forget_events(redis_client, event_ids)
+        
+        logger.info(f"Массовое удаление: удалено {deleted} из {len(event_ids)} событий")
+        return {
+            "success": True,
+            "requested": len(event_ids),
+            "deleted": deleted,
+            "not_found": len(event_ids) - deleted
+        }
+    except ResilienceError:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка массового удаления событий: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка массового удаления событий")
+
 @app.get("/security-events", response_model=EventsResponse)
 async def get_security_events(
     limit: int = 100,
@@ -1118,7 +2139,7 @@ async def get_security_events(
             event_data['_index'] = hit['_index']
             events.append(event_data)
         
-        logger.info(f"Получено {len(events)} событий безопасности (страница {page}, всего {total})")
+        logger.debug("Получено %s событий безопасности (страница %s, всего %s)", len(events), page, total)
         
         return EventsResponse(
             events=events,
@@ -1127,6 +2148,8 @@ async def get_security_events(
             size=len(events)
         )
         
+    except ResilienceError:
+        raise
     except Exception as e:
         logger.error(f"Ошибка получения событий безопасности: {e}")
         raise HTTPException(status_code=500, detail="Ошибка получения событий безопасности")
@@ -1138,6 +2161,18 @@ async def get_event_by_id(
 ):
     """Получение конкретного события по ID"""
     try:
+        # Прямое чтение из известного индекса
+        index = await locate_event(redis_client, event_id) if redis_client else None
+        if index:
+            try:
+                hit = await opensearch.get(index=index, id=event_id)
+                event_data = hit['_source']
+                event_data['_id'] = hit['_id']
+                event_data['_index'] = hit['_index']
+                return event_data
+            except NotFoundError:
+                await forget_events(redis_client, [event_id])
+        
         # Поиск по всем индексам
         search_body = {
             "query": {"term": {"event_id": event_id}},
@@ -1157,9 +2192,13 @@ async def get_event_by_id(
         event_data['_id'] = hit['_id']
         event_data['_index'] = hit['_index']
         
+        # Запоминаем расположение для следующих запросов
+        if redis_client:
+            await record_event_locations(redis_client, {hit['_id']: hit['_index']})
+        
         return event_data
         
-    except HTTPException:
+    except (HTTPException, ResilienceError):
         raise
     except Exception as e:
         logger.error(f"Ошибка получения события {event_id}: {e}")
@@ -1171,17 +2210,13 @@ async def get_stats(
 ):
     """Получение статистики системы с данными агентов"""
     try:
-        logger.info("=== STATS: Запрос статистики для dashboard ===")
-        
         # Сначала получаем статистику агентов (активные хосты)
-        logger.info("=== STATS: Вызываю get_agent_stats_data ===")
         agent_stats = await get_agent_stats_data(opensearch)
-        logger.info(f"=== STATS: agent_stats = {agent_stats} ===")
+        logger.debug("agent_stats = %s", agent_stats)
         
         # Затем получаем статистику событий безопасности
-        logger.info("=== STATS: Вызываю get_security_stats_data ===")
         security_stats = await get_security_stats_data(opensearch)
-        logger.info(f"=== STATS: security_stats = {security_stats} ===")
+        logger.debug("security_stats = %s", security_stats)
         
         # Объединяем статистику
         combined_stats = {
@@ -1192,16 +2227,17 @@ async def get_stats(
             "events_per_hour": agent_stats["events_per_hour"] + security_stats["events_per_hour"]
         }
         
-        logger.info(f"Статистика получена: {combined_stats['total_events']} событий от {combined_stats['unique_hosts']} хостов")
+        logger.debug("Статистика получена: %s событий от %s хостов", combined_stats['total_events'], combined_stats['unique_hosts'])
         return combined_stats
         
+    except ResilienceError:
+        raise
     except Exception as e:
         logger.error(f"Ошибка получения статистики: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка получения статистики: {str(e)}")
 
 async def get_agent_stats_data(opensearch: AsyncOpenSearch):
     """Получение статистики агентов"""
-    logger.info("=== ENTERING get_agent_stats_data ===")
     search_body = {
         "query": {
             "bool": {
@@ -1215,14 +2251,14 @@ async def get_agent_stats_data(opensearch: AsyncOpenSearch):
     }
     
     try:
-        logger.info(f"Agent stats search body: {search_body}")
+        logger.debug("Agent stats search body: %s", LazyJSON(search_body))
         response = await opensearch.search(
             index="agent-events-*",
             body=search_body
         )
         
         total_events = response['hits']['total']['value']
-        logger.info(f"Agent stats SUCCESS: total_events={total_events}")
+        logger.debug("Agent stats: total_events=%s", total_events)
         
         # Простая версия без агрегации пока
         return {
@@ -1233,7 +2269,7 @@ async def get_agent_stats_data(opensearch: AsyncOpenSearch):
         }
     except Exception as e:
         logger.error(f"Ошибка при получении статистики агентов: {e}")
-        logger.error(f"Search body that failed: {search_body}")
+        logger.error("Search body that failed: %s", LazyJSON(search_body))
         return {
             "total_events": 0,
             "unique_hosts": 0,
@@ -1322,6 +2358,305 @@ async def simple_clear():
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+@app.post("/admin/rollups/backfill")
+async def backfill_rollups(
+    background_tasks: BackgroundTasks,
+    days: int = 30,
+    opensearch: AsyncOpenSearch = Depends(get_opensearch),
+    redis: aioredis.Redis = Depends(get_redis)
+):
+    """Пересчет сводок findings по уже сохраненным снимкам host_posture"""
+    if days < 1 or days > 365:
+        raise HTTPException(status_code=400, detail="days должен быть от 1 до 365")
+    background_tasks.add_task(backfill_findings_rollups, opensearch, redis, days)
+    return {"status": "started", "days": days}
+
+class ProfilingSettings(BaseModel):
+    enabled: Optional[bool] = Field(None, description="Включить/выключить профилирование")
+    sample_rate: Optional[float] = Field(None, ge=0, le=1, description="Доля профилируемых запросов")
+    slow_ms: Optional[float] = Field(None, ge=0, description="Порог медленного запроса, мс (0 - выключить)")
+    interval_ms: Optional[float] = Field(None, ge=1, le=1000, description="Интервал снятия стека, мс")
+
+# Настройки профилирования, общие для всех воркеров
+PROFILING_SETTINGS_KEY = "profiling:settings"
+
+async def apply_shared_profiling_settings(redis: aioredis.Redis):
+    """Применение настроек, сохраненных другим воркером (вызывается из фонового цикла)"""
+    raw = await redis.get(PROFILING_SETTINGS_KEY)
+    if raw:
+        profiler.configure(**json.loads(raw))
+
+# Версии перезагрузок по запросу (поле - ioc/reputation), общие для всех воркеров:
+# воркер, принявший /admin/.../reload, увеличивает версию, остальные
+# перезагружаются в фоновом цикле, увидев версию новее примененной
+RELOAD_VERSIONS_KEY = "admin:reload_versions"
+applied_reload_versions: Dict[str, int] = {}
+
+async def read_reload_versions(redis: aioredis.Redis) -> Dict[str, int]:
+    versions = {}
+    for name, version in (await redis.hgetall(RELOAD_VERSIONS_KEY)).items():
+        if isinstance(name, bytes):
+            name = name.decode()
+        versions[name] = int(version)
+    return versions
+
+async def seed_reload_versions():
+    """
+    Версии на момент запуска: воркер и так загружает IOC и список репутации
+    при старте, перезагружать их нужно только по более поздним запросам.
+    Без Redis версии начинаются с 0 и первая же известная версия вызовет
+    одну лишнюю перезагрузку.
+    """
+    if redis_client is None:
+        return
+    try:
+        applied_reload_versions.update(await read_reload_versions(redis_client))
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать версии перезагрузок: {e}")
+
+async def publish_reload(name: str):
+    """Сообщение остальным воркерам о перезагрузке, выполненной на этом воркере"""
+    if WORKERS > 1 and redis_client:
+        applied_reload_versions[name] = int(await redis_client.hincrby(RELOAD_VERSIONS_KEY, name, 1))
+
+async def apply_shared_reloads(redis: aioredis.Redis):
+    """Перезагрузки, запрошенные на других воркерах (вызывается из фонового цикла)"""
+    reloads = {"ioc": reload_ioc_index, "reputation": reload_reputation_list}
+    for name, version in (await read_reload_versions(redis)).items():
+        if name not in reloads or version <= applied_reload_versions.get(name, 0):
+            continue
+        # Версия фиксируется и при ошибке: повтор - следующим запросом на reload
+        applied_reload_versions[name] = version
+        try:
+            await reloads[name]()
+            logger.info(f"Перезагрузка {name} (версия {version}) по запросу другого воркера выполнена")
+        except Exception as e:
+            logger.error(f"Ошибка перезагрузки {name} (версия {version}) по запросу другого воркера: {e}")
+
+async def apply_shared_settings(redis: aioredis.Redis):
+    """Общие настройки и перезагрузки других воркеров (фоновый цикл воркера)"""
+    await apply_shared_profiling_settings(redis)
+    await apply_shared_reloads(redis)
+
+@app.get("/admin/profiling")
+async def get_profiling_settings():
+    """Текущие настройки профилирования"""
+    return {"worker_id": WORKER_ID, **profiler.settings()}
+
+@app.post("/admin/profiling")
+async def update_profiling_settings(settings: ProfilingSettings):
+    """Изменение настроек профилирования без перезапуска (на всех воркерах)"""
+    result = profiler.configure(**settings.dict())
+    if WORKERS > 1 and redis_client:
+        shared = {key: result[key] for key in ("enabled", "sample_rate", "slow_ms", "interval_ms")}
+        await redis_client.set(PROFILING_SETTINGS_KEY, json.dumps(shared))
+    logger.info(f"Настройки профилирования изменены: {result}")
+    return {"worker_id": WORKER_ID, **result}
+
+@app.get("/admin/resilience")
+async def get_resilience_stats():
+    """Состояние политик устойчивости: breaker, вызовы в обработке, счетчики повторов и отказов"""
+    return {
+        "worker_id": WORKER_ID,
+        "request_deadline_seconds": REQUEST_DEADLINE_SECONDS,
+        "backends": [opensearch_policy.stats(), redis_policy.stats()],
+    }
+
+@app.get("/admin/ioc")
+async def get_ioc_stats():
+    """Состояние индекса индикаторов компрометации"""
+    return {
+        "worker_id": WORKER_ID,
+        "enabled": IOC_MATCHING_ENABLED,
+        "version": ioc_holder.version,
+        **ioc_holder.index.stats(),
+    }
+
+@app.post("/admin/ioc/reload")
+async def reload_ioc():
+    """
+    Перестроение индекса IOC без перезапуска: на этом воркере сразу, на
+    остальных - в их фоновом цикле (METRICS_PUBLISH_INTERVAL)
+    """
+    try:
+        result = await reload_ioc_index()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка загрузки индикаторов: {e}")
+    await publish_reload("ioc")
+    return {"worker_id": WORKER_ID, **result}
+
+@app.get("/admin/report-schedule")
+async def get_report_schedule():
+    """Состояние расписания отчетов агентов: размер парка, частота отчетов, отставание и интервал"""
+    return {"worker_id": WORKER_ID, "enabled": REPORT_SCHEDULING_ENABLED, **report_scheduler.stats()}
+
+@app.get("/admin/reputation")
+async def get_reputation_stats():
+    """Счетчики кэша репутации файлов этого воркера (попадания по уровням, запросы к провайдеру)"""
+    if reputation_cache is None:
+        return {"worker_id": WORKER_ID, "enabled": False}
+    return {"worker_id": WORKER_ID, "enabled": True, **reputation_cache.stats()}
+
+@app.post("/admin/reputation/reload")
+async def reload_reputation():
+    """
+    Перечитывание REPUTATION_LIST_FILE: на этом воркере сразу, на остальных -
+    в их фоновом цикле. Версия списка входит в ключи Redis, поэтому вердикты
+    прежнего списка больше не используются.
+    """
+    if reputation_cache is None:
+        raise HTTPException(status_code=400, detail="Репутация файлов выключена: не задан REPUTATION_LIST_FILE")
+    try:
+        result = await reload_reputation_list()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка загрузки списка репутации: {e}")
+    await publish_reload("reputation")
+    return {"worker_id": WORKER_ID, **result}
+
+# Статистика воркеров корреляции аутентификации (auth_correlator.py), поле hash - shard/shards
+CORRELATION_STATS_KEY = "auth_corr:stats"
+
+@app.get("/admin/correlation")
+async def get_correlation_stats(redis: aioredis.Redis = Depends(get_redis)):
+    """Статистика корреляции аутентификации: ключи в памяти, срабатывания правил, контрольные точки"""
+    raw = await redis.hgetall(CORRELATION_STATS_KEY)
+    workers = [json.loads(value) for value in raw.values()]
+    return {
+        "workers": sorted(workers, key=lambda item: item.get("shard", "")),
+        "auth_events": sum(item.get("correlator", {}).get("auth_events", 0) for item in workers),
+        "alerts": sum(item.get("alerts", 0) for item in workers),
+    }
+
+@app.get("/admin/flows")
+async def get_flow_stats():
+    """Состояние агрегатора сетевых потоков этого воркера"""
+    return {"worker_id": WORKER_ID, "enabled": FLOW_AGGREGATION_ENABLED, **flow_aggregator.stats()}
+
+@app.post("/admin/flows/flush")
+async def flush_flow_windows(opensearch: AsyncOpenSearch = Depends(get_opensearch)):
+    """Немедленный сброс всех открытых окон потоков этого воркера"""
+    written = await flush_flows(flow_aggregator, opensearch, force=True)
+    return {"worker_id": WORKER_ID, "written": written, "open_flows": len(flow_aggregator)}
+
+# Статистика воркеров обнаружения (detection_worker.py), поле hash - имя потребителя
+DETECTION_STATS_KEY = "detection:stats"
+
+@app.get("/admin/detection")
+async def get_detection_stats(redis: aioredis.Redis = Depends(get_redis)):
+    """Статистика воркеров обнаружения: события, алерты, стоимость каждого правила"""
+    raw = await redis.hgetall(DETECTION_STATS_KEY)
+    workers = [json.loads(value) for value in raw.values()]
+    return {
+        "workers": sorted(workers, key=lambda item: item.get("consumer", "")),
+        "events": sum(item.get("events", 0) for item in workers),
+        "alerts": sum(item.get("alerts", 0) for item in workers),
+    }
+
+@app.get("/admin/posture-rules")
+async def get_posture_rules(redis: aioredis.Redis = Depends(get_redis)):
+    """Серверные правила posture и статистика процесса posture_evaluator.py"""
+    raw = await redis.hgetall(POSTURE_RULES_KEY)
+    version = await redis.get(POSTURE_RULES_VERSION_KEY)
+    evaluators = [json.loads(value) for value in (await redis.hgetall(POSTURE_STATS_KEY)).values()]
+    return {
+        "version": int(version or 0),
+        "rules": [json.loads(value) for _, value in sorted(raw.items())],
+        "evaluators": sorted(evaluators, key=lambda item: item.get("consumer", "")),
+    }
+
+@app.put("/admin/posture-rules/{rule_id}")
+async def put_posture_rule(rule_id: str, definition: Dict[str, Any], redis: aioredis.Redis = Depends(get_redis)):
+    """
+    Добавление или замена серверного правила posture.
+
+    Правило проверяется компиляцией; posture_evaluator.py замечает новую
+    версию правил и пересчитывает по всему парку только это правило.
+    """
+    definition = dict(definition, rule_id=rule_id)
+    try:
+        PostureRule(definition)
+    except PostureRuleError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    pipe = redis.pipeline()
+    pipe.hset(POSTURE_RULES_KEY, rule_id, json.dumps(definition, ensure_ascii=False))
+    pipe.incr(POSTURE_RULES_VERSION_KEY)
+    _, version = await pipe.execute()
+    logger.info(f"Правило posture {rule_id} сохранено, версия правил {version}")
+    return {"rule_id": rule_id, "version": version}
+
+@app.delete("/admin/posture-rules/{rule_id}")
+async def delete_posture_rule(rule_id: str, redis: aioredis.Redis = Depends(get_redis)):
+    """Удаление серверного правила posture; его findings удаляются при следующей синхронизации"""
+    if not await redis.hdel(POSTURE_RULES_KEY, rule_id):
+        raise HTTPException(status_code=404, detail=f"Правило {rule_id} не найдено")
+    version = await redis.incr(POSTURE_RULES_VERSION_KEY)
+    logger.info(f"Правило posture {rule_id} удалено, версия правил {version}")
+    return {"rule_id": rule_id, "version": version}
+
+@app.get("/admin/opensearch/queries")
+async def get_opensearch_query_costs(endpoint: Optional[str] = None, slow_limit: int = 50):
+    """Стоимость запросов к OpenSearch по эндпоинтам за скользящее окно и последние медленные запросы"""
+    slow_queries = list(query_tracker.slow_queries)
+    if endpoint:
+        slow_queries = [query for query in slow_queries if query["endpoint"] == endpoint]
+    return {
+        "worker_id": WORKER_ID,
+        "settings": query_tracker.settings(),
+        "aggregates": query_tracker.aggregates(endpoint),
+        "slow_queries": slow_queries[-slow_limit:][::-1],
+    }
+
+@app.get("/admin/profiles")
+async def list_profiles():
+    """Список сохраненных профилей, новые первыми"""
+    return {"worker_id": WORKER_ID, "profiles": profiler.list_profiles(), "settings": profiler.settings()}
+
+@app.get("/admin/profiles/{profile_id}")
+async def download_profile(profile_id: str, format: str = "json"):
+    """Профиль запроса: json (топ функций, стеки, вызовы OpenSearch) или collapsed (для flamegraph)"""
+    profile = profiler.get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    if format == "collapsed":
+        return PlainTextResponse(
+            profiler.collapsed(profile),
+            headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.folded"'}
+        )
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format должен быть json или collapsed")
+    return profiler.summarize(profile)
+
+@app.get("/api/trends/findings")
+async def get_findings_trends(
+    host_id: Optional[str] = None,
+    interval: str = "day",
+    days: int = 30,
+    include_rules: bool = False,
+    opensearch: AsyncOpenSearch = Depends(get_opensearch)
+):
+    """
+    Динамика количества findings по хосту или по всему парку.
+    
+    Параметры:
+    - host_id: ID хоста (без него - сводка по всему парку)
+    - interval: hour или day
+    - days: глубина в сутках (для hour не более 31)
+    - include_rules: добавить разбивку по rule_id в каждую точку
+    """
+    if interval not in ROLLUP_INTERVALS:
+        raise HTTPException(status_code=400, detail=f"interval должен быть одним из: {list(ROLLUP_INTERVALS)}")
+    max_days = 31 if interval == "hour" else 365
+    if days < 1 or days > max_days:
+        raise HTTPException(status_code=400, detail=f"days должен быть от 1 до {max_days}")
+    
+    try:
+        return await get_findings_trend(opensearch, host_id, interval, days, include_rules)
+    except ResilienceError:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка получения динамики findings: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка получения динамики findings")
+
 @app.get("/api/hosts")
 async def get_hosts():
     """Получить список всех хостов с последней активностью"""
@@ -1427,6 +2762,8 @@ async def get_host_latest_posture(host_id: str):
         else:
             raise HTTPException(status_code=404, detail="Host not found")
             
+    except ResilienceError:
+        raise
     except Exception as e:
         logger.error(f"Error getting host posture: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1437,7 +2774,7 @@ async def get_host_processes(host_id: str):
     try:
         posture = await get_host_latest_posture(host_id)
         return posture.get("inventory", {}).get("processes", [])
-    except HTTPException:
+    except (HTTPException, ResilienceError):
         raise
     except Exception as e:
         logger.error(f"Error getting host processes: {e}")
@@ -1449,7 +2786,7 @@ async def get_host_autoruns(host_id: str):
     try:
         posture = await get_host_latest_posture(host_id)
         return posture.get("inventory", {}).get("autoruns", {})
-    except HTTPException:
+    except (HTTPException, ResilienceError):
         raise
     except Exception as e:
         logger.error(f"Error getting host autoruns: {e}")
@@ -1461,24 +2798,337 @@ async def get_host_security(host_id: str):
     try:
         posture = await get_host_latest_posture(host_id)
         return posture.get("security", {})
-    except HTTPException:
+    except (HTTPException, ResilienceError):
         raise
     except Exception as e:
         logger.error(f"Error getting host security: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def get_server_findings(host_id: str) -> List[Dict[str, Any]]:
+    """Findings хоста по серверным правилам (posture_evaluator.py); при ошибке - пустой список"""
+    try:
+        response = await opensearch_client.search(
+            index=POSTURE_FINDINGS_INDEX,
+            body={"query": {"term": {"host_id": host_id}}, "size": 1000},
+            ignore_unavailable=True
+        )
+    except Exception as e:
+        logger.warning(f"Не удалось получить серверные findings хоста {host_id}: {e}")
+        return []
+    return [
+        {key: hit["_source"].get(key) for key in ("rule_id", "severity", "message_ru", "evidence", "source", "evaluated_at")}
+        for hit in response["hits"]["hits"]
+    ]
+
 @app.get("/api/host/{host_id}/findings")
 async def get_host_findings(host_id: str):
-    """Получить findings для конкретного хоста"""
+    """
+    Получить findings для конкретного хоста.
+
+    Findings агента из последнего снимка дополняются результатами серверных
+    правил; серверный результат правила заменяет findings агента с тем же rule_id.
+    """
     try:
         posture = await get_host_latest_posture(host_id)
-        return posture.get("findings", [])
-    except HTTPException:
+        server_findings = await get_server_findings(posture.get("host_info", {}).get("host_id") or host_id)
+        server_rules = {finding["rule_id"] for finding in server_findings}
+        agent_findings = [finding for finding in posture.get("findings") or [] if finding.get("rule_id") not in server_rules]
+        return agent_findings + server_findings
+    except (HTTPException, ResilienceError):
         raise
     except Exception as e:
         logger.error(f"Error getting host findings: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/posture/findings")
+async def get_posture_findings(
+    rule_id: Optional[str] = None,
+    severity: Optional[str] = None,
+    host_id: Optional[str] = None,
+    limit: int = 100,
+    opensearch: AsyncOpenSearch = Depends(get_opensearch)
+):
+    """
+    Findings серверных правил posture по всему парку.
+
+    Возвращает findings с фильтрами по правилу, severity и хосту и количество
+    хостов по каждому правилу и уровню severity.
+    """
+    filters = [{"term": {field: value}} for field, value in
+               (("rule_id", rule_id), ("severity", severity), ("host_id", host_id)) if value]
+    try:
+        response = await opensearch.search(
+            index=POSTURE_FINDINGS_INDEX,
+            body={
+                "query": {"bool": {"filter": filters}},
+                "sort": [{"rule_id": {"order": "asc"}}, {"host_id": {"order": "asc"}}],
+                "size": min(limit, 1000),
+                "aggs": {
+                    "rules": {"terms": {"field": "rule_id", "size": 500}},
+                    "severity": {"terms": {"field": "severity", "size": 10}}
+                }
+            },
+            ignore_unavailable=True
+        )
+    except ResilienceError:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка получения серверных findings: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка получения серверных findings")
+    aggregations = response.get("aggregations", {})
+    return {
+        "total": response["hits"]["total"]["value"],
+        "findings": [hit["_source"] for hit in response["hits"]["hits"]],
+        "by_rule": {b["key"]: b["doc_count"] for b in aggregations.get("rules", {}).get("buckets", [])},
+        "by_severity": {b["key"]: b["doc_count"] for b in aggregations.get("severity", {}).get("buckets", [])},
+    }
+
+async def resolve_tree_process(opensearch: AsyncOpenSearch, redis: aioredis.Redis,
+                               host_id: str, process: str) -> Dict[str, Any]:
+    """Документ экземпляра процесса по PID (текущий экземпляр) или ключу pid:start_ms"""
+    key = await resolve_process_key(redis, host_id, process)
+    doc = await get_process(opensearch, host_id, key) if key else None
+    if doc is None:
+        raise HTTPException(status_code=404, detail=f"Процесс {process} на хосте {host_id} не найден")
+    return doc
+
+@app.get("/api/host/{host_id}/process-tree/{process}/ancestry")
+async def get_process_ancestry(
+    host_id: str,
+    process: str,
+    opensearch: AsyncOpenSearch = Depends(get_opensearch),
+    redis: aioredis.Redis = Depends(get_redis)
+):
+    """
+    Цепочка предков процесса от корня.
+
+    process - PID (текущий живой экземпляр) или ключ экземпляра pid:start_ms
+    из process_key; предки читаются одним mget по сохраненному пути.
+    """
+    try:
+        key = await resolve_process_key(redis, host_id, process)
+        result = await get_ancestry(opensearch, host_id, key) if key else None
+    except ResilienceError:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка получения предков процесса {process} хоста {host_id}: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка получения дерева процессов")
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Процесс {process} на хосте {host_id} не найден")
+    return result
+
+@app.get("/api/host/{host_id}/process-tree/{process}/descendants")
+async def get_process_descendants(
+    host_id: str,
+    process: str,
+    max_depth: Optional[int] = None,
+    running_only: bool = False,
+    limit: int = 1000,
+    opensearch: AsyncOpenSearch = Depends(get_opensearch),
+    redis: aioredis.Redis = Depends(get_redis)
+):
+    """Потомки процесса плоским списком по уровням (depth) и времени запуска"""
+    try:
+        root = await resolve_tree_process(opensearch, redis, host_id, process)
+        descendants = await get_descendants(opensearch, host_id, root, max_depth, running_only, min(limit, MAX_DESCENDANTS))
+    except (HTTPException, ResilienceError):
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка получения потомков процесса {process} хоста {host_id}: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка получения дерева процессов")
+    return {"process": root, "descendants": descendants, "total": len(descendants)}
+
+@app.get("/api/host/{host_id}/process-tree/{process}/subtree")
+async def get_process_subtree(
+    host_id: str,
+    process: str,
+    max_depth: Optional[int] = None,
+    running_only: bool = False,
+    opensearch: AsyncOpenSearch = Depends(get_opensearch),
+    redis: aioredis.Redis = Depends(get_redis)
+):
+    """Поддерево процесса: вложенные children, собранные из одного запроса потомков"""
+    try:
+        root = await resolve_tree_process(opensearch, redis, host_id, process)
+        descendants = await get_descendants(opensearch, host_id, root, max_depth, running_only)
+    except (HTTPException, ResilienceError):
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка получения поддерева процесса {process} хоста {host_id}: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка получения дерева процессов")
+    return {"tree": build_subtree(root, descendants), "total": len(descendants) + 1}
+
+@app.get("/api/network/top-talkers")
+async def get_network_top_talkers(
+    by: str = "destination_ip",
+    metric: str = "bytes_total",
+    hours: int = 24,
+    host_id: Optional[str] = None,
+    flagged_only: bool = False,
+    limit: int = 10,
+    opensearch: AsyncOpenSearch = Depends(get_opensearch)
+):
+    """
+    Top talkers по агрегированным потокам network-flows.
+    
+    Параметры:
+    - by: source_ip, destination_ip, host_id, destination_port или protocol
+    - metric: bytes_total, bytes_sent, bytes_received или connections
+    - hours: глубина в часах (не более 720)
+    - host_id: только потоки одного хоста
+    - flagged_only: только помеченные потоки (IOC, списки угроз, severity)
+    """
+    if by not in TOP_TALKER_FIELDS:
+        raise HTTPException(status_code=400, detail=f"by должен быть одним из: {list(TOP_TALKER_FIELDS)}")
+    if metric not in TOP_TALKER_METRICS:
+        raise HTTPException(status_code=400, detail=f"metric должен быть одним из: {list(TOP_TALKER_METRICS)}")
+    if hours < 1 or hours > 720:
+        raise HTTPException(status_code=400, detail="hours должен быть от 1 до 720")
+    
+    try:
+        return await get_top_talkers(opensearch, by, metric, hours, host_id, flagged_only, min(max(limit, 1), 1000))
+    except ResilienceError:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка получения top talkers: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка получения top talkers")
+
+@app.get("/api/network/flows")
+async def get_network_flows(
+    host_id: Optional[str] = None,
+    ip: Optional[str] = None,
+    port: Optional[int] = None,
+    hours: int = 24,
+    flagged_only: bool = False,
+    size: int = 100,
+    opensearch: AsyncOpenSearch = Depends(get_opensearch)
+):
+    """Окна сетевых потоков хоста, адреса (источник или назначение) и порта назначения"""
+    if hours < 1 or hours > 720:
+        raise HTTPException(status_code=400, detail="hours должен быть от 1 до 720")
+    
+    try:
+        return await search_flows(opensearch, hours, host_id, ip, port, flagged_only, min(max(size, 1), 1000))
+    except ResilienceError:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка поиска сетевых потоков: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка поиска сетевых потоков")
+
+@app.get("/api/vulnerabilities")
+async def get_vulnerability_exposure(
+    min_cvss: Optional[float] = None,
+    limit: int = 20,
+    opensearch: AsyncOpenSearch = Depends(get_opensearch)
+):
+    """
+    Уязвимость парка по индексу уязвимостей: хосты по максимальному уровню
+    CVSS, число пар хост + CVE и CVE с наибольшим числом затронутых хостов.
+    
+    Параметры:
+    - min_cvss: только CVE с оценкой не ниже (для списка top_cves)
+    - limit: размер списка top_cves
+    """
+    try:
+        return await get_fleet_exposure(opensearch, min_cvss, min(max(limit, 1), 1000))
+    except ResilienceError:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка получения сводки уязвимостей парка: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка получения сводки уязвимостей")
+
+@app.get("/api/vulnerabilities/{cve_id}/hosts")
+async def get_vulnerability_hosts(
+    cve_id: str,
+    limit: int = 1000,
+    opensearch: AsyncOpenSearch = Depends(get_opensearch)
+):
+    """Хосты, затронутые CVE, и сводка CVE (оценка, число хостов)"""
+    try:
+        return await get_cve_exposure(opensearch, cve_id, min(max(limit, 1), 10000))
+    except ResilienceError:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка получения хостов с {cve_id}: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка получения хостов уязвимости")
+
+@app.get("/api/host/{host_id}/vulnerabilities")
+async def get_host_vulnerability_list(
+    host_id: str,
+    min_cvss: Optional[float] = None,
+    limit: int = 100,
+    opensearch: AsyncOpenSearch = Depends(get_opensearch)
+):
+    """Сводка (максимальный CVSS, число CVE по уровням) и уязвимости хоста по убыванию CVSS"""
+    try:
+        return await get_host_vulnerabilities(opensearch, host_id, min_cvss, min(max(limit, 1), 10000))
+    except ResilienceError:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка получения уязвимостей хоста {host_id}: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка получения уязвимостей хоста")
+
+# Ограничение пакетной проверки репутации хешей за один запрос
+REPUTATION_LOOKUP_MAX = 1000
+
+@app.post("/api/reputation/lookup")
+async def lookup_file_reputation(hashes: List[str], redis: aioredis.Redis = Depends(get_redis)):
+    """Пакетная проверка репутации хешей файлов (md5, sha1, sha256) через кэш"""
+    if reputation_cache is None:
+        raise HTTPException(status_code=400, detail="Репутация файлов выключена: не задан REPUTATION_LIST_FILE")
+    if len(hashes) > REPUTATION_LOOKUP_MAX:
+        raise HTTPException(status_code=400, detail=f"Не больше {REPUTATION_LOOKUP_MAX} хешей за запрос")
+    return {"verdicts": await reputation_cache.lookup_many(hashes, redis)}
+
+# Ограничение пакетной классификации IP за один запрос
+IP_CLASSIFY_MAX = 1000
+
+@app.post("/api/ip/classify")
+async def classify_ip_addresses(ips: List[str]):
+    """
+    Пакетная классификация IP-адресов: private, public, internal_site,
+    known_bad и другие классы, площадка и списки известных плохих адресов.
+    """
+    if len(ips) > IP_CLASSIFY_MAX:
+        raise HTTPException(status_code=400, detail=f"Не больше {IP_CLASSIFY_MAX} адресов за запрос")
+    return {"results": list(ip_classifier.classify_many(ips).values()), "stats": ip_classifier.stats()}
+
+@app.get("/api/inventory/search")
+async def search_inventory(
+    name: Optional[str] = None,
+    path: Optional[str] = None,
+    cmdline: Optional[str] = None,
+    hash: Optional[str] = None,
+    kind: Optional[str] = None,
+    limit: int = Query(100, ge=1),
+    opensearch: AsyncOpenSearch = Depends(get_opensearch)
+):
+    """
+    Поиск хостов по инвентарю последнего снимка.
+    
+    Параметры:
+    - name: имя процесса / записи автозапуска / службы / задачи (без учета регистра)
+    - path: полный путь к исполняемому файлу
+    - cmdline: подстрока командной строки (значения Run-ключа, действия задачи)
+    - hash: SHA256 исполняемого файла
+    - kind: process, registry, startup, service или task
+    """
+    if not any([name, path, cmdline, hash]):
+        raise HTTPException(status_code=400, detail="Укажите хотя бы один из параметров: name, path, cmdline, hash")
+    if kind and kind not in INVENTORY_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind должен быть одним из: {list(INVENTORY_KINDS)}")
+    if limit > 1000:
+        limit = 1000
+    
+    try:
+        query = build_inventory_query(kind=kind, name=name, path=path, cmdline=cmdline, hash=hash)
+        return await search_inventory_hosts(opensearch, query, limit=limit)
+    except ResilienceError:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка поиска по инвентарю: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка поиска по инвентарю")
+
 # Точка входа для запуска
 if __name__ == "__main__":
     uvicorn.run(
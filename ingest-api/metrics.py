@@ -0,0 +1,412 @@
+"""
+Встроенные метрики Ingest API в формате Prometheus.
+
+Минимальная реализация без внешних зависимостей: счетчики, gauge и
+гистограммы с фиксированными бакетами. Наблюдение значения - это поиск
+бакета bisect и два сложения (меньше микросекунды), полный набор метрик
+одного события обходится в несколько микросекунд
+(см. benchmarks/bench_metrics.py).
+
+Все значения хранятся в памяти процесса и изменяются только из event loop,
+блокировки не нужны. В многопроцессном режиме (server.py) каждый воркер
+публикует снимок своих серий (snapshot) в Redis, а /metrics складывает
+снимки всех живых воркеров (render с параметром snapshots).
+"""
+
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Бакеты латентности стадий (секунды): от 100 мкс до 10 с
+DEFAULT_LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+    def series(self) -> Dict[LabelValues, object]:
+        """Текущие значения по наборам меток (для снимка воркера)"""
+        raise NotImplementedError
+
+    def merge(self, snapshot: List[list]) -> None:
+        """Добавление серий из снимка другого воркера"""
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+    def series(self) -> Dict[LabelValues, float]:
+        return dict(self._values)
+
+    def merge(self, snapshot: List[list]) -> None:
+        for labels, value in snapshot:
+            self.inc(*labels, amount=value)
+
+
+class Gauge(_Metric):
+    """
+    Текущее значение.
+
+    Значение либо устанавливается явно (set/inc/dec), либо вычисляется
+    в момент чтения функцией, переданной в set_function.
+
+    merge_mode определяет объединение значений воркеров: "sum" для
+    величин процесса (запросы в обработке, соединения), "max" для общих
+    величин, которые каждый воркер читает из одного источника.
+    """
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 merge_mode: str = "sum"):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], Dict[LabelValues, float]]] = None
+        self.merge_mode = merge_mode
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) - amount
+
+    def set_function(self, function: Callable[[], Dict[LabelValues, float]]) -> None:
+        self._function = function
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def merge(self, snapshot: List[list]) -> None:
+        for labels, value in snapshot:
+            labels = tuple(labels)
+            if self.merge_mode == "max":
+                self._values[labels] = max(self._values.get(labels, value), value)
+            else:
+                self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def series(self) -> Dict[LabelValues, float]:
+        values = dict(self._values)
+        if self._function is not None:
+            try:
+                values.update(self._function())
+            except Exception:
+                pass
+        return values
+
+    def render(self, values: Optional[Dict[LabelValues, float]] = None) -> List[str]:
+        if values is None:
+            values = self.series()
+        lines = self._header()
+        for labels, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными бакетами"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [счетчики бакетов..., счетчик +Inf, сумма]
+        self._series: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, *labels: str) -> "_Timer":
+        """Контекстный менеджер, измеряющий длительность блока"""
+        return _Timer(self, labels)
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return int(sum(series[:-1])) if series else 0
+
+    def series(self) -> Dict[LabelValues, List[float]]:
+        return {labels: list(values) for labels, values in self._series.items()}
+
+    def merge(self, snapshot: List[list]) -> None:
+        for labels, values in snapshot:
+            labels = tuple(labels)
+            series = self._series.get(labels)
+            if series is None or len(series) != len(values):
+                self._series[labels] = list(values)
+            else:
+                for i, value in enumerate(values):
+                    series[i] += value
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for labels, series in self._series.items():
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {_format_value(cumulative)}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{label_str} {_format_value(cumulative)}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_labels", "_start")
+
+    def __init__(self, histogram: Histogram, labels: LabelValues):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._histogram.observe(time.perf_counter() - self._start, *self._labels)
+
+
+class Registry:
+    """Набор метрик, отдаваемых в /metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              merge_mode: str = "sum") -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, merge_mode))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self, snapshots: Optional[Iterable[Dict[str, List[list]]]] = None) -> str:
+        """
+        Текст в формате Prometheus. Если переданы снимки других воркеров,
+        их серии складываются с сериями этого процесса.
+        """
+        if snapshots is None:
+            lines: List[str] = []
+            for metric in self._metrics.values():
+                lines.extend(metric.render())
+            return "\n".join(lines) + "\n"
+
+        merged = Registry()
+        for name, metric in self._metrics.items():
+            if isinstance(metric, Histogram):
+                copy: _Metric = merged.histogram(name, metric.documentation, metric.labelnames, metric.buckets)
+            elif isinstance(metric, Gauge):
+                copy = merged.gauge(name, metric.documentation, metric.labelnames, metric.merge_mode)
+            else:
+                copy = merged.counter(name, metric.documentation, metric.labelnames)
+            copy.merge([[labels, value] for labels, value in metric.series().items()])
+        for snapshot in snapshots:
+            for name, series in snapshot.items():
+                metric = merged._metrics.get(name)
+                if metric is not None:
+                    metric.merge([[tuple(labels), value] for labels, value in series])
+        return merged.render()
+
+    def snapshot(self) -> Dict[str, List[list]]:
+        """Серии всех метрик процесса в виде, пригодном для JSON"""
+        return {
+            name: [[list(labels), value] for labels, value in metric.series().items()]
+            for name, metric in self._metrics.items()
+        }
+
+
+REGISTRY = Registry()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# === Метрики конвейера приема ===
+
+INGEST_STAGE_SECONDS = REGISTRY.histogram(
+    "ingest_stage_duration_seconds",
+    "Длительность стадий обработки события",
+    ("endpoint", "stage"),
+)
+
+INGEST_EVENTS_TOTAL = REGISTRY.counter(
+    "ingest_events_total",
+    "Обработанные события по результату",
+    ("endpoint", "event_type", "status"),
+)
+
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "http_requests_in_flight",
+    "Запросы, обрабатываемые в данный момент",
+)
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Полное время обработки HTTP-запроса",
+    ("method", "path", "status"),
+)
+
+BACKEND_POOL_CONNECTIONS = REGISTRY.gauge(
+    "backend_pool_connections",
+    "Состояние пулов соединений с OpenSearch и Redis",
+    ("backend", "state"),
+)
+
+STREAM_LENGTH = REGISTRY.gauge(
+    "redis_stream_length",
+    "Количество записей в Redis Streams событий",
+    ("stream",),
+    merge_mode="max",
+)
+
+LOG_RECORDS = REGISTRY.gauge(
+    "log_records",
+    "Очередь логирования: ожидающие, отброшенные при переполнении и подавленные лимитом записи",
+    ("state",),
+)
+
+# === Стоимость запросов к OpenSearch (см. opensearch_tracing.py) ===
+
+OPENSEARCH_REQUEST_SECONDS = REGISTRY.histogram(
+    "opensearch_request_duration_seconds",
+    "Время вызовов OpenSearch на стороне клиента по эндпоинтам API",
+    ("endpoint", "operation"),
+)
+
+OPENSEARCH_RESPONSE_BYTES = REGISTRY.counter(
+    "opensearch_response_bytes_total",
+    "Объем ответов OpenSearch по эндпоинтам API",
+    ("endpoint", "operation"),
+)
+
+# === Устойчивость вызовов бэкендов (см. shared/resilience.py) ===
+
+BACKEND_RESILIENCE_EVENTS = REGISTRY.counter(
+    "backend_resilience_events_total",
+    "События политик устойчивости: вызовы, сбои, повторы, таймауты, отказы breaker и bulkhead",
+    ("backend", "event"),
+)
+
+BACKEND_CIRCUIT_STATE = REGISTRY.gauge(
+    "backend_circuit_state",
+    "Состояние circuit breaker бэкенда (1 - текущее)",
+    ("backend", "state"),
+    merge_mode="max",
+)
+
+BACKEND_CALLS_IN_FLIGHT = REGISTRY.gauge(
+    "backend_calls_in_flight",
+    "Вызовы бэкенда в обработке (занятые слоты bulkhead)",
+    ("backend",),
+)
+
+# === Индикаторы компрометации (см. shared/ioc.py) ===
+
+IOC_MATCHES = REGISTRY.counter(
+    "ioc_matches_total",
+    "Совпадения с индикаторами компрометации при приеме",
+    ("endpoint", "indicator_type"),
+)
+
+REPUTATION_VERDICTS = REGISTRY.counter(
+    "file_reputation_verdicts_total",
+    "Вердикты репутации хешей файлов, записанные в события при приеме",
+    ("endpoint", "verdict"),
+)
+
+IOC_INDICATORS = REGISTRY.gauge(
+    "ioc_indicators",
+    "Индикаторы в текущем индексе IOC по типам",
+    ("indicator_type",),
+    merge_mode="max",
+)
+
+# === Условная загрузка снимков host_posture (см. posture_sections.py) ===
+
+POSTURE_SECTIONS_TOTAL = REGISTRY.counter(
+    "posture_sections_total",
+    "Разделы снимков host_posture с хешами: присланные агентом и взятые из сохраненного снимка",
+    ("section", "source"),
+)
+
+# === Расписание отчетов агентов (см. report_scheduler.py) ===
+
+REPORT_SCHEDULE_INTERVAL = REGISTRY.gauge(
+    "report_schedule_interval_seconds",
+    "Интервал отчетов парка с учетом емкости и нагрузки, без поправки на историю хоста",
+    merge_mode="max",
+)
+
+REPORT_SCHEDULE_LOAD = REGISTRY.gauge(
+    "report_schedule_load",
+    "Коэффициенты загрузки, по которым растягивается интервал отчетов (1 - предел)",
+    ("signal",),
+    merge_mode="max",
+)
@@ -0,0 +1,309 @@
+"""
+Учет стоимости запросов к OpenSearch по эндпоинтам API.
+
+TracedOpenSearch - тонкая обертка над AsyncOpenSearch: все атрибуты
+проксируются в исходный клиент, а вызовы из TRACED_OPERATIONS дополнительно
+замеряются. На каждый вызов фиксируются:
+- эндпоинт API (шаблон маршрута FastAPI, "background" вне запроса);
+- операция и шаблон индекса (даты в именах индексов заменяются на *);
+- время на стороне клиента и took из ответа;
+- число шардов (всего/с ошибкой/пропущено), hits и размер ответа в байтах.
+
+Размер ответа считает TracedAIOHttpConnection - класс соединения, который
+видит сырой ответ до десериализации.
+
+Агрегаты ведутся по ключу (эндпоинт, операция, шаблон индекса) в минутных
+корзинах за последние window_minutes минут. Запросы дольше порога
+пишутся в лог opensearch.slow вместе с нормализованным телом (литералы
+заменены на "?"), по которому одинаковые запросы с разными параметрами
+группируются в один fingerprint.
+"""
+
+import contextvars
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from opensearchpy import AIOHttpConnection
+
+from metrics import OPENSEARCH_REQUEST_SECONDS, OPENSEARCH_RESPONSE_BYTES
+
+slow_logger = logging.getLogger("opensearch.slow")
+
+TRACED_OPERATIONS = (
+    "search", "count", "msearch", "get", "mget", "exists", "index", "update",
+    "delete", "bulk", "delete_by_query", "update_by_query", "scroll",
+)
+
+# Даты и номера в именах ежедневных индексов: agent-events-2025.09.01 -> agent-events-*
+_INDEX_DATE = re.compile(r"\d{4}[.\-]\d{2}[.\-]\d{2}.*$|\d{6,}$")
+
+# Операции записи: тело - это документы, а не запрос, в журнал оно не попадает
+WRITE_OPERATIONS = frozenset(("index", "update", "bulk"))
+
+# Максимальная длина нормализованного тела в логе
+MAX_NORMALIZED_BODY = 4000
+
+# Байты ответа текущего вызова; ячейку создает TracedOpenSearch, заполняет соединение
+_response_bytes: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar(
+    "opensearch_response_bytes", default=None
+)
+# ASGI scope текущего запроса: маршрут в нем появляется после роутинга
+_request_scope: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    "opensearch_request_scope", default=None
+)
+
+
+def bind_request_scope(scope: Dict[str, Any]) -> None:
+    """Привязка вызовов OpenSearch к текущему HTTP-запросу (вызывается из middleware)"""
+    _request_scope.set(scope)
+
+
+def current_endpoint() -> str:
+    scope = _request_scope.get()
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+
+def index_pattern(index: Any) -> str:
+    """Шаблон индекса: даты заменяются на *, списки объединяются через запятую"""
+    if not index:
+        return "_all"
+    if isinstance(index, (list, tuple)):
+        index = ",".join(index)
+    return ",".join(sorted({_INDEX_DATE.sub("*", part) for part in str(index).split(",")}))
+
+
+def normalize_body(body: Any) -> Any:
+    """Тело запроса без литералов: структура сохраняется, значения заменяются на "?"."""
+    if isinstance(body, dict):
+        return {key: normalize_body(value) for key, value in sorted(body.items())}
+    if isinstance(body, (list, tuple)):
+        if not body:
+            return []
+        normalized = [normalize_body(item) for item in body]
+        # Списки литералов (terms, ids) и одинаковых по структуре элементов схлопываются
+        if all(item == normalized[0] for item in normalized):
+            return normalized[:1]
+        return normalized
+    return "?"
+
+
+def query_fingerprint(normalized: Any) -> str:
+    return hashlib.sha1(json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+class TracedAIOHttpConnection(AIOHttpConnection):
+    """Соединение, сообщающее размер сырого ответа трассировщику"""
+
+    async def perform_request(self, *args, **kwargs):
+        status, headers, raw_data = await super().perform_request(*args, **kwargs)
+        cell = _response_bytes.get()
+        if cell is not None and raw_data:
+            cell[0] += len(raw_data) if isinstance(raw_data, bytes) else len(raw_data.encode("utf-8"))
+        return status, headers, raw_data
+
+
+class _Bucket:
+    __slots__ = ("minute", "stats")
+
+    def __init__(self, minute: int):
+        self.minute = minute
+        self.stats: Dict[Tuple[str, str, str], Dict[str, float]] = {}
+
+
+def _new_stats() -> Dict[str, float]:
+    return {
+        "calls": 0, "errors": 0, "client_ms": 0.0, "max_client_ms": 0.0, "took_ms": 0.0,
+        "max_took_ms": 0.0, "shards_total": 0, "shards_failed": 0, "shards_skipped": 0,
+        "hits_total": 0, "hits_returned": 0, "response_bytes": 0, "slow": 0,
+    }
+
+
+class QueryCostTracker:
+    """Скользящие агрегаты стоимости запросов и журнал медленных запросов"""
+
+    def __init__(self, slow_ms: float = 500.0, window_minutes: int = 15, slow_log_size: int = 100):
+        self.slow_ms = slow_ms
+        self.window_minutes = window_minutes
+        self.buckets: Deque[_Bucket] = deque()
+        self.slow_queries: Deque[Dict[str, Any]] = deque(maxlen=slow_log_size)
+
+    def _bucket(self, now: float) -> _Bucket:
+        minute = int(now // 60)
+        if not self.buckets or self.buckets[-1].minute != minute:
+            self.buckets.append(_Bucket(minute))
+        while self.buckets[0].minute <= minute - self.window_minutes:
+            self.buckets.popleft()
+        return self.buckets[-1]
+
+    def record(self, endpoint: str, operation: str, index: str, body: Any, client_ms: float,
+               response: Any, response_bytes: int, error: Optional[str] = None) -> None:
+        stats = self._bucket(time.time()).stats
+        key = (endpoint, operation, index)
+        entry = stats.get(key)
+        if entry is None:
+            entry = stats[key] = _new_stats()
+
+        took, shards, hits_total, hits_returned = _response_cost(operation, response)
+        entry["calls"] += 1
+        entry["client_ms"] += client_ms
+        entry["max_client_ms"] = max(entry["max_client_ms"], client_ms)
+        entry["took_ms"] += took
+        entry["max_took_ms"] = max(entry["max_took_ms"], took)
+        entry["shards_total"] += shards.get("total", 0)
+        entry["shards_failed"] += shards.get("failed", 0)
+        entry["shards_skipped"] += shards.get("skipped", 0)
+        entry["hits_total"] += hits_total
+        entry["hits_returned"] += hits_returned
+        entry["response_bytes"] += response_bytes
+        if error:
+            entry["errors"] += 1
+
+        OPENSEARCH_REQUEST_SECONDS.observe(client_ms / 1000, endpoint, operation)
+        OPENSEARCH_RESPONSE_BYTES.inc(endpoint, operation, amount=response_bytes)
+
+        if self.slow_ms and max(client_ms, took) >= self.slow_ms:
+            entry["slow"] += 1
+            normalized = normalize_body(body) if body is not None else None
+            normalized_text = json.dumps(normalized, ensure_ascii=False)[:MAX_NORMALIZED_BODY]
+            slow_query = {
+                "timestamp": time.time(),
+                "endpoint": endpoint,
+                "operation": operation,
+                "index": index,
+                "client_ms": round(client_ms, 2),
+                "took_ms": took,
+                "shards": shards,
+                "hits_total": hits_total,
+                "hits_returned": hits_returned,
+                "response_bytes": response_bytes,
+                "fingerprint": query_fingerprint([operation, index, normalized]),
+                "body": normalized_text,
+                "error": error,
+            }
+            self.slow_queries.append(slow_query)
+            slow_logger.warning(
+                "Медленный запрос OpenSearch %s %s [%s] %.1f мс (took %s мс, шардов %s, hits %s, %s байт) "
+                "fingerprint=%s body=%s",
+                endpoint, operation, index, client_ms, took, shards.get("total", 0), hits_total,
+                response_bytes, slow_query["fingerprint"], normalized_text
+            )
+
+    def aggregates(self, endpoint: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Сводка за окно по (эндпоинт, операция, индекс), самые дорогие первыми"""
+        self._bucket(time.time())
+        merged: Dict[Tuple[str, str, str], Dict[str, float]] = {}
+        for bucket in self.buckets:
+            for key, stats in bucket.stats.items():
+                if endpoint and key[0] != endpoint:
+                    continue
+                total = merged.get(key)
+                if total is None:
+                    total = merged[key] = _new_stats()
+                for field, value in stats.items():
+                    if field.startswith("max_"):
+                        total[field] = max(total[field], value)
+                    else:
+                        total[field] += value
+
+        result = []
+        for (endpoint_name, operation, index), stats in merged.items():
+            calls = stats["calls"] or 1
+            result.append({
+                "endpoint": endpoint_name,
+                "operation": operation,
+                "index": index,
+                **{field: round(value, 2) for field, value in stats.items()},
+                "avg_client_ms": round(stats["client_ms"] / calls, 2),
+                "avg_took_ms": round(stats["took_ms"] / calls, 2),
+                "avg_response_bytes": int(stats["response_bytes"] / calls),
+            })
+        result.sort(key=lambda item: item["client_ms"], reverse=True)
+        return result
+
+    def settings(self) -> Dict[str, Any]:
+        return {"slow_ms": self.slow_ms, "window_minutes": self.window_minutes}
+
+
+def _response_cost(operation: str, response: Any) -> Tuple[float, Dict[str, int], int, int]:
+    """took, шарды, всего hits и возвращено hits из ответа OpenSearch"""
+    if not isinstance(response, dict):
+        return 0.0, {}, 0, 0
+    if operation == "msearch":
+        took, shards, total, returned = float(response.get("took", 0)), {}, 0, 0
+        for item in response.get("responses", []):
+            _, item_shards, item_total, item_returned = _response_cost("search", item)
+            for field, value in item_shards.items():
+                shards[field] = shards.get(field, 0) + value
+            total += item_total
+            returned += item_returned
+        return took, shards, total, returned
+
+    shards_info = response.get("_shards") or {}
+    shards = {field: shards_info.get(field, 0) for field in ("total", "failed", "skipped")}
+    hits = response.get("hits")
+    total = returned = 0
+    if isinstance(hits, dict):
+        hits_total = hits.get("total", 0)
+        total = hits_total.get("value", 0) if isinstance(hits_total, dict) else hits_total or 0
+        returned = len(hits.get("hits", ()))
+    elif operation == "count":
+        total = response.get("count", 0)
+    elif operation == "bulk":
+        returned = len(response.get("items", ()))
+    elif operation in ("delete_by_query", "update_by_query"):
+        total = response.get("total", 0)
+    return float(response.get("took", 0) or 0), shards, total, returned
+
+
+class TracedOpenSearch:
+    """Прокси над AsyncOpenSearch с учетом стоимости каждого вызова"""
+
+    def __init__(self, client, tracker: QueryCostTracker):
+        self._client = client
+        self._tracker = tracker
+        for operation in TRACED_OPERATIONS:
+            if hasattr(client, operation):
+                setattr(self, operation, self._traced(operation, getattr(client, operation)))
+
+    def __getattr__(self, name: str):
+        return getattr(self._client, name)
+
+    def _traced(self, operation: str, method):
+        tracker = self._tracker
+
+        async def call(*args, **kwargs):
+            index = kwargs.get("index")
+            if index is None and args and isinstance(args[0], (str, list, tuple)):
+                index = args[0]
+            body = None if operation in WRITE_OPERATIONS else kwargs.get("body")
+            cell = [0]
+            token = _response_bytes.set(cell)
+            start = time.perf_counter()
+            response = None
+            error = None
+            try:
+                response = await method(*args, **kwargs)
+                return response
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                _response_bytes.reset(token)
+                try:
+                    tracker.record(
+                        current_endpoint(), operation, index_pattern(index), body,
+                        (time.perf_counter() - start) * 1000, response, cell[0], error
+                    )
+                except Exception as e:
+                    slow_logger.debug("Ошибка учета запроса OpenSearch: %s", e)
+
+        call.__name__ = operation
+        return call
@@ -0,0 +1,428 @@
+"""
+Серверная оценка правил состояния (posture) по всему парку.
+
+Findings в снимках host_posture считает агент при сборе, поэтому новое или
+измененное правило доходит до хоста только с его следующим отчетом. Этот
+процесс держит в памяти последние настройки безопасности каждого хоста
+(defender, firewall, uac, rdp, bitlocker, smb1, windows_update) в виде
+колонок с bitmap-индексом и оценивает правила shared/posture_rules.py сразу
+по всему парку. Результат - документы индекса posture-findings, по одному на
+хост и правило (ID host_id:rule_id); записываются только изменения.
+
+- при запуске таблица заполняется последними снимками из agent-events-*
+  за --history-days суток, затем findings индекса сверяются с результатом;
+- новые снимки читаются из потока events:host_posture группой потребителей
+  и обновляют findings своих хостов;
+- правила хранятся в Redis (hash posture:rules, поле - rule_id); при пустом
+  hash он заполняется из posture_rules.json. Ingest API меняет правила через
+  /admin/posture-rules и увеличивает posture:rules:version - процесс замечает
+  это на следующей итерации и оценивает только добавленные и измененные
+  правила;
+- раз в --refresh-interval секунд правила пересчитываются целиком (условия
+  на возраст дат зависят от текущего дня).
+
+    python posture_evaluator.py --history-days 30
+
+Процесс держит полное состояние парка, поэтому в группе должен быть один
+потребитель; второй экземпляр запускается со своей --group.
+Статистика пишется в Redis (hash posture:stats) и показывается
+GET /admin/posture-rules в Ingest API.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis.asyncio as aioredis
+from opensearchpy import AsyncOpenSearch
+from redis.exceptions import RedisError, ResponseError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.posture_rules import (  # noqa: E402
+    PostureEvaluator, PostureRule, RuleChange, iter_rows,
+)
+from shared.resilience import retry_safe  # noqa: E402
+from detection_worker import _text, decode_stream_fields  # noqa: E402
+
+logger = logging.getLogger("ingest.posture")
+
+POSTURE_STREAM = "events:host_posture"
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "posture_rules.json")
+FINDINGS_INDEX = "posture-findings"
+RULES_KEY = "posture:rules"
+RULES_VERSION_KEY = "posture:rules:version"
+STATS_KEY = "posture:stats"
+
+# Поля записи потока и документа, из которых строятся колонки
+SNAPSHOT_FIELDS = frozenset(("host_info", "host", "timestamp", "security", "windows_update"))
+
+FINDINGS_INDEX_BODY = {
+    "mappings": {
+        "properties": {
+            "host_id": {"type": "keyword"},
+            "hostname": {"type": "keyword"},
+            "rule_id": {"type": "keyword"},
+            "severity": {"type": "keyword"},
+            "message_ru": {"type": "text"},
+            "evidence": {"type": "text"},
+            "source": {"type": "keyword"},
+            "rule_digest": {"type": "keyword"},
+            "snapshot_timestamp": {"type": "date"},
+            "evaluated_at": {"type": "date"}
+        }
+    }
+}
+
+
+async def ensure_findings_index(opensearch: AsyncOpenSearch) -> None:
+    """Создание индекса серверных findings, если его ещё нет"""
+    if not await opensearch.indices.exists(index=FINDINGS_INDEX):
+        await opensearch.indices.create(index=FINDINGS_INDEX, body=FINDINGS_INDEX_BODY)
+        logger.info(f"Создан индекс {FINDINGS_INDEX}")
+
+
+def finding_id(host_id: str, rule_id: str) -> str:
+    return f"{host_id}:{rule_id}"
+
+
+def parse_rule_definitions(raw: Dict[Any, Any]) -> List[PostureRule]:
+    """Правила из hash posture:rules; ошибочные пропускаются с записью в лог"""
+    rules = []
+    for rule_id, value in sorted(raw.items()):
+        try:
+            rules.append(PostureRule(json.loads(value)))
+        except (ValueError, TypeError) as e:
+            logger.error(f"Правило {_text(rule_id)} пропущено: {e}")
+    return rules
+
+
+async def seed_rules(redis: aioredis.Redis, rules_file: str) -> int:
+    """Заполнение пустого hash правил из файла; существующие правила не перезаписываются"""
+    if await redis.exists(RULES_KEY):
+        return 0
+    with open(rules_file, encoding="utf-8") as f:
+        data = json.load(f)
+    definitions = data.get("rules", []) if isinstance(data, dict) else data
+    added = 0
+    for definition in definitions:
+        PostureRule(definition)
+        added += await redis.hsetnx(RULES_KEY, definition["rule_id"], json.dumps(definition, ensure_ascii=False))
+    if added:
+        await redis.incr(RULES_VERSION_KEY)
+        logger.info(f"В {RULES_KEY} загружено правил из {rules_file}: {added}")
+    return added
+
+
+class PostureRuleWorker:
+    """Таблица последних снимков парка, правила из Redis и запись изменений findings"""
+
+    def __init__(self, redis: aioredis.Redis, opensearch: AsyncOpenSearch,
+                 evaluator: Optional[PostureEvaluator] = None, group: str = "posture-rules",
+                 consumer: Optional[str] = None, rules_file: str = DEFAULT_RULES_FILE,
+                 history_days: int = 30, batch_size: int = 500, block_ms: int = 1000,
+                 retry_delay: float = 5.0, stats_interval: float = 30.0,
+                 refresh_interval: float = 3600.0, bulk_size: int = 1000, page_size: int = 500):
+        self.redis = redis
+        self.opensearch = opensearch
+        self.evaluator = evaluator or PostureEvaluator()
+        self.group = group
+        self.consumer = consumer or socket.gethostname()
+        self.rules_file = rules_file
+        self.history_days = history_days
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.retry_delay = retry_delay
+        self.stats_interval = stats_interval
+        self.refresh_interval = refresh_interval
+        self.bulk_size = bulk_size
+        self.page_size = page_size
+        self.rules_version: Optional[bytes] = None
+        self.last_rule_change: Optional[Dict[str, Any]] = None
+        # Строки (rule_id -> маска), чьи findings не записаны: маски оценщика
+        # уже изменены, поэтому запись повторяется по ним, а не по изменениям
+        self.unwritten: Dict[str, int] = {}
+        self._stopping = asyncio.Event()
+        self.counters = {"snapshots": 0, "findings_upserted": 0, "findings_deleted": 0,
+                         "write_errors": 0, "batches": 0, "rule_syncs": 0, "decode_errors": 0}
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    async def ensure_group(self) -> None:
+        # Группа создается до загрузки истории: снимки, пришедшие во время загрузки, не теряются
+        try:
+            await self.redis.xgroup_create(POSTURE_STREAM, self.group, id="$", mkstream=True)
+            logger.info(f"Создана группа {self.group} для {POSTURE_STREAM}")
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def load_fleet(self) -> int:
+        """Последние снимки хостов из OpenSearch (постранично, только нужные поля)"""
+        table = self.evaluator.table
+        body: Dict[str, Any] = {
+            "query": {"bool": {"filter": [
+                {"term": {"event_type": "host_posture"}},
+                {"range": {"timestamp": {"gte": f"now-{self.history_days}d/d"}}}
+            ]}},
+            "sort": [{"timestamp": {"order": "asc"}}, {"_id": {"order": "asc"}}],
+            "_source": ["host_info.host_id", "host_info.hostname", "timestamp", "security", "windows_update"],
+            "size": self.page_size
+        }
+        snapshots = 0
+        while True:
+            response = await self.opensearch.search(index="agent-events-*", body=body, ignore_unavailable=True)
+            hits = response["hits"]["hits"]
+            if not hits:
+                break
+            for hit in hits:
+                table.upsert_snapshot(hit["_source"])
+            snapshots += len(hits)
+            body["search_after"] = hits[-1]["sort"]
+        logger.info(f"Загружено {snapshots} снимков host_posture, хостов: {len(table)}")
+        return snapshots
+
+    async def initial_sync(self) -> None:
+        """Загрузка парка и правил, запись всех findings и удаление устаревших документов индекса"""
+        await ensure_findings_index(self.opensearch)
+        await seed_rules(self.redis, self.rules_file)
+        await self.load_fleet()
+        started = datetime.now(timezone.utc).isoformat()
+        await self.sync_rules(force=True)
+        # Документы, не перезаписанные этой сверкой, остались от прежних правил или запусков
+        await self.opensearch.delete_by_query(
+            index=FINDINGS_INDEX,
+            body={"query": {"range": {"evaluated_at": {"lt": started}}}},
+            conflicts="proceed", refresh=True
+        )
+
+    async def sync_rules(self, force: bool = False) -> bool:
+        """Применение правил из Redis, если изменилась их версия"""
+        version = await self.redis.get(RULES_VERSION_KEY)
+        if not force and version == self.rules_version:
+            return False
+        started = time.perf_counter()
+        rules = parse_rule_definitions(await self.redis.hgetall(RULES_KEY))
+        evaluator = self.evaluator
+        if force:
+            # Полная сверка: записываются все текущие findings
+            evaluator.set_rules([])
+            evaluator.results.clear()
+        changes = evaluator.set_rules(rules)
+        evaluated = time.perf_counter() - started
+        await self.write_changes(changes)
+        self.rules_version = version
+        self.counters["rule_syncs"] += 1
+        if changes:
+            self.last_rule_change = {
+                "rules": [change.rule_id for change in changes],
+                "hosts": len(evaluator.table),
+                "upserted": sum(bin(change.upsert).count("1") for change in changes),
+                "deleted": sum(bin(change.delete).count("1") for change in changes),
+                "evaluate_ms": round(evaluated * 1000, 2),
+                "total_ms": round((time.perf_counter() - started) * 1000, 2),
+                "at": datetime.now(timezone.utc).isoformat(),
+            }
+            logger.info(f"Правила posture применены: {self.last_rule_change}")
+        return True
+
+    def change_actions(self, dirty: Dict[str, int]) -> List[Tuple[str, int, List[Dict[str, Any]]]]:
+        """
+        Действия bulk для строк dirty (rule_id -> маска) по текущим маскам
+        оценщика: index, если правило выполняется на хосте, иначе delete.
+        """
+        evaluator = self.evaluator
+        host_ids = evaluator.table.host_ids
+        evaluated_at = datetime.now(timezone.utc).isoformat()
+        actions: List[Tuple[str, int, List[Dict[str, Any]]]] = []
+        for rule_id, rows in dirty.items():
+            mask = evaluator.results.get(rule_id, 0) if rule_id in evaluator.rules else 0
+            for row in iter_rows(rows):
+                doc_id = finding_id(host_ids[row], rule_id)
+                if mask >> row & 1:
+                    lines = [{"index": {"_index": FINDINGS_INDEX, "_id": doc_id}},
+                             evaluator.finding(rule_id, row, evaluated_at)]
+                else:
+                    lines = [{"delete": {"_index": FINDINGS_INDEX, "_id": doc_id}}]
+                actions.append((rule_id, row, lines))
+        return actions
+
+    async def write_changes(self, changes: List[RuleChange]) -> None:
+        """
+        Bulk-запись изменений findings пачками по bulk_size документов.
+
+        Вместе с изменениями пишутся строки, не записанные раньше. Строки
+        пачки с ошибкой и всех последующих пачек остаются в unwritten и
+        пишутся следующим вызовом (при ошибке bulk исключение пробрасывается).
+        """
+        dirty = self.unwritten
+        self.unwritten = {}
+        for change in changes:
+            dirty[change.rule_id] = dirty.get(change.rule_id, 0) | change.upsert | change.delete
+        actions = self.change_actions(dirty)
+        for start in range(0, len(actions), self.bulk_size):
+            chunk = actions[start:start + self.bulk_size]
+            try:
+                with retry_safe():
+                    response = await self.opensearch.bulk(
+                        body=[line for _, _, lines in chunk for line in lines], refresh=False
+                    )
+            except Exception:
+                self._keep_unwritten(actions[start:])
+                raise
+            for (rule_id, row, _), item in zip(chunk, response.get("items", [])):
+                kind, result = next(iter(item.items()))
+                if result.get("error") or (kind != "delete" and result.get("status", 200) >= 300):
+                    self.counters["write_errors"] += 1
+                    self._keep_unwritten([(rule_id, row, None)])
+                elif kind == "delete":
+                    self.counters["findings_deleted"] += result.get("result") == "deleted"
+                else:
+                    self.counters["findings_upserted"] += 1
+        if self.unwritten:
+            logger.warning(f"Не записано findings: {self.unwritten_count()}, повтор на следующей итерации")
+
+    def _keep_unwritten(self, actions) -> None:
+        for rule_id, row, _ in actions:
+            self.unwritten[rule_id] = self.unwritten.get(rule_id, 0) | 1 << row
+
+    def unwritten_count(self) -> int:
+        return sum(bin(rows).count("1") for rows in self.unwritten.values())
+
+    def snapshots(self, response: List[Any]) -> List[Dict[str, Any]]:
+        result = []
+        for _, entries in response:
+            for _, fields in entries:
+                if not fields:
+                    continue
+                try:
+                    result.append(decode_stream_fields(fields, SNAPSHOT_FIELDS))
+                except (UnicodeDecodeError, TypeError, ValueError):
+                    self.counters["decode_errors"] += 1
+        return result
+
+    async def process(self, response: List[Any]) -> int:
+        snapshots = self.snapshots(response)
+        await self.write_changes(self.evaluator.update_hosts(snapshots))
+        entries = 0
+        for stream, items in response:
+            ids = [entry_id for entry_id, _ in items]
+            if ids:
+                await self.redis.xack(_text(stream), self.group, *ids)
+                entries += len(ids)
+        self.counters["snapshots"] += len(snapshots)
+        self.counters["batches"] += 1
+        return entries
+
+    async def run(self) -> None:
+        await self.ensure_group()
+        while not self._stopping.is_set():
+            try:
+                await self.initial_sync()
+                break
+            except Exception as e:
+                logger.error(f"Ошибка начальной загрузки парка, повтор через {self.retry_delay}с: {e}")
+                await self._sleep(self.retry_delay)
+        backlog = True
+        last_stats = last_refresh = time.monotonic()
+        while not self._stopping.is_set():
+            try:
+                await self.sync_rules()
+                if self.unwritten:
+                    await self.write_changes([])
+                if time.monotonic() - last_refresh >= self.refresh_interval:
+                    last_refresh = time.monotonic()
+                    await self.write_changes(self.evaluator.evaluate_all())
+                response = await self.redis.xreadgroup(
+                    self.group, self.consumer, {POSTURE_STREAM: "0" if backlog else ">"},
+                    count=self.batch_size, block=None if backlog else self.block_ms,
+                )
+                if backlog and not any(entries for _, entries in response or ()):
+                    backlog = False
+                elif response:
+                    await self.process(response)
+            except Exception as e:
+                # Неподтвержденные записи остаются в pending и будут прочитаны повторно
+                logger.error(f"Ошибка оценки правил posture, повтор через {self.retry_delay}с: {e}")
+                backlog = True
+                await self._sleep(self.retry_delay)
+            if time.monotonic() - last_stats >= self.stats_interval:
+                last_stats = time.monotonic()
+                await self.publish_stats()
+        await self.publish_stats()
+
+    async def _sleep(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "consumer": self.consumer,
+            "group": self.group,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "rules_version": _text(self.rules_version) if self.rules_version is not None else None,
+            "last_rule_change": self.last_rule_change,
+            **self.counters,
+            "unwritten": self.unwritten_count(),
+            "evaluator": self.evaluator.stats(),
+        }
+
+    async def publish_stats(self) -> None:
+        stats = self.stats()
+        logger.info(f"Правила posture: {stats['evaluator']['hosts']} хостов, "
+                    f"{len(stats['evaluator']['rules'])} правил, {stats['snapshots']} снимков из потока")
+        try:
+            await self.redis.hset(STATS_KEY, self.consumer, json.dumps(stats))
+        except RedisError as e:
+            logger.warning(f"Не удалось сохранить статистику правил posture: {e}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Серверная оценка правил posture по всему парку")
+    parser.add_argument("--rules", default=os.getenv("POSTURE_RULES_FILE", DEFAULT_RULES_FILE),
+                        help="Начальные правила, если hash posture:rules пуст")
+    parser.add_argument("--group", default=os.getenv("POSTURE_RULES_GROUP", "posture-rules"))
+    parser.add_argument("--consumer", default=os.getenv("POSTURE_RULES_CONSUMER") or socket.gethostname())
+    parser.add_argument("--history-days", type=int, default=int(os.getenv("POSTURE_RULES_HISTORY_DAYS", "30")))
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("POSTURE_RULES_BATCH_SIZE", "500")))
+    parser.add_argument("--refresh-interval", type=float,
+                        default=float(os.getenv("POSTURE_RULES_REFRESH_INTERVAL", "3600")))
+    parser.add_argument("--stats-interval", type=float, default=float(os.getenv("POSTURE_RULES_STATS_INTERVAL", "30")))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"),
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    async def run() -> None:
+        redis = aioredis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379"))
+        opensearch = AsyncOpenSearch([os.getenv("OPENSEARCH_URL", "http://localhost:9200")], http_compress=True)
+        worker = PostureRuleWorker(
+            redis, opensearch, group=args.group, consumer=args.consumer, rules_file=args.rules,
+            history_days=args.history_days, batch_size=args.batch_size,
+            refresh_interval=args.refresh_interval, stats_interval=args.stats_interval,
+        )
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, worker.stop)
+        try:
+            await worker.run()
+        finally:
+            await opensearch.close()
+            await redis.aclose()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Условная загрузка снимков host_posture по хешам разделов.
+
+У неизменившегося хоста снимок от цикла к циклу почти не меняется, но
+агент каждый раз присылал его целиком. Загрузка идет в два шага:
+
+1. POST /ingest/host-posture/handshake - агент присылает хеши разделов
+   (см. POSTURE_SECTIONS), сервер сравнивает их
+   с таблицей хешей хоста и отвечает списком нужных разделов;
+2. POST /ingest/host-posture - агент присылает только нужные разделы,
+   перечисляя остальные в unchanged_sections, и хеши всех разделов в
+   section_hashes. Сервер подставляет пропущенные разделы из последнего
+   сохраненного снимка и дальше обрабатывает полный снимок как обычно.
+
+Таблица хешей хоста - хеш Redis posture:sections:<host_id>: хеш каждого
+раздела и ссылка (_event, _index) на сохраненный снимок, в котором эти
+разделы лежат. Таблица заменяется целиком после сохранения снимка с
+section_hashes, поэтому хеши всегда описывают содержимое снимка по ссылке.
+Хеши считает агент по своему представлению раздела; сервер их не
+пересчитывает, а только сравнивает.
+
+Если между шагами таблица изменилась или снимок по ссылке удален,
+загрузка отклоняется с кодом 409 и списком разделов, которые нужно
+прислать (агент повторяет отправку полного снимка).
+"""
+
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import redis.asyncio as aioredis
+from opensearchpy import AsyncOpenSearch, NotFoundError
+
+from event_locator import LOCATOR_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Раздел -> путь в документе снимка. Автозапуски разбиты на части: состояние
+# служб (services_auto) меняется между отчетами почти всегда, а реестр,
+# папки автозагрузки и задачи планировщика - редко. Список процессов меняется
+# каждый отчет (новые PID), но сохраняется разделом целиком: дерево процессов
+# строится по PID из снимка
+POSTURE_SECTIONS: Dict[str, Tuple[str, ...]] = {
+    "processes": ("inventory", "processes"),
+    "autoruns.registry": ("inventory", "autoruns", "registry"),
+    "autoruns.startup_folders": ("inventory", "autoruns", "startup_folders"),
+    "autoruns.services_auto": ("inventory", "autoruns", "services_auto"),
+    "autoruns.scheduled_tasks": ("inventory", "autoruns", "scheduled_tasks"),
+    "security": ("security",),
+    "windows_update": ("windows_update",),
+}
+
+KEY_PREFIX = "posture:sections:"
+
+# Служебные поля таблицы хешей
+EVENT_FIELD = "_event"
+INDEX_FIELD = "_index"
+TIMESTAMP_FIELD = "_timestamp"
+
+# Длина хеша раздела: sha256 в hex с запасом под другие алгоритмы
+MAX_HASH_LENGTH = 128
+
+
+def _key(host_id: str) -> str:
+    return f"{KEY_PREFIX}{host_id}"
+
+
+def _snapshot_time(timestamp: str) -> Optional[datetime]:
+    """Время снимка для сравнения порядка (смещения в строках бывают разными)"""
+    try:
+        dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def invalid_sections(section_hashes: Dict[str, str], sections: Iterable[str] = ()) -> List[str]:
+    """Неизвестные разделы и хеши неподходящей длины (для ответа 400)"""
+    invalid = [name for name in sections if name not in POSTURE_SECTIONS]
+    invalid += [
+        name for name, value in section_hashes.items()
+        if name not in POSTURE_SECTIONS or not value or len(value) > MAX_HASH_LENGTH
+    ]
+    return sorted(set(invalid))
+
+
+async def _load_table(redis: aioredis.Redis, host_id: str) -> Dict[str, str]:
+    raw = await redis.hgetall(_key(host_id))
+    return {k.decode(): v.decode() for k, v in raw.items()}
+
+
+def _changed(table: Dict[str, str], section_hashes: Dict[str, str]) -> List[str]:
+    """Разделы, которые нельзя взять из сохраненного снимка"""
+    if not table.get(EVENT_FIELD):
+        return list(POSTURE_SECTIONS)
+    return [name for name in POSTURE_SECTIONS if table.get(name) is None or table.get(name) != section_hashes.get(name)]
+
+
+async def sections_needed(redis: aioredis.Redis, host_id: str, section_hashes: Dict[str, str]) -> List[str]:
+    """Разделы, которые агент должен прислать (шаг 1). Без таблицы хоста - все"""
+    return _changed(await _load_table(redis, host_id), section_hashes)
+
+
+def _get_path(document: Dict[str, Any], path: Tuple[str, ...]) -> Any:
+    for part in path:
+        if not isinstance(document, dict):
+            return None
+        document = document.get(part)
+    return document
+
+
+def _set_path(document: Dict[str, Any], path: Tuple[str, ...], value: Any) -> None:
+    for part in path[:-1]:
+        if not isinstance(document.get(part), dict):
+            document[part] = {}
+        document = document[part]
+    document[path[-1]] = value
+
+
+async def fill_unchanged_sections(
+    opensearch: AsyncOpenSearch,
+    redis: aioredis.Redis,
+    host_id: str,
+    event_data: Dict[str, Any],
+    unchanged: Iterable[str],
+    section_hashes: Dict[str, str]
+) -> List[str]:
+    """
+    Подстановка разделов unchanged из сохраненного снимка в event_data (на месте).
+    Возвращает разделы, которые подставить нельзя: пустой список - снимок полный.
+    """
+    unchanged = list(dict.fromkeys(unchanged))
+    table = await _load_table(redis, host_id)
+    stale = [name for name in _changed(table, section_hashes) if name in unchanged]
+    if stale:
+        return stale
+    paths = [POSTURE_SECTIONS[name] for name in unchanged]
+    try:
+        response = await opensearch.get(
+            index=table[INDEX_FIELD], id=table[EVENT_FIELD],
+            _source_includes=[".".join(path) for path in paths]
+        )
+    except NotFoundError:
+        logger.info(f"Снимок {table[EVENT_FIELD]} хоста {host_id} не найден, разделы нужно прислать заново")
+        return unchanged
+    source = response.get("_source") or {}
+    for path in paths:
+        _set_path(event_data, path, _get_path(source, path))
+    return []
+
+
+async def record_section_hashes(
+    redis: aioredis.Redis,
+    host_id: str,
+    section_hashes: Dict[str, str],
+    event_id: str,
+    index_name: str,
+    timestamp: str
+) -> None:
+    """
+    Замена таблицы хешей хоста после сохранения снимка. Снимок старше уже
+    учтенного (события могут приходить не по порядку) таблицу не меняет.
+    """
+    key = _key(host_id)
+    try:
+        previous: Optional[bytes] = await redis.hget(key, TIMESTAMP_FIELD)
+        previous_time = _snapshot_time(previous.decode()) if previous is not None else None
+        if previous_time is not None:
+            current = _snapshot_time(timestamp)
+            if current is None or current < previous_time:
+                return
+        pipe = redis.pipeline(transaction=True)
+        pipe.delete(key)
+        pipe.hset(key, mapping={
+            **{name: value for name, value in section_hashes.items() if name in POSTURE_SECTIONS},
+            EVENT_FIELD: event_id,
+            INDEX_FIELD: index_name,
+            TIMESTAMP_FIELD: timestamp,
+        })
+        pipe.expire(key, LOCATOR_TTL_SECONDS)
+        await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Не удалось обновить хеши разделов хоста {host_id}: {e}")
@@ -0,0 +1,490 @@
+"""
+Дерево процессов хостов: предки, потомки и поддеревья.
+
+Каждый экземпляр процесса хранится отдельным документом в индексе
+process-tree с ID host_id:pid:start_ms. Экземпляр определяется парой
+(PID, время запуска): Windows переиспользует PID, и без времени запуска
+новый процесс унаследовал бы предков и потомков завершившегося. Время
+запуска - create_time процесса, если агент его передал, иначе время
+process_start или первого снимка host_posture, в котором процесс виден.
+
+Документ хранит материализованный путь - ключи всех предков от корня до
+родителя (ancestors). Поэтому:
+- цепочка предков - один mget документов по ключам пути, O(глубины);
+- потомки и поддерево - один term-запрос ancestors = ключ процесса,
+  без повторных запросов по уровням дерева.
+
+Путь вычисляется при приеме. Для этого в Redis для каждого хоста хранится
+hash живых процессов: PID -> ключ экземпляра, время запуска и путь.
+Родителем считается живой процесс с PID = ppid, запущенный не позже
+потомка; иначе PID родителя уже переиспользован и процесс становится корнем.
+Индекс обновляется инкрементально:
+- process_start / process_end из /ingest - одна операция с Redis и один
+  документ;
+- снимок host_posture - сравнение списка процессов с hash живых: в
+  OpenSearch отправляются только новые экземпляры и отметки о завершении.
+"""
+
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis.asyncio as aioredis
+from opensearchpy import AsyncOpenSearch
+
+logger = logging.getLogger(__name__)
+
+PROCESS_TREE_INDEX = "process-tree"
+
+# Ключи Redis
+LIVE_PREFIX = "proctree:live:"
+SNAPSHOT_KEY = "proctree:snapshot"
+
+# Предел длины пути: цепочки глубже обрезаются со стороны корня,
+# depth при этом остается полной глубиной процесса
+MAX_DEPTH = 64
+# Предел числа потомков в ответе
+MAX_DESCENDANTS = 10000
+
+PROCESS_TREE_INDEX_BODY = {
+    "mappings": {
+        "properties": {
+            "host_id": {"type": "keyword"},
+            "hostname": {"type": "keyword"},
+            "process_key": {"type": "keyword"},
+            "parent_key": {"type": "keyword"},
+            "ancestors": {"type": "keyword"},
+            "depth": {"type": "integer"},
+            "pid": {"type": "long"},
+            "ppid": {"type": "long"},
+            "name": {"type": "keyword", "normalizer": "lowercase"},
+            "exe_path": {"type": "keyword", "normalizer": "lowercase"},
+            "cmdline": {"type": "keyword", "ignore_above": 8191},
+            "user": {"type": "keyword"},
+            "sha256": {"type": "keyword"},
+            "start_time": {"type": "date"},
+            "start_source": {"type": "keyword"},
+            "end_time": {"type": "date"},
+            "status": {"type": "keyword"},
+            "event_id": {"type": "keyword"},
+            "indexed_at": {"type": "date"}
+        }
+    },
+    "settings": {
+        "analysis": {
+            "normalizer": {
+                "lowercase": {"type": "custom", "filter": ["lowercase"]}
+            }
+        }
+    }
+}
+
+
+async def ensure_process_tree_index(opensearch: AsyncOpenSearch) -> None:
+    """Создание индекса дерева процессов с маппингом, если его ещё нет"""
+    try:
+        if not await opensearch.indices.exists(index=PROCESS_TREE_INDEX):
+            await opensearch.indices.create(index=PROCESS_TREE_INDEX, body=PROCESS_TREE_INDEX_BODY)
+            logger.info(f"Создан индекс {PROCESS_TREE_INDEX}")
+    except Exception as e:
+        logger.warning(f"Не удалось создать индекс {PROCESS_TREE_INDEX}: {e}")
+
+
+def _epoch_ms(value: Any) -> Optional[int]:
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        # Секунды или миллисекунды с начала эпохи
+        return int(value if value > 1e11 else value * 1000)
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return int((dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp() * 1000)
+
+
+def _iso(ms: int) -> str:
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).isoformat()
+
+
+def process_key(pid: int, start_ms: int) -> str:
+    return f"{pid}:{start_ms}"
+
+
+def process_doc_id(host_id: str, key: str) -> str:
+    return f"{host_id}:{key}"
+
+
+def _identity(name: Optional[str], exe_path: Optional[str]) -> str:
+    """Признак того же экземпляра, когда время запуска неизвестно"""
+    return hashlib.sha1(f"{name or ''}\x1f{exe_path or ''}".lower().encode("utf-8")).hexdigest()[:12]
+
+
+def _node_state(key: str, start_ms: int, identity: str, ancestors: List[str], depth: int) -> str:
+    return json.dumps({"k": key, "s": start_ms, "i": identity, "a": ancestors, "d": depth}, separators=(",", ":"))
+
+
+def _lineage(parent: Optional[Dict[str, Any]], start_ms: int) -> Tuple[List[str], int]:
+    """
+    Путь и глубина потомка; родитель, запущенный позже потомка, -
+    переиспользованный PID. Путь обрезается до MAX_DEPTH, глубина - нет.
+    """
+    if parent is None or parent["s"] > start_ms:
+        return [], 0
+    # Состояния без "d" записаны до хранения глубины: глубина = длина пути
+    return (parent["a"] + [parent["k"]])[-MAX_DEPTH:], parent.get("d", len(parent["a"])) + 1
+
+
+def _process_doc(host_id: str, hostname: Optional[str], key: str, pid: int, ppid: Optional[int],
+                 ancestors: List[str], depth: int, start_ms: int, start_source: str, proc: Dict[str, Any],
+                 event_id: Optional[str], indexed_at: str) -> Dict[str, Any]:
+    return {
+        "host_id": host_id,
+        "hostname": hostname,
+        "process_key": key,
+        "parent_key": ancestors[-1] if ancestors else None,
+        "ancestors": ancestors,
+        "depth": depth,
+        "pid": pid,
+        "ppid": ppid,
+        "name": proc.get("name"),
+        "exe_path": proc.get("exe_path") or proc.get("path"),
+        "cmdline": proc.get("cmdline") or proc.get("command_line"),
+        "user": proc.get("username") or proc.get("user"),
+        "sha256": proc.get("sha256"),
+        "start_time": _iso(start_ms),
+        "start_source": start_source,
+        "end_time": None,
+        "status": "running",
+        "event_id": event_id,
+        "indexed_at": indexed_at,
+    }
+
+
+def _ended(host_id: str, key: str, end_ms: int) -> List[Dict[str, Any]]:
+    return [
+        {"update": {"_index": PROCESS_TREE_INDEX, "_id": process_doc_id(host_id, key)}},
+        {"doc": {"status": "exited", "end_time": _iso(end_ms)}},
+    ]
+
+
+def _bulk_failures(response: Dict[str, Any]) -> set:
+    """
+    ID элементов bulk, которые не записаны. Отметка о завершении отсутствующего
+    документа (404) - не ошибка: завершать нечего.
+    """
+    if not response.get("errors"):
+        return set()
+    failed = set()
+    for item in response.get("items", []):
+        kind, result = next(iter(item.items()))
+        if kind == "update" and result.get("status") == 404:
+            continue
+        if result.get("error") or result.get("status", 200) >= 300:
+            failed.add(result.get("_id"))
+    return failed
+
+
+def _host(event_data: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    host_info = event_data.get("host_info") or event_data.get("host") or {}
+    return host_info.get("host_id") or host_info.get("hostname"), host_info.get("hostname")
+
+
+async def record_process_event(
+    opensearch: AsyncOpenSearch,
+    redis: aioredis.Redis,
+    event_data: Dict[str, Any]
+) -> Optional[str]:
+    """
+    Учет события process_start или process_end телеметрии.
+
+    Возвращает ключ экземпляра процесса или None, если событие не описывает процесс.
+    """
+    proc = event_data.get("process") or {}
+    host_id, hostname = _host(event_data)
+    pid = proc.get("pid")
+    event_type = event_data.get("event_type")
+    if not host_id or pid is None or event_type not in ("process_start", "process_end"):
+        return None
+    live_key = f"{LIVE_PREFIX}{host_id}"
+    event_ms = _epoch_ms(event_data.get("timestamp")) or _epoch_ms(datetime.now(timezone.utc).isoformat())
+    create_ms = _epoch_ms(proc.get("create_time"))
+
+    try:
+        if event_type == "process_end":
+            raw = await redis.hget(live_key, str(pid))
+            if raw is None:
+                return None
+            state = json.loads(raw)
+            if create_ms is not None and state["s"] != create_ms:
+                # Событие о другом (уже замененном) экземпляре
+                return None
+            response = await opensearch.bulk(body=_ended(host_id, state["k"], event_ms), refresh=False)
+            if _bulk_failures(response):
+                # Живой экземпляр остается в Redis: завершение повторит следующее событие или снимок
+                logger.warning(f"Завершение процесса {state['k']} хоста {host_id} не записано")
+                return None
+            await redis.hdel(live_key, str(pid))
+            return state["k"]
+
+        ppid = proc.get("ppid")
+        start_ms = create_ms if create_ms is not None else event_ms
+        key = process_key(pid, start_ms)
+        current_raw, parent_raw = await redis.hmget(live_key, [str(pid), str(ppid)])
+        actions: List[Dict[str, Any]] = []
+        if current_raw is not None:
+            current = json.loads(current_raw)
+            if current["k"] == key:
+                return key
+            # PID переиспользован: прежний экземпляр завершился не позже запуска нового
+            actions += _ended(host_id, current["k"], start_ms)
+        parent = json.loads(parent_raw) if parent_raw is not None and ppid != pid else None
+        ancestors, depth = _lineage(parent, start_ms)
+        doc = _process_doc(host_id, hostname, key, pid, ppid, ancestors, depth, start_ms,
+                           "create_time" if create_ms is not None else "process_start", proc,
+                           event_data.get("event_id"), datetime.now(timezone.utc).isoformat())
+        actions += [{"index": {"_index": PROCESS_TREE_INDEX, "_id": process_doc_id(host_id, key)}}, doc]
+        # Состояние в Redis - только после записи: повтор события иначе
+        # остановился бы на совпадающем ключе и документ не появился бы
+        response = await opensearch.bulk(body=actions, refresh=False)
+        if _bulk_failures(response):
+            logger.warning(f"Процесс {key} хоста {host_id} не записан в {PROCESS_TREE_INDEX}")
+            return None
+        await redis.hset(live_key, str(pid), _node_state(key, start_ms, _identity(doc["name"], doc["exe_path"]),
+                                                           ancestors, depth))
+        return key
+    except Exception as e:
+        logger.error(f"Ошибка обновления дерева процессов хоста {host_id}: {e}")
+        return None
+
+
+async def _is_latest_snapshot(redis: aioredis.Redis, host_id: str, timestamp: str) -> bool:
+    """Снимок не старше учтённого; время сравнивается после разбора, а не строкой"""
+    previous = await redis.hget(SNAPSHOT_KEY, host_id)
+    previous_ms = _epoch_ms(previous.decode()) if previous is not None else None
+    if previous_ms is None:
+        return True
+    current = _epoch_ms(timestamp)
+    return current is not None and current >= previous_ms
+
+
+async def _mark_snapshot(redis: aioredis.Redis, host_id: str, timestamp: str) -> None:
+    """Отметка учтённого снимка - после записи, чтобы повтор неудачного снимка не отбрасывался"""
+    if await _is_latest_snapshot(redis, host_id, timestamp):
+        await redis.hset(SNAPSHOT_KEY, host_id, timestamp)
+
+
+def diff_snapshot_processes(
+    host_id: str,
+    hostname: Optional[str],
+    processes: List[Dict[str, Any]],
+    live: Dict[str, Dict[str, Any]],
+    snapshot_ms: int,
+    event_id: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Dict[str, str], List[str]]:
+    """
+    Сравнение списка процессов снимка с живыми процессами хоста.
+
+    Возвращает bulk-действия (новые экземпляры и завершенные), новое
+    состояние измененных PID и завершенные PID без замены.
+    """
+    indexed_at = datetime.now(timezone.utc).isoformat()
+    by_pid: Dict[str, Dict[str, Any]] = {}
+    for proc in processes:
+        if proc.get("pid") is not None:
+            by_pid[str(proc["pid"])] = proc
+
+    actions: List[Dict[str, Any]] = []
+    changed: Dict[str, str] = {}
+    resolved: Dict[str, Optional[Dict[str, Any]]] = {}
+
+    def resolve(pid: str, visiting: frozenset) -> Optional[Dict[str, Any]]:
+        """Состояние экземпляра PID в этом снимке (существующего или нового)"""
+        if pid in resolved:
+            return resolved[pid]
+        proc = by_pid.get(pid)
+        if proc is None:
+            return None
+        name, exe_path = proc.get("name"), proc.get("exe_path") or proc.get("path")
+        identity = _identity(name, exe_path)
+        create_ms = _epoch_ms(proc.get("create_time"))
+        previous = live.get(pid)
+        if previous is not None and (
+            previous["s"] == create_ms if create_ms is not None else previous["i"] == identity
+        ):
+            resolved[pid] = previous
+            return previous
+        start_ms = create_ms if create_ms is not None else snapshot_ms
+        key = process_key(int(pid), start_ms)
+        ppid = proc.get("ppid")
+        parent = None
+        if ppid is not None and str(ppid) != pid and str(ppid) not in visiting:
+            parent = resolve(str(ppid), visiting | {pid})
+        ancestors, depth = _lineage(parent, start_ms)
+        state = {"k": key, "s": start_ms, "i": identity, "a": ancestors, "d": depth}
+        resolved[pid] = state
+        if previous is not None:
+            actions.extend(_ended(host_id, previous["k"], start_ms))
+        actions.append({"index": {"_index": PROCESS_TREE_INDEX, "_id": process_doc_id(host_id, key)}})
+        actions.append(_process_doc(host_id, hostname, key, int(pid), ppid, ancestors, depth, start_ms,
+                                    "create_time" if create_ms is not None else "first_seen",
+                                    proc, event_id, indexed_at))
+        changed[pid] = _node_state(key, start_ms, identity, ancestors, depth)
+        return state
+
+    for pid in by_pid:
+        resolve(pid, frozenset())
+
+    exited = [pid for pid in live if pid not in by_pid]
+    for pid in exited:
+        actions.extend(_ended(host_id, live[pid]["k"], snapshot_ms))
+    return actions, changed, exited
+
+
+async def sync_host_processes(
+    opensearch: AsyncOpenSearch,
+    redis: aioredis.Redis,
+    event_data: Dict[str, Any]
+) -> Tuple[int, int]:
+    """
+    Синхронизация дерева процессов с новым снимком host_posture.
+
+    Возвращает (новых экземпляров, завершенных).
+    """
+    host_id, hostname = _host(event_data)
+    timestamp = event_data.get("timestamp") or ""
+    processes = (event_data.get("inventory") or {}).get("processes")
+    if not host_id or processes is None:
+        return 0, 0
+
+    try:
+        if not await _is_latest_snapshot(redis, host_id, timestamp):
+            logger.debug("Снимок %s хоста %s устарел, дерево процессов не обновляется", event_data.get("event_id"), host_id)
+            return 0, 0
+
+        live_key = f"{LIVE_PREFIX}{host_id}"
+        live = {pid.decode(): json.loads(raw) for pid, raw in (await redis.hgetall(live_key)).items()}
+        snapshot_ms = _epoch_ms(timestamp) or _epoch_ms(datetime.now(timezone.utc).isoformat())
+        actions, changed, exited = diff_snapshot_processes(
+            host_id, hostname, processes, live, snapshot_ms, event_data.get("event_id")
+        )
+
+        # Первый снимок после потери состояния в Redis: процессы прежних
+        # экземпляров, оставшиеся running, отмечаются завершенными
+        if not live:
+            current = {process_doc_id(host_id, json.loads(state)["k"]) for state in changed.values()}
+            response = await opensearch.search(
+                index=PROCESS_TREE_INDEX,
+                body={"query": {"bool": {"filter": [{"term": {"host_id": host_id}}, {"term": {"status": "running"}}]}},
+                      "_source": ["process_key"], "size": MAX_DESCENDANTS},
+                ignore_unavailable=True
+            )
+            for hit in response["hits"]["hits"]:
+                if hit["_id"] not in current:
+                    actions.extend(_ended(host_id, hit["_source"]["process_key"], snapshot_ms))
+
+        failed = set()
+        if actions:
+            failed = _bulk_failures(await opensearch.bulk(body=actions, refresh=False))
+        if failed:
+            # В Redis попадают только PID, все документы которых записаны;
+            # остальные остаются прежними и сравниваются заново следующим снимком
+            def written(pid: str, key: Optional[str]) -> bool:
+                previous = live.get(pid)
+                if previous is not None and process_doc_id(host_id, previous["k"]) in failed:
+                    return False
+                return key is None or process_doc_id(host_id, key) not in failed
+
+            changed = {pid: state for pid, state in changed.items() if written(pid, json.loads(state)["k"])}
+            exited = [pid for pid in exited if written(pid, None)]
+            logger.warning(f"Дерево процессов хоста {host_id}: не записано документов {len(failed)}")
+        pipe = redis.pipeline()
+        if exited:
+            pipe.hdel(live_key, *exited)
+        if changed:
+            pipe.hset(live_key, mapping=changed)
+        await pipe.execute()
+        await _mark_snapshot(redis, host_id, timestamp)
+
+        started = len(changed)
+        logger.debug("Дерево процессов хоста %s: +%s / -%s", host_id, started, len(exited))
+        return started, len(exited)
+    except Exception as e:
+        logger.error(f"Ошибка обновления дерева процессов хоста {host_id}: {e}")
+        return 0, 0
+
+
+async def resolve_process_key(redis: aioredis.Redis, host_id: str, process: str) -> Optional[str]:
+    """Ключ экземпляра: pid:start_ms как есть, для одного PID - текущий живой экземпляр"""
+    if ":" in process:
+        return process
+    raw = await redis.hget(f"{LIVE_PREFIX}{host_id}", process)
+    return json.loads(raw)["k"] if raw is not None else None
+
+
+async def get_process(opensearch: AsyncOpenSearch, host_id: str, key: str) -> Optional[Dict[str, Any]]:
+    response = await opensearch.mget(index=PROCESS_TREE_INDEX, body={"ids": [process_doc_id(host_id, key)]})
+    docs = [doc["_source"] for doc in response["docs"] if doc.get("found")]
+    return docs[0] if docs else None
+
+
+async def get_ancestry(opensearch: AsyncOpenSearch, host_id: str, key: str) -> Optional[Dict[str, Any]]:
+    """Процесс и цепочка его предков от корня: один mget по материализованному пути"""
+    process = await get_process(opensearch, host_id, key)
+    if process is None:
+        return None
+    ancestors: List[Dict[str, Any]] = []
+    if process["ancestors"]:
+        response = await opensearch.mget(
+            index=PROCESS_TREE_INDEX,
+            body={"ids": [process_doc_id(host_id, ancestor) for ancestor in process["ancestors"]]}
+        )
+        # Предки, уже удаленные из индекса, обозначаются только ключом
+        ancestors = [
+            doc["_source"] if doc.get("found") else {"process_key": ancestor, "missing": True}
+            for ancestor, doc in zip(process["ancestors"], response["docs"])
+        ]
+    return {"process": process, "ancestors": ancestors, "depth": len(ancestors)}
+
+
+async def get_descendants(
+    opensearch: AsyncOpenSearch,
+    host_id: str,
+    process: Dict[str, Any],
+    max_depth: Optional[int] = None,
+    running_only: bool = False,
+    limit: int = MAX_DESCENDANTS
+) -> List[Dict[str, Any]]:
+    """Все потомки процесса одним запросом по полю ancestors, по уровням и времени запуска"""
+    filters: List[Dict[str, Any]] = [
+        {"term": {"host_id": host_id}},
+        {"term": {"ancestors": process["process_key"]}}
+    ]
+    if max_depth is not None:
+        filters.append({"range": {"depth": {"lte": process["depth"] + max_depth}}})
+    if running_only:
+        filters.append({"term": {"status": "running"}})
+    response = await opensearch.search(
+        index=PROCESS_TREE_INDEX,
+        body={
+            "query": {"bool": {"filter": filters}},
+            "sort": [{"depth": {"order": "asc"}}, {"start_time": {"order": "asc"}}],
+            "size": min(limit, MAX_DESCENDANTS)
+        },
+        ignore_unavailable=True
+    )
+    return [hit["_source"] for hit in response["hits"]["hits"]]
+
+
+def build_subtree(root: Dict[str, Any], descendants: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Вложенное дерево (children) из корня и плоского списка потомков"""
+    nodes = {root["process_key"]: dict(root, children=[])}
+    for doc in descendants:
+        nodes[doc["process_key"]] = dict(doc, children=[])
+    for doc in descendants:
+        parent = nodes.get(doc.get("parent_key"))
+        if parent is not None:
+            parent["children"].append(nodes[doc["process_key"]])
+    return nodes[root["process_key"]]
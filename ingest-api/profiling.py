@@ -0,0 +1,298 @@
+"""
+Профилирование запросов Ingest API по требованию.
+
+Статистический профайлер: фоновый поток с заданным интервалом снимает стек
+потока event loop (sys._current_frames) и складывает выборки с отметкой
+времени в кольцевой буфер. Пока запросов в обработке нет, выборки не
+снимаются, поэтому в простое накладные расходы нулевые.
+
+Профиль запроса собирается после его завершения из выборок, попавших в
+интервал [начало, конец] запроса, если:
+- запрос пришел с заголовком X-Profile: 1;
+- запрос попал в случайную долю sample_rate;
+- запрос выполнялся дольше slow_ms (захват медленных запросов).
+
+Все запросы обслуживаются одним event loop, поэтому выборки за интервал
+запроса включают и работу параллельных запросов; в профиле указывается,
+сколько запросов выполнялось одновременно.
+
+Вместе со стеками сохраняются тайминги вызовов OpenSearch этого запроса
+(обертка над transport.perform_request клиента). Готовые профили хранятся в
+ограниченном кольце в памяти процесса и отдаются через /admin/profiles.
+Настройки меняются на лету через /admin/profiling без перезапуска.
+"""
+
+import contextvars
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter as CollectionsCounter, deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# Максимальная глубина сохраняемого стека
+MAX_STACK_DEPTH = 64
+# Сколько различных стеков и функций включать в профиль
+TOP_STACKS = 200
+TOP_FUNCTIONS = 30
+
+# Вызовы OpenSearch текущего запроса; список создается в middleware
+_backend_calls: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar(
+    "profiling_backend_calls", default=None
+)
+
+
+def _frame_label(code, cache: Dict[Any, str]) -> str:
+    label = cache.get(code)
+    if label is None:
+        filename = code.co_filename.replace("\\", "/").rsplit("/", 2)
+        label = f"{code.co_name} ({'/'.join(filename[-2:])}:{code.co_firstlineno})"
+        cache[code] = label
+    return label
+
+
+class StackSampler(threading.Thread):
+    """Фоновый поток, снимающий стек одного потока с заданным интервалом"""
+
+    def __init__(self, target_thread_id: int, interval: float, window_seconds: float = 120.0):
+        super().__init__(name="profiling-sampler", daemon=True)
+        self.target_thread_id = target_thread_id
+        self.interval = interval
+        self.samples: Deque[Tuple[float, Tuple[str, ...]]] = deque(
+            maxlen=max(100, int(window_seconds / interval))
+        )
+        self.active_requests = 0
+        self._labels: Dict[Any, str] = {}
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        own_file = __file__
+        while not self._stop_event.wait(self.interval):
+            if self.active_requests <= 0:
+                continue
+            frame = sys._current_frames().get(self.target_thread_id)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                if code.co_filename != own_file:
+                    stack.append(_frame_label(code, self._labels))
+                frame = frame.f_back
+            if stack:
+                stack.reverse()
+                self.samples.append((time.monotonic(), tuple(stack)))
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def samples_between(self, start: float, end: float) -> List[Tuple[str, ...]]:
+        # Копия буфера: поток семплера продолжает дописывать в него
+        return [stack for ts, stack in list(self.samples) if start <= ts <= end]
+
+
+class RequestProfiler:
+    """Решение о профилировании запросов, сборка профилей и их хранение"""
+
+    def __init__(self, enabled: bool = False, sample_rate: float = 0.0, slow_ms: float = 1000.0,
+                 interval_ms: float = 10.0, ring_size: int = 50, header: str = "X-Profile"):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.interval_ms = interval_ms
+        self.header = header
+        self.profiles: Deque[Dict[str, Any]] = deque(maxlen=ring_size)
+        self.sampler: Optional[StackSampler] = None
+        self.captured = 0
+
+    # === Жизненный цикл ===
+
+    def start(self) -> None:
+        """Запуск семплера для текущего потока (вызывается из event loop)"""
+        if not self.enabled or self.sampler is not None:
+            return
+        self.sampler = StackSampler(threading.get_ident(), self.interval_ms / 1000.0)
+        self.sampler.start()
+
+    def stop(self) -> None:
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.sampler = None
+
+    def configure(self, enabled: Optional[bool] = None, sample_rate: Optional[float] = None,
+                  slow_ms: Optional[float] = None, interval_ms: Optional[float] = None) -> Dict[str, Any]:
+        """Изменение настроек на лету"""
+        if sample_rate is not None:
+            self.sample_rate = max(0.0, min(1.0, sample_rate))
+        if slow_ms is not None:
+            self.slow_ms = max(0.0, slow_ms)
+        restart = False
+        if interval_ms is not None and interval_ms != self.interval_ms:
+            self.interval_ms = max(1.0, interval_ms)
+            restart = True
+        if enabled is not None and enabled != self.enabled:
+            self.enabled = enabled
+            restart = True
+        if restart:
+            self.stop()
+            self.start()
+        return self.settings()
+
+    def settings(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "slow_ms": self.slow_ms,
+            "interval_ms": self.interval_ms,
+            "header": self.header,
+            "ring_size": self.profiles.maxlen,
+            "stored": len(self.profiles),
+            "captured_total": self.captured,
+        }
+
+    # === Запросы ===
+
+    def begin_request(self, headers) -> Optional[Dict[str, Any]]:
+        """
+        Начало запроса. Возвращает состояние профилирования или None,
+        если профилирование выключено.
+        """
+        if not self.enabled or self.sampler is None:
+            return None
+        reason = None
+        if headers.get(self.header, "") in ("1", "true"):
+            reason = "header"
+        elif self.sample_rate > 0 and random.random() < self.sample_rate:
+            reason = "sampled"
+        calls: List[Dict[str, Any]] = []
+        _backend_calls.set(calls)
+        self.sampler.active_requests += 1
+        return {
+            # Семплер запоминается: после перезапуска в configure() счетчик
+            # уменьшается у того, который его увеличил
+            "sampler": self.sampler,
+            "reason": reason,
+            "start": time.monotonic(),
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "calls": calls,
+            "concurrent": self.sampler.active_requests,
+        }
+
+    def end_request(self, state: Optional[Dict[str, Any]], method: str, path: str,
+                    status_code: str) -> Optional[str]:
+        """Завершение запроса; возвращает ID профиля, если он сохранен"""
+        if state is None:
+            return None
+        sampler = state["sampler"]
+        end = time.monotonic()
+        sampler.active_requests -= 1
+        duration_ms = (end - state["start"]) * 1000
+        reason = state["reason"]
+        if reason is None and self.slow_ms and duration_ms >= self.slow_ms:
+            reason = "slow"
+        if reason is None:
+            return None
+
+        stacks = sampler.samples_between(state["start"], end)
+        profile_id = uuid.uuid4().hex[:16]
+        self.profiles.append({
+            "profile_id": profile_id,
+            "reason": reason,
+            "method": method,
+            "path": path,
+            "status": status_code,
+            "started_at": state["started_at"],
+            "duration_ms": round(duration_ms, 2),
+            "interval_ms": self.interval_ms,
+            "concurrent_requests": max(state["concurrent"], sampler.active_requests + 1),
+            "samples": len(stacks),
+            "stacks": stacks,
+            "opensearch_calls": state["calls"],
+        })
+        self.captured += 1
+        return profile_id
+
+    # === Выдача профилей ===
+
+    def list_profiles(self) -> List[Dict[str, Any]]:
+        return [
+            {key: profile[key] for key in (
+                "profile_id", "reason", "method", "path", "status", "started_at",
+                "duration_ms", "samples", "concurrent_requests"
+            )} | {"opensearch_calls": len(profile["opensearch_calls"]),
+                  "opensearch_ms": round(sum(c["duration_ms"] for c in profile["opensearch_calls"]), 2)}
+            for profile in reversed(self.profiles)
+        ]
+
+    def get_profile(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        for profile in self.profiles:
+            if profile["profile_id"] == profile_id:
+                return profile
+        return None
+
+    @staticmethod
+    def summarize(profile: Dict[str, Any]) -> Dict[str, Any]:
+        """Профиль в JSON: свернутые стеки и функции с наибольшим собственным и общим временем"""
+        stacks = CollectionsCounter(profile["stacks"])
+        self_counts: CollectionsCounter = CollectionsCounter()
+        total_counts: CollectionsCounter = CollectionsCounter()
+        for stack, count in stacks.items():
+            self_counts[stack[-1]] += count
+            for label in set(stack):
+                total_counts[label] += count
+        samples = profile["samples"] or 1
+        result = {key: value for key, value in profile.items() if key != "stacks"}
+        result["top_self"] = [
+            {"function": label, "samples": count, "percent": round(count * 100 / samples, 1)}
+            for label, count in self_counts.most_common(TOP_FUNCTIONS)
+        ]
+        result["top_total"] = [
+            {"function": label, "samples": count, "percent": round(count * 100 / samples, 1)}
+            for label, count in total_counts.most_common(TOP_FUNCTIONS)
+        ]
+        result["stacks"] = {";".join(stack): count for stack, count in stacks.most_common(TOP_STACKS)}
+        return result
+
+    @staticmethod
+    def collapsed(profile: Dict[str, Any]) -> str:
+        """Свернутые стеки (формат flamegraph.pl / speedscope)"""
+        stacks = CollectionsCounter(profile["stacks"])
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in stacks.most_common())
+
+
+def record_backend_call(backend: str, method: str, path: str, duration: float,
+                        status: Optional[int] = None) -> None:
+    """Запись вызова бэкенда в профиль текущего запроса (если запрос профилируется)"""
+    calls = _backend_calls.get()
+    if calls is not None:
+        calls.append({
+            "backend": backend,
+            "method": method,
+            "path": path,
+            "duration_ms": round(duration * 1000, 3),
+            "status": status,
+        })
+
+
+def instrument_opensearch(client) -> None:
+    """Замер каждого HTTP-вызова клиента OpenSearch на уровне transport"""
+    transport = getattr(client, "transport", None)
+    if transport is None or getattr(transport, "_profiling_wrapped", False):
+        return
+    perform_request = transport.perform_request
+
+    async def timed_perform_request(method, url, *args, **kwargs):
+        start = time.perf_counter()
+        status = None
+        try:
+            result = await perform_request(method, url, *args, **kwargs)
+            status = 200
+            return result
+        except Exception as e:
+            status = getattr(e, "status_code", None)
+            raise
+        finally:
+            record_backend_call("opensearch", method, url, time.perf_counter() - start, status)
+
+    transport.perform_request = timed_perform_request
+    transport._profiling_wrapped = True
@@ -0,0 +1,268 @@
+"""
+Адаптивное расписание отчетов агентов.
+
+Агенты присылают host_posture каждый со своим фиксированным интервалом,
+и парк, загруженный одновременно, приходит синхронными всплесками. В ответе
+/ingest/host-posture сервер сообщает агенту next_report_after - через
+сколько секунд прислать следующий снимок:
+
+- каждому хосту назначается постоянный слот внутри интервала (доля от хеша
+  host_id), поэтому отчеты парка распределяются по интервалу равномерно,
+  когда бы хосты ни загрузились; после первого ответа агент переходит на
+  свой слот, следующие отчеты приходят раз в интервал;
+- интервал растягивается под нагрузкой: не меньше, чем нужно, чтобы парк
+  укладывался в REPORT_TARGET_RATE отчетов в секунду, и пропорционально
+  перегрузке по самому загруженному сигналу (всплеск частоты отчетов парка
+  сверх целевой, отставание групп потребителей потока events:host_posture
+  против REPORT_BACKLOG_LIMIT, заполнение пула вызовов OpenSearch воркера);
+  учитываются группы с потребителями (или только REPORT_BACKLOG_GROUPS):
+  брошенная группа копит отставание, которое никто не разберет;
+- хосты, инвентарь которых недавно менялся, отчитываются чаще, давно
+  неизменные - реже.
+
+Парк и частота отчетов общие для всех воркеров: ZSET report:hosts
+(host_id -> время последнего отчета) в Redis. Время последнего изменения
+инвентаря хранится в хеше report:changed; его обновляет фоновая
+синхронизация индекса инвентаря, а выбывшие из парка хосты удаляются из
+него вместе с report:hosts. Размер парка, частота и отставание
+перечитываются не чаще раза в refresh_interval секунд, поэтому на запрос
+приходится один конвейер из двух команд Redis.
+"""
+
+import hashlib
+import logging
+import random
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+# Ключи Redis
+HOSTS_KEY = "report:hosts"
+CHANGED_KEY = "report:changed"
+
+# Окно измерения частоты отчетов парка, секунды
+RATE_WINDOW_SECONDS = 60
+
+# Частота отчетов парка считается перегрузкой, только если превышает целевую в столько раз:
+# в установившемся режиме ее держит интервал по емкости, а сигнал частоты ловит всплески
+# (агенты без расписания, массовое переподключение); реакция на малые отклонения
+# с задержкой в интервал отчета раскачивала бы частоту
+RATE_TOLERANCE = 1.5
+
+# Вес нового отчета в скользящем среднем множителя давности изменений
+FACTOR_SMOOTHING = 0.001
+
+
+def host_slot(host_id: str) -> float:
+    """Постоянная доля интервала [0, 1), в которую отчитывается хост"""
+    digest = hashlib.blake2b(host_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64
+
+
+class ReportScheduler:
+    """
+    Расчет next_report_after для агентов.
+
+    interval() и next_report_after() не обращаются к Redis и получают время
+    параметром (их использует бенчмарк с виртуальными часами); schedule()
+    и refresh() читают и обновляют общее состояние парка в Redis. load_sources
+    возвращает дополнительные коэффициенты загрузки воркера (1.0 - предел).
+    """
+
+    def __init__(
+        self,
+        base_interval: float = 900,
+        min_interval: float = 300,
+        max_interval: float = 3600,
+        target_rate: float = 0.0,
+        backlog_limit: int = 10000,
+        active_window: float = 3600,
+        active_factor: float = 0.5,
+        stable_after: float = 86400,
+        stable_factor: float = 2.0,
+        jitter: float = 0.02,
+        refresh_interval: float = 10,
+        stream: str = "events:host_posture",
+        backlog_groups: Iterable[str] = (),
+        load_sources: Optional[Callable[[], Dict[str, float]]] = None,
+        rng: Optional[random.Random] = None
+    ):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_rate = target_rate
+        self.backlog_limit = backlog_limit
+        self.active_window = active_window
+        self.active_factor = active_factor
+        self.stable_after = stable_after
+        self.stable_factor = stable_factor
+        self.jitter = jitter
+        self.refresh_interval = refresh_interval
+        self.stream = stream
+        # Группы потока, чье отставание считается нагрузкой; пусто - все группы с потребителями
+        self.backlog_groups = frozenset(backlog_groups)
+        self.load_sources = load_sources
+        self.rng = rng or random.Random()
+        # Состояние парка на момент последнего refresh()
+        self.fleet_size = 0
+        self.report_rate = 0.0
+        self.backlog = 0
+        self.refreshed_at = 0.0
+        self._refreshing = False
+        self.errors = 0
+        # Средний множитель давности изменений по отчетам: активные хосты отчитываются
+        # чаще, и емкость парка считается с учетом их доли
+        self.mean_factor = 1.0
+
+    # === Расчет ===
+
+    def load(self) -> Dict[str, float]:
+        """Коэффициенты загрузки по сигналам; больше 1 - перегрузка"""
+        load: Dict[str, float] = {}
+        if self.target_rate > 0:
+            load["rate"] = self.report_rate / (self.target_rate * RATE_TOLERANCE)
+        if self.backlog_limit > 0:
+            load["backlog"] = self.backlog / self.backlog_limit
+        if self.load_sources is not None:
+            try:
+                load.update(self.load_sources())
+            except Exception as e:
+                logger.debug(f"Источник нагрузки недоступен: {e}")
+        return load
+
+    def fleet_interval(self) -> float:
+        """Интервал парка без учета истории хоста: базовый, растянутый по емкости и нагрузке"""
+        interval = self.base_interval
+        if self.target_rate > 0:
+            # Частота парка - fleet_size / (interval * множитель хоста) в среднем по хостам,
+            # а средний по хостам 1/множитель равен 1/mean_factor по отчетам
+            interval = max(interval, self.fleet_size / (self.target_rate * self.mean_factor))
+        stretch = max(self.load().values(), default=0.0)
+        if stretch > 1.0:
+            interval *= stretch
+        return interval
+
+    def recency_factor(self, changed_at: Optional[float], now: float) -> float:
+        """Множитель интервала по давности изменения инвентаря хоста"""
+        if changed_at is None:
+            return 1.0
+        age = now - changed_at
+        if age < self.active_window:
+            return self.active_factor
+        if age > self.stable_after:
+            return self.stable_factor
+        return 1.0
+
+    def interval(self, changed_at: Optional[float], now: float) -> float:
+        """Интервал хоста: интервал парка с поправкой на давность изменения его инвентаря"""
+        interval = self.fleet_interval() * self.recency_factor(changed_at, now)
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def next_report_after(self, host_id: str, changed_at: Optional[float], now: float) -> int:
+        """
+        Секунды до следующего отчета: ближайшее наступление слота хоста не
+        раньше чем через пол-интервала, с небольшим случайным сдвигом.
+        Задержка лежит в [interval/2, 3*interval/2), в среднем - интервал.
+        """
+        self.mean_factor += FACTOR_SMOOTHING * (self.recency_factor(changed_at, now) - self.mean_factor)
+        interval = self.interval(changed_at, now)
+        delay = (host_slot(host_id) * interval - now) % interval
+        if delay < interval / 2:
+            delay += interval
+        delay += self.rng.uniform(-self.jitter, self.jitter) * interval
+        return max(1, int(round(delay)))
+
+    # === Состояние в Redis ===
+
+    async def schedule(self, redis: aioredis.Redis, host_id: str) -> int:
+        """
+        Учет отчета хоста и расчет next_report_after. Ошибки Redis не мешают
+        приему: расписание считается по последнему известному состоянию.
+        """
+        now = time.time()
+        changed_at = None
+        try:
+            pipe = redis.pipeline(transaction=False)
+            pipe.zadd(HOSTS_KEY, {host_id: now})
+            pipe.hget(CHANGED_KEY, host_id)
+            _, changed = await pipe.execute()
+            if changed is not None:
+                changed_at = float(changed)
+            if time.monotonic() - self.refreshed_at >= self.refresh_interval and not self._refreshing:
+                await self.refresh(redis)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Расписание отчетов: Redis недоступен, используется последнее состояние: {e}")
+        return self.next_report_after(host_id, changed_at, now)
+
+    async def refresh(self, redis: aioredis.Redis) -> None:
+        """Перечитывание размера парка, частоты отчетов и отставания обработки"""
+        self._refreshing = True
+        try:
+            now = time.time()
+            expire_before = now - 2 * self.max_interval
+            # Хосты, не отчитывавшиеся дольше двух максимальных интервалов, выбывают из парка;
+            # MULTI: хост, отчитавшийся между чтением и удалением, не теряет время изменения
+            pipe = redis.pipeline(transaction=True)
+            pipe.zrangebyscore(HOSTS_KEY, 0, expire_before)
+            pipe.zremrangebyscore(HOSTS_KEY, 0, expire_before)
+            pipe.zcard(HOSTS_KEY)
+            pipe.zcount(HOSTS_KEY, now - RATE_WINDOW_SECONDS, now)
+            expired, _, fleet_size, recent = await pipe.execute()
+            if expired:
+                await redis.hdel(CHANGED_KEY, *expired)
+            self.fleet_size = int(fleet_size)
+            self.report_rate = int(recent) / RATE_WINDOW_SECONDS
+            self.backlog = await self._stream_backlog(redis)
+            self.refreshed_at = time.monotonic()
+        finally:
+            self._refreshing = False
+
+    async def _stream_backlog(self, redis: aioredis.Redis) -> int:
+        """
+        Наибольшее отставание группы потребителей потока (lag, без него - pending).
+        Группы без потребителей и не из backlog_groups (если задан) не учитываются.
+        """
+        try:
+            groups = await redis.xinfo_groups(self.stream)
+        except aioredis.ResponseError:
+            return 0
+        backlog = 0
+        for group in groups:
+            name = group.get("name")
+            if isinstance(name, bytes):
+                name = name.decode()
+            if self.backlog_groups:
+                if name not in self.backlog_groups:
+                    continue
+            elif not group.get("consumers"):
+                continue
+            lag = group.get("lag")
+            backlog = max(backlog, int(lag if lag is not None else group.get("pending") or 0))
+        return backlog
+
+    async def mark_changed(self, redis: aioredis.Redis, host_id: str, when: Optional[float] = None) -> None:
+        """Отметка изменения инвентаря хоста (вызывается фоновой синхронизацией)"""
+        try:
+            await redis.hset(CHANGED_KEY, host_id, when if when is not None else time.time())
+        except Exception as e:
+            logger.warning(f"Расписание отчетов: не удалось отметить изменение хоста {host_id}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "fleet_size": self.fleet_size,
+            "report_rate": round(self.report_rate, 3),
+            "backlog": self.backlog,
+            "load": {name: round(value, 3) for name, value in self.load().items()},
+            "fleet_interval": round(self.fleet_interval(), 1),
+            "mean_factor": round(self.mean_factor, 3),
+            "base_interval": self.base_interval,
+            "min_interval": self.min_interval,
+            "max_interval": self.max_interval,
+            "target_rate": self.target_rate,
+            "refreshed_seconds_ago": round(time.monotonic() - self.refreshed_at, 1) if self.refreshed_at else None,
+            "errors": self.errors,
+        }
@@ -0,0 +1,108 @@
+"""
+Запуск Ingest API в production-режиме: несколько процессов на одном сокете.
+
+    python server.py --workers 4
+
+Порядок запуска:
+1. Родительский процесс один раз создает индексы OpenSearch
+   (host-inventory, findings-rollup), дожидаясь доступности кластера не
+   дольше --bootstrap-timeout секунд. Воркеры получают INGEST_BOOTSTRAPPED
+   и не повторяют эту работу параллельно. Если кластер недоступен,
+   воркеры создают индексы сами при подключении.
+2. uvicorn запускает --workers процессов, которые принимают соединения с
+   общего сокета. Число воркеров передается им через INGEST_WORKERS: по нему
+   делится бюджет соединений OpenSearch/Redis и включается общий учет
+   метрик (см. workers.py).
+3. По SIGTERM/SIGINT воркеры перестают принимать соединения и дожидаются
+   завершения запросов в обработке не дольше --drain-timeout секунд,
+   затем закрывают пулы соединений.
+
+Для разработки по-прежнему используется `python main.py` (один процесс с
+автоперезагрузкой).
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+import uvicorn
+
+logger = logging.getLogger("ingest.server")
+
+
+async def bootstrap(opensearch_url: str, timeout: float) -> bool:
+    """Однократная подготовка индексов до запуска воркеров"""
+    from opensearchpy import AsyncOpenSearch
+
+    from inventory_index import ensure_inventory_index
+    from findings_rollup import ensure_rollup_index
+    from process_tree import ensure_process_tree_index
+    from flow_aggregator import ensure_flow_index
+    from vuln_index import ensure_vuln_index
+
+    deadline = time.monotonic() + timeout
+    delay = 1.0
+    client = AsyncOpenSearch([opensearch_url])
+    try:
+        while True:
+            try:
+                await client.ping()
+                await ensure_inventory_index(client)
+                await ensure_rollup_index(client)
+                await ensure_process_tree_index(client)
+                await ensure_flow_index(client)
+                await ensure_vuln_index(client)
+                return True
+            except Exception as e:
+                if time.monotonic() + delay > deadline:
+                    logger.warning(f"OpenSearch недоступен, индексы создадут воркеры: {e}")
+                    return False
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10.0)
+    finally:
+        await client.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ingest API: многопроцессный режим")
+    parser.add_argument("--host", default=os.getenv("API_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", "8000")))
+    parser.add_argument("--workers", type=int,
+                        default=int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1))),
+                        help="Число процессов (по умолчанию - число ядер)")
+    parser.add_argument("--drain-timeout", type=float,
+                        default=float(os.getenv("INGEST_DRAIN_TIMEOUT", "30")),
+                        help="Ожидание запросов в обработке при остановке, секунды")
+    parser.add_argument("--bootstrap-timeout", type=float,
+                        default=float(os.getenv("INGEST_BOOTSTRAP_TIMEOUT", "30")),
+                        help="Ожидание OpenSearch при подготовке индексов, секунды")
+    parser.add_argument("--backlog", type=int, default=int(os.getenv("INGEST_BACKLOG", "2048")))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"),
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    workers = max(1, args.workers)
+    # Воркеры - дочерние процессы, настройки передаются им через окружение
+    os.environ["INGEST_WORKERS"] = str(workers)
+    opensearch_url = os.getenv("OPENSEARCH_URL", "http://localhost:9200")
+    if asyncio.run(bootstrap(opensearch_url, args.bootstrap_timeout)):
+        os.environ["INGEST_BOOTSTRAPPED"] = "true"
+        logger.info("Индексы OpenSearch подготовлены")
+
+    logger.info(f"Запуск {workers} воркеров на {args.host}:{args.port}")
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        backlog=args.backlog,
+        timeout_graceful_shutdown=args.drain_timeout,
+        log_level="info",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+"""
+Unit tests of the ingest API and shared modules.
+
+Run from the ingest-api directory:
+    pytest
+
+Backends are the in-memory replacements from ingest-api/benchmarks/backends.py.
+"""
+
+import os
+import sys
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (os.path.join(API_DIR, "benchmarks"), API_DIR, os.path.dirname(API_DIR)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
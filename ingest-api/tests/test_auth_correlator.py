@@ -0,0 +1,66 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from auth_correlator import DEFAULT_STREAM, AuthCorrelationWorker
+from backends import InMemoryOpenSearch, InMemoryRedis
+from shared.correlation import AuthCorrelator, load_correlation_rules
+
+RULES = os.path.join(os.path.dirname(__file__), "..", "auth_correlation_rules.json")
+
+
+class FlakyRedis(InMemoryRedis):
+    """Транзакция контрольной точки падает заданное число раз"""
+
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+
+    def pipeline(self, transaction: bool = True):
+        pipe = super().pipeline(transaction)
+        execute = pipe.execute
+
+        async def flaky_execute():
+            if self.failures:
+                self.failures -= 1
+                pipe.commands = []
+                raise RedisConnectionError("connection reset")
+            return await execute()
+
+        pipe.execute = flaky_execute
+        return pipe
+
+
+def test_failed_checkpoint_keeps_partitions_dirty():
+    async def run():
+        redis = FlakyRedis(failures=1)
+        start = datetime(2025, 9, 1, tzinfo=timezone.utc)
+        for i in range(3):
+            await redis.xadd(DEFAULT_STREAM, {
+                "event_id": f"auth-{i}", "event_type": "authentication",
+                "timestamp": (start + timedelta(seconds=i)).isoformat(),
+                "user": "admin", "source_ip": "203.0.113.7", "success": "False",
+            })
+        correlator = AuthCorrelator(load_correlation_rules(RULES), partitions=8)
+        worker = AuthCorrelationWorker(redis, InMemoryOpenSearch(), correlator, start_id="0")
+        worker.correlate(await redis.xread({DEFAULT_STREAM: "0"}, count=10))
+
+        with pytest.raises(RedisConnectionError):
+            await worker.checkpoint()
+        assert await redis.hgetall(worker.state_key) == {}
+
+        await worker.checkpoint()
+        saved = await redis.hgetall(worker.state_key)
+        restored = AuthCorrelator(load_correlation_rules(RULES), partitions=8)
+        keys = sum(restored.restore(int(partition), json.loads(raw))
+                   for partition, raw in saved.items())
+        return saved, keys, correlator
+
+    saved, keys, correlator = asyncio.run(run())
+    assert saved
+    assert keys == sum(len(states) for states in correlator._states.values())
+    assert correlator.checkpoint_dirty() == {}
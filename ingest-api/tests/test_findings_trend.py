@@ -0,0 +1,27 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from backends import InMemoryOpenSearch
+from findings_rollup import ROLLUP_INDEX, get_findings_trend
+
+
+def test_hour_trend_keeps_newest_buckets_of_partial_day():
+    async def run():
+        opensearch = InMemoryOpenSearch()
+        now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        # now-1d/d начинается с полуночи вчерашних суток: до 48 часовых точек
+        start = (now - timedelta(days=1)).replace(hour=0)
+        hours = int((now - start) / timedelta(hours=1)) + 1
+        for i in range(hours):
+            bucket = start + timedelta(hours=i)
+            await opensearch.index(index=ROLLUP_INDEX, id=f"fleet:hour:{i}", body={
+                "scope": "fleet", "interval": "hour", "bucket": bucket.isoformat(), "total": i,
+            })
+        trend = await get_findings_trend(opensearch, None, "hour", 1)
+        return trend, hours, now
+
+    trend, hours, now = asyncio.run(run())
+    buckets = [point["bucket"] for point in trend["points"]]
+    assert len(buckets) == hours
+    assert buckets == sorted(buckets)
+    assert buckets[-1] == now.isoformat()
@@ -0,0 +1,52 @@
+import asyncio
+import uuid
+
+import httpx
+
+from backends import InMemoryOpenSearch, InMemoryRedis
+import main
+
+
+def connection_event(event_id):
+    return {
+        "event_id": event_id,
+        "event_type": "network_connection",
+        "timestamp": "2025-09-01T10:00:00Z",
+        "severity": "high",
+        "host": {"host_id": "h1", "hostname": "WS-1", "os_version": "Windows 10 Pro", "ip_addresses": ["10.0.0.1"]},
+        "agent": {"agent_version": "1.0.0", "collect_level": "standard"},
+        "network": {"protocol": "tcp", "source_ip": "10.0.0.1", "source_port": 50000,
+                    "destination_ip": "93.184.1.1", "destination_port": 443,
+                    "bytes_sent": 100, "bytes_received": 200},
+    }
+
+
+def test_flagged_event_is_stored_by_retry_after_failed_index(monkeypatch):
+    async def run():
+        main.opensearch_client, main.redis_client = InMemoryOpenSearch(), InMemoryRedis()
+        original = main.index_event
+        calls = []
+
+        async def failing_once(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 1:
+                return False
+            return await original(*args, **kwargs)
+
+        monkeypatch.setattr(main, "index_event", failing_once)
+        aggregator = main.flow_aggregator
+        before = aggregator.counters["events"]
+        event = connection_event(str(uuid.uuid4()))
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            first = await client.post("/ingest", json=event)
+            retry = await client.post("/ingest", json=event)
+            again = await client.post("/ingest", json=event)
+        return first, retry, again, aggregator.counters["events"] - before, len(calls)
+
+    first, retry, again, counted, index_calls = asyncio.run(run())
+    assert first.status_code == 500
+    assert retry.status_code == 200 and retry.json()["status"] == "accepted"
+    assert again.json()["status"] == "duplicate"
+    # Соединение учтено в потоке один раз, сырое событие сохранено повтором
+    assert counted == 1
+    assert index_calls == 2
@@ -0,0 +1,69 @@
+import asyncio
+
+import httpx
+
+from backends import InMemoryOpenSearch, InMemoryRedis
+import main
+from inventory_index import INVENTORY_INDEX, SNAPSHOT_KEY, sync_host_inventory
+
+
+class FailingBulk(InMemoryOpenSearch):
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+
+    async def bulk(self, body, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("bulk timed out")
+        return await super().bulk(body, **kwargs)
+
+
+def snapshot(timestamp, *processes):
+    return {
+        "event_id": f"posture-{timestamp}",
+        "timestamp": timestamp,
+        "host_info": {"host_id": "h1", "hostname": "WS-1"},
+        "inventory": {"processes": [{"name": name, "exe_path": f"C:\\{name}"} for name in processes]},
+    }
+
+
+def test_snapshot_order_uses_time_not_string():
+    async def run():
+        opensearch, redis = InMemoryOpenSearch(), InMemoryRedis()
+        first = await sync_host_inventory(opensearch, redis, snapshot("2025-09-01T12:00:00+03:00", "a.exe"))
+        # 10:00Z позже 09:00Z (12:00+03:00), хотя строка меньше
+        second = await sync_host_inventory(opensearch, redis, snapshot("2025-09-01T10:00:00Z", "b.exe"))
+        older = await sync_host_inventory(opensearch, redis, snapshot("2025-09-01T09:30:00Z", "c.exe"))
+        return first, second, older, sorted(doc["name"] for doc in opensearch.docs[INVENTORY_INDEX].values())
+
+    first, second, older, names = asyncio.run(run())
+    assert first == (1, 0)
+    assert second == (1, 1)
+    assert older == (0, 0)
+    assert names == ["b.exe"]
+
+
+def test_failed_write_does_not_advance_marker():
+    async def run():
+        opensearch, redis = FailingBulk(failures=1), InMemoryRedis()
+        event = snapshot("2025-09-01T10:00:00Z", "a.exe")
+        failed = await sync_host_inventory(opensearch, redis, event)
+        marker = await redis.hget(SNAPSHOT_KEY, "h1")
+        retried = await sync_host_inventory(opensearch, redis, event)
+        return failed, marker, retried, await redis.hget(SNAPSHOT_KEY, "h1")
+
+    failed, marker, retried, after = asyncio.run(run())
+    assert failed == (0, 0)
+    assert marker is None
+    assert retried == (1, 0)
+    assert after == b"2025-09-01T10:00:00Z"
+
+
+def test_search_rejects_non_positive_limit():
+    async def run():
+        main.opensearch_client, main.redis_client = InMemoryOpenSearch(), InMemoryRedis()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            return await client.get("/api/inventory/search", params={"name": "a.exe", "limit": 0})
+
+    assert asyncio.run(run()).status_code == 422
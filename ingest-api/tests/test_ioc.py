@@ -0,0 +1,47 @@
+import csv
+
+from enrichment import collect_indicators
+from shared.ioc import Indicator, IocIndex, load_indicator_feed
+
+EICAR_MD5 = "44d88612fea8a8f36de82e1278abb02f"
+
+
+def test_bad_confidence_skips_only_that_record():
+    records = [
+        {"indicator_type": "md5", "indicator_value": EICAR_MD5.upper(), "confidence": "90"},
+        {"indicator_type": "domain", "indicator_value": "evil.example.com", "confidence": "high"},
+        {"indicator_type": "ip", "indicator_value": "203.0.113.7", "confidence": None},
+        {"indicator_type": "unknown", "indicator_value": "x"},
+    ]
+    index = IocIndex.build(collect_indicators(None, records, min_confidence=50))
+
+    assert index.match_hash(EICAR_MD5).indicator.confidence == 90
+    assert index.match_ip("203.0.113.7") is not None
+    assert not index.domains
+    assert index.skipped == 2
+
+
+def test_csv_feed_with_empty_and_bad_confidence(tmp_path):
+    path = tmp_path / "feed.csv"
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["indicator_type", "indicator_value", "threat_type", "confidence", "source"])
+        writer.writerow(["domain", "*.Evil.Example.com.", "c2", "", "feed"])
+        writer.writerow(["substring", "Invoke-Mimikatz", "tool", "80", "feed"])
+        writer.writerow(["md5", EICAR_MD5, "malware", "n/a", "feed"])
+    index = IocIndex.build(load_indicator_feed(str(path)))
+
+    assert index.skipped == 1
+    assert index.domains["evil.example.com"].confidence == 50
+    assert index.substrings == 1
+    assert [m.indicator.value for m in index.match_text("powershell invoke-mimikatz -dump")] == ["invoke-mimikatz"]
+
+
+def test_duplicate_values_keep_highest_confidence():
+    index = IocIndex.build([
+        Indicator.normalized("sha1", "a" * 40, confidence=30),
+        Indicator.normalized("sha1", "A" * 40, confidence=70),
+        Indicator.normalized("ip", "10.0.0.0/8", confidence=60),
+    ])
+    assert index.match_hash("a" * 40).indicator.confidence == 70
+    assert index.match_ip("10.1.2.3").indicator.value == "10.0.0.0/8"
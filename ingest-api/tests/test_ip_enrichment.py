@@ -0,0 +1,43 @@
+import ipaddress
+
+from shared.ip_enrichment import IpClassifier, _stdlib_private_ranges
+
+
+def boundary_addresses():
+    """First and last address of every stdlib range and their neighbours."""
+    for cidr, _ in _stdlib_private_ranges():
+        network = ipaddress.ip_network(cidr)
+        top = 2 ** network.max_prefixlen - 1
+        for number in (int(network.network_address), int(network.broadcast_address)):
+            for candidate in (number - 1, number, number + 1):
+                if 0 <= candidate <= top:
+                    yield str(ipaddress.ip_address(candidate) if network.version == 4
+                              else ipaddress.IPv6Address(candidate))
+
+
+def test_is_private_matches_ipaddress_on_stdlib_ranges():
+    classifier = IpClassifier()
+    addresses = list(boundary_addresses()) + [
+        "192.0.0.8", "192.0.0.9", "192.0.0.170", "64:ff9b::1", "64:ff9b:1::1", "2002::1",
+        "100.64.0.1", "224.0.0.1", "ff02::1", "::ffff:10.0.0.1", "::ffff:8.8.8.8",
+        "8.8.8.8", "2606:4700::1111",
+    ]
+    mismatched = [ip for ip in addresses
+                  if classifier.is_private(ip) != ipaddress.ip_address(ip).is_private]
+    assert mismatched == []
+
+
+def test_invalid_and_zone_addresses():
+    classifier = IpClassifier()
+    assert classifier.is_private("not-an-ip") is False
+    assert classifier.classify("not-an-ip")["classes"] == ["invalid"]
+    assert classifier.is_private("fe80::1%eth0") is True
+
+
+def test_site_and_known_bad_labels():
+    classifier = IpClassifier(internal_sites={"hq": ["10.10.0.0/16"], "lab": ["10.10.5.0/24"]},
+                              known_bad={"drop": ["198.51.100.0/24"]})
+    info = classifier.classify("10.10.5.1")
+    assert info["site"] == "lab"
+    assert info["classes"] == ["internal_site", "private"]
+    assert classifier.classify("198.51.100.7")["threat_lists"] == ["drop"]
@@ -0,0 +1,45 @@
+from shared.posture_rules import PostureRule, PostureTable, iter_rows
+
+
+def rule(op, value, field="uac.level"):
+    return PostureRule({"rule_id": "R", "condition": {"field": field, "op": op, "value": value}})
+
+
+def matched(table, op, value):
+    mask = rule(op, value).evaluate(table, 0) & table.live
+    return {table.host_ids[row] for row in iter_rows(mask)}
+
+
+def test_bool_and_int_values_keep_separate_masks():
+    table = PostureTable()
+    table.upsert("int", None, "2025-09-01T00:00:00Z", {"uac.level": 1})
+    table.upsert("bool", None, "2025-09-01T00:00:00Z", {"uac.level": True})
+    table.upsert("zero", None, "2025-09-01T00:00:00Z", {"uac.level": 0})
+
+    assert matched(table, "eq", True) == {"bool"}
+    assert matched(table, "eq", 1) == {"int"}
+    assert matched(table, "in", [True, 0]) == {"bool", "zero"}
+    assert matched(table, "ne", 1) == {"bool", "zero"}
+    assert matched(table, "gte", 1) == {"int"}
+
+
+def test_changing_value_type_moves_row_between_masks():
+    table = PostureTable()
+    table.upsert("a", None, "2025-09-01T00:00:00Z", {"uac.level": 1})
+    table.upsert("b", None, "2025-09-01T00:00:00Z", {"uac.level": 1})
+    table.upsert("a", None, "2025-09-02T00:00:00Z", {"uac.level": True})
+    assert matched(table, "eq", True) == {"a"}
+    assert matched(table, "eq", 1) == {"b"}
+
+    table.upsert("b", None, "2025-09-02T00:00:00Z", {"uac.level": True})
+    table.upsert("a", None, "2025-09-03T00:00:00Z", {})
+    assert matched(table, "eq", True) == {"b"}
+    assert matched(table, "eq", 1) == set()
+    assert table.columns["uac.level"].masks == {(bool, True): 1 << table.rows["b"]}
+
+
+def test_late_snapshot_is_ignored():
+    table = PostureTable()
+    table.upsert("a", None, "2025-09-02T00:00:00Z", {"uac.level": 2})
+    assert table.upsert("a", None, "2025-09-01T00:00:00Z", {"uac.level": 0}) is None
+    assert matched(table, "eq", 2) == {"a"}
@@ -0,0 +1,105 @@
+import asyncio
+
+from backends import InMemoryOpenSearch, InMemoryRedis
+from posture_sections import (
+    POSTURE_SECTIONS,
+    fill_unchanged_sections,
+    record_section_hashes,
+    sections_needed,
+)
+
+INDEX = "host-posture-2025.09.01"
+HASHES = {name: f"h-{name}" for name in POSTURE_SECTIONS}
+
+
+def stored_snapshot():
+    return {
+        "event_id": "posture-1",
+        "timestamp": "2025-09-01T10:00:00Z",
+        "host_info": {"host_id": "h1"},
+        "inventory": {
+            "processes": [{"pid": 4, "name": "System"}],
+            "autoruns": {
+                "registry": [{"name": "Run", "value": "a.exe"}],
+                "startup_folders": [],
+                "services_auto": [{"name": "svc", "state": "running"}],
+                "scheduled_tasks": [{"name": "task"}],
+            },
+        },
+        "security": {"firewall": {"enabled": True}},
+        "windows_update": {"pending": 0},
+    }
+
+
+async def stored(opensearch, redis):
+    await opensearch.index(index=INDEX, id="posture-1", body=stored_snapshot())
+    await record_section_hashes(redis, "h1", HASHES, "posture-1", INDEX, "2025-09-01T10:00:00Z")
+
+
+def test_unknown_host_needs_all_sections():
+    needed = asyncio.run(sections_needed(InMemoryRedis(), "h1", HASHES))
+    assert needed == list(POSTURE_SECTIONS)
+
+
+def test_changed_autoruns_part_is_the_only_section_needed():
+    async def run():
+        opensearch, redis = InMemoryOpenSearch(), InMemoryRedis()
+        await stored(opensearch, redis)
+        return await sections_needed(redis, "h1", dict(HASHES, **{"autoruns.services_auto": "h-new"}))
+
+    assert asyncio.run(run()) == ["autoruns.services_auto"]
+
+
+def test_unchanged_sections_are_merged_from_stored_snapshot():
+    async def run():
+        opensearch, redis = InMemoryOpenSearch(), InMemoryRedis()
+        await stored(opensearch, redis)
+        hashes = dict(HASHES, **{"autoruns.services_auto": "h-new"})
+        event = {
+            "event_id": "posture-2",
+            "host_info": {"host_id": "h1"},
+            "inventory": {"autoruns": {"services_auto": [{"name": "svc", "state": "stopped"}]}},
+        }
+        unchanged = [name for name in POSTURE_SECTIONS if name != "autoruns.services_auto"]
+        missing = await fill_unchanged_sections(opensearch, redis, "h1", event, unchanged, hashes)
+        return missing, event
+
+    missing, event = asyncio.run(run())
+    expected = stored_snapshot()
+    assert missing == []
+    assert event["inventory"]["processes"] == expected["inventory"]["processes"]
+    assert event["inventory"]["autoruns"]["registry"] == expected["inventory"]["autoruns"]["registry"]
+    assert event["inventory"]["autoruns"]["services_auto"] == [{"name": "svc", "state": "stopped"}]
+    assert event["security"] == expected["security"]
+    assert event["windows_update"] == expected["windows_update"]
+
+
+def test_stale_or_deleted_reference_asks_for_sections_again():
+    async def run():
+        opensearch, redis = InMemoryOpenSearch(), InMemoryRedis()
+        await stored(opensearch, redis)
+        stale = await fill_unchanged_sections(
+            opensearch, redis, "h1", {}, ["security", "processes"], dict(HASHES, security="h-other"))
+        await opensearch.delete(index=INDEX, id="posture-1")
+        deleted = await fill_unchanged_sections(opensearch, redis, "h1", {}, ["security"], HASHES)
+        return stale, deleted
+
+    stale, deleted = asyncio.run(run())
+    assert stale == ["security"]
+    assert deleted == ["security"]
+
+
+def test_older_snapshot_does_not_replace_table():
+    async def run():
+        redis = InMemoryRedis()
+        await record_section_hashes(redis, "h1", HASHES, "posture-1", INDEX, "2025-09-01T12:00:00+03:00")
+        # 10:00Z позже 09:00Z, хотя строка меньше
+        await record_section_hashes(redis, "h1", dict(HASHES, security="h-2"), "posture-2", INDEX,
+                                    "2025-09-01T10:00:00Z")
+        await record_section_hashes(redis, "h1", dict(HASHES, security="h-3"), "posture-3", INDEX,
+                                    "2025-09-01T09:30:00Z")
+        return await redis.hgetall("posture:sections:h1")
+
+    table = asyncio.run(run())
+    assert table[b"_event"] == b"posture-2"
+    assert table[b"security"] == b"h-2"
@@ -0,0 +1,84 @@
+import asyncio
+
+from backends import InMemoryOpenSearch, InMemoryRedis
+from process_tree import (
+    MAX_DEPTH,
+    PROCESS_TREE_INDEX,
+    SNAPSHOT_KEY,
+    get_descendants,
+    get_process,
+    sync_host_processes,
+)
+
+CHAIN = MAX_DEPTH + 6
+START_MS = 1756713600000  # 2025-09-01T08:00:00Z
+
+
+def snapshot(timestamp, processes):
+    return {
+        "event_id": f"posture-{timestamp}",
+        "timestamp": timestamp,
+        "host_info": {"host_id": "h1", "hostname": "WS-1"},
+        "inventory": {"processes": processes},
+    }
+
+
+def chain(length):
+    """Цепочка родитель -> потомок: PID i+1 запущен процессом i"""
+    return [
+        {"pid": pid, "ppid": pid - 1 if pid > 1 else None, "name": f"p{pid}.exe",
+         "create_time": START_MS + pid * 1000}
+        for pid in range(1, length + 1)
+    ]
+
+
+class FailingBulk(InMemoryOpenSearch):
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+
+    async def bulk(self, body, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("bulk timed out")
+        return await super().bulk(body, **kwargs)
+
+
+def test_depth_is_not_truncated_with_the_path():
+    async def run():
+        opensearch, redis = InMemoryOpenSearch(), InMemoryRedis()
+        processes = sorted(chain(CHAIN), key=lambda proc: -proc["pid"])
+        await sync_host_processes(opensearch, redis, snapshot("2025-09-01T10:00:00Z", processes))
+        docs = {doc["pid"]: doc for doc in opensearch.docs[PROCESS_TREE_INDEX].values()}
+        deep = docs[CHAIN - 2]
+        below = await get_descendants(opensearch, "h1", deep, max_depth=1)
+        # Потомок, запущенный после снимка, получает глубину от родителя из Redis
+        await sync_host_processes(opensearch, redis, snapshot("2025-09-01T10:05:00Z", processes + [
+            {"pid": 9999, "ppid": CHAIN, "name": "late.exe", "create_time": START_MS + 3600 * 1000}
+        ]))
+        late = await get_process(opensearch, "h1", f"9999:{START_MS + 3600 * 1000}")
+        return docs, below, late
+
+    docs, below, late = asyncio.run(run())
+    assert docs[1]["depth"] == 0
+    assert docs[CHAIN]["depth"] == CHAIN - 1
+    assert len(docs[CHAIN]["ancestors"]) == MAX_DEPTH
+    assert [doc["pid"] for doc in below] == [CHAIN - 1]
+    assert late["depth"] == CHAIN
+
+
+def test_failed_bulk_does_not_advance_marker():
+    async def run():
+        opensearch, redis = FailingBulk(failures=1), InMemoryRedis()
+        event = snapshot("2025-09-01T10:00:00Z", chain(3))
+        failed = await sync_host_processes(opensearch, redis, event)
+        marker = await redis.hget(SNAPSHOT_KEY, "h1")
+        retried = await sync_host_processes(opensearch, redis, event)
+        stale = await sync_host_processes(opensearch, redis, snapshot("2025-09-01T12:59:00+03:00", []))
+        return failed, marker, retried, stale
+
+    failed, marker, retried, stale = asyncio.run(run())
+    assert failed == (0, 0)
+    assert marker is None
+    assert retried == (3, 0)
+    assert stale == (0, 0)
@@ -0,0 +1,19 @@
+from profiling import RequestProfiler
+
+
+def test_restart_keeps_request_counters_balanced():
+    profiler = RequestProfiler(enabled=True, slow_ms=0)
+    profiler.start()
+    try:
+        first = profiler.sampler
+        state = profiler.begin_request({"X-Profile": "1"})
+        profiler.configure(interval_ms=5)
+        second = profiler.sampler
+        assert second is not first
+
+        profile_id = profiler.end_request(state, "GET", "/health", "200")
+        assert profile_id is not None
+        assert first.active_requests == 0
+        assert second.active_requests == 0
+    finally:
+        profiler.stop()
@@ -0,0 +1,67 @@
+import asyncio
+import random
+import time
+
+from backends import InMemoryRedis
+from report_scheduler import CHANGED_KEY, HOSTS_KEY, ReportScheduler, host_slot
+
+NOW = 1_756_713_600.0
+
+
+def scheduler(**options):
+    options.setdefault("jitter", 0.0)
+    return ReportScheduler(rng=random.Random(1), **options)
+
+
+def test_delay_lands_on_host_slot_within_half_to_one_and_half_intervals():
+    s = scheduler(base_interval=900)
+    for i in range(200):
+        host_id = f"host-{i}"
+        now = NOW + i * 37
+        delay = s.next_report_after(host_id, None, now)
+        assert 450 <= delay <= 1350
+        # Отчет приходит в слот хоста: (now + delay) mod interval = slot * interval
+        offset = (now + delay - host_slot(host_id) * 900) % 900
+        assert min(offset, 900 - offset) <= 1
+
+
+def test_capacity_and_overload_stretch_interval():
+    s = scheduler(base_interval=900, max_interval=10_000, target_rate=10, backlog_limit=1000)
+    s.fleet_size = 20_000
+    assert s.fleet_interval() == 2000
+    s.backlog = 3000
+    assert s.fleet_interval() == 6000
+    assert s.interval(None, NOW) == 6000
+    s.backlog = 0
+    s.report_rate = 30
+    assert s.fleet_interval() == 4000
+
+
+def test_recency_factor_and_bounds():
+    s = scheduler(base_interval=900, min_interval=600, max_interval=1200)
+    assert s.interval(NOW - 60, NOW) == 600
+    assert s.interval(NOW - 7200, NOW) == 900
+    assert s.interval(NOW - 2 * 86400, NOW) == 1200
+
+
+def test_refresh_ignores_abandoned_groups_and_prunes_expired_hosts():
+    async def run():
+        redis = InMemoryRedis()
+        s = scheduler(max_interval=3600)
+        now = time.time()
+        await redis.zadd(HOSTS_KEY, {"old": now - 3 * 3600, "fresh": now})
+        await redis.hset(CHANGED_KEY, "old", now - 4 * 3600)
+        await redis.hset(CHANGED_KEY, "fresh", now - 60)
+        for _ in range(3):
+            await redis.xadd(s.stream, {"event_type": "host_posture"})
+        # Брошенная группа без потребителей отстает на 3, рабочая - на 1
+        await redis.xgroup_create(s.stream, "abandoned", id="0")
+        await redis.xgroup_create(s.stream, "live", id="0")
+        await redis.xreadgroup("live", "worker-1", {s.stream: ">"}, count=2)
+        await s.refresh(redis)
+        return s, await redis.hgetall(CHANGED_KEY)
+
+    s, changed = asyncio.run(run())
+    assert s.fleet_size == 1
+    assert list(changed) == [b"fresh"]
+    assert s.backlog == 1
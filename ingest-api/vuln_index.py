@@ -0,0 +1,520 @@
+"""
+Индекс корреляции уязвимостей с хостами.
+
+Результаты сканирования (VulnScanResult: target, vulnerability_id,
+cvss_score) и события безопасности с cve_id приходят отдельно от
+host_posture и адресуют хост по IP или имени. Модуль связывает их с хостами
+парка и поддерживает индекс vulnerability-index из документов трех видов:
+- exposure - пара хост + CVE: оценка CVSS, первое и последнее обнаружение;
+- host     - сводка хоста: максимальный CVSS, число CVE по уровням, список CVE;
+- cve      - сводка CVE: число затронутых хостов, оценка, название.
+
+Связи CVE -> хосты и хост -> CVE хранятся в Redis (множество хостов CVE и
+хеш CVE -> CVSS хоста), сводки пересчитываются только для затронутых хостов
+и CVE. Чтение состояния и увеличение версии сводки выполняются одной
+транзакцией, сводки пишутся с внешней версией, поэтому устаревшая сводка не
+перезапишет более новую при параллельной обработке.
+
+Адреса и имена хостов берутся из событий агентов и снимков host_posture.
+Уязвимости цели, которую еще не удалось сопоставить с хостом, учитываются
+под самой целью и переносятся на хост, когда агент сообщит этот адрес.
+"""
+
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import redis.asyncio as aioredis
+from opensearchpy import AsyncOpenSearch
+
+logger = logging.getLogger(__name__)
+
+VULN_INDEX = "vulnerability-index"
+
+VULN_KINDS = ("exposure", "host", "cve")
+
+# Уровни по оценке CVSS v3 (нижняя граница); без оценки - none
+CVSS_SEVERITIES = (("critical", 9.0), ("high", 7.0), ("medium", 4.0), ("low", 0.1))
+SEVERITY_LEVELS = tuple(name for name, _ in CVSS_SEVERITIES) + ("none",)
+
+# Статусы результата сканирования, означающие устранение уязвимости
+FIXED_STATUSES = {"fixed", "resolved", "closed", "remediated"}
+
+# Ключи Redis
+TARGETS_KEY = "vuln:targets"          # имя хоста / IP / host_id в нижнем регистре -> host_id
+HOSTNAMES_KEY = "vuln:hostnames"      # host_id -> имя хоста
+CVE_META_KEY = "vuln:cve_meta"        # CVE -> JSON с названием и оценкой
+VERSIONS_KEY = "vuln:versions"        # host:<ключ> / cve:<id> -> версия сводки
+HOST_CVES_PREFIX = "vuln:host:"       # хеш CVE -> CVSS хоста
+CVE_HOSTS_PREFIX = "vuln:cve:"        # множество хостов CVE
+
+# Сколько хостов помнить в процессе, чтобы не переписывать неизменные адреса
+REGISTERED_HOSTS_MAX = 100_000
+
+VULN_INDEX_BODY = {
+    "mappings": {
+        "properties": {
+            "kind": {"type": "keyword"},
+            "host_id": {"type": "keyword"},
+            "hostname": {"type": "keyword"},
+            "resolved": {"type": "boolean"},
+            "target": {"type": "keyword"},
+            "cve_id": {"type": "keyword"},
+            "name": {"type": "keyword", "ignore_above": 1024},
+            "cvss_score": {"type": "float"},
+            "severity": {"type": "keyword"},
+            "source": {"type": "keyword"},
+            "solution": {"type": "text", "index": False},
+            "first_seen": {"type": "date"},
+            "last_seen": {"type": "date"},
+            "last_event_id": {"type": "keyword"},
+            "max_cvss": {"type": "float"},
+            "max_severity": {"type": "keyword"},
+            "cve_count": {"type": "integer"},
+            "host_count": {"type": "integer"},
+            "severity_counts": {
+                "properties": {s: {"type": "integer"} for s in SEVERITY_LEVELS}
+            },
+            "cves": {"type": "keyword"},
+            "updated_at": {"type": "date"}
+        }
+    }
+}
+
+# Процесс запоминает последние зарегистрированные адреса хостов
+_registered: Dict[str, Tuple[str, Tuple[str, ...]]] = {}
+
+
+async def ensure_vuln_index(opensearch: AsyncOpenSearch) -> None:
+    """Создание индекса уязвимостей с маппингом, если его ещё нет"""
+    try:
+        if not await opensearch.indices.exists(index=VULN_INDEX):
+            await opensearch.indices.create(index=VULN_INDEX, body=VULN_INDEX_BODY)
+            logger.info(f"Создан индекс {VULN_INDEX}")
+    except Exception as e:
+        logger.warning(f"Не удалось создать индекс {VULN_INDEX}: {e}")
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def normalize_cve(value: Optional[str]) -> Optional[str]:
+    """CVE-2024-1234 в верхнем регистре без пробелов; пустые значения - None"""
+    value = (value or "").strip().upper()
+    return value or None
+
+
+def cvss_severity(score: Optional[float]) -> str:
+    """Уровень по оценке CVSS"""
+    if score is None:
+        return "none"
+    for name, lower in CVSS_SEVERITIES:
+        if score >= lower:
+            return name
+    return "none"
+
+
+def _score(value: Any) -> Optional[float]:
+    try:
+        return None if value in (None, "") else float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def exposures_from_event(event_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Пары цель + CVE из результата сканирования или события безопасности.
+
+    Результат сканирования адресует цель полем target. Событие безопасности
+    с cve_id связывается с хостом через metadata (host_id, hostname, target
+    или target_ip); без них событие в индекс не попадает.
+    """
+    metadata = event_data.get("metadata") or {}
+    if event_data.get("vulnerability_id"):
+        cve_id = normalize_cve(event_data.get("vulnerability_id"))
+        target = event_data.get("target")
+        host_id = metadata.get("host_id")
+        source = "vuln_scan"
+        name = event_data.get("vulnerability_name")
+    else:
+        cve_id = normalize_cve(event_data.get("cve_id"))
+        host_id = metadata.get("host_id")
+        target = metadata.get("hostname") or metadata.get("target") or metadata.get("target_ip")
+        source = event_data.get("source") or "security_event"
+        name = event_data.get("description")
+    target = (target or host_id or "").strip().lower()
+    if not cve_id or not target:
+        return []
+    return [{
+        "cve_id": cve_id,
+        "target": target,
+        "host_id": host_id or None,
+        "cvss_score": _score(event_data.get("cvss_score")),
+        "name": name,
+        "solution": event_data.get("solution"),
+        "source": source,
+        "event_id": event_data.get("event_id"),
+        "timestamp": str(event_data.get("timestamp") or datetime.now(timezone.utc).isoformat()),
+        "fixed": str(metadata.get("status") or "").lower() in FIXED_STATUSES,
+    }]
+
+
+def _doc_id(kind: str, *parts: str) -> str:
+    return ":".join((kind,) + parts)
+
+
+def _host_summary(host_key: str, cves: Dict[bytes, bytes], hostname: str,
+                  resolved: bool, updated_at: str) -> Dict[str, Any]:
+    """Сводка хоста по хешу CVE -> CVSS из Redis"""
+    counts = dict.fromkeys(SEVERITY_LEVELS, 0)
+    max_cvss: Optional[float] = None
+    cve_ids = []
+    for cve, raw_score in cves.items():
+        score = _score(_text(raw_score))
+        counts[cvss_severity(score)] += 1
+        if score is not None and (max_cvss is None or score > max_cvss):
+            max_cvss = score
+        cve_ids.append(_text(cve))
+    return {
+        "kind": "host",
+        "host_id": host_key,
+        "hostname": hostname,
+        "resolved": resolved,
+        "max_cvss": max_cvss,
+        "max_severity": cvss_severity(max_cvss),
+        "cve_count": len(cve_ids),
+        "severity_counts": counts,
+        "cves": sorted(cve_ids),
+        "updated_at": updated_at,
+    }
+
+
+def _versioned(action: str, doc_id: str, version: int) -> Dict[str, Any]:
+    return {action: {"_index": VULN_INDEX, "_id": doc_id, "version": version, "version_type": "external"}}
+
+
+async def apply_exposures(
+    opensearch: AsyncOpenSearch,
+    redis: aioredis.Redis,
+    exposures: List[Dict[str, Any]],
+    refresh_hosts: Iterable[str] = ()
+) -> int:
+    """
+    Учет пар хост + CVE и пересчет сводок затронутых хостов и CVE.
+
+    Цели сопоставляются с хостами по адресам из событий агентов; пары с
+    fixed=True удаляются. refresh_hosts - хосты, сводку которых нужно
+    переписать без изменения уязвимостей (например, после смены имени).
+    Возвращает число учтенных пар.
+    """
+    refresh_hosts = list(refresh_hosts)
+    if not exposures and not refresh_hosts:
+        return 0
+
+    unresolved = sorted({e["target"] for e in exposures if not e.get("host_key") and not e.get("host_id")})
+    resolved_ids = dict(zip(unresolved, await redis.hmget(TARGETS_KEY, unresolved))) if unresolved else {}
+    for exposure in exposures:
+        if not exposure.get("host_key"):
+            host_id = exposure.get("host_id") or _text(resolved_ids.get(exposure["target"]))
+            exposure["host_key"] = host_id or exposure["target"]
+            exposure["resolved"] = bool(host_id)
+
+    hosts = sorted({e["host_key"] for e in exposures} | set(refresh_hosts))
+    cves = sorted({e["cve_id"] for e in exposures})
+
+    # Изменение связей, чтение итогового состояния и новые версии сводок - одна транзакция
+    pipe = redis.pipeline()
+    for exposure in exposures:
+        host_key, cve_id = exposure["host_key"], exposure["cve_id"]
+        if exposure["fixed"]:
+            pipe.hdel(f"{HOST_CVES_PREFIX}{host_key}", cve_id)
+            pipe.srem(f"{CVE_HOSTS_PREFIX}{cve_id}", host_key)
+        else:
+            score = exposure["cvss_score"]
+            pipe.hset(f"{HOST_CVES_PREFIX}{host_key}", cve_id, "" if score is None else repr(score))
+            pipe.sadd(f"{CVE_HOSTS_PREFIX}{cve_id}", host_key)
+            pipe.hset(CVE_META_KEY, cve_id, json.dumps(
+                {"name": exposure["name"], "cvss_score": score}, ensure_ascii=False))
+    for host_key in hosts:
+        pipe.hincrby(VERSIONS_KEY, f"host:{host_key}", 1)
+        pipe.hgetall(f"{HOST_CVES_PREFIX}{host_key}")
+    for cve_id in cves:
+        pipe.hincrby(VERSIONS_KEY, f"cve:{cve_id}", 1)
+        pipe.scard(f"{CVE_HOSTS_PREFIX}{cve_id}")
+    if hosts:
+        pipe.hmget(HOSTNAMES_KEY, hosts)
+    if cves:
+        pipe.hmget(CVE_META_KEY, cves)
+    results = await pipe.execute()
+
+    position = len(results) - 2 * len(hosts) - 2 * len(cves) - bool(hosts) - bool(cves)
+    host_state = results[position:position + 2 * len(hosts)]
+    position += 2 * len(hosts)
+    cve_state = results[position:position + 2 * len(cves)]
+    position += 2 * len(cves)
+    hostnames = {host_key: _text(name) or host_key
+                 for host_key, name in zip(hosts, results[position] if hosts else [])}
+    cve_meta = results[position + bool(hosts)] if cves else []
+
+    updated_at = datetime.now(timezone.utc).isoformat()
+    actions: List[Dict[str, Any]] = []
+    for exposure in exposures:
+        doc_id = _doc_id("exposure", exposure["host_key"], exposure["cve_id"])
+        if exposure["fixed"]:
+            actions.append({"delete": {"_index": VULN_INDEX, "_id": doc_id}})
+            continue
+        doc = {
+            "hostname": hostnames[exposure["host_key"]],
+            "resolved": exposure["resolved"],
+            "target": exposure["target"],
+            "name": exposure["name"],
+            "cvss_score": exposure["cvss_score"],
+            "severity": cvss_severity(exposure["cvss_score"]),
+            "source": exposure["source"],
+            "solution": exposure["solution"],
+            "last_seen": exposure["timestamp"],
+            "last_event_id": exposure["event_id"],
+        }
+        upsert = dict(doc, kind="exposure", host_id=exposure["host_key"], cve_id=exposure["cve_id"],
+                      first_seen=exposure.get("first_seen") or exposure["timestamp"])
+        actions.append({"update": {"_index": VULN_INDEX, "_id": doc_id}})
+        actions.append({"doc": doc, "upsert": upsert})
+
+    resolved_hosts = {e["host_key"] for e in exposures if e["resolved"]} | set(refresh_hosts)
+    for i, host_key in enumerate(hosts):
+        version, cve_scores = int(host_state[2 * i]), host_state[2 * i + 1] or {}
+        doc_id = _doc_id("host", host_key)
+        if not cve_scores:
+            actions.append(_versioned("delete", doc_id, version))
+            continue
+        actions.append(_versioned("index", doc_id, version))
+        actions.append(_host_summary(host_key, cve_scores, hostnames[host_key],
+                                     host_key in resolved_hosts, updated_at))
+
+    for i, cve_id in enumerate(cves):
+        version, host_count = int(cve_state[2 * i]), int(cve_state[2 * i + 1] or 0)
+        doc_id = _doc_id("cve", cve_id)
+        if not host_count:
+            actions.append(_versioned("delete", doc_id, version))
+            continue
+        meta = json.loads(_text(cve_meta[i]) or "{}")
+        actions.append(_versioned("index", doc_id, version))
+        actions.append({
+            "kind": "cve",
+            "cve_id": cve_id,
+            "name": meta.get("name"),
+            "cvss_score": meta.get("cvss_score"),
+            "severity": cvss_severity(meta.get("cvss_score")),
+            "host_count": host_count,
+            "updated_at": updated_at,
+        })
+
+    response = await opensearch.bulk(body=actions, refresh=False)
+    if response.get("errors"):
+        # 409 - сводку уже перезаписала более новая версия, 404 - удаляемого документа нет
+        failed = [item for item in response.get("items", [])
+                  for result in item.values() if result.get("status", 200) >= 300
+                  and result.get("status") not in (404, 409)]
+        if failed:
+            logger.warning(f"Индекс уязвимостей: {len(failed)} документов не записано: {failed[0]}")
+    return len(exposures)
+
+
+async def sync_vulnerabilities(
+    opensearch: AsyncOpenSearch,
+    redis: aioredis.Redis,
+    event_data: Dict[str, Any]
+) -> int:
+    """Учет уязвимостей из результата сканирования или события безопасности"""
+    exposures = exposures_from_event(event_data)
+    if not exposures:
+        return 0
+    try:
+        return await apply_exposures(opensearch, redis, exposures)
+    except Exception as e:
+        logger.error(f"Ошибка обновления индекса уязвимостей по событию {event_data.get('event_id')}: {e}")
+        return 0
+
+
+def host_needs_registration(host_id: Optional[str], hostname: Optional[str],
+                            addresses: Optional[Iterable[str]] = None) -> bool:
+    """Изменились ли имя или адреса хоста с последней регистрации в этом процессе"""
+    if not host_id:
+        return False
+    identity = ((hostname or "").lower(), tuple(sorted(a.lower() for a in addresses or ())))
+    return _registered.get(host_id) != identity
+
+
+async def register_host(
+    opensearch: AsyncOpenSearch,
+    redis: aioredis.Redis,
+    host_id: str,
+    hostname: Optional[str],
+    addresses: Optional[Iterable[str]] = None
+) -> int:
+    """
+    Регистрация имени и адресов хоста для сопоставления целей сканирования.
+
+    Уязвимости, уже учтенные под именем или адресом хоста как отдельной
+    целью, переносятся на хост. При смене имени сводка хоста переписывается.
+    Возвращает число перенесенных пар.
+    """
+    addresses = [a.lower() for a in addresses or () if a]
+    identity = ((hostname or "").lower(), tuple(sorted(addresses)))
+    targets = {host_id.lower(), *addresses}
+    if hostname:
+        targets.add(hostname.lower())
+    targets = sorted(targets)
+    try:
+        pipe = redis.pipeline()
+        pipe.hset(TARGETS_KEY, mapping={target: host_id for target in targets})
+        pipe.hget(HOSTNAMES_KEY, host_id)
+        if hostname:
+            pipe.hset(HOSTNAMES_KEY, host_id, hostname)
+        pipe.exists(f"{HOST_CVES_PREFIX}{host_id}")
+        for target in targets:
+            if target != host_id:
+                pipe.hgetall(f"{HOST_CVES_PREFIX}{target}")
+        results = await pipe.execute()
+
+        previous = _text(results[1])
+        has_cves = bool(results[3 if hostname else 2])
+        orphaned = [t for t in targets if t != host_id]
+        exposures: List[Dict[str, Any]] = []
+        pairs = [(target, _text(cve), _score(_text(raw_score)))
+                 for target, state in zip(orphaned, results[-len(orphaned):] if orphaned else [])
+                 for cve, raw_score in (state or {}).items()]
+        if pairs:
+            # Перенос сохраняет название, решение и время обнаружения из документа цели
+            docs = await opensearch.mget(index=VULN_INDEX, body={
+                "ids": [_doc_id("exposure", target, cve_id) for target, cve_id, _ in pairs]
+            })
+            now = datetime.now(timezone.utc).isoformat()
+            for (target, cve_id, score), doc in zip(pairs, docs.get("docs", [])):
+                source = doc.get("_source") or {}
+                base = {"cve_id": cve_id, "target": target, "cvss_score": score,
+                        "name": source.get("name"), "solution": source.get("solution"),
+                        "source": source.get("source") or "vuln_scan",
+                        "event_id": source.get("last_event_id"),
+                        "timestamp": source.get("last_seen") or now,
+                        "first_seen": source.get("first_seen")}
+                exposures.append(dict(base, host_key=target, resolved=False, fixed=True))
+                exposures.append(dict(base, host_key=host_id, resolved=True, fixed=False))
+
+        renamed = bool(hostname) and previous is not None and previous != hostname and has_cves
+        if exposures or renamed:
+            await apply_exposures(opensearch, redis, exposures, refresh_hosts=[host_id])
+
+        if len(_registered) >= REGISTERED_HOSTS_MAX:
+            _registered.clear()
+        _registered[host_id] = identity
+        if exposures:
+            logger.info(f"Уязвимости целей {orphaned} перенесены на хост {host_id}: {len(exposures) // 2}")
+        return len(exposures) // 2
+    except Exception as e:
+        logger.error(f"Ошибка регистрации адресов хоста {host_id} для индекса уязвимостей: {e}")
+        return 0
+
+
+async def get_host_vulnerabilities(
+    opensearch: AsyncOpenSearch,
+    host_id: str,
+    min_cvss: Optional[float] = None,
+    limit: int = 100
+) -> Dict[str, Any]:
+    """Сводка и уязвимости хоста по убыванию CVSS"""
+    filters: List[Dict[str, Any]] = [{"term": {"kind": "exposure"}}, {"term": {"host_id": host_id}}]
+    if min_cvss is not None:
+        filters.append({"range": {"cvss_score": {"gte": min_cvss}}})
+    response = await opensearch.search(index=VULN_INDEX, body={
+        "query": {"bool": {"filter": filters}},
+        "sort": [{"cvss_score": {"order": "desc", "missing": "_last"}}, {"cve_id": {"order": "asc"}}],
+        "size": limit,
+        "track_total_hits": True,
+        "_source": ["host_id", "hostname", "resolved", "target", "cve_id", "name", "cvss_score",
+                    "severity", "source", "solution", "first_seen", "last_seen", "last_event_id"]
+    }, ignore_unavailable=True)
+    try:
+        summary = (await opensearch.get(index=VULN_INDEX, id=_doc_id("host", host_id)))["_source"]
+        summary.pop("cves", None)
+    except Exception:
+        summary = None
+    return {
+        "host_id": host_id,
+        "summary": summary,
+        "vulnerabilities": [hit["_source"] for hit in response["hits"]["hits"]],
+        "total": response["hits"]["total"]["value"],
+    }
+
+
+async def get_cve_exposure(
+    opensearch: AsyncOpenSearch,
+    cve_id: str,
+    limit: int = 1000
+) -> Dict[str, Any]:
+    """Сводка CVE и затронутые хосты"""
+    cve_id = normalize_cve(cve_id)
+    try:
+        summary = (await opensearch.get(index=VULN_INDEX, id=_doc_id("cve", cve_id)))["_source"]
+    except Exception:
+        summary = None
+    response = await opensearch.search(index=VULN_INDEX, body={
+        "query": {"bool": {"filter": [{"term": {"kind": "exposure"}}, {"term": {"cve_id": cve_id}}]}},
+        "sort": [{"host_id": {"order": "asc"}}],
+        "size": limit,
+        "track_total_hits": True,
+        "_source": ["host_id", "hostname", "resolved", "target", "cvss_score", "severity",
+                    "first_seen", "last_seen", "source"]
+    }, ignore_unavailable=True)
+    return {
+        "cve_id": cve_id,
+        "summary": summary,
+        "hosts": [hit["_source"] for hit in response["hits"]["hits"]],
+        "total_hosts": response["hits"]["total"]["value"],
+    }
+
+
+async def get_fleet_exposure(
+    opensearch: AsyncOpenSearch,
+    min_cvss: Optional[float] = None,
+    limit: int = 20
+) -> Dict[str, Any]:
+    """
+    Уязвимость парка: хосты по максимальному уровню, общее число пар
+    хост + CVE и CVE с наибольшим числом затронутых хостов.
+    """
+    host_response = await opensearch.search(index=VULN_INDEX, body={
+        "query": {"term": {"kind": "host"}},
+        "size": 0,
+        "track_total_hits": True,
+        "aggs": {
+            "by_severity": {"terms": {"field": "max_severity", "size": len(SEVERITY_LEVELS)}},
+            "exposures": {"sum": {"field": "cve_count"}}
+        }
+    }, ignore_unavailable=True)
+    cve_filters: List[Dict[str, Any]] = [{"term": {"kind": "cve"}}]
+    if min_cvss is not None:
+        cve_filters.append({"range": {"cvss_score": {"gte": min_cvss}}})
+    cve_response = await opensearch.search(index=VULN_INDEX, body={
+        "query": {"bool": {"filter": cve_filters}},
+        "sort": [{"host_count": {"order": "desc"}}, {"cvss_score": {"order": "desc", "missing": "_last"}}],
+        "size": limit,
+        "track_total_hits": True,
+        "_source": ["cve_id", "name", "cvss_score", "severity", "host_count"]
+    }, ignore_unavailable=True)
+
+    aggregations = host_response.get("aggregations", {})
+    hosts_by_severity = dict.fromkeys(SEVERITY_LEVELS, 0)
+    for bucket in aggregations.get("by_severity", {}).get("buckets", []):
+        hosts_by_severity[bucket["key"]] = bucket["doc_count"]
+    return {
+        "hosts_affected": host_response["hits"]["total"]["value"],
+        "hosts_by_max_severity": hosts_by_severity,
+        "exposures": int(aggregations.get("exposures", {}).get("value") or 0),
+        "cves": cve_response["hits"]["total"]["value"],
+        "top_cves": [hit["_source"] for hit in cve_response["hits"]["hits"]],
+    }
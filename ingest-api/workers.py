@@ -0,0 +1,121 @@
+"""
+Многопроцессный режим Ingest API: параметры воркера и общее состояние.
+
+server.py запускает несколько процессов uvicorn на одном сокете. Состояние
+процесса делится на две группы:
+- общее через Redis: метрики Prometheus. Каждый воркер раз в
+  METRICS_PUBLISH_INTERVAL секунд записывает снимок своих серий в хеш
+  metrics:workers, /metrics складывает снимки всех живых воркеров;
+- локальное для воркера: профили запросов (profiling.py) и агрегаты
+  стоимости запросов OpenSearch (opensearch_tracing.py). Ответы
+  административных эндпоинтов содержат worker_id, чтобы было видно,
+  какой процесс ответил. Настройки профилирования общие: они хранятся
+  в Redis и применяются каждым воркером в фоновом цикле.
+
+Пулы соединений делятся между воркерами: общий бюджет соединений с
+OpenSearch и Redis делится на число воркеров.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Число воркеров задает server.py; при запуске через uvicorn напрямую - один процесс
+WORKERS = max(1, int(os.getenv("INGEST_WORKERS", "1")))
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"
+# Индексы и шаблоны уже созданы родительским процессом server.py
+BOOTSTRAPPED = os.getenv("INGEST_BOOTSTRAPPED", "false").lower() == "true"
+
+# Бюджет соединений на все воркеры и явное переопределение на один воркер
+OPENSEARCH_POOL_TOTAL = int(os.getenv("OPENSEARCH_POOL_TOTAL", "40"))
+REDIS_POOL_TOTAL = int(os.getenv("REDIS_POOL_TOTAL", "200"))
+MIN_POOL_PER_WORKER = 4
+
+METRICS_WORKERS_KEY = "metrics:workers"
+METRICS_PUBLISH_INTERVAL = float(os.getenv("METRICS_PUBLISH_INTERVAL", "5"))
+# Снимок воркера считается устаревшим (воркер завершился) через три интервала
+METRICS_STALE_AFTER = METRICS_PUBLISH_INTERVAL * 3
+
+
+def pool_size_per_worker(total: int, override_env: str) -> int:
+    """Размер пула соединений одного воркера"""
+    override = os.getenv(override_env)
+    if override:
+        return int(override)
+    return max(MIN_POOL_PER_WORKER, total // WORKERS)
+
+
+OPENSEARCH_POOL_PER_WORKER = pool_size_per_worker(OPENSEARCH_POOL_TOTAL, "OPENSEARCH_POOL_PER_WORKER")
+REDIS_POOL_PER_WORKER = pool_size_per_worker(REDIS_POOL_TOTAL, "REDIS_POOL_PER_WORKER")
+
+
+def worker_info() -> Dict[str, Any]:
+    return {
+        "worker_id": WORKER_ID,
+        "workers": WORKERS,
+        "opensearch_pool": OPENSEARCH_POOL_PER_WORKER,
+        "redis_pool": REDIS_POOL_PER_WORKER,
+    }
+
+
+async def publish_metrics_snapshot(redis, registry) -> None:
+    """Запись снимка метрик этого воркера в Redis"""
+    payload = json.dumps({"updated_at": time.time(), "metrics": registry.snapshot()})
+    await redis.hset(METRICS_WORKERS_KEY, WORKER_ID, payload)
+
+
+async def collect_worker_snapshots(redis) -> List[Dict[str, Any]]:
+    """Снимки метрик других живых воркеров; устаревшие записи удаляются"""
+    snapshots = []
+    stale = []
+    now = time.time()
+    for worker_id, payload in (await redis.hgetall(METRICS_WORKERS_KEY)).items():
+        if isinstance(worker_id, bytes):
+            worker_id = worker_id.decode()
+        if worker_id == WORKER_ID:
+            continue
+        try:
+            data = json.loads(payload)
+        except (TypeError, ValueError):
+            stale.append(worker_id)
+            continue
+        if now - data.get("updated_at", 0) > METRICS_STALE_AFTER:
+            stale.append(worker_id)
+            continue
+        snapshots.append(data["metrics"])
+    if stale:
+        await redis.hdel(METRICS_WORKERS_KEY, *stale)
+    return snapshots
+
+
+async def run_worker_heartbeat(get_redis_client, registry,
+                               on_tick: Optional[Callable[[Any], Awaitable[None]]] = None) -> None:
+    """
+    Фоновый цикл воркера: публикация снимка метрик и синхронизация общих
+    настроек (on_tick получает клиент Redis), пока воркер работает.
+    """
+    while True:
+        await asyncio.sleep(METRICS_PUBLISH_INTERVAL)
+        redis = get_redis_client()
+        if redis is None:
+            continue
+        try:
+            await publish_metrics_snapshot(redis, registry)
+            if on_tick is not None:
+                await on_tick(redis)
+        except Exception as e:
+            logger.warning(f"Ошибка фонового цикла воркера {WORKER_ID}: {e}")
+
+
+async def unregister_worker(redis) -> None:
+    """Удаление снимка метрик при штатной остановке воркера"""
+    try:
+        await redis.hdel(METRICS_WORKERS_KEY, WORKER_ID)
+    except Exception as e:
+        logger.warning(f"Не удалось снять регистрацию воркера {WORKER_ID}: {e}")
@@ -0,0 +1,544 @@
+"""
+Stateful sliding-window correlation of authentication events.
+
+Brute force and password spraying show up only across many events: twenty
+failed logons for one account from one address, one address failing against
+fifty accounts, a success right after a run of failures. Finding them with
+range queries over stored events is expensive and late. AuthCorrelator keeps
+per-key counters in memory and updates them in constant time per event.
+
+A rule counts the authentication events that match ``match`` per key over a
+sliding window and fires when ``threshold`` events and/or
+``distinct.threshold`` distinct values of another field are reached:
+
+    {
+        "id": "auth-password-spray",
+        "name": "Password spray from one address",
+        "severity": "high",
+        "key": ["source_ip"],
+        "match": {"success": false},
+        "window_seconds": 600,
+        "distinct": {"field": "user", "threshold": 15}
+    }
+
+Keys are built from the normalized fields ``user``, ``source_ip``,
+``host_id`` and ``auth_type`` (``["user", "source_ip"]`` for a pair). With
+``trigger`` the rule fires on an event matching the trigger, once the
+counted events already satisfy the thresholds: ``"match": {"success": false},
+"trigger": {"success": true}`` is a success after repeated failures. After
+firing a key is quiet for ``cooldown_seconds`` (the window by default).
+
+The window is a ring of ``buckets`` sub-windows (12 by default), so its edge
+moves in steps of ``window_seconds / buckets``. Counting an event touches one
+bucket; expired buckets are subtracted as time moves, at most ``buckets``
+per event. Distinct values are counted per bucket as well, so a value that
+leaves the window is subtracted exactly. Memory is bounded:
+``max_keys`` keys per rule (least recently updated keys are evicted first),
+``max_distinct`` tracked values per key, and keys idle for a whole window are
+evicted as event time moves on.
+
+Every key belongs to one of ``partitions`` partitions (crc32 of the key).
+A worker owns a subset of the partitions, so several workers can read the
+same stream and split the keys. The state of every dirty partition can be
+exported with ``checkpoint_dirty`` and loaded back with ``restore``, so a
+restarted worker, or a worker that took over a partition, continues with
+the counters instead of an empty window.
+
+Both the flat ``AuthEvent`` schema (``user``, ``success``, ``source_ip``)
+and agent ``user_login`` events (fields under ``raw_data``) are accepted;
+see ``auth_fields``.
+
+    correlator = AuthCorrelator(load_correlation_rules("auth_correlation_rules.json"))
+    for detection in correlator.process(event):
+        alert = build_correlation_alert(detection, event)
+"""
+
+import json
+import time
+import uuid
+import zlib
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Any, AbstractSet, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from .detection import ALERT_NAMESPACE, SEVERITIES
+
+__all__ = [
+    "KEY_FIELDS",
+    "CorrelationRuleError",
+    "CorrelationRule",
+    "Detection",
+    "AuthCorrelator",
+    "auth_fields",
+    "load_correlation_rules",
+    "build_correlation_alert",
+]
+
+AUTH_EVENT_TYPES = frozenset(("authentication", "user_login"))
+KEY_FIELDS = ("user", "source_ip", "host_id", "auth_type")
+MATCH_FIELDS = KEY_FIELDS + ("success",)
+
+DEFAULT_BUCKETS = 12
+# Event IDs kept per key for related_events of an alert
+RECENT_EVENTS = 10
+# Event time ahead of the clock by more than this is clamped (agent clock skew)
+MAX_CLOCK_SKEW = 300.0
+# Idle keys evicted per event at most, to keep updates constant-time
+EVICTIONS_PER_EVENT = 8
+
+_FALSE = frozenset(("false", "0", "no", "failure", "failed", "fail", "denied"))
+_TRUE = frozenset(("true", "1", "yes", "success", "succeeded", "ok"))
+
+
+class CorrelationRuleError(ValueError):
+    """A correlation rule that cannot be compiled; the message names the rule."""
+
+
+def _bool(value: Any) -> Optional[bool]:
+    if isinstance(value, bool):
+        return value
+    if value is None:
+        return None
+    text = str(value).strip().lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    return None
+
+
+def _epoch(timestamp: Any) -> Optional[float]:
+    if isinstance(timestamp, datetime):
+        dt = timestamp
+    else:
+        try:
+            dt = datetime.fromisoformat(str(timestamp).replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def _text(value: Any) -> Optional[str]:
+    if value in (None, ""):
+        return None
+    return str(value).strip().lower() or None
+
+
+def auth_fields(event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Normalized fields of an authentication event, or None for other events.
+
+    ``AuthEvent``: ``user``, ``success``, ``source_ip``, ``auth_type``,
+    ``source_host``. Agent ``user_login``: ``raw_data.user`` (or
+    ``username``, ``target_user``), ``raw_data.success`` (or ``status`` /
+    ``result``; a login without either counts as successful),
+    ``raw_data.source_ip`` (or ``ip_address``, ``network.source_ip``),
+    ``raw_data.logon_type``. Strings are lower-cased.
+    """
+    if event.get("event_type") not in AUTH_EVENT_TYPES:
+        return None
+    raw = event.get("raw_data") if isinstance(event.get("raw_data"), dict) else {}
+    network = event.get("network") if isinstance(event.get("network"), dict) else {}
+    host = event.get("host") if isinstance(event.get("host"), dict) else {}
+
+    success = _bool(event.get("success"))
+    for name in ("success", "status", "result"):
+        if success is None:
+            success = _bool(raw.get(name))
+    if success is None:
+        success = event.get("event_type") == "user_login"
+
+    return {
+        "user": _text(event.get("user") or raw.get("user") or raw.get("username") or raw.get("target_user")),
+        "success": success,
+        "source_ip": _text(event.get("source_ip") or raw.get("source_ip") or raw.get("ip_address")
+                           or network.get("source_ip")),
+        "host_id": _text(host.get("host_id") or host.get("hostname") or event.get("source_host")),
+        "auth_type": _text(event.get("auth_type") or raw.get("auth_type") or raw.get("logon_type")),
+    }
+
+
+def _conditions(rule_id: str, name: str, spec: Any) -> Tuple[Tuple[str, Any], ...]:
+    if spec is None:
+        return ()
+    if not isinstance(spec, dict):
+        raise CorrelationRuleError(f"rule {rule_id}: {name} must be an object")
+    conditions = []
+    for field, value in spec.items():
+        if field not in MATCH_FIELDS:
+            raise CorrelationRuleError(f"rule {rule_id}: unknown field {field!r} in {name}")
+        conditions.append((field, _bool(value) if field == "success" else _text(value)))
+    return tuple(conditions)
+
+
+class CorrelationRule:
+    """A compiled correlation rule with its counters."""
+
+    __slots__ = ("id", "name", "description", "severity", "recommended_actions", "tags",
+                 "key_fields", "match", "trigger", "window_seconds", "buckets", "bucket_seconds",
+                 "threshold", "distinct_field", "distinct_threshold", "cooldown_seconds",
+                 "evaluations", "detections", "evicted")
+
+    def __init__(self, definition: Dict[str, Any]):
+        self.id = str(definition.get("id") or "")
+        if not self.id:
+            raise CorrelationRuleError(f"rule without an id: {definition!r}")
+        self.name = definition.get("name") or self.id
+        self.description = definition.get("description") or self.name
+        self.severity = str(definition.get("severity", "medium")).lower()
+        if self.severity not in SEVERITIES:
+            raise CorrelationRuleError(f"rule {self.id}: unknown severity {self.severity!r}")
+        self.recommended_actions = list(definition.get("recommended_actions") or [])
+        self.tags = list(definition.get("tags") or [])
+
+        key = definition.get("key")
+        key = [key] if isinstance(key, str) else list(key or [])
+        if not key or any(field not in KEY_FIELDS for field in key):
+            raise CorrelationRuleError(f"rule {self.id}: key must be a list of {list(KEY_FIELDS)}")
+        self.key_fields = tuple(key)
+        self.match = _conditions(self.id, "match", definition.get("match"))
+        self.trigger = _conditions(self.id, "trigger", definition.get("trigger"))
+
+        try:
+            self.window_seconds = float(definition["window_seconds"])
+            self.buckets = int(definition.get("buckets", DEFAULT_BUCKETS))
+            self.threshold = int(definition.get("threshold", 0))
+        except (KeyError, TypeError, ValueError):
+            raise CorrelationRuleError(f"rule {self.id}: window_seconds, buckets and threshold must be numbers")
+        if self.window_seconds <= 0 or self.buckets < 1:
+            raise CorrelationRuleError(f"rule {self.id}: window_seconds and buckets must be positive")
+        self.bucket_seconds = self.window_seconds / self.buckets
+
+        distinct = definition.get("distinct")
+        self.distinct_field: Optional[str] = None
+        self.distinct_threshold = 0
+        if distinct is not None:
+            if not isinstance(distinct, dict) or distinct.get("field") not in KEY_FIELDS:
+                raise CorrelationRuleError(f"rule {self.id}: distinct.field must be one of {list(KEY_FIELDS)}")
+            self.distinct_field = distinct["field"]
+            self.distinct_threshold = int(distinct.get("threshold", 0))
+        if self.threshold <= 0 and self.distinct_threshold <= 0:
+            raise CorrelationRuleError(f"rule {self.id}: threshold or distinct.threshold is required")
+        self.cooldown_seconds = float(definition.get("cooldown_seconds", self.window_seconds))
+
+        self.evaluations = 0
+        self.detections = 0
+        self.evicted = 0
+
+    def stats(self, keys: int) -> Dict[str, Any]:
+        return {"rule_id": self.id, "keys": keys, "evaluations": self.evaluations,
+                "detections": self.detections, "evicted": self.evicted}
+
+
+class _KeyState:
+    """Ring of per-bucket counters of one key"""
+
+    __slots__ = ("partition", "head", "counts", "values", "total", "distinct",
+                 "last_seen", "quiet_until", "recent")
+
+    def __init__(self, partition: int, buckets: int, with_values: bool, head: int):
+        self.partition = partition
+        self.head = head
+        self.counts = [0] * buckets
+        self.values: Optional[List[Optional[Dict[str, int]]]] = [None] * buckets if with_values else None
+        self.total = 0
+        self.distinct: Dict[str, int] = {}
+        self.last_seen = 0.0
+        self.quiet_until = 0.0
+        self.recent: deque = deque(maxlen=RECENT_EVENTS)
+
+    def _expire(self, slot: int) -> None:
+        self.total -= self.counts[slot]
+        self.counts[slot] = 0
+        if self.values is not None and self.values[slot]:
+            for value, count in self.values[slot].items():
+                left = self.distinct[value] - count
+                if left > 0:
+                    self.distinct[value] = left
+                else:
+                    del self.distinct[value]
+            self.values[slot] = None
+
+    def advance(self, index: int) -> None:
+        """Move the head to bucket ``index``, subtracting buckets that left the window"""
+        gap = index - self.head
+        if gap <= 0:
+            return
+        size = len(self.counts)
+        for step in range(1, min(gap, size) + 1):
+            self._expire((self.head + step) % size)
+        self.head = index
+
+    def add(self, index: int, value: Optional[str], max_distinct: int) -> None:
+        slot = index % len(self.counts)
+        self.counts[slot] += 1
+        self.total += 1
+        if self.values is not None and value is not None:
+            if value in self.distinct or len(self.distinct) < max_distinct:
+                bucket = self.values[slot]
+                if bucket is None:
+                    bucket = self.values[slot] = {}
+                bucket[value] = bucket.get(value, 0) + 1
+                self.distinct[value] = self.distinct.get(value, 0) + 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {"h": self.head, "c": self.counts, "l": self.last_seen, "q": self.quiet_until, "r": list(self.recent)}
+        if self.values is not None:
+            data["v"] = self.values
+        return data
+
+    @classmethod
+    def from_dict(cls, partition: int, data: Dict[str, Any], buckets: int, with_values: bool) -> Optional["_KeyState"]:
+        counts = data.get("c")
+        if not isinstance(counts, list) or len(counts) != buckets or with_values != ("v" in data):
+            return None
+        state = cls(partition, buckets, with_values, int(data["h"]))
+        state.counts = [int(count) for count in counts]
+        state.total = sum(state.counts)
+        if with_values:
+            state.values = [dict(bucket) if bucket else None for bucket in data["v"]]
+            for bucket in state.values:
+                for value, count in (bucket or {}).items():
+                    state.distinct[value] = state.distinct.get(value, 0) + count
+        state.last_seen = float(data.get("l", 0))
+        state.quiet_until = float(data.get("q", 0))
+        state.recent.extend(data.get("r") or [])
+        return state
+
+
+class Detection(NamedTuple):
+    rule: CorrelationRule
+    key: Dict[str, Any]
+    count: int
+    distinct_count: int
+    related_events: List[str]
+    timestamp: float
+
+
+class AuthCorrelator:
+    """
+    Sliding-window counters of all rules for the owned partitions.
+
+    ``owned`` is the set of partitions this instance counts (all when None).
+    ``process`` takes one event and returns the detections it caused.
+    """
+
+    def __init__(self, rules: Iterable[Dict[str, Any]], partitions: int = 64,
+                 owned: Optional[AbstractSet[int]] = None, max_keys: int = 100_000,
+                 max_distinct: int = 1000):
+        self.rules = [CorrelationRule(definition) for definition in rules]
+        ids = [rule.id for rule in self.rules]
+        duplicates = sorted({rule_id for rule_id in ids if ids.count(rule_id) > 1})
+        if duplicates:
+            raise CorrelationRuleError(f"duplicate rule ids: {duplicates}")
+        self.partitions = partitions
+        self.owned = frozenset(owned) if owned is not None else None
+        self.max_keys = max_keys
+        self.max_distinct = max_distinct
+        self._states: Dict[str, "OrderedDict[Tuple[str, ...], _KeyState]"] = {rule.id: OrderedDict() for rule in self.rules}
+        # Keys of each partition, for checkpoints of single partitions
+        self._members: Dict[int, set] = {}
+        self._dirty: set = set()
+        self.watermark = 0.0
+        self.counters = {"events": 0, "auth_events": 0, "skipped": 0, "late": 0, "detections": 0}
+
+    def partition_of(self, key: Tuple[str, ...]) -> int:
+        return zlib.crc32("\x1f".join(key).encode("utf-8")) % self.partitions
+
+    def process(self, event: Dict[str, Any], skip: Optional[AbstractSet[int]] = None) -> List[Detection]:
+        """
+        Count one event. Partitions in ``skip`` are not updated (the worker
+        replays events their checkpoint already contains).
+        """
+        self.counters["events"] += 1
+        fields = auth_fields(event)
+        if fields is None:
+            return []
+        self.counters["auth_events"] += 1
+        now = time.time()
+        seen = _epoch(event.get("timestamp"))
+        seen = now if seen is None else min(seen, now + MAX_CLOCK_SKEW)
+        self.watermark = max(self.watermark, seen)
+        event_id = str(event.get("event_id") or "")
+
+        detections: List[Detection] = []
+        for rule in self.rules:
+            counted = all(fields[name] == value for name, value in rule.match)
+            triggered = bool(rule.trigger) and all(fields[name] == value for name, value in rule.trigger)
+            if not counted and not triggered:
+                continue
+            key = tuple(fields[name] for name in rule.key_fields)
+            if None in key:
+                continue
+            partition = self.partition_of(key)
+            if (self.owned is not None and partition not in self.owned) or (skip and partition in skip):
+                self.counters["skipped"] += 1
+                continue
+            rule.evaluations += 1
+            detection = self._update(rule, key, partition, fields, seen, event_id, counted, triggered)
+            if detection is not None:
+                detections.append(detection)
+            self._evict_idle(rule)
+
+        self.counters["detections"] += len(detections)
+        return detections
+
+    def _update(self, rule: CorrelationRule, key: Tuple[str, ...], partition: int, fields: Dict[str, Any],
+                seen: float, event_id: str, counted: bool, triggered: bool) -> Optional[Detection]:
+        states = self._states[rule.id]
+        index = int(seen // rule.bucket_seconds)
+        state = states.get(key)
+        if state is None:
+            if not counted:
+                return None
+            state = _KeyState(partition, rule.buckets, rule.distinct_field is not None, index)
+            states[key] = state
+            self._members.setdefault(partition, set()).add((rule.id, key))
+            if len(states) > self.max_keys:
+                self._evict(rule, *states.popitem(last=False))
+        else:
+            states.move_to_end(key)
+        self._dirty.add(partition)
+
+        state.advance(index)
+        if counted:
+            if index <= state.head - rule.buckets:
+                # Older than the window: nothing to count
+                self.counters["late"] += 1
+            else:
+                state.add(index, fields[rule.distinct_field] if rule.distinct_field else None, self.max_distinct)
+                if event_id:
+                    state.recent.append(event_id)
+        state.last_seen = max(state.last_seen, seen)
+
+        if rule.trigger and not triggered:
+            return None
+        if seen < state.quiet_until:
+            return None
+        if rule.threshold and state.total < rule.threshold:
+            return None
+        if rule.distinct_threshold and len(state.distinct) < rule.distinct_threshold:
+            return None
+        state.quiet_until = seen + rule.cooldown_seconds
+        rule.detections += 1
+        related = list(state.recent)
+        if triggered and event_id and event_id not in related:
+            related.append(event_id)
+        return Detection(rule, dict(zip(rule.key_fields, key)), state.total, len(state.distinct), related, seen)
+
+    def _evict(self, rule: CorrelationRule, key: Tuple[str, ...], state: _KeyState) -> None:
+        rule.evicted += 1
+        members = self._members.get(state.partition)
+        if members is not None:
+            members.discard((rule.id, key))
+        self._dirty.add(state.partition)
+
+    def _evict_idle(self, rule: CorrelationRule) -> None:
+        states = self._states[rule.id]
+        horizon = self.watermark - max(rule.window_seconds, rule.cooldown_seconds)
+        for _ in range(EVICTIONS_PER_EVENT):
+            if not states:
+                return
+            key, state = next(iter(states.items()))
+            if state.last_seen >= horizon:
+                return
+            del states[key]
+            self._evict(rule, key, state)
+
+    def checkpoint_dirty(self) -> Dict[int, Dict[str, Any]]:
+        """State of every partition changed since the previous call: {partition: {rule_id: [[key, state]]}}"""
+        dirty, self._dirty = self._dirty, set()
+        return {partition: self.checkpoint(partition) for partition in sorted(dirty)}
+
+    def mark_dirty(self, partitions: Iterable[int]) -> None:
+        """Return partitions to the dirty set, e.g. when saving their checkpoint failed."""
+        self._dirty.update(partitions)
+
+    def checkpoint(self, partition: int) -> Dict[str, Any]:
+        data: Dict[str, List[Any]] = {}
+        for rule_id, key in self._members.get(partition, ()):
+            state = self._states[rule_id].get(key)
+            if state is not None:
+                data.setdefault(rule_id, []).append([list(key), state.to_dict()])
+        return data
+
+    def restore(self, partition: int, data: Dict[str, Any]) -> int:
+        """
+        Load the checkpoint of a partition. States of unknown rules, or of
+        rules whose window layout changed, are dropped. Returns the number
+        of restored keys.
+        """
+        restored = 0
+        for rule in self.rules:
+            states = self._states[rule.id]
+            for key, raw in data.get(rule.id, ()):
+                state = _KeyState.from_dict(partition, raw, rule.buckets, rule.distinct_field is not None)
+                if state is None:
+                    continue
+                key = tuple(key)
+                states[key] = state
+                self._members.setdefault(partition, set()).add((rule.id, key))
+                self.watermark = max(self.watermark, state.last_seen)
+                restored += 1
+        return restored
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "partitions": self.partitions,
+            "owned_partitions": len(self.owned) if self.owned is not None else self.partitions,
+            "keys": sum(len(states) for states in self._states.values()),
+            "watermark": datetime.fromtimestamp(self.watermark, tz=timezone.utc).isoformat() if self.watermark else None,
+            "rule_stats": [rule.stats(len(self._states[rule.id])) for rule in self.rules],
+        }
+
+
+def load_correlation_rules(path: str) -> List[Dict[str, Any]]:
+    """Rule definitions from a JSON file: a list of rules or {"rules": [...]}."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    rules = data.get("rules", []) if isinstance(data, dict) else data
+    if not isinstance(rules, list):
+        raise CorrelationRuleError(f"{path}: expected a list of rules")
+    return rules
+
+
+def build_correlation_alert(detection: Detection, event: Dict[str, Any], stream: Optional[str] = None,
+                            now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Alert document (shared.schemas.Alert) for a detection. The ID is derived
+    from the rule, the key and the event that completed the condition, so
+    replaying the stream after a restart does not duplicate alerts.
+    """
+    rule = detection.rule
+    key_text = "|".join(f"{name}={value}" for name, value in detection.key.items())
+    event_id = str(event.get("event_id") or "")
+    host = event.get("host") if isinstance(event.get("host"), dict) else {}
+    agent = event.get("agent") if isinstance(event.get("agent"), dict) else {}
+    return {
+        "event_id": str(uuid.uuid5(ALERT_NAMESPACE, f"{rule.id}:{key_text}:{event_id}")),
+        "timestamp": (now or datetime.now(timezone.utc)).isoformat(),
+        "event_type": "alert",
+        "source_host": host.get("hostname") or event.get("source_host") or "unknown",
+        "source_agent": event.get("agent_id") or agent.get("agent_id") or event.get("source_agent") or "unknown",
+        "severity": rule.severity,
+        "alert_name": rule.name,
+        "description": rule.description,
+        "rule_id": rule.id,
+        "related_events": detection.related_events,
+        "recommended_actions": rule.recommended_actions,
+        "metadata": {
+            "stream": stream,
+            "correlation_key": detection.key,
+            "count": detection.count,
+            "distinct_count": detection.distinct_count,
+            "distinct_field": rule.distinct_field,
+            "window_seconds": rule.window_seconds,
+            "source_event_type": event.get("event_type"),
+            "source_timestamp": event.get("timestamp"),
+            "host_id": host.get("host_id"),
+            "tags": rule.tags,
+        },
+    }
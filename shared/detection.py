@@ -0,0 +1,511 @@
+"""
+Streaming detection rules compiled into field-indexed predicate trees.
+
+Rules are declarative (JSON) and describe a condition over event fields:
+
+    {
+        "id": "proc-encoded-powershell",
+        "name": "Encoded PowerShell command",
+        "description": "PowerShell started with an encoded command",
+        "severity": "high",
+        "streams": ["events:ingestion"],
+        "condition": {"all": [
+            {"field": "process.name", "op": "in", "value": ["powershell.exe", "pwsh.exe"]},
+            {"field": "process.command_line", "op": "contains", "value": ["-enc ", "-encodedcommand"]}
+        ]},
+        "recommended_actions": ["Decode the command and review the parent process"]
+    }
+
+Conditions nest with ``all``, ``any`` and ``not``; leaves compare one field
+with ``eq``, ``ne``, ``in``, ``not_in``, ``contains``, ``startswith``,
+``endswith``, ``regex``, ``gt``, ``gte``, ``lt``, ``lte`` or ``exists``.
+Field paths are dotted; a path through a list matches when any element
+matches (``inventory.processes.name``). String comparisons ignore case.
+The pseudo-field ``@stream`` holds the name of the stream the event came
+from; a rule's ``streams`` list is shorthand for a condition on it.
+
+DetectionEngine indexes rules by one equality leaf of their top-level
+conjunction (the most selective one) and compiles the rest of the condition
+into a tree of closures, cheapest checks first. For each event only the
+rules whose indexed field has the event's value are evaluated, plus the few
+rules without an equality leaf. Field values are resolved and normalized
+once per event and shared by all rules. Every rule keeps its evaluation
+count, matches and cost (timed on a sample of events).
+
+    engine = DetectionEngine(load_rules("detection_rules.json"))
+    for rule in engine.evaluate(event, stream="events:ingestion"):
+        alert = build_alert(rule, event, stream="events:ingestion")
+"""
+
+import json
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+__all__ = [
+    "RuleError",
+    "Rule",
+    "DetectionEngine",
+    "load_rules",
+    "build_alert",
+]
+
+SEVERITIES = ("low", "medium", "high", "critical")
+STREAM_FIELD = "@stream"
+# Namespace of alert IDs: the same rule and event always give the same alert ID
+ALERT_NAMESPACE = uuid.UUID("5b0c7f52-3f0e-4c55-9f55-2f1d6d1a7a31")
+
+_MISSING: Tuple[Any, ...] = ()
+
+
+class RuleError(ValueError):
+    """A rule that cannot be compiled; the message names the rule."""
+
+
+def _key(value: Any) -> Any:
+    """Normalized form used by equality and string operators."""
+    if isinstance(value, str):
+        return value.lower()
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, int):
+        return str(value)
+    return value
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+def _resolve(value: Any, path: Tuple[str, ...], out: List[Any]) -> None:
+    for position, part in enumerate(path):
+        if isinstance(value, dict):
+            value = value.get(part)
+            if value is None:
+                return
+        elif isinstance(value, list):
+            rest = path[position:]
+            for item in value:
+                _resolve(item, rest, out)
+            return
+        else:
+            return
+    if isinstance(value, list):
+        out.extend(item for item in value if item is not None and not isinstance(item, (dict, list)))
+    elif not isinstance(value, dict):
+        out.append(value)
+
+
+class _Context:
+    """Field values of one event, resolved on first use and shared by all rules."""
+
+    __slots__ = ("event", "stream", "_raw", "_keys")
+
+    def __init__(self, event: Dict[str, Any], stream: Optional[str]):
+        self.event = event
+        self.stream = stream
+        self._raw: Dict[Tuple[str, ...], Tuple[Any, ...]] = {}
+        self._keys: Dict[Tuple[str, ...], Tuple[Any, ...]] = {}
+
+    def raw(self, path: Tuple[str, ...]) -> Tuple[Any, ...]:
+        values = self._raw.get(path)
+        if values is None:
+            if path == (STREAM_FIELD,):
+                values = (self.stream,) if self.stream else _MISSING
+            elif len(path) == 1:
+                # Top-level scalar: no list walking needed
+                value = self.event.get(path[0])
+                if value is None:
+                    values = _MISSING
+                elif isinstance(value, (dict, list)):
+                    out: List[Any] = []
+                    _resolve(self.event, path, out)
+                    values = tuple(out)
+                else:
+                    values = (value,)
+            else:
+                out = []
+                _resolve(self.event, path, out)
+                values = tuple(out)
+            self._raw[path] = values
+        return values
+
+    def keys(self, path: Tuple[str, ...]) -> Tuple[Any, ...]:
+        values = self._keys.get(path)
+        if values is None:
+            values = self._keys[path] = tuple(_key(value) for value in self.raw(path))
+        return values
+
+
+Predicate = Callable[[_Context], bool]
+
+# Relative cost of a node; children of all/any are evaluated cheapest first
+_COST = {"exists": 1, "eq": 1, "in": 1, "ne": 1, "not_in": 1, "gt": 2, "gte": 2, "lt": 2, "lte": 2,
+         "startswith": 3, "endswith": 3, "contains": 4, "regex": 6}
+
+
+def _values_list(leaf: Dict[str, Any]) -> List[Any]:
+    value = leaf.get("value")
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+
+def _compile_leaf(leaf: Dict[str, Any]) -> Predicate:
+    field = leaf.get("field")
+    op = leaf.get("op", "eq")
+    if not isinstance(field, str) or not field:
+        raise ValueError(f"leaf without a field: {leaf!r}")
+    path = tuple(field.split("."))
+
+    if op == "exists":
+        expected = bool(leaf.get("value", True))
+        return lambda ctx: bool(ctx.raw(path)) is expected
+    if op in ("eq", "in", "ne", "not_in"):
+        wanted = frozenset(_key(value) for value in _values_list(leaf))
+        if op in ("eq", "in"):
+            if len(wanted) == 1:
+                (single,) = wanted
+                return lambda ctx: single in ctx.keys(path)
+            return lambda ctx: not wanted.isdisjoint(ctx.keys(path))
+        return lambda ctx: wanted.isdisjoint(ctx.keys(path))
+    if op in ("contains", "startswith", "endswith", "regex"):
+        needles = [str(value) for value in _values_list(leaf)]
+        if op == "regex":
+            source = "|".join(f"(?:{needle})" for needle in needles)
+        else:
+            escaped = "|".join(re.escape(needle.lower()) for needle in needles)
+            source = {"contains": f"(?:{escaped})",
+                      "startswith": f"^(?:{escaped})",
+                      "endswith": f"(?:{escaped})$"}[op]
+        search = re.compile(source, re.IGNORECASE | re.DOTALL).search
+
+        def text_match(ctx: _Context) -> bool:
+            for value in ctx.keys(path):
+                if value.__class__ is str and search(value) is not None:
+                    return True
+            return False
+        return text_match
+    if op in ("gt", "gte", "lt", "lte"):
+        bound = _number(leaf.get("value"))
+        if bound is None:
+            raise ValueError(f"{op} needs a numeric value: {leaf!r}")
+        compare = {
+            "gt": lambda number: number > bound,
+            "gte": lambda number: number >= bound,
+            "lt": lambda number: number < bound,
+            "lte": lambda number: number <= bound,
+        }[op]
+
+        def numeric(ctx: _Context) -> bool:
+            for value in ctx.raw(path):
+                number = _number(value)
+                if number is not None and compare(number):
+                    return True
+            return False
+        return numeric
+    raise ValueError(f"unknown operator {op!r}")
+
+
+def _all_of(children: List[Predicate]) -> Predicate:
+    # Plain `and` chains avoid the generator of all() for the common short conjunctions
+    if len(children) == 1:
+        return children[0]
+    if len(children) == 2:
+        first, second = children
+        return lambda ctx: first(ctx) and second(ctx)
+    if len(children) == 3:
+        first, second, third = children
+        return lambda ctx: first(ctx) and second(ctx) and third(ctx)
+
+    def conjunction(ctx: _Context) -> bool:
+        for child in children:
+            if not child(ctx):
+                return False
+        return True
+    return conjunction
+
+
+def _any_of(children: List[Predicate]) -> Predicate:
+    if len(children) == 1:
+        return children[0]
+    if len(children) == 2:
+        first, second = children
+        return lambda ctx: first(ctx) or second(ctx)
+
+    def disjunction(ctx: _Context) -> bool:
+        for child in children:
+            if child(ctx):
+                return True
+        return False
+    return disjunction
+
+
+def _compile(node: Any) -> Tuple[Predicate, int]:
+    """Predicate of a condition node and its relative cost."""
+    if not isinstance(node, dict):
+        raise ValueError(f"condition must be an object: {node!r}")
+    if "all" in node or "any" in node:
+        compiled = sorted((_compile(child) for child in node["all" if "all" in node else "any"]),
+                          key=lambda item: item[1])
+        if not compiled:
+            raise ValueError("empty all/any")
+        children = [predicate for predicate, _ in compiled]
+        cost = sum(cost for _, cost in compiled)
+        return (_all_of(children) if "all" in node else _any_of(children)), cost
+    if "not" in node:
+        child, cost = _compile(node["not"])
+        return (lambda ctx: not child(ctx)), cost
+    return _compile_leaf(node), _COST.get(node.get("op", "eq"), 6)
+
+
+def _index_leaf(leaves: List[Any]) -> Optional[int]:
+    """
+    Position of the equality leaf to index the rule by: the one with the
+    fewest values, @stream and event_type only when nothing better exists.
+    """
+    best, best_key = None, None
+    for position, leaf in enumerate(leaves):
+        if isinstance(leaf, dict) and leaf.get("op", "eq") in ("eq", "in") and "field" in leaf:
+            key = (leaf["field"] in (STREAM_FIELD, "event_type"), len(_values_list(leaf)))
+            if best_key is None or key < best_key:
+                best, best_key = position, key
+    return best
+
+
+def _always(ctx: _Context) -> bool:
+    return True
+
+
+class Rule:
+    """A compiled detection rule with its evaluation counters."""
+
+    __slots__ = ("id", "name", "description", "severity", "recommended_actions", "tags",
+                 "condition", "predicate", "fields", "index_field", "index_values",
+                 "evaluations", "matches", "errors", "timed", "time_ns")
+
+    def __init__(self, definition: Dict[str, Any]):
+        self.id = str(definition.get("id") or "")
+        if not self.id:
+            raise RuleError(f"rule without an id: {definition!r}")
+        self.name = definition.get("name") or self.id
+        self.description = definition.get("description") or self.name
+        self.severity = str(definition.get("severity", "medium")).lower()
+        if self.severity not in SEVERITIES:
+            raise RuleError(f"rule {self.id}: unknown severity {self.severity!r}")
+        self.recommended_actions = list(definition.get("recommended_actions") or [])
+        self.tags = list(definition.get("tags") or [])
+
+        condition = definition.get("condition")
+        if condition is None:
+            raise RuleError(f"rule {self.id}: no condition")
+        # Rule-level filters become leaves of one top-level conjunction
+        leaves = list(condition["all"]) if isinstance(condition, dict) and "all" in condition else [condition]
+        if definition.get("streams"):
+            leaves.insert(0, {"field": STREAM_FIELD, "op": "in", "value": list(definition["streams"])})
+        if definition.get("event_types"):
+            leaves.insert(0, {"field": "event_type", "op": "in", "value": list(definition["event_types"])})
+        self.condition = {"all": leaves} if len(leaves) > 1 else leaves[0]
+        self.fields = frozenset(_fields(self.condition))
+
+        # The indexed leaf holds for every event the index hands to this rule:
+        # only the rest of the conjunction is compiled into the predicate
+        position = _index_leaf(leaves)
+        self.index_field: Optional[str] = None
+        self.index_values: frozenset = frozenset()
+        if position is not None:
+            leaf = leaves[position]
+            self.index_field = leaf["field"]
+            self.index_values = frozenset(_key(value) for value in _values_list(leaf))
+            leaves = leaves[:position] + leaves[position + 1:]
+        try:
+            self.predicate = _compile({"all": leaves})[0] if leaves else _always
+        except (ValueError, TypeError, KeyError, re.error) as e:
+            raise RuleError(f"rule {self.id}: {e}") from e
+
+        self.evaluations = 0
+        self.matches = 0
+        self.errors = 0
+        # Evaluations on timed (sampled) events and their total time
+        self.timed = 0
+        self.time_ns = 0
+
+    def stats(self) -> Dict[str, Any]:
+        avg_ns = self.time_ns / self.timed if self.timed else 0.0
+        return {
+            "rule_id": self.id,
+            "indexed_by": self.index_field,
+            "evaluations": self.evaluations,
+            "matches": self.matches,
+            "errors": self.errors,
+            "avg_us": round(avg_ns / 1e3, 3),
+            # Estimated from the timed sample
+            "time_ms": round(avg_ns * self.evaluations / 1e6, 3),
+        }
+
+
+def _fields(node: Any) -> Iterable[str]:
+    if not isinstance(node, dict):
+        return
+    for key in ("all", "any"):
+        if key in node:
+            for child in node[key]:
+                yield from _fields(child)
+            return
+    if "not" in node:
+        yield from _fields(node["not"])
+    elif isinstance(node.get("field"), str):
+        yield node["field"]
+
+
+class DetectionEngine:
+    """
+    Rule set with an index from (field, value) to the rules that may match.
+
+    Rule timing costs about as much as a cheap predicate, so only every
+    ``timing_every``-th event is timed; per-rule cost is extrapolated from
+    that sample.
+    """
+
+    def __init__(self, rules: Iterable[Any], timing_every: int = 16):
+        self.rules: List[Rule] = []
+        self._index: Dict[Tuple[str, ...], Dict[Any, List[Rule]]] = {}
+        self._unindexed: List[Rule] = []
+        self.timing_every = max(1, timing_every)
+        seen = set()
+        for definition in rules:
+            rule = definition if isinstance(definition, Rule) else Rule(definition)
+            if rule.id in seen:
+                raise RuleError(f"duplicate rule id {rule.id}")
+            seen.add(rule.id)
+            self.rules.append(rule)
+            if rule.index_field is None:
+                self._unindexed.append(rule)
+                continue
+            table = self._index.setdefault(tuple(rule.index_field.split(".")), {})
+            for value in rule.index_values:
+                table.setdefault(value, []).append(rule)
+        # Top-level event fields any rule reads; others need not be decoded
+        self.fields = frozenset(
+            field.split(".", 1)[0] for rule in self.rules for field in rule.fields | {rule.index_field or ""}
+            if field and field != STREAM_FIELD
+        )
+        self.events = 0
+        self.candidates = 0
+        self.alerts = 0
+
+    def evaluate(self, event: Dict[str, Any], stream: Optional[str] = None) -> List[Rule]:
+        """Rules matching the event, in order of candidate discovery."""
+        ctx = _Context(event, stream)
+        candidates: List[Rule] = []
+        for path, table in self._index.items():
+            for value in ctx.keys(path):
+                rules = table.get(value)
+                if rules:
+                    candidates.extend(rules)
+        if len(candidates) > 1:
+            # A rule indexed by a list field can be found through several values
+            candidates = list(dict.fromkeys(candidates))
+        candidates.extend(self._unindexed)
+
+        self.events += 1
+        self.candidates += len(candidates)
+        timed = self.events % self.timing_every == 0
+        clock = time.perf_counter_ns
+        matched: List[Rule] = []
+        for rule in candidates:
+            rule.evaluations += 1
+            if timed:
+                start = clock()
+            try:
+                hit = rule.predicate(ctx)
+            except (TypeError, ValueError, AttributeError):
+                rule.errors += 1
+                hit = False
+            if timed:
+                rule.time_ns += clock() - start
+                rule.timed += 1
+            if hit:
+                rule.matches += 1
+                matched.append(rule)
+        self.alerts += len(matched)
+        return matched
+
+    def stats(self, top: Optional[int] = None) -> Dict[str, Any]:
+        """Engine counters and per-rule cost, most expensive rules first."""
+        rules = sorted((rule.stats() for rule in self.rules), key=lambda item: item["time_ms"], reverse=True)
+        return {
+            "rules": len(self.rules),
+            "indexed_fields": sorted(".".join(path) for path in self._index),
+            "unindexed_rules": [rule.id for rule in self._unindexed],
+            "events": self.events,
+            "alerts": self.alerts,
+            "candidates_per_event": round(self.candidates / self.events, 3) if self.events else 0.0,
+            "timing_every": self.timing_every,
+            "rule_stats": rules[:top] if top else rules,
+        }
+
+
+def load_rules(path: str) -> List[Dict[str, Any]]:
+    """Rule definitions from a JSON file: a list of rules or {"rules": [...]}."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    rules = data.get("rules", []) if isinstance(data, dict) else data
+    if not isinstance(rules, list):
+        raise RuleError(f"{path}: expected a list of rules")
+    return rules
+
+
+def _first(event: Dict[str, Any], paths: Sequence[Tuple[str, ...]]) -> Optional[str]:
+    for path in paths:
+        out: List[Any] = []
+        _resolve(event, path, out)
+        if out and out[0] not in ("", None):
+            return str(out[0])
+    return None
+
+
+_HOST_PATHS = (("host", "hostname"), ("host_info", "hostname"), ("source_host",), ("source",))
+_AGENT_PATHS = (("agent_id",), ("agent", "agent_id"), ("source_agent",), ("source_system",))
+
+
+def build_alert(rule: Rule, event: Dict[str, Any], stream: Optional[str] = None,
+                now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Alert document (shared.schemas.Alert) for a rule match. The ID is
+    derived from the rule and the source event, so reprocessing the same
+    event does not create a second alert.
+    """
+    event_id = str(event.get("event_id") or "")
+    alert_id = str(uuid.uuid5(ALERT_NAMESPACE, f"{rule.id}:{event_id}"))
+    return {
+        "event_id": alert_id,
+        "timestamp": (now or datetime.now(timezone.utc)).isoformat(),
+        "event_type": "alert",
+        "source_host": _first(event, _HOST_PATHS) or "unknown",
+        "source_agent": _first(event, _AGENT_PATHS) or "unknown",
+        "severity": rule.severity,
+        "alert_name": rule.name,
+        "description": rule.description,
+        "rule_id": rule.id,
+        "related_events": [event_id] if event_id else [],
+        "recommended_actions": rule.recommended_actions,
+        "metadata": {
+            "stream": stream,
+            "source_event_type": event.get("event_type"),
+            "source_timestamp": event.get("timestamp"),
+            "host_id": _first(event, (("host", "host_id"), ("host_info", "host_id"))),
+            "tags": rule.tags,
+        },
+    }
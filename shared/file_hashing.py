@@ -0,0 +1,292 @@
+"""
+Parallel file hashing with a persistent cache.
+
+Hashing the executables behind thousands of process and autorun entries is
+dominated by I/O and by re-reading files that did not change. FileHasher:
+
+- reads small files with one reusable 1 MiB buffer and maps large files
+  with mmap, so hashing never goes through 4 KiB read() calls;
+- hashes many files in parallel on a thread pool (hashlib releases the GIL
+  for large updates, so threads scale with cores and disks);
+- remembers digests in a FileHashCache keyed by (path, size, mtime, inode):
+  a file whose stat() did not change is never read again. The cache lives
+  in memory and, when given a path, in a SQLite file that survives restarts.
+
+    hasher = FileHasher(cache=FileHashCache("/var/cache/securityapp/file_hashes.db"))
+    digest = hasher.hash("C:/Windows/System32/svchost.exe")
+    digests = hasher.hash_many(paths)          # {path: digest or None}
+    digests = await hasher.ahash_many(paths)   # same, without blocking the loop
+
+shared.utils.get_file_hash uses the process-wide default hasher
+(get_default_hasher), configured by FILE_HASH_CACHE_PATH and
+FILE_HASH_WORKERS. Benchmark: ingest-api/benchmarks/bench_file_hash.py.
+"""
+
+import asyncio
+import atexit
+import hashlib
+import logging
+import mmap
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+__all__ = [
+    "hash_file",
+    "FileHashCache",
+    "FileHasher",
+    "get_default_hasher",
+]
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ALGORITHM = "sha256"
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+# Files at least this large are hashed through mmap instead of read()
+DEFAULT_MMAP_THRESHOLD = 16 * 1024 * 1024
+DEFAULT_CACHE_ENTRIES = 200_000
+# Pending cache rows written to SQLite in one transaction
+CACHE_FLUSH_BATCH = 512
+
+# (size, mtime_ns, inode) - identity of the file contents as seen by stat()
+FileSignature = Tuple[int, int, int]
+
+
+def _signature(stat_result: os.stat_result) -> FileSignature:
+    return stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino
+
+
+def hash_file(path: str, algorithm: str = DEFAULT_ALGORITHM,
+              buffer_size: int = DEFAULT_BUFFER_SIZE,
+              mmap_threshold: int = DEFAULT_MMAP_THRESHOLD,
+              buffer: Optional[bytearray] = None) -> Tuple[str, FileSignature]:
+    """
+    Hash one file; returns the hex digest and the signature the digest is
+    valid for (taken from the open descriptor before reading).
+
+    Raises OSError like open() does.
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, "rb", buffering=0) as f:
+        signature = _signature(os.fstat(f.fileno()))
+        size = signature[0]
+        if size >= mmap_threshold:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+        elif size > 0:
+            if buffer is None or len(buffer) < buffer_size:
+                buffer = bytearray(buffer_size)
+            view = memoryview(buffer)
+            while True:
+                read = f.readinto(buffer)
+                if not read:
+                    break
+                digest.update(view[:read])
+    return digest.hexdigest(), signature
+
+
+class FileHashCache:
+    """
+    Digest cache keyed by (path, algorithm) and validated by the file signature.
+
+    An LRU of ``max_entries`` entries in memory; with ``path`` set, entries
+    are also stored in SQLite and looked up there on a memory miss. Writes
+    are batched; call flush() or close() to persist the tail.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = DEFAULT_CACHE_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[FileSignature, str]]" = OrderedDict()
+        self._pending: List[tuple] = []
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS file_hashes ("
+                " path TEXT NOT NULL, algorithm TEXT NOT NULL,"
+                " size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL,"
+                " digest TEXT NOT NULL, PRIMARY KEY (path, algorithm))"
+            )
+
+    def get(self, path: str, algorithm: str, signature: FileSignature) -> Optional[str]:
+        key = (path, algorithm)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT size, mtime_ns, inode, digest FROM file_hashes WHERE path = ? AND algorithm = ?",
+                    key,
+                ).fetchone()
+                if row is not None:
+                    entry = ((row[0], row[1], row[2]), row[3])
+                    self._remember(key, entry)
+            elif entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None or entry[0] != signature:
+            return None
+        return entry[1]
+
+    def put(self, path: str, algorithm: str, signature: FileSignature, digest: str) -> None:
+        key = (path, algorithm)
+        with self._lock:
+            self._remember(key, (signature, digest))
+            if self._db is not None:
+                self._pending.append((path, algorithm, *signature, digest))
+                if len(self._pending) >= CACHE_FLUSH_BATCH:
+                    self._flush_locked()
+
+    def _remember(self, key: Tuple[str, str], entry: Tuple[FileSignature, str]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _flush_locked(self) -> None:
+        if not self._pending or self._db is None:
+            return
+        rows, self._pending = self._pending, []
+        try:
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO file_hashes (path, algorithm, size, mtime_ns, inode, digest)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to persist {len(rows)} file hashes to {self.path}: {e}")
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_locked()
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class FileHasher:
+    """Thread-pool file hashing engine with a signature-validated cache."""
+
+    def __init__(self, cache: Optional[FileHashCache] = None,
+                 algorithm: str = DEFAULT_ALGORITHM,
+                 max_workers: Optional[int] = None,
+                 buffer_size: int = DEFAULT_BUFFER_SIZE,
+                 mmap_threshold: int = DEFAULT_MMAP_THRESHOLD):
+        hashlib.new(algorithm)  # fail fast on an unknown algorithm
+        self.cache = cache if cache is not None else FileHashCache()
+        self.algorithm = algorithm
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) * 2)
+        self.buffer_size = buffer_size
+        self.mmap_threshold = mmap_threshold
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        # One read buffer per pool thread instead of one per file
+        self._local = threading.local()
+        self.counters: Dict[str, int] = {"hits": 0, "misses": 0, "errors": 0, "bytes_hashed": 0}
+        self._counters_lock = threading.Lock()
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._counters_lock:
+            self.counters[name] += amount
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix="file-hash"
+                    )
+        return self._executor
+
+    def _buffer(self) -> bytearray:
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            buffer = self._local.buffer = bytearray(self.buffer_size)
+        return buffer
+
+    def hash(self, path: str) -> Optional[str]:
+        """Digest of one file, or None when it cannot be read (logged)."""
+        try:
+            signature = _signature(os.stat(path))
+            cached = self.cache.get(path, self.algorithm, signature)
+            if cached is not None:
+                self._count("hits")
+                return cached
+            digest, signature = hash_file(
+                path, self.algorithm, self.buffer_size, self.mmap_threshold, self._buffer()
+            )
+        except (OSError, ValueError) as e:
+            self._count("errors")
+            logger.error(f"Failed to calculate hash for {path}: {e}")
+            return None
+        self._count("misses")
+        self._count("bytes_hashed", signature[0])
+        self.cache.put(path, self.algorithm, signature, digest)
+        return digest
+
+    def hash_many(self, paths: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Digests of many files hashed in parallel; duplicates are hashed once."""
+        unique = list(dict.fromkeys(paths))
+        if len(unique) <= 1:
+            return {path: self.hash(path) for path in unique}
+        results = dict(zip(unique, self._pool().map(self.hash, unique)))
+        self.cache.flush()
+        return results
+
+    async def ahash(self, path: str) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool(), self.hash, path)
+
+    async def ahash_many(self, paths: Iterable[str]) -> Dict[str, Optional[str]]:
+        unique = list(dict.fromkeys(paths))
+        loop = asyncio.get_running_loop()
+        pool = self._pool()
+        digests = await asyncio.gather(*(loop.run_in_executor(pool, self.hash, path) for path in unique))
+        self.cache.flush()
+        return dict(zip(unique, digests))
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.counters, "cached": len(self.cache), "workers": self.max_workers}
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.cache.close()
+
+
+_default_hasher: Optional[FileHasher] = None
+_default_lock = threading.Lock()
+
+
+def get_default_hasher() -> FileHasher:
+    """
+    Process-wide hasher used by shared.utils.get_file_hash.
+
+    FILE_HASH_CACHE_PATH enables the persistent SQLite cache (memory only
+    when unset); FILE_HASH_WORKERS sets the thread pool size.
+    """
+    global _default_hasher
+    if _default_hasher is None:
+        with _default_lock:
+            if _default_hasher is None:
+                cache_path = os.getenv("FILE_HASH_CACHE_PATH") or None
+                workers = int(os.getenv("FILE_HASH_WORKERS", "0")) or None
+                _default_hasher = FileHasher(cache=FileHashCache(cache_path), max_workers=workers)
+                atexit.register(_default_hasher.close)
+    return _default_hasher
@@ -0,0 +1,391 @@
+"""
+Tumbling-window aggregation of network connection events into flows.
+
+One stored document per connection swamps the event indices as soon as
+network collection is enabled: a busy host opens the same connection to the
+same service thousands of times an hour. FlowAggregator folds connection
+events into fixed (tumbling) windows keyed by
+
+    (window_start, host_id, source_ip, destination_ip, destination_port, protocol)
+
+and sums connections and bytes per key. The source port is not part of the
+key (it changes on every connection); only the number of distinct source
+ports is kept. Closed windows are drained as compact FlowRecord objects, so
+the number of stored documents grows with the number of distinct
+conversations per window instead of the number of connections.
+
+Both event shapes are accepted: the agent telemetry format with a nested
+``network`` section (``NetworkInfo``) and the flat ``NetworkEvent`` schema
+(``source_ip``, ``dest_ip``, ``dest_port``). Events are folded into the
+window of their own timestamp, so events delivered late land in the window
+they belong to; a window drained earlier is simply emitted again with the
+late part, and the store is expected to add partial records together.
+
+Each drained record gets a ``part_id``, so the store can apply a part at
+most once. Records that could not be written are put back with ``restore``
+unchanged (same part, not merged with newer events) and drained again first.
+
+``add`` also decides whether the raw event should be stored as well:
+
+- ``flagged`` - the event matched an IOC, one of its addresses is on a
+  threat list, or its severity is high/critical; the flow stays flagged for
+  the rest of the window, so the following connections are kept too;
+- ``sampled`` - the flow key (without the window) falls into the sample
+  fraction. The decision is a hash of the key, so a sampled conversation is
+  kept completely, in every window and by every process.
+
+    aggregator = FlowAggregator(window_seconds=60, sample_rate=0.01)
+    mark = aggregator.add(event)
+    if mark is not None and mark["retain"] is None:
+        ...  # counted in the flow, the raw event is not stored
+    for record in aggregator.drain(time.time()):
+        doc = record.to_doc()
+"""
+
+import hashlib
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+__all__ = [
+    "FlowKey",
+    "FlowRecord",
+    "FlowAggregator",
+    "connection_fields",
+    "flow_id",
+    "flag_reasons",
+    "is_sampled",
+]
+
+# (window_start, host_id, source_ip, destination_ip, destination_port, protocol)
+FlowKey = Tuple[int, str, str, str, int, str]
+
+# Distinct values kept per flow; counts above the cap are lower bounds
+MAX_SOURCE_PORTS = 256
+MAX_PROCESSES = 16
+
+FLAG_SEVERITIES = frozenset(("high", "critical"))
+
+
+def _epoch(timestamp: Any) -> float:
+    if isinstance(timestamp, datetime):
+        dt = timestamp
+    else:
+        try:
+            dt = datetime.fromisoformat(str(timestamp).replace("Z", "+00:00"))
+        except ValueError:
+            return time.time()
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def _iso(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).isoformat(timespec="milliseconds")
+
+
+def _int(value: Any) -> int:
+    try:
+        return max(int(value or 0), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def connection_fields(event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Connection attributes of an event in either schema, or None when the
+    event has no destination address.
+    """
+    network = event.get("network")
+    if isinstance(network, dict):
+        host = event.get("host") or event.get("host_info") or {}
+        fields = {
+            "host_id": host.get("host_id") or host.get("hostname") or "",
+            "hostname": host.get("hostname"),
+            "source_ip": network.get("source_ip") or "",
+            "source_port": network.get("source_port"),
+            "destination_ip": network.get("destination_ip"),
+            "destination_port": network.get("destination_port"),
+            "protocol": network.get("protocol"),
+            "bytes_sent": network.get("bytes_sent"),
+            "bytes_received": network.get("bytes_received"),
+            "annotations": network,
+        }
+        process = event.get("process") or {}
+        fields["process"] = process.get("name") if isinstance(process, dict) else None
+    else:
+        fields = {
+            "host_id": event.get("source_host") or "",
+            "hostname": event.get("source_host"),
+            "source_ip": event.get("source_ip") or "",
+            "source_port": event.get("source_port"),
+            "destination_ip": event.get("dest_ip"),
+            "destination_port": event.get("dest_port"),
+            "protocol": event.get("protocol"),
+            "bytes_sent": event.get("bytes_sent"),
+            "bytes_received": event.get("bytes_received"),
+            "annotations": event,
+            "process": (event.get("metadata") or {}).get("process_name"),
+        }
+    if not fields["destination_ip"]:
+        return None
+    fields["destination_port"] = _int(fields["destination_port"])
+    fields["protocol"] = str(fields["protocol"] or "unknown").lower()
+    return fields
+
+
+def flow_id(key: FlowKey) -> str:
+    """Stable document id of a flow window"""
+    return hashlib.sha1("|".join(str(part) for part in key).encode("utf-8")).hexdigest()
+
+
+def flag_reasons(event: Dict[str, Any], annotations: Optional[Dict[str, Any]] = None) -> List[str]:
+    """Reasons to keep the raw event: IOC match, threat-listed address, high severity"""
+    reasons = []
+    ioc = event.get("ioc")
+    if isinstance(ioc, dict) and ioc.get("matched"):
+        reasons.append("ioc")
+    annotations = annotations if annotations is not None else event
+    if annotations.get("source_threat_lists") or annotations.get("destination_threat_lists"):
+        reasons.append("threat_list")
+    severity = event.get("severity")
+    if str(getattr(severity, "value", severity) or "").lower() in FLAG_SEVERITIES:
+        reasons.append("severity")
+    return reasons
+
+
+def is_sampled(key: FlowKey, sample_rate: float) -> bool:
+    """Deterministic sampling of a conversation: the window is not part of the hash"""
+    if sample_rate <= 0:
+        return False
+    if sample_rate >= 1:
+        return True
+    digest = hashlib.blake2b("|".join(str(part) for part in key[1:]).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") < sample_rate * (1 << 64)
+
+
+class FlowRecord:
+    """Counters of one flow key within one window"""
+
+    __slots__ = (
+        "key", "flow_id", "window_seconds", "hostname", "connections", "bytes_sent", "bytes_received",
+        "first_seen", "last_seen", "source_ports", "processes", "flags", "sampled",
+        "raw_events", "direction", "source_classes", "destination_classes", "part_id",
+    )
+
+    def __init__(self, key: FlowKey, window_seconds: int, sampled: bool = False):
+        self.key = key
+        self.flow_id = flow_id(key)
+        self.window_seconds = window_seconds
+        self.hostname: Optional[str] = None
+        self.connections = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.first_seen = float("inf")
+        self.last_seen = float("-inf")
+        self.source_ports: set = set()
+        self.processes: set = set()
+        self.flags: set = set()
+        self.sampled = sampled
+        self.raw_events = 0
+        self.direction: Optional[str] = None
+        self.source_classes: List[str] = []
+        self.destination_classes: List[str] = []
+        # Identity of the drained part; assigned by FlowAggregator.drain
+        self.part_id: Optional[str] = None
+
+    @property
+    def window_end(self) -> int:
+        return self.key[0] + self.window_seconds
+
+    def merge(self, other: "FlowRecord") -> None:
+        """Add the counters of another record with the same key"""
+        self.hostname = self.hostname or other.hostname
+        self.connections += other.connections
+        self.bytes_sent += other.bytes_sent
+        self.bytes_received += other.bytes_received
+        self.first_seen = min(self.first_seen, other.first_seen)
+        self.last_seen = max(self.last_seen, other.last_seen)
+        self.source_ports.update(list(other.source_ports)[:MAX_SOURCE_PORTS - len(self.source_ports)])
+        self.processes.update(list(other.processes)[:MAX_PROCESSES - len(self.processes)])
+        self.flags |= other.flags
+        self.sampled = self.sampled or other.sampled
+        self.raw_events += other.raw_events
+        self.direction = self.direction or other.direction
+        self.source_classes = self.source_classes or other.source_classes
+        self.destination_classes = self.destination_classes or other.destination_classes
+
+    def to_doc(self) -> Dict[str, Any]:
+        window_start, host_id, source_ip, destination_ip, destination_port, protocol = self.key
+        doc = {
+            "flow_id": self.flow_id,
+            "window_start": _iso(window_start),
+            "window_end": _iso(self.window_end),
+            "window_seconds": self.window_seconds,
+            "host_id": host_id,
+            "hostname": self.hostname,
+            "source_ip": source_ip or None,
+            "destination_ip": destination_ip,
+            "destination_port": destination_port,
+            "protocol": protocol,
+            "connections": self.connections,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "bytes_total": self.bytes_sent + self.bytes_received,
+            "source_ports": len(self.source_ports),
+            "processes": sorted(self.processes),
+            "first_seen": _iso(self.first_seen),
+            "last_seen": _iso(self.last_seen),
+            "flagged": bool(self.flags),
+            "flags": sorted(self.flags),
+            "sampled": self.sampled,
+            "raw_events": self.raw_events,
+        }
+        if self.direction:
+            doc["direction"] = self.direction
+        if self.source_classes:
+            doc["source_ip_classes"] = self.source_classes
+        if self.destination_classes:
+            doc["destination_ip_classes"] = self.destination_classes
+        return doc
+
+
+class FlowAggregator:
+    """
+    Open flow windows of one process.
+
+    ``add`` is called for every connection event, ``drain`` periodically with
+    the current time. A window is drained once ``allowed_lateness`` seconds
+    have passed after its end. ``add`` and ``drain`` are thread-safe.
+    """
+
+    def __init__(self, window_seconds: int = 60, allowed_lateness: float = 30.0,
+                 sample_rate: float = 0.0, keep_flagged: bool = True, max_pending: int = 50_000):
+        if window_seconds <= 0:
+            raise ValueError("window_seconds must be positive")
+        self.window_seconds = int(window_seconds)
+        self.allowed_lateness = allowed_lateness
+        self.sample_rate = sample_rate
+        self.keep_flagged = keep_flagged
+        self.max_pending = max_pending
+        self._flows: Dict[FlowKey, FlowRecord] = {}
+        # Drained parts put back by restore, emitted as they are
+        self._unwritten: List[FlowRecord] = []
+        self._lock = threading.Lock()
+        self.counters = {"events": 0, "raw_retained": 0, "flows_emitted": 0}
+
+    def __len__(self) -> int:
+        return len(self._flows) + len(self._unwritten)
+
+    @property
+    def overflowing(self) -> bool:
+        """More pending flows than max_pending: the caller should drain with force"""
+        return len(self) >= self.max_pending
+
+    def window_start(self, epoch: float) -> int:
+        return int(epoch // self.window_seconds) * self.window_seconds
+
+    def add(self, event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Fold a connection event into its flow.
+
+        Returns None for events without a destination address, otherwise a
+        mark ``{"flow_id", "window_start", "retain"}`` where ``window_start``
+        is in epoch seconds and ``retain`` is ``"flagged"``, ``"sampled"`` or
+        None (the raw event may be dropped).
+        """
+        fields = connection_fields(event)
+        if fields is None:
+            return None
+        seen = _epoch(event.get("timestamp"))
+        key: FlowKey = (
+            self.window_start(seen), str(fields["host_id"]), str(fields["source_ip"]),
+            str(fields["destination_ip"]), fields["destination_port"], fields["protocol"],
+        )
+        annotations = fields["annotations"]
+        reasons = flag_reasons(event, annotations)
+
+        with self._lock:
+            record = self._flows.get(key)
+            if record is None:
+                record = FlowRecord(key, self.window_seconds, is_sampled(key, self.sample_rate))
+                record.hostname = fields["hostname"]
+                record.direction = annotations.get("direction")
+                record.source_classes = list(annotations.get("source_ip_classes") or [])
+                record.destination_classes = list(annotations.get("destination_ip_classes") or [])
+                self._flows[key] = record
+            record.connections += 1
+            record.bytes_sent += _int(fields["bytes_sent"])
+            record.bytes_received += _int(fields["bytes_received"])
+            record.first_seen = min(record.first_seen, seen)
+            record.last_seen = max(record.last_seen, seen)
+            if fields["source_port"] is not None and len(record.source_ports) < MAX_SOURCE_PORTS:
+                record.source_ports.add(fields["source_port"])
+            if fields["process"] and len(record.processes) < MAX_PROCESSES:
+                record.processes.add(fields["process"])
+            record.flags.update(reasons)
+
+            retain = None
+            if self.keep_flagged and record.flags:
+                retain = "flagged"
+            elif record.sampled:
+                retain = "sampled"
+            if retain:
+                record.raw_events += 1
+                self.counters["raw_retained"] += 1
+            self.counters["events"] += 1
+
+        return {"flow_id": record.flow_id, "window_start": key[0], "retain": retain}
+
+    def drain(self, now: Optional[float] = None, force: bool = False) -> List[FlowRecord]:
+        """
+        Remove and return the windows that are closed at ``now`` (all of them
+        with force), preceded by the restored parts.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            if force:
+                closed = list(self._flows.values())
+                self._flows = {}
+            else:
+                cutoff = now - self.allowed_lateness
+                closed = [record for record in self._flows.values() if record.window_end <= cutoff]
+                for record in closed:
+                    del self._flows[record.key]
+            for record in closed:
+                record.part_id = uuid.uuid4().hex
+            closed = self._unwritten + closed
+            self._unwritten = []
+            self.counters["flows_emitted"] += len(closed)
+        return closed
+
+    def restore(self, records: Iterable[FlowRecord]) -> int:
+        """
+        Put drained records back (not written to the store). They keep their
+        part_id and are not merged with open windows: a part the store may
+        already hold is then retried as is. Records that do not fit under
+        max_pending are dropped; returns their number.
+        """
+        dropped = 0
+        with self._lock:
+            for record in records:
+                if len(self._flows) + len(self._unwritten) >= self.max_pending:
+                    dropped += 1
+                    continue
+                self._unwritten.append(record)
+                self.counters["flows_emitted"] -= 1
+        return dropped
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_seconds": self.window_seconds,
+            "allowed_lateness": self.allowed_lateness,
+            "sample_rate": self.sample_rate,
+            "keep_flagged": self.keep_flagged,
+            "open_flows": len(self._flows),
+            "unwritten_flows": len(self._unwritten),
+            "max_pending": self.max_pending,
+            **self.counters,
+        }
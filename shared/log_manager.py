@@ -0,0 +1,227 @@
+"""
+Non-blocking structured logging for the cybersecurity platform.
+
+Log calls on the asyncio event loop only enqueue the LogRecord; message
+formatting, JSON serialization and I/O happen on a background listener
+thread. Hot-path loggers can be sampled and rate limited so that a burst of
+per-event messages never turns into a burst of log lines.
+
+Typical use in a service:
+
+    configure_logging(level="INFO", json_format=True)
+    logger = get_logger(__name__)
+    hot_logger = get_hot_logger(__name__, sample_rate=0.1, max_per_second=50)
+
+    hot_logger.info("Received event %s from agent %s", event_id, agent_id)
+    logger.debug("Search query: %s", LazyJSON(search_body))
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional
+
+try:
+    from pythonjsonlogger import jsonlogger
+except ImportError:  # pragma: no cover - plain text fallback
+    jsonlogger = None
+
+
+DEFAULT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+JSON_FORMAT = "%(asctime)s %(name)s %(levelname)s %(message)s"
+DEFAULT_QUEUE_SIZE = 10000
+HOT_LOGGER_SUFFIX = ".hot"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional["NonBlockingQueueHandler"] = None
+
+
+class LazyJSON:
+    """Defers json.dumps of a payload until the record is actually formatted."""
+
+    __slots__ = ("payload",)
+
+    def __init__(self, payload: Any):
+        self.payload = payload
+
+    def __str__(self) -> str:
+        try:
+            return json.dumps(self.payload, ensure_ascii=False, default=str)
+        except (TypeError, ValueError):
+            return repr(self.payload)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that never blocks the caller.
+
+    Records are enqueued unformatted: the listener thread merges msg and args,
+    so log arguments must not be mutated after the call. When the queue is
+    full the record is dropped and counted instead of waiting.
+    """
+
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket limiting how many records per second a logger emits."""
+
+    def __init__(self, max_per_second: float, burst: Optional[float] = None):
+        super().__init__()
+        self.rate = float(max_per_second)
+        self.capacity = float(burst if burst is not None else max(max_per_second, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        self.suppressed += 1
+        return False
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes a fixed fraction of records below WARNING.
+
+    Warnings and errors are never sampled out.
+    """
+
+    def __init__(self, sample_rate: float):
+        super().__init__()
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.sample_rate >= 1.0:
+            return True
+        return random.random() < self.sample_rate
+
+
+def _build_formatter(json_format: bool) -> logging.Formatter:
+    if json_format and jsonlogger is not None:
+        return jsonlogger.JsonFormatter(
+            JSON_FORMAT,
+            rename_fields={"asctime": "timestamp", "levelname": "level", "name": "logger"},
+            json_ensure_ascii=False,
+        )
+    return logging.Formatter(DEFAULT_FORMAT)
+
+
+def configure_logging(
+    level: str = "INFO",
+    json_format: bool = True,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    stream=None,
+    log_file: Optional[str] = None,
+) -> logging.Logger:
+    """
+    Route all logging through a bounded queue drained by a background thread.
+
+    Replaces handlers of the root logger. Safe to call more than once: the
+    previous listener is stopped and flushed first.
+    """
+    global _listener, _queue_handler
+
+    shutdown_logging()
+
+    if log_file:
+        output: logging.Handler = logging.FileHandler(log_file, encoding="utf-8")
+    else:
+        output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(_build_formatter(json_format))
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=queue_size)
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(getattr(logging, level.upper(), logging.INFO))
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+    return root
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        try:
+            _listener.stop()
+        finally:
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Get a regular logger."""
+    return logging.getLogger(name)
+
+
+_hot_lock = threading.Lock()
+
+
+def get_hot_logger(
+    name: str,
+    sample_rate: float = 1.0,
+    max_per_second: Optional[float] = None,
+) -> logging.Logger:
+    """
+    Get a child logger for per-event hot-path messages.
+
+    The child ("<name>.hot") carries sampling and rate limiting filters, so
+    only calls made through it are thinned out; warnings and errors pass the
+    sampler but still count against the rate limit.
+    """
+    logger = logging.getLogger(name + HOT_LOGGER_SUFFIX)
+    with _hot_lock:
+        if not getattr(logger, "_hot_configured", False):
+            if sample_rate < 1.0:
+                logger.addFilter(SamplingFilter(sample_rate))
+            if max_per_second:
+                logger.addFilter(RateLimitFilter(max_per_second))
+            logger._hot_configured = True
+    return logger
+
+
+def get_logging_stats() -> Dict[str, int]:
+    """Queue depth and drop/suppression counters for monitoring."""
+    stats = {"queued": 0, "dropped": 0, "rate_limited": 0}
+    if _queue_handler is not None:
+        stats["queued"] = _queue_handler.queue.qsize()
+        stats["dropped"] = _queue_handler.dropped
+    for logger in logging.Logger.manager.loggerDict.values():
+        if isinstance(logger, logging.Logger) and logger.name.endswith(HOT_LOGGER_SUFFIX):
+            for log_filter in logger.filters:
+                if isinstance(log_filter, RateLimitFilter):
+                    stats["rate_limited"] += log_filter.suppressed
+    return stats
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,538 @@
+"""
+Posture rules evaluated column-wise over the latest posture of every host.
+
+The agent computes ``findings`` at collection time; a new or changed rule
+reaches a host only with its next report. This module evaluates declarative
+rules on the server over a table holding the latest ``security`` and
+``windows_update`` settings of the whole fleet:
+
+    {
+        "rule_id": "DEFENDER_SIGNATURES_OUTDATED",
+        "severity": "medium",
+        "message_ru": "Сигнатуры антивируса устарели",
+        "condition": {"field": "defender.signature_age_days", "op": "gt", "value": 7},
+        "evidence": ["defender.signature_age_days"]
+    }
+
+Fields are dotted paths inside the sections defender, firewall, uac, rdp,
+bitlocker, smb1 (``security.*`` of host_posture) and windows_update.
+A section whose ``permission`` is ``denied`` contributes no values, so rules
+neither fire nor clear on data the agent could not read. Fields ending in
+``_date`` are stored as days since the epoch and compared with
+``older_than_days``. Conditions nest with ``all``, ``any`` and ``not``;
+leaves use ``eq``, ``ne``, ``in``, ``not_in``, ``gt``, ``gte``, ``lt``,
+``lte``, ``exists``, ``missing`` or ``older_than_days``. A leaf on a missing
+value is false (``ne`` and ``not_in`` included); ``missing`` tests for it.
+String comparisons ignore case.
+
+PostureTable keeps one row per host and a bitmap index per column: for
+every distinct value, an int whose bit N is set when host N has that value.
+A leaf is a few bitwise operations over the values of one column and a rule
+is a mask of all matching hosts, so evaluating a rule over 10k hosts costs
+microseconds regardless of the number of hosts that match. PostureEvaluator
+keeps the result mask of every rule: replacing the rule set evaluates only
+the added or changed rules, updating hosts re-evaluates the masks, and both
+return per-rule diffs (hosts to upsert and to delete) instead of the whole
+result.
+
+    evaluator = PostureEvaluator(load_posture_rules("posture_rules.json"))
+    changes = evaluator.update_hosts(snapshots)
+    for change in changes:
+        for row in iter_rows(change.upsert):
+            finding = evaluator.finding(change.rule_id, row)
+"""
+
+import hashlib
+import json
+import time
+from datetime import date, datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+__all__ = [
+    "SECTIONS",
+    "PostureRuleError",
+    "PostureRule",
+    "PostureTable",
+    "PostureEvaluator",
+    "RuleChange",
+    "posture_columns",
+    "load_posture_rules",
+    "iter_rows",
+]
+
+SECTIONS = ("defender", "firewall", "uac", "rdp", "bitlocker", "smb1", "windows_update")
+SEVERITIES = ("critical", "high", "medium", "low", "info")
+# Section keys that describe collection, not settings
+_SERVICE_KEYS = frozenset(("permission", "error_message"))
+_EPOCH = date(1970, 1, 1)
+_MISSING = object()
+
+# (table, today) -> mask of matching rows
+Evaluate = Callable[["PostureTable", int], int]
+
+
+class PostureRuleError(ValueError):
+    """A rule that cannot be compiled; the message names the rule."""
+
+
+def _value(value: Any) -> Any:
+    """Normalized column value: strings lowercased, integral floats as ints."""
+    if isinstance(value, str):
+        return value.strip().lower()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _epoch_day(value: Any) -> Optional[int]:
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return (dt.date() - _EPOCH).days
+
+
+def _flatten(prefix: str, section: Dict[str, Any], columns: Dict[str, Any]) -> None:
+    for key, value in section.items():
+        if key in _SERVICE_KEYS or value is None:
+            continue
+        name = f"{prefix}.{key}"
+        if isinstance(value, dict):
+            _flatten(name, value, columns)
+        elif isinstance(value, list):
+            continue
+        elif key.endswith("_date"):
+            day = _epoch_day(value)
+            if day is not None:
+                columns[name] = day
+        else:
+            columns[name] = _value(value)
+
+
+def posture_columns(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Column values of one host_posture snapshot (dotted path -> scalar)."""
+    security = event.get("security") or {}
+    columns: Dict[str, Any] = {}
+    for name in SECTIONS:
+        section = event.get(name) if name == "windows_update" else security.get(name)
+        if not isinstance(section, dict):
+            continue
+        if str(section.get("permission") or "").lower() == "denied":
+            continue
+        _flatten(name, section, columns)
+    # Older agents report only bitlocker.enabled
+    if "bitlocker.system_drive_protected" not in columns and "bitlocker.enabled" in columns:
+        columns["bitlocker.system_drive_protected"] = columns["bitlocker.enabled"]
+    return columns
+
+
+def iter_rows(mask: int) -> Iterator[int]:
+    """Row numbers of the set bits of a mask, ascending."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def _timestamp(value: Any) -> float:
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return 0.0
+    return (dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp()
+
+
+class _Column:
+    """
+    Bitmap index of one setting: (type, value) -> mask of rows, plus the value
+    of every row. The type is part of the key because True == 1 and both
+    would otherwise share one mask.
+    """
+
+    __slots__ = ("masks", "rows", "present")
+
+    def __init__(self):
+        self.masks: Dict[Tuple[type, Any], int] = {}
+        self.rows: Dict[int, Any] = {}
+        self.present = 0
+
+    def set(self, row: int, value: Any) -> bool:
+        """Store the value of a row (None clears it); True when it changed."""
+        old = self.rows.get(row, _MISSING)
+        if old is not _MISSING and type(old) is type(value) and old == value:
+            return False
+        if old is _MISSING and value is None:
+            return False
+        bit = 1 << row
+        if old is not _MISSING:
+            key = (type(old), old)
+            remaining = self.masks[key] & ~bit
+            if remaining:
+                self.masks[key] = remaining
+            else:
+                del self.masks[key]
+            del self.rows[row]
+            self.present &= ~bit
+        if value is not None:
+            key = (type(value), value)
+            self.rows[row] = value
+            self.masks[key] = self.masks.get(key, 0) | bit
+            self.present |= bit
+        return True
+
+    def rows_equal(self, value: Any) -> int:
+        """Rows holding exactly this value, type included."""
+        return self.masks.get((type(value), value), 0)
+
+    def mask_where(self, test: Callable[[Any], bool]) -> int:
+        """Rows whose value passes test; one check per distinct value."""
+        mask = 0
+        for (_, value), rows in self.masks.items():
+            if test(value):
+                mask |= rows
+        return mask
+
+
+class PostureTable:
+    """Latest posture settings of every host, one row per host."""
+
+    def __init__(self):
+        self.rows: Dict[str, int] = {}
+        self.host_ids: List[str] = []
+        self.hostnames: List[Optional[str]] = []
+        self.timestamps: List[Optional[str]] = []
+        self._times: List[float] = []
+        self.columns: Dict[str, _Column] = {}
+        self.live = 0
+
+    def __len__(self) -> int:
+        return len(self.host_ids)
+
+    def upsert(self, host_id: str, hostname: Optional[str], timestamp: Optional[str],
+               columns: Dict[str, Any]) -> Optional[int]:
+        """
+        Replace the settings of a host with a newer snapshot.
+
+        Returns the row, or None when the table already holds a later
+        snapshot of the host (replayed or late events).
+        """
+        at = _timestamp(timestamp)
+        row = self.rows.get(host_id)
+        if row is None:
+            row = len(self.host_ids)
+            self.rows[host_id] = row
+            self.host_ids.append(host_id)
+            self.hostnames.append(hostname)
+            self.timestamps.append(timestamp)
+            self._times.append(at)
+            self.live |= 1 << row
+        elif at < self._times[row]:
+            return None
+        else:
+            self.hostnames[row] = hostname or self.hostnames[row]
+            self.timestamps[row] = timestamp
+            self._times[row] = at
+            for name, column in self.columns.items():
+                if name not in columns:
+                    column.set(row, None)
+        for name, value in columns.items():
+            column = self.columns.get(name)
+            if column is None:
+                column = self.columns[name] = _Column()
+            column.set(row, value)
+        return row
+
+    def upsert_snapshot(self, event: Dict[str, Any]) -> Optional[int]:
+        """Upsert from a host_posture document (as stored in OpenSearch or read from the stream)."""
+        host_info = event.get("host_info") or event.get("host") or {}
+        host_id = host_info.get("host_id") or host_info.get("hostname")
+        if not host_id:
+            return None
+        timestamp = event.get("timestamp") or event.get("@timestamp")
+        return self.upsert(host_id, host_info.get("hostname"), timestamp, posture_columns(event))
+
+    def value(self, name: str, row: int) -> Any:
+        column = self.columns.get(name)
+        return None if column is None else column.rows.get(row)
+
+    def row_values(self, row: int) -> Dict[str, Any]:
+        return {name: column.rows[row] for name, column in self.columns.items() if row in column.rows}
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value)
+
+
+_COMPARE = {
+    "gt": lambda a, b: a > b,
+    "gte": lambda a, b: a >= b,
+    "lt": lambda a, b: a < b,
+    "lte": lambda a, b: a <= b,
+}
+
+
+def _values(rule_id: str, field: str, value: Any, as_list: bool) -> List[Any]:
+    values = value if isinstance(value, list) else [value]
+    if not as_list and len(values) != 1:
+        raise PostureRuleError(f"{rule_id}: {field}: expected a single value")
+    if not values or any(item is None or isinstance(item, (dict, list)) for item in values):
+        raise PostureRuleError(f"{rule_id}: {field}: expected scalar values")
+    return [_value(item) for item in values]
+
+
+def _compile_leaf(rule_id: str, node: Dict[str, Any], fields: List[str]) -> Evaluate:
+    field = node.get("field")
+    op = node.get("op", "eq")
+    if not isinstance(field, str) or field.split(".", 1)[0] not in SECTIONS or "." not in field:
+        raise PostureRuleError(f"{rule_id}: field must be <section>.<setting> with section one of {list(SECTIONS)}")
+    if field not in fields:
+        fields.append(field)
+
+    def column(table: PostureTable) -> Optional[_Column]:
+        return table.columns.get(field)
+
+    if op == "exists":
+        return lambda table, today: getattr(column(table), "present", 0)
+    if op == "missing":
+        return lambda table, today: table.live & ~getattr(column(table), "present", 0)
+    if op in ("eq", "in", "ne", "not_in"):
+        wanted = _values(rule_id, field, node.get("value"), as_list=op in ("in", "not_in"))
+
+        def equal(table: PostureTable, today: int) -> int:
+            col = column(table)
+            if col is None:
+                return 0
+            mask = 0
+            for item in wanted:
+                mask |= col.rows_equal(item)
+            return mask
+
+        if op in ("eq", "in"):
+            return equal
+        return lambda table, today: getattr(column(table), "present", 0) & ~equal(table, today)
+    if op in _COMPARE:
+        bound = _number(_values(rule_id, field, node.get("value"), as_list=False)[0])
+        if bound is None:
+            raise PostureRuleError(f"{rule_id}: {field}: {op} needs a number")
+        compare = _COMPARE[op]
+
+        def ordered(table: PostureTable, today: int) -> int:
+            col = column(table)
+            if col is None:
+                return 0
+            return col.mask_where(lambda value: _number(value) is not None and compare(value, bound))
+        return ordered
+    if op == "older_than_days":
+        days = _number(_values(rule_id, field, node.get("value"), as_list=False)[0])
+        if days is None or not field.endswith("_date"):
+            raise PostureRuleError(f"{rule_id}: {field}: older_than_days needs a *_date field and a number")
+
+        def older(table: PostureTable, today: int) -> int:
+            col = column(table)
+            if col is None:
+                return 0
+            threshold = today - days
+            return col.mask_where(lambda value: value < threshold)
+        return older
+    raise PostureRuleError(f"{rule_id}: unknown operator {op!r}")
+
+
+def _compile(rule_id: str, node: Any, fields: List[str]) -> Evaluate:
+    if not isinstance(node, dict):
+        raise PostureRuleError(f"{rule_id}: condition must be an object")
+    if "all" in node or "any" in node:
+        conjunction = "all" in node
+        children = node["all" if conjunction else "any"]
+        if not isinstance(children, list) or not children:
+            raise PostureRuleError(f"{rule_id}: {'all' if conjunction else 'any'} needs a non-empty list")
+        compiled = [_compile(rule_id, child, fields) for child in children]
+        if len(compiled) == 1:
+            return compiled[0]
+        if conjunction:
+            def all_of(table: PostureTable, today: int) -> int:
+                mask = table.live
+                for child in compiled:
+                    mask &= child(table, today)
+                    if not mask:
+                        break
+                return mask
+            return all_of
+
+        def any_of(table: PostureTable, today: int) -> int:
+            mask = 0
+            for child in compiled:
+                mask |= child(table, today)
+            return mask
+        return any_of
+    if "not" in node:
+        inner = _compile(rule_id, node["not"], fields)
+        return lambda table, today: table.live & ~inner(table, today)
+    return _compile_leaf(rule_id, node, fields)
+
+
+class PostureRule:
+    """A compiled posture rule: finding attributes and a column-wise condition."""
+
+    __slots__ = ("rule_id", "severity", "message_ru", "description", "evidence",
+                 "definition", "digest", "evaluate", "evaluations", "time_ns")
+
+    def __init__(self, definition: Dict[str, Any]):
+        rule_id = definition.get("rule_id")
+        if not isinstance(rule_id, str) or not rule_id:
+            raise PostureRuleError(f"rule without rule_id: {json.dumps(definition, ensure_ascii=False)[:200]}")
+        severity = str(definition.get("severity", "medium")).lower()
+        if severity not in SEVERITIES:
+            raise PostureRuleError(f"{rule_id}: severity must be one of {list(SEVERITIES)}")
+        if "condition" not in definition:
+            raise PostureRuleError(f"{rule_id}: condition is required")
+        fields: List[str] = []
+        self.evaluate = _compile(rule_id, definition["condition"], fields)
+        self.rule_id = rule_id
+        self.severity = severity
+        self.message_ru = definition.get("message_ru") or rule_id
+        self.description = definition.get("description", "")
+        self.evidence = list(definition.get("evidence") or fields)
+        self.definition = definition
+        self.digest = hashlib.sha1(
+            json.dumps(definition, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+        self.evaluations = 0
+        self.time_ns = 0
+
+
+def load_posture_rules(path: str) -> List[PostureRule]:
+    """Rules from a JSON file: a list of rules or {"rules": [...]}."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("rules", [])
+    return [PostureRule(item) for item in data]
+
+
+class RuleChange(NamedTuple):
+    """Rows whose finding for a rule must be written (upsert) or removed (delete)."""
+
+    rule_id: str
+    upsert: int
+    delete: int
+
+
+class PostureEvaluator:
+    """Rule result masks over a PostureTable, maintained incrementally."""
+
+    def __init__(self, rules: Iterable[PostureRule] = (), table: Optional[PostureTable] = None,
+                 clock: Callable[[], datetime] = lambda: datetime.now(timezone.utc)):
+        self.table = table or PostureTable()
+        self.rules: Dict[str, PostureRule] = {}
+        self.results: Dict[str, int] = {}
+        self.clock = clock
+        self.set_rules(rules)
+
+    def _today(self) -> int:
+        return (self.clock().date() - _EPOCH).days
+
+    def _run(self, rule: PostureRule, today: int) -> int:
+        started = time.perf_counter_ns()
+        mask = rule.evaluate(self.table, today) & self.table.live
+        rule.time_ns += time.perf_counter_ns() - started
+        rule.evaluations += 1
+        return mask
+
+    def set_rules(self, rules: Iterable[PostureRule]) -> List[RuleChange]:
+        """
+        Replace the rule set. Only added and changed rules (by definition
+        digest) are evaluated; removed rules delete all their findings.
+        """
+        incoming = {rule.rule_id: rule for rule in rules}
+        changes: List[RuleChange] = []
+        for rule_id in [rule_id for rule_id in self.rules if rule_id not in incoming]:
+            del self.rules[rule_id]
+            changes.append(RuleChange(rule_id, 0, self.results.pop(rule_id, 0)))
+        today = self._today()
+        for rule_id, rule in incoming.items():
+            current = self.rules.get(rule_id)
+            if current is not None and current.digest == rule.digest:
+                continue
+            self.rules[rule_id] = rule
+            old = self.results.get(rule_id, 0)
+            mask = self.results[rule_id] = self._run(rule, today)
+            # A changed rule may change message or severity: rewrite all its findings
+            changes.append(RuleChange(rule_id, mask if current is not None else mask & ~old, old & ~mask))
+        return changes
+
+    def evaluate_all(self, touched: int = 0) -> List[RuleChange]:
+        """
+        Re-evaluate every rule against the table. Findings of rows in
+        touched (hosts with a new snapshot) are rewritten even if unchanged.
+        """
+        today = self._today()
+        changes = []
+        for rule_id, rule in self.rules.items():
+            old = self.results.get(rule_id, 0)
+            mask = self.results[rule_id] = self._run(rule, today)
+            upsert, delete = (mask & ~old) | (mask & touched), old & ~mask
+            if upsert or delete:
+                changes.append(RuleChange(rule_id, upsert, delete))
+        return changes
+
+    def update_hosts(self, snapshots: Iterable[Dict[str, Any]]) -> List[RuleChange]:
+        """Apply host_posture snapshots and return the resulting finding changes."""
+        touched = 0
+        for snapshot in snapshots:
+            row = self.table.upsert_snapshot(snapshot)
+            if row is not None:
+                touched |= 1 << row
+        return self.evaluate_all(touched) if touched else []
+
+    def host_rules(self, host_id: str) -> List[PostureRule]:
+        row = self.table.rows.get(host_id)
+        if row is None:
+            return []
+        bit = 1 << row
+        return [self.rules[rule_id] for rule_id, mask in self.results.items() if mask & bit]
+
+    def finding(self, rule_id: str, row: int, evaluated_at: Optional[str] = None) -> Dict[str, Any]:
+        """Finding document in the shape of the agent's findings, plus host and provenance fields."""
+        rule = self.rules[rule_id]
+        table = self.table
+        evidence = []
+        for field in rule.evidence:
+            value = table.value(field, row)
+            if value is None:
+                continue
+            if isinstance(value, bool):
+                value = "true" if value else "false"
+            elif field.endswith("_date"):
+                value = date.fromordinal(_EPOCH.toordinal() + value).isoformat()
+            evidence.append(f"{field}={value}")
+        return {
+            "rule_id": rule_id,
+            "severity": rule.severity,
+            "message_ru": rule.message_ru,
+            "evidence": "; ".join(evidence) or None,
+            "host_id": table.host_ids[row],
+            "hostname": table.hostnames[row],
+            "snapshot_timestamp": table.timestamps[row],
+            "rule_digest": rule.digest,
+            "source": "server",
+            "evaluated_at": evaluated_at or self.clock().isoformat(),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        table = self.table
+        return {
+            "hosts": len(table),
+            "columns": len(table.columns),
+            "rules": [
+                {
+                    "rule_id": rule_id,
+                    "severity": rule.severity,
+                    "hosts": bin(self.results.get(rule_id, 0)).count("1"),
+                    "evaluations": rule.evaluations,
+                    "avg_us": round(rule.time_ns / rule.evaluations / 1000, 2) if rule.evaluations else 0.0,
+                }
+                for rule_id, rule in sorted(self.rules.items())
+            ],
+        }
@@ -0,0 +1,361 @@
+"""
+File-hash reputation with a two-tier cache and batched provider lookups.
+
+The same few thousand binaries run on every host, so a posture cycle of
+the whole fleet asks about the same hashes over and over. ReputationCache
+answers them from:
+
+1. an in-process LRU with per-entry expiry (no I/O);
+2. Redis, shared by all workers: one MGET per lookup for the local misses;
+3. the provider, only for hashes nobody has resolved recently. Missing
+   hashes are deduplicated, split into batches of ``provider.max_batch``,
+   and coalesced with identical lookups already in flight in this process.
+
+Verdicts are ``malicious``, ``suspicious``, ``clean`` and ``unknown``.
+``unknown`` is cached too (negative caching), with a shorter TTL, so an
+unknown binary does not reach the provider once per host. Provider errors
+are not cached: those hashes come back without a verdict and are retried
+on the next lookup.
+
+Providers are pluggable: anything with ``name``, ``version``,
+``max_batch`` and ``async lookup(hashes) -> {hash: verdict}`` works.
+``version`` is part of the Redis key, so reloading a changed list file
+makes verdicts of the previous list unreachable without a flush.
+
+    provider = ListFileProvider("reputation.csv")
+    cache = ReputationCache(provider, local_size=100_000)
+    verdicts = await cache.lookup_many(hashes, redis)
+    verdicts["44d88612fea8a8f36de82e1278abb02f"]["verdict"]   # "malicious"
+"""
+
+import asyncio
+import csv
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+__all__ = [
+    "VERDICTS",
+    "normalize_hash",
+    "ReputationProvider",
+    "ListFileProvider",
+    "StaticReputationProvider",
+    "ReputationCache",
+]
+
+logger = logging.getLogger(__name__)
+
+VERDICTS = ("malicious", "suspicious", "clean", "unknown")
+
+# Aliases accepted in list files
+_VERDICT_ALIASES = {
+    "deny": "malicious", "block": "malicious", "bad": "malicious",
+    "allow": "clean", "good": "clean", "trusted": "clean",
+}
+
+# md5, sha1, sha256
+_HASH_RE = re.compile(r"^(?:[0-9a-f]{32}|[0-9a-f]{40}|[0-9a-f]{64})$")
+
+
+def normalize_hash(value: Any) -> Optional[str]:
+    """Lower-case hex md5/sha1/sha256, or None for anything else."""
+    if not isinstance(value, str):
+        return None
+    value = value.strip().lower()
+    return value if _HASH_RE.match(value) else None
+
+
+def _normalize_verdict(value: Any) -> Optional[str]:
+    value = str(value or "").strip().lower()
+    value = _VERDICT_ALIASES.get(value, value)
+    return value if value in VERDICTS else None
+
+
+class ReputationProvider:
+    """Base class of verdict sources; hashes absent from the result are unknown."""
+
+    name = "provider"
+    version = "0"
+    max_batch = 500
+
+    async def lookup(self, hashes: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        raise NotImplementedError
+
+
+class ListFileProvider(ReputationProvider):
+    """
+    Local allow/deny list.
+
+    CSV with the header ``hash,verdict,reason`` (``.csv``), or JSON lines /
+    a JSON list of ``{"hash", "verdict", "reason"}`` records. Verdicts may
+    also be written as deny/block (malicious) and allow/trusted (clean).
+    Lines with an invalid hash or verdict are skipped and counted.
+    """
+
+    name = "list"
+
+    def __init__(self, path: str, max_batch: int = 10_000):
+        self.path = path
+        self.max_batch = max_batch
+        self.verdicts: Dict[str, Dict[str, Any]] = {}
+        self.skipped = 0
+        digest = hashlib.blake2b(digest_size=8)
+        with open(path, "rb") as f:
+            raw = f.read()
+        digest.update(raw)
+        self.version = digest.hexdigest()
+        for record in self._records(raw.decode("utf-8")):
+            file_hash = normalize_hash(record.get("hash"))
+            verdict = _normalize_verdict(record.get("verdict"))
+            if file_hash is None or verdict is None:
+                self.skipped += 1
+                continue
+            entry: Dict[str, Any] = {"verdict": verdict, "source": self.name}
+            if record.get("reason"):
+                entry["reason"] = str(record["reason"])
+            self.verdicts[file_hash] = entry
+
+    def _records(self, text: str) -> Iterable[Dict[str, Any]]:
+        if self.path.endswith(".csv"):
+            return csv.DictReader(text.splitlines())
+        stripped = text.lstrip()
+        if stripped.startswith("["):
+            return json.loads(stripped)
+        return (json.loads(line) for line in text.splitlines() if line.strip())
+
+    def __len__(self) -> int:
+        return len(self.verdicts)
+
+    async def lookup(self, hashes: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        return {h: self.verdicts[h] for h in hashes if h in self.verdicts}
+
+
+class StaticReputationProvider(ReputationProvider):
+    """
+    Provider over a dict, with an optional per-call delay: a stand-in for
+    a remote reputation service in tests and benchmarks. Counts calls and
+    hashes asked, and can be told to fail.
+    """
+
+    name = "static"
+
+    def __init__(self, verdicts: Optional[Mapping[str, str]] = None, delay: float = 0.0,
+                 max_batch: int = 500, version: str = "0"):
+        self.verdicts = {normalize_hash(h): {"verdict": v, "source": self.name}
+                         for h, v in (verdicts or {}).items() if normalize_hash(h)}
+        self.delay = delay
+        self.max_batch = max_batch
+        self.version = version
+        self.calls = 0
+        self.asked = 0
+        self.fail = False
+
+    async def lookup(self, hashes: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        self.calls += 1
+        self.asked += len(hashes)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("reputation service unavailable")
+        return {h: self.verdicts[h] for h in hashes if h in self.verdicts}
+
+
+class _LocalCache:
+    """LRU of verdicts with a per-entry expiry time."""
+
+    __slots__ = ("max_size", "entries")
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    def get(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        item = self.entries.get(key)
+        if item is None:
+            return None
+        if item[0] <= now:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return item[1]
+
+    def put(self, key: str, verdict: Dict[str, Any], expires_at: float) -> None:
+        self.entries[key] = (expires_at, verdict)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+class ReputationCache:
+    """
+    Verdicts of file hashes from the local LRU, Redis and the provider.
+
+    ``ttl`` applies to known verdicts and ``negative_ttl`` to ``unknown``.
+    ``local_ttl`` caps how long a verdict is served from process memory
+    before Redis is asked again, e.g. after its keys were flushed.
+    Redis is optional and passed per call (the client may be replaced on
+    reconnect); without it the cache is process-local.
+    """
+
+    def __init__(self, provider: ReputationProvider, local_size: int = 100_000,
+                 ttl: float = 86400, negative_ttl: float = 3600, local_ttl: float = 300,
+                 timeout: float = 5.0, key_prefix: str = "reputation:"):
+        self.provider = provider
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.local_ttl = local_ttl
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+        self._local = _LocalCache(local_size)
+        self._inflight: Dict[str, "asyncio.Future[Optional[Dict[str, Any]]]"] = {}
+        self.counters = {
+            "lookups": 0, "hashes": 0, "local_hits": 0, "redis_hits": 0, "coalesced": 0,
+            "provider_calls": 0, "provider_hashes": 0, "provider_errors": 0, "redis_errors": 0,
+            "negative": 0,
+        }
+
+    def set_provider(self, provider: ReputationProvider) -> None:
+        """Replace the provider; verdicts of the previous one are dropped locally."""
+        self.provider = provider
+        self._local = _LocalCache(self._local.max_size)
+
+    def _key(self, file_hash: str) -> str:
+        return f"{self.key_prefix}{self.provider.version}:{file_hash}"
+
+    async def lookup(self, file_hash: str, redis: Any = None) -> Optional[Dict[str, Any]]:
+        normalized = normalize_hash(file_hash)
+        if normalized is None:
+            return None
+        return (await self.lookup_many([normalized], redis)).get(normalized)
+
+    async def lookup_many(self, hashes: Iterable[Any], redis: Any = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Verdicts of many hashes keyed by normalized hash. Invalid values are
+        ignored; hashes the provider failed on are absent from the result.
+        """
+        wanted = {h for h in map(normalize_hash, hashes) if h}
+        self.counters["lookups"] += 1
+        self.counters["hashes"] += len(wanted)
+        now = time.time()
+        result: Dict[str, Dict[str, Any]] = {}
+        missing: List[str] = []
+        for file_hash in wanted:
+            verdict = self._local.get(file_hash, now)
+            if verdict is None:
+                missing.append(file_hash)
+            else:
+                result[file_hash] = verdict
+        self.counters["local_hits"] += len(result)
+        if not missing:
+            return result
+
+        # Identical lookups already in flight in this process are awaited, not repeated
+        waiting = {h: self._inflight[h] for h in missing if h in self._inflight}
+        owned = [h for h in missing if h not in waiting]
+        self.counters["coalesced"] += len(waiting)
+        futures = {h: asyncio.get_running_loop().create_future() for h in owned}
+        self._inflight.update(futures)
+        resolved: Dict[str, Dict[str, Any]] = {}
+        try:
+            if owned:
+                resolved = await self._resolve(owned, redis, now)
+        finally:
+            # Waiters get None when the lookup failed and ask again next time
+            for file_hash, future in futures.items():
+                self._inflight.pop(file_hash, None)
+                future.set_result(resolved.get(file_hash))
+        result.update(resolved)
+        for file_hash, future in waiting.items():
+            verdict = await future
+            if verdict is not None:
+                result[file_hash] = verdict
+        return result
+
+    async def _resolve(self, hashes: List[str], redis: Any, now: float) -> Dict[str, Dict[str, Any]]:
+        result: Dict[str, Dict[str, Any]] = {}
+        missing = hashes
+        if redis is not None:
+            try:
+                values = await redis.mget([self._key(h) for h in hashes])
+                missing = []
+                for file_hash, raw in zip(hashes, values):
+                    if raw is None:
+                        missing.append(file_hash)
+                        continue
+                    stored = json.loads(raw)
+                    expires_at = stored.pop("expires_at", now + self.local_ttl)
+                    self._local.put(file_hash, stored, min(expires_at, now + self.local_ttl))
+                    result[file_hash] = stored
+                self.counters["redis_hits"] += len(result)
+            except Exception as e:
+                self.counters["redis_errors"] += 1
+                logger.warning(f"Reputation cache: Redis lookup failed, asking the provider: {e}")
+                missing = hashes
+        if not missing:
+            return result
+
+        fetched = await self._ask_provider(missing)
+        stored_at = time.time()
+        pipe = None
+        if redis is not None:
+            try:
+                pipe = redis.pipeline(transaction=False)
+            except Exception as e:
+                self.counters["redis_errors"] += 1
+                logger.warning(f"Reputation cache: Redis unavailable, verdicts kept locally: {e}")
+        for file_hash in missing:
+            if file_hash not in fetched:
+                continue
+            verdict = fetched[file_hash]
+            ttl = self.negative_ttl if verdict["verdict"] == "unknown" else self.ttl
+            self._local.put(file_hash, verdict, stored_at + min(ttl, self.local_ttl))
+            if pipe is not None:
+                pipe.set(self._key(file_hash), json.dumps(dict(verdict, expires_at=stored_at + ttl)), ex=int(ttl))
+            result[file_hash] = verdict
+        if pipe is not None and fetched:
+            try:
+                await pipe.execute()
+            except Exception as e:
+                self.counters["redis_errors"] += 1
+                logger.warning(f"Reputation cache: failed to store verdicts in Redis: {e}")
+        return result
+
+    async def _ask_provider(self, hashes: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Provider verdicts for all hashes in batches; unknown for hashes it does not know."""
+        provider = self.provider
+        batches = [hashes[i:i + provider.max_batch] for i in range(0, len(hashes), provider.max_batch)]
+        results = await asyncio.gather(
+            *(asyncio.wait_for(provider.lookup(batch), self.timeout) for batch in batches),
+            return_exceptions=True
+        )
+        fetched: Dict[str, Dict[str, Any]] = {}
+        for batch, answer in zip(batches, results):
+            self.counters["provider_calls"] += 1
+            self.counters["provider_hashes"] += len(batch)
+            if isinstance(answer, BaseException):
+                self.counters["provider_errors"] += 1
+                logger.warning(f"Reputation provider {provider.name} failed for {len(batch)} hashes: {answer!r}")
+                continue
+            for file_hash in batch:
+                verdict = answer.get(file_hash)
+                if verdict is None:
+                    self.counters["negative"] += 1
+                    verdict = {"verdict": "unknown", "source": provider.name}
+                fetched[file_hash] = verdict
+        return fetched
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.counters["hashes"] or 1
+        return {
+            "provider": self.provider.name,
+            "provider_version": self.provider.version,
+            "local_entries": len(self._local.entries),
+            "local_size": self._local.max_size,
+            "inflight": len(self._inflight),
+            "local_hit_ratio": round(self.counters["local_hits"] / lookups, 4),
+            **self.counters,
+        }
@@ -0,0 +1,418 @@
+"""
+Asyncio-native resilience primitives for calls to backend services.
+
+A ResiliencePolicy guards every call to one backend (OpenSearch, Redis)
+with, from the outside in:
+
+- a bulkhead: at most ``max_concurrent`` calls in flight, callers wait at
+  most ``max_wait`` seconds for a slot instead of piling up;
+- a circuit breaker: after ``failure_threshold`` consecutive failures the
+  backend is failed fast for ``reset_timeout`` seconds, then a limited
+  number of probe calls decide whether to close it again;
+- a per-attempt timeout bounded by the request deadline budget;
+- retries with full jitter (sleep uniformly in [0, base * 2^attempt]) for
+  idempotent operations, only while the deadline budget allows.
+
+Only errors the ``is_failure`` classifier accepts (connection errors,
+timeouts, overload responses) count against the breaker and are retried;
+application errors such as "not found" pass straight through.
+
+The deadline budget is per request: a middleware calls ``start_deadline``
+and every guarded call in that context shares the remaining time.
+
+    policy = ResiliencePolicy("redis", is_failure=is_redis_failure)
+    redis = ResilientClient(redis_client, policy, methods={"get": True, "incr": False})
+
+    deadline = start_deadline(10.0)
+    try:
+        await redis.get("key")
+    finally:
+        deadline.close()
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional
+
+__all__ = [
+    "ResilienceError",
+    "CircuitOpenError",
+    "BulkheadFullError",
+    "DeadlineExceededError",
+    "Deadline",
+    "start_deadline",
+    "remaining_budget",
+    "retry_safe",
+    "CircuitBreaker",
+    "Bulkhead",
+    "ResiliencePolicy",
+    "ResilientClient",
+]
+
+logger = logging.getLogger(__name__)
+
+
+class ResilienceError(Exception):
+    """Base class for calls rejected by a resilience policy."""
+
+    def __init__(self, backend: str, message: str):
+        super().__init__(f"{backend}: {message}")
+        self.backend = backend
+
+
+class CircuitOpenError(ResilienceError):
+    """The backend's circuit breaker is open; the call was not attempted."""
+
+
+class BulkheadFullError(ResilienceError):
+    """No concurrency slot became free within the bulkhead wait time."""
+
+
+class DeadlineExceededError(ResilienceError):
+    """The request deadline budget is exhausted."""
+
+
+# === Deadline budget ===
+
+class Deadline:
+    """Absolute deadline shared by all guarded calls of one request."""
+
+    __slots__ = ("expires_at", "active")
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+        self.active = True
+
+    def remaining(self) -> Optional[float]:
+        if not self.active:
+            return None
+        return self.expires_at - time.monotonic()
+
+    def close(self) -> None:
+        """Stop enforcing the budget (e.g. for background work after the response)."""
+        self.active = False
+
+
+_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("resilience_deadline", default=None)
+
+
+def start_deadline(seconds: float) -> Deadline:
+    """Set the deadline budget for the current context."""
+    deadline = Deadline(seconds)
+    _deadline.set(deadline)
+    return deadline
+
+
+_retry_safe: contextvars.ContextVar[bool] = contextvars.ContextVar("resilience_retry_safe", default=False)
+
+
+@contextlib.contextmanager
+def retry_safe():
+    """
+    Mark guarded calls in this block as idempotent, whatever the method table
+    says. Used for calls of a non-idempotent method whose arguments make this
+    particular call safe to repeat, e.g. a bulk of plain index/delete actions.
+    """
+    token = _retry_safe.set(True)
+    try:
+        yield
+    finally:
+        _retry_safe.reset(token)
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left in the current deadline budget, or None when there is none."""
+    deadline = _deadline.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+# === Circuit breaker ===
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    closed    -> calls pass; ``failure_threshold`` consecutive failures open it.
+    open      -> calls fail fast until ``reset_timeout`` has passed.
+    half_open -> up to ``half_open_max_calls`` probes pass; a success closes
+                 the breaker, a failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 5.0,
+                 half_open_max_calls: int = 1,
+                 on_state_change: Optional[Callable[[str, str], None]] = None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.on_state_change = on_state_change
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probes = 0
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._transition(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self._probes >= self.half_open_max_calls:
+                return False
+            self._probes += 1
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        if self.state != self.CLOSED:
+            self._transition(self.CLOSED)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            if self.state != self.OPEN:
+                self._transition(self.OPEN)
+
+    def release_probe(self) -> None:
+        """A half-open probe ended without a verdict; let another call probe."""
+        if self.state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def _transition(self, state: str) -> None:
+        previous, self.state = self.state, state
+        self._probes = 0
+        if state == self.OPEN:
+            logger.warning(f"Circuit breaker {self.name} opened after {self.failures} failures")
+        elif state == self.CLOSED:
+            logger.info(f"Circuit breaker {self.name} closed")
+        if self.on_state_change is not None:
+            self.on_state_change(previous, state)
+
+
+# === Bulkhead ===
+
+class Bulkhead:
+    """Limits concurrent calls; waiting for a slot is bounded in time."""
+
+    def __init__(self, name: str, max_concurrent: int, max_wait: float = 1.0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def acquire(self, budget: Optional[float]) -> None:
+        wait = self.max_wait if budget is None else max(0.0, min(self.max_wait, budget))
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), wait)
+        except asyncio.TimeoutError:
+            raise BulkheadFullError(self.name, f"{self.max_concurrent} calls in flight") from None
+        self.in_flight += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
+
+
+# === Policy ===
+
+if hasattr(asyncio, "timeout"):
+    async def _with_timeout(awaitable: Awaitable[Any], timeout: float) -> Any:
+        # asyncio.timeout (3.11+) cancels in place instead of wrapping the call in a task
+        async with asyncio.timeout(timeout):
+            return await awaitable
+else:  # pragma: no cover - Python < 3.11
+    async def _with_timeout(awaitable: Awaitable[Any], timeout: float) -> Any:
+        return await asyncio.wait_for(awaitable, timeout)
+
+
+def _default_is_failure(error: BaseException) -> bool:
+    return isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError, OSError))
+
+
+class ResiliencePolicy:
+    """Bulkhead + circuit breaker + timeout + retries for one backend."""
+
+    def __init__(self, name: str,
+                 is_failure: Callable[[BaseException], bool] = _default_is_failure,
+                 max_attempts: int = 3,
+                 base_backoff: float = 0.05,
+                 max_backoff: float = 1.0,
+                 call_timeout: Optional[float] = 10.0,
+                 failure_threshold: int = 5,
+                 reset_timeout: float = 5.0,
+                 max_concurrent: int = 100,
+                 max_wait: float = 1.0,
+                 on_event: Optional[Callable[[str, str], None]] = None,
+                 on_state_change: Optional[Callable[[str, str], None]] = None):
+        self.name = name
+        self.is_failure = is_failure
+        self.max_attempts = max(1, max_attempts)
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.call_timeout = call_timeout
+        self.on_event = on_event
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout, on_state_change=on_state_change)
+        self.bulkhead = Bulkhead(name, max_concurrent, max_wait)
+        self.counters: Dict[str, int] = {
+            "calls": 0, "success": 0, "failure": 0, "retry": 0, "timeout": 0,
+            "circuit_open": 0, "bulkhead_full": 0, "deadline_exceeded": 0,
+        }
+
+    def _count(self, event: str) -> None:
+        self.counters[event] = self.counters.get(event, 0) + 1
+        if self.on_event is not None:
+            self.on_event(self.name, event)
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** attempt)))
+
+    def _attempt_timeout(self) -> Optional[float]:
+        budget = remaining_budget()
+        if budget is not None and budget <= 0:
+            self._count("deadline_exceeded")
+            raise DeadlineExceededError(self.name, "request deadline exceeded")
+        if budget is None:
+            return self.call_timeout
+        return budget if self.call_timeout is None else min(self.call_timeout, budget)
+
+    async def call(self, func: Callable[..., Awaitable[Any]], *args,
+                   idempotent: bool = True, **kwargs) -> Any:
+        """Run ``func(*args, **kwargs)`` under the policy."""
+        self._count("calls")
+        await self.bulkhead.acquire(remaining_budget())
+        try:
+            attempts = self.max_attempts if idempotent else 1
+            attempt = 0
+            while True:
+                if not self.breaker.allow():
+                    self._count("circuit_open")
+                    raise CircuitOpenError(self.name, "circuit breaker is open")
+                timeout = self._attempt_timeout()
+                budget_bound = timeout is not None and timeout != self.call_timeout
+                try:
+                    if timeout is None:
+                        result = await func(*args, **kwargs)
+                    else:
+                        result = await _with_timeout(func(*args, **kwargs), timeout)
+                except asyncio.TimeoutError as e:
+                    self._count("timeout")
+                    if budget_bound:
+                        # The request budget ran out, not the backend: no breaker verdict
+                        self.breaker.release_probe()
+                        self._count("deadline_exceeded")
+                        raise DeadlineExceededError(self.name, "request deadline exceeded") from e
+                    error: BaseException = e
+                except asyncio.CancelledError:
+                    self.breaker.release_probe()
+                    raise
+                except Exception as e:
+                    if not self.is_failure(e):
+                        # Application error: the backend answered, which counts as healthy
+                        self.breaker.record_success()
+                        raise
+                    error = e
+                else:
+                    self.breaker.record_success()
+                    self._count("success")
+                    return result
+
+                self.breaker.record_failure()
+                self._count("failure")
+                attempt += 1
+                if attempt >= attempts:
+                    raise error
+                delay = self._backoff(attempt)
+                budget = remaining_budget()
+                if budget is not None and budget <= delay:
+                    raise error
+                self._count("retry")
+                await asyncio.sleep(delay)
+        finally:
+            self.bulkhead.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "in_flight": self.bulkhead.in_flight,
+            "max_concurrent": self.bulkhead.max_concurrent,
+            **self.counters,
+        }
+
+
+# === Client proxy ===
+
+class ResilientClient:
+    """
+    Proxy that runs the listed methods of a client through a policy.
+
+    ``methods`` maps method names to whether they are idempotent (retried)
+    or not (single attempt, still behind the bulkhead, breaker and
+    timeout). Everything else, e.g. ``ping`` used by health checks, is
+    passed through unguarded. ``namespaces`` wraps nested API objects
+    (``client.indices``); ``factories`` wraps objects returned by a method
+    (Redis ``pipeline()``) with their own method table.
+    """
+
+    def __init__(self, client: Any, policy: ResiliencePolicy,
+                 methods: Mapping[str, bool],
+                 namespaces: Optional[Mapping[str, Mapping[str, bool]]] = None,
+                 factories: Optional[Mapping[str, Mapping[str, bool]]] = None):
+        self._client = client
+        self._policy = policy
+        self._methods = dict(methods)
+        self._namespaces = dict(namespaces or {})
+        self._factories = dict(factories or {})
+        self._cache: Dict[str, Any] = {}
+
+    @property
+    def policy(self) -> ResiliencePolicy:
+        return self._policy
+
+    @property
+    def wrapped(self) -> Any:
+        return self._client
+
+    def __getattr__(self, name: str) -> Any:
+        cached = self._cache.get(name)
+        if cached is not None:
+            return cached
+        attr = getattr(self._client, name)
+        if name in self._methods:
+            wrapped = self._guard(name, attr, self._methods[name])
+        elif name in self._namespaces:
+            wrapped = ResilientClient(attr, self._policy, self._namespaces[name])
+        elif name in self._factories:
+            wrapped = self._wrap_factory(attr, self._factories[name])
+        else:
+            return attr
+        self._cache[name] = wrapped
+        return wrapped
+
+    def _guard(self, name: str, method: Callable[..., Awaitable[Any]], idempotent: bool):
+        policy = self._policy
+
+        async def guarded(*args, **kwargs):
+            return await policy.call(method, *args, idempotent=idempotent or _retry_safe.get(), **kwargs)
+
+        guarded.__name__ = name
+        return guarded
+
+    def _wrap_factory(self, factory: Callable[..., Any], methods: Mapping[str, bool]):
+        policy = self._policy
+
+        def wrapped(*args, **kwargs):
+            return ResilientClient(factory(*args, **kwargs), policy, methods)
+
+        return wrapped
@@ -5,7 +5,7 @@ All modules use these standardized schemas for data exchange.
 
 from datetime import datetime
 from enum import Enum
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Literal
 from pydantic import BaseModel, Field
 
 
@@ -42,7 +42,7 @@ class BaseEvent(BaseModel):
 
 class ProcessEvent(BaseEvent):
     """Process-related event data."""
-    event_type: EventType = Field(default=EventType.PROCESS, const=True)
+    event_type: Literal[EventType.PROCESS] = Field(default=EventType.PROCESS)
     process_id: int = Field(..., description="Process ID")
     parent_process_id: Optional[int] = Field(None, description="Parent process ID")
     process_name: str = Field(..., description="Process executable name")
@@ -53,7 +53,7 @@ class ProcessEvent(BaseEvent):
 
 class FileEvent(BaseEvent):
     """File system event data."""
-    event_type: EventType = Field(default=EventType.FILE, const=True)
+    event_type: Literal[EventType.FILE] = Field(default=EventType.FILE)
     file_path: str = Field(..., description="Full file path")
     file_hash: Optional[str] = Field(None, description="SHA256 hash")
     file_size: Optional[int] = Field(None, description="File size in bytes")
@@ -63,7 +63,7 @@ class FileEvent(BaseEvent):
 
 class NetworkEvent(BaseEvent):
     """Network activity event data."""
-    event_type: EventType = Field(default=EventType.NETWORK, const=True)
+    event_type: Literal[EventType.NETWORK] = Field(default=EventType.NETWORK)
     source_ip: str = Field(..., description="Source IP address")
     dest_ip: str = Field(..., description="Destination IP address")
     source_port: Optional[int] = Field(None, description="Source port")
@@ -75,7 +75,7 @@ class NetworkEvent(BaseEvent):
 
 class AuthEvent(BaseEvent):
     """Authentication event data."""
-    event_type: EventType = Field(default=EventType.AUTH, const=True)
+    event_type: Literal[EventType.AUTH] = Field(default=EventType.AUTH)
     user: str = Field(..., description="Username")
     auth_type: str = Field(..., description="Authentication type")
     success: bool = Field(..., description="Authentication success")
@@ -85,7 +85,7 @@ class AuthEvent(BaseEvent):
 
 class VulnScanResult(BaseEvent):
     """Vulnerability scan result."""
-    event_type: EventType = Field(default=EventType.VULN_SCAN, const=True)
+    event_type: Literal[EventType.VULN_SCAN] = Field(default=EventType.VULN_SCAN)
     target: str = Field(..., description="Scan target (IP/hostname)")
     vulnerability_id: str = Field(..., description="CVE or vulnerability ID")
     vulnerability_name: str = Field(..., description="Vulnerability name")
@@ -96,7 +96,7 @@ class VulnScanResult(BaseEvent):
 
 class ThreatIntelEvent(BaseEvent):
     """Threat intelligence indicator."""
-    event_type: EventType = Field(default=EventType.THREAT_INTEL, const=True)
+    event_type: Literal[EventType.THREAT_INTEL] = Field(default=EventType.THREAT_INTEL)
     indicator_type: str = Field(..., description="IOC type (ip, domain, hash, etc.)")
     indicator_value: str = Field(..., description="IOC value")
     threat_type: str = Field(..., description="Threat classification")
@@ -106,7 +106,7 @@ class ThreatIntelEvent(BaseEvent):
 
 class Alert(BaseEvent):
     """Security alert generated by analysis."""
-    event_type: EventType = Field(default=EventType.ALERT, const=True)
+    event_type: Literal[EventType.ALERT] = Field(default=EventType.ALERT)
     alert_name: str = Field(..., description="Alert name/title")
     description: str = Field(..., description="Alert description")
     rule_id: Optional[str] = Field(None, description="Detection rule ID")
@@ -203,7 +203,7 @@ class AgentInfo(BaseModel):
 
 class HostPostureEvent(BaseEvent):
     """Событие оценки состояния хоста"""
-    event_type: EventType = Field(default=EventType.HOST_POSTURE, const=True)
+    event_type: Literal[EventType.HOST_POSTURE] = Field(default=EventType.HOST_POSTURE)
     agent: AgentInfo = Field(..., description="Информация об агенте")
     host: HostInfo = Field(..., description="Информация о хосте")
     inventory: InventoryData = Field(..., description="Данные инвентаризации")
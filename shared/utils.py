@@ -11,6 +11,10 @@ from datetime import datetime
 from typing import Any, Dict, Optional
 from pathlib import Path
 
+from .file_hashing import get_default_hasher
+from .ip_enrichment import get_default_classifier, parse_ip
+from .masking import DataMasker, get_default_masker
+
 
 def generate_event_id() -> str:
     """Generate a unique event ID."""
@@ -18,16 +22,13 @@ def generate_event_id() -> str:
 
 
 def get_file_hash(file_path: str) -> Optional[str]:
-    """Calculate SHA256 hash of a file."""
-    try:
-        sha256_hash = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(chunk)
-        return sha256_hash.hexdigest()
-    except Exception as e:
-        logging.error(f"Failed to calculate hash for {file_path}: {e}")
-        return None
+    """
+    Calculate SHA256 hash of a file.
+
+    Goes through the shared FileHasher: unchanged files are answered from
+    its cache. For many files use get_default_hasher().hash_many().
+    """
+    return get_default_hasher().hash(file_path)
 
 
 def get_string_hash(data: str) -> str:
@@ -95,36 +96,38 @@ def format_bytes(bytes_value: int) -> str:
 
 
 def mask_sensitive_data(data: Dict[str, Any], sensitive_fields: Optional[list] = None) -> Dict[str, Any]:
-    """Mask sensitive fields in data dictionary."""
+    """
+    Mask sensitive fields and secrets in command lines at any depth.
+
+    Copy-on-write (see shared.masking): unchanged subtrees are shared with
+    the input, and data itself is returned when nothing was masked.
+    With sensitive_fields only these exact key names are masked by key.
+    """
     if sensitive_fields is None:
-        sensitive_fields = ['password', 'token', 'key', 'secret', 'credential']
-    
-    masked_data = data.copy()
-    for field in sensitive_fields:
-        if field in masked_data:
-            masked_data[field] = "***MASKED***"
-    
-    return masked_data
+        return get_default_masker().mask(data)
+    fields = tuple(sensitive_fields)
+    masker = _field_maskers.get(fields)
+    if masker is None:
+        masker = _field_maskers[fields] = DataMasker(fields, match_key_words=False)
+    return masker.mask(data)
+
+
+_field_maskers: Dict[tuple, DataMasker] = {}
 
 
 def validate_ip_address(ip: str) -> bool:
     """Validate IP address format."""
-    import ipaddress
-    try:
-        ipaddress.ip_address(ip)
-        return True
-    except ValueError:
-        return False
+    return parse_ip(ip) is not None
 
 
 def is_private_ip(ip: str) -> bool:
-    """Check if IP address is private."""
-    import ipaddress
-    try:
-        ip_obj = ipaddress.ip_address(ip)
-        return ip_obj.is_private
-    except ValueError:
-        return False
+    """
+    Check if IP address is private (same answer as ipaddress' is_private).
+
+    Answered by the cached classifier in shared.ip_enrichment; use
+    IpClassifier.classify_many() for batches.
+    """
+    return get_default_classifier().is_private(ip)
 
 
 class ConfigManager:
@@ -163,7 +166,12 @@ class ConfigManager:
 
 
 def retry_with_backoff(max_retries: int = 3, backoff_factor: float = 1.0):
-    """Decorator for retrying functions with exponential backoff."""
+    """
+    Decorator for retrying functions with exponential backoff.
+
+    Blocking (time.sleep); for async backend calls use shared.resilience,
+    which adds jitter, a deadline budget and circuit breakers.
+    """
     import time
     import functools
     